@@ -76,6 +76,10 @@ async def agent_main():
                 
                 print(f"🤖 Agent replied: {response}")
             
+            elif data.get("type") == "ping":
+                # Server heartbeat; silent connections are closed
+                await ws.send(json.dumps({"type": "pong"}))
+            
             elif data.get("type") == "pong":
                 print("🏓 Pong received")
 
@@ -0,0 +1,93 @@
+"""Microbenchmark: CPU per WebSocket broadcast against watcher count.
+
+Compares the old per-recipient path (model_dump + json encode for every
+watcher) with the shared pre-encoded Frame used by ConnectionManager.
+
+Usage:
+    python scripts/bench_broadcast.py
+    python scripts/bench_broadcast.py --watchers 1 100 10000 --broadcasts 200
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+from uuid import uuid4
+
+from delta.api.websocket.terminal import ConnectionManager, Message
+
+
+class NullWebSocket:
+    """Socket that accepts frames and discards them."""
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text):
+        pass
+
+    async def send_json(self, data):
+        json.dumps(data)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def make_message(i: int) -> Message:
+    return Message(
+        id=str(uuid4()),
+        type="agent_message",
+        content=f"token chunk {i} " * 8,
+        sender="agent",
+        agent_id="bench-agent",
+        timestamp=datetime.utcnow().isoformat(),
+        metadata={"tokens_used": 12, "step": i},
+    )
+
+
+async def bench_legacy(watchers: int, broadcasts: int) -> float:
+    """Per-recipient encoding, as broadcast_to_users did before."""
+    sockets = [NullWebSocket() for _ in range(watchers)]
+    start = time.process_time()
+    for i in range(broadcasts):
+        message = make_message(i)
+        message.model_dump()  # history copy
+        for ws in sockets:
+            await ws.send_json(message.model_dump())
+    return (time.process_time() - start) / broadcasts
+
+
+async def bench_frame(watchers: int, broadcasts: int) -> float:
+    """Shared Frame through the real ConnectionManager."""
+    manager = ConnectionManager(num_shards=64, send_queue_size=broadcasts + 64)
+    for i in range(watchers):
+        await manager.connect_user(NullWebSocket(), "bench-agent", f"user-{i}")
+    await asyncio.sleep(0.05)
+
+    start = time.process_time()
+    for i in range(broadcasts):
+        await manager.broadcast_to_users("bench-agent", make_message(i))
+    while any(conn.queue.qsize() for conn in manager.connections.values()):
+        await asyncio.sleep(0)
+    elapsed = (time.process_time() - start) / broadcasts
+
+    await manager.close()
+    return elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--watchers", type=int, nargs="+", default=[1, 10, 100, 1000, 5000])
+    parser.add_argument("--broadcasts", type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{'watchers':>9} {'legacy us':>12} {'frame us':>12} {'speedup':>8}")
+    for watchers in args.watchers:
+        legacy = await bench_legacy(watchers, args.broadcasts)
+        frame = await bench_frame(watchers, args.broadcasts)
+        print(f"{watchers:>9} {legacy * 1e6:>12.1f} {frame * 1e6:>12.1f} {legacy / frame:>7.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""Benchmark: frames/s and bytes/s to watchers with and without coalescing.
+
+An agent streams small token chunks to N watchers through the real
+ConnectionManager. Each configuration reports the WebSocket frames and
+payload bytes sent to all watchers, plus the bytes one watcher would
+receive with permessage-deflate (a per-connection zlib stream with
+context takeover, as negotiated by browsers and the websockets client).
+
+Usage:
+    python scripts/bench_coalesce.py
+    python scripts/bench_coalesce.py --watchers 1000 --chunks 2000 --windows 0 10 20 50
+"""
+
+import argparse
+import asyncio
+import time
+import zlib
+
+from delta.api.websocket.terminal import ConnectionManager
+
+
+class CountingWebSocket:
+    """Socket that counts frames and bytes; one can also deflate its stream."""
+
+    def __init__(self, deflate: bool = False):
+        self.frames = 0
+        self.bytes = 0
+        self.deflated = 0
+        self._zlib = zlib.compressobj(wbits=-zlib.MAX_WBITS) if deflate else None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text):
+        await self.send_bytes(text.encode())
+
+    async def send_bytes(self, data):
+        self.frames += 1
+        self.bytes += len(data)
+        if self._zlib is not None:
+            self.deflated += len(self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH))
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def run(watchers: int, chunks: int, window_ms: int, rate: int, binary: bool) -> dict:
+    manager = ConnectionManager(send_queue_size=chunks + 64, coalesce_window_ms=window_ms)
+    sockets = [CountingWebSocket(deflate=(i == 0)) for i in range(watchers)]
+    subprotocol = "delta.msgpack.v1" if binary else None
+    for i, ws in enumerate(sockets):
+        await manager.connect_user(ws, "bench-agent", f"user-{i}", subprotocol=subprotocol)
+    await asyncio.sleep(0.05)
+    for ws in sockets:
+        ws.frames = ws.bytes = ws.deflated = 0
+
+    # Stream chunks at roughly `rate` per second, like an LLM emitting tokens
+    interval = 1 / rate
+    start = time.perf_counter()
+    for i in range(chunks):
+        await manager.send_from_agent("bench-agent", f" token{i}", metadata={"step": i})
+        await asyncio.sleep(max(0.0, start + (i + 1) * interval - time.perf_counter()))
+    while any(conn.queue.qsize() for conn in manager.connections.values()):
+        await asyncio.sleep(0.001)
+    await asyncio.sleep(window_ms / 1000 + 0.01)
+    elapsed = time.perf_counter() - start
+
+    await manager.close()
+    return {
+        "frames": sum(ws.frames for ws in sockets),
+        "bytes": sum(ws.bytes for ws in sockets),
+        "deflated_per_watcher": sockets[0].deflated,
+        "raw_per_watcher": sockets[0].bytes,
+        "elapsed": elapsed,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--watchers", type=int, default=1000)
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--rate", type=int, default=500, help="chunks per second")
+    parser.add_argument("--windows", type=int, nargs="+", default=[0, 10, 20, 50])
+    parser.add_argument("--msgpack", action="store_true", help="use the binary subprotocol")
+    args = parser.parse_args()
+
+    print(f"{args.watchers} watchers, {args.chunks} chunks at {args.rate}/s")
+    print(
+        f"{'window ms':>9} {'elapsed s':>9} {'frames':>10} {'frames/s':>10} {'MB/s':>8} "
+        f"{'per watcher':>12} {'deflated':>10}"
+    )
+    for window in args.windows:
+        r = await run(args.watchers, args.chunks, window, args.rate, args.msgpack)
+        print(
+            f"{window:>9} {r['elapsed']:>9.2f} {r['frames']:>10} "
+            f"{r['frames'] / r['elapsed']:>10.0f} "
+            f"{r['bytes'] / r['elapsed'] / 1e6:>8.2f} {r['raw_per_watcher']:>12} "
+            f"{r['deflated_per_watcher']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
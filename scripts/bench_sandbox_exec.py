@@ -0,0 +1,88 @@
+"""Benchmark: end-to-end exec latency and throughput on the local sandbox driver.
+
+Creates N sandboxes under a temporary root, then runs M commands in
+each, `concurrency` at a time across all sandboxes, through the same
+ExecJobs path the API uses (submit, then wait for the result). Reports
+per-command latency percentiles and commands per second.
+
+Usage:
+    python scripts/bench_sandbox_exec.py
+    python scripts/bench_sandbox_exec.py --sandboxes 50 --commands 40 --concurrency 64
+    python scripts/bench_sandbox_exec.py --command "python -c 'print(1)'" --isolate-network
+"""
+
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from uuid import uuid4
+
+from delta.core.agents import AgentService
+from delta.core.exec_jobs import ExecJobs
+from delta.sandbox.local import LocalProcessDriver
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as root:
+        driver = LocalProcessDriver(root, isolate_network=args.isolate_network)
+        jobs = ExecJobs(
+            AgentService(driver).stream_command,
+            max_concurrent_per_sandbox=args.per_sandbox,
+        )
+        sandboxes = [uuid4() for _ in range(args.sandboxes)]
+        began = time.perf_counter()
+        for sandbox_id in sandboxes:
+            await driver.create(sandbox_id)
+        print(f"created {len(sandboxes)} sandboxes in {time.perf_counter() - began:.3f}s")
+
+        gate = asyncio.Semaphore(args.concurrency)
+        latencies = []
+        failures = 0
+
+        async def one(sandbox_id):
+            nonlocal failures
+            async with gate:
+                start = time.perf_counter()
+                job = jobs.submit(sandbox_id, args.command)
+                job = await jobs.wait(job.id, timeout=60)
+                latencies.append(time.perf_counter() - start)
+                if job.exit_code != 0:
+                    failures += 1
+
+        began = time.perf_counter()
+        await asyncio.gather(*(
+            one(sandbox_id) for _ in range(args.commands) for sandbox_id in sandboxes
+        ))
+        elapsed = time.perf_counter() - began
+
+        latencies.sort()
+        total = len(latencies)
+        print(f"command: {args.command!r}, concurrency {args.concurrency}")
+        print(
+            f"{total} execs in {elapsed:.2f}s ({total / elapsed:.0f} execs/s), {failures} failed"
+        )
+        print(
+            f"latency ms: p50 {statistics.median(latencies) * 1000:.1f}  "
+            f"p90 {latencies[int(total * 0.9)] * 1000:.1f}  "
+            f"p99 {latencies[min(total - 1, int(total * 0.99))] * 1000:.1f}  "
+            f"max {latencies[-1] * 1000:.1f}"
+        )
+        await jobs.close()
+        for sandbox_id in sandboxes:
+            await driver.destroy(sandbox_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sandboxes", type=int, default=20)
+    parser.add_argument("--commands", type=int, default=25, help="per sandbox")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--per-sandbox", type=int, default=4)
+    parser.add_argument("--command", default="echo hello")
+    parser.add_argument("--isolate-network", action="store_true")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Benchmark: usage log append and scan throughput.
+
+Writes N synthetic events spread over a number of days, agents and
+models into a temporary segment directory, then reports append rate,
+full-scan aggregation rate and a filtered (one agent, one task) scan
+that can skip segments by index.
+
+Usage:
+    python scripts/bench_usage_log.py
+    python scripts/bench_usage_log.py --events 10000000 --days 30 --agents 500
+"""
+
+import argparse
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from delta.core import usage_log
+from delta.core.usage_log import UsageLog, UsageLogReader
+from delta.core.usage_writer import usage_row
+from delta.models.token_usage import TokenUsageType
+
+MODELS = ["claude-3-opus", "claude-3-sonnet", "claude-3-haiku", None]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=2_000_000)
+    parser.add_argument("--days", type=int, default=10)
+    parser.add_argument("--agents", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    users = [uuid4() for _ in range(max(1, args.agents // 10))]
+    agents = [(uuid4(), rng.choice(users)) for _ in range(args.agents)]
+    types = list(TokenUsageType)
+    start = datetime(2024, 3, 1)
+    step = timedelta(days=args.days) / args.events
+
+    with tempfile.TemporaryDirectory() as directory:
+        log = UsageLog(directory)
+        began = time.perf_counter()
+        for i in range(args.events):
+            agent_id, user_id = agents[rng.randrange(len(agents))]
+            log.append(usage_row(
+                user_id, agent_id, types[i % len(types)], rng.randrange(1, 500),
+                model=MODELS[i % len(MODELS)], task_id=f"task-{agent_id.hex[:8]}-{i % 7}",
+                created_at=start + step * i,
+            ))
+        log.close()
+        append_s = time.perf_counter() - began
+        print(
+            f"appended {args.events} events over {args.days} days in {append_s:.2f}s "
+            f"({args.events / append_s / 1e6:.2f}M events/s)"
+        )
+        print(f"scan path: {'numpy' if usage_log.np is not None else 'struct'}")
+
+        for label, kwargs in [
+            ("full scan by model", {"group_by": "model"}),
+            ("full scan by agent", {"group_by": "agent"}),
+            ("one agent", {"agent_id": agents[0][0], "group_by": "type"}),
+            ("one agent's task", {
+                "agent_id": agents[0][0], "task_id": f"task-{agents[0][0].hex[:8]}-3", "group_by": "model",
+            }),
+        ]:
+            reader = UsageLogReader(directory)
+            began = time.perf_counter()
+            totals = reader.aggregate(**kwargs)
+            elapsed = time.perf_counter() - began
+            events = sum(entry["events"] for entry in totals.values())
+            print(
+                f"{label:<20} {elapsed:>7.3f}s  scanned {reader.events_scanned:>10} "
+                f"({reader.events_scanned / elapsed / 1e6:>6.1f}M/s), matched {events}, "
+                f"segments read {reader.segments_read}, skipped {reader.segments_skipped}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,5 +3,12 @@
 # Handles PORT environment variable for Railway and local Docker
 
 PORT="${PORT:-8000}"
+# permessage-deflate is negotiated per client; set to false to save server CPU
+WS_PER_MESSAGE_DEFLATE="${WS_PER_MESSAGE_DEFLATE:-true}"
+# Protocol-level pings drop dead connections, including read-only watchers
+WS_PING_INTERVAL="${WS_PING_INTERVAL:-20}"
+WS_PING_TIMEOUT="${WS_PING_TIMEOUT:-20}"
 echo "Starting DELTA Platform on port $PORT"
-exec uvicorn delta.api.main:app --host 0.0.0.0 --port "$PORT"
+exec uvicorn delta.api.main:app --host 0.0.0.0 --port "$PORT" \
+    --ws websockets --ws-per-message-deflate "$WS_PER_MESSAGE_DEFLATE" \
+    --ws-ping-interval "$WS_PING_INTERVAL" --ws-ping-timeout "$WS_PING_TIMEOUT"
@@ -0,0 +1,44 @@
+"""Shared FastAPI dependencies."""
+
+from typing import Optional
+
+from fastapi import Depends, Header, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from delta.core.auth import API_KEY_PREFIX, get_auth_service
+from delta.core.credentials import CachedCredential
+from delta.database import get_session
+
+
+async def get_current_user(
+    authorization: Optional[str] = Header(default=None),
+    x_api_key: Optional[str] = Header(default=None),
+    session: AsyncSession = Depends(get_session),
+) -> CachedCredential:
+    """
+    The verified credential of the caller.
+
+    Accepts "Authorization: Bearer <access token or API key>" or
+    "X-API-Key: <key>". Both kinds go through the credential cache, so
+    an API key only queries the database on its first use per cache TTL.
+    """
+    token = x_api_key
+    if token is None and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+
+    credential = None
+    if token:
+        auth = get_auth_service()
+        if token.startswith(API_KEY_PREFIX):
+            credential = await auth.resolve_api_key(session, token)
+        else:
+            credential = auth.verify_token_cached(token)
+            if credential is not None and credential.kind != "access":
+                credential = None
+    if credential is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or missing credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return credential
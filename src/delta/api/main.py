@@ -1,18 +1,61 @@
 """FastAPI application for DELTA platform - Minimal Production Version."""
 
 import os
+import secrets
+from contextlib import asynccontextmanager
 from datetime import datetime
-from fastapi import FastAPI, WebSocket, Query
+from typing import Optional
+from fastapi import FastAPI, Header, HTTPException, WebSocket, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+
+from delta.api.websocket import terminal
+from delta.config import get_settings
+from delta.core.budget import close_budget_engine
+from delta.core.exec_jobs import close_exec_jobs
+from delta.core.metrics import get_metrics
+from delta.core.token_reset import close_token_reset_job, get_token_reset_job
+from delta.core.usage_writer import close_usage_writer, get_usage_writer
+from delta.database import close_engine
+from delta.sandbox import close_checkpointer, close_sandbox_driver, close_warm_pool, get_warm_pool
 
 __version__ = "0.1.0"
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start and stop the app's background work.
+
+    On startup, schedule the monthly token reset and warm pool refills and
+    start the usage writer. On shutdown, stop exec jobs, sandboxes, restores
+    and WebSocket writers, then flush usage and budgets and close the
+    database engine they share.
+    """
+    if get_settings().token_reset_interval_seconds > 0:
+        get_token_reset_job().start()
+    if get_settings().warm_pool_enabled:
+        get_warm_pool().start()
+    await get_usage_writer().start()
+    yield
+    await close_token_reset_job()
+    await close_exec_jobs()
+    await close_warm_pool()
+    await close_checkpointer()
+    await close_sandbox_driver()
+    await terminal.manager.close()
+    await close_usage_writer()
+    await close_budget_engine()
+    await close_engine()
+
+
 app = FastAPI(
     title="DELTA Platform",
     description="Cloud-based sandbox-as-a-service for self-improving LLM agents",
     version=__version__,
     docs_url="/docs",
     redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
 # CORS
@@ -91,75 +134,58 @@ async def api_status():
 # WebSocket (for agent-to-user communication)
 # =============================================================================
 
-# Simple in-memory message store
-connections = {}
-messages = {}
-
-
 @app.websocket("/v1/ws/user/{agent_id}")
-async def websocket_user(websocket: WebSocket, agent_id: str, user_id: str = Query("anonymous")):
+async def websocket_user(
+    websocket: WebSocket,
+    agent_id: str,
+    user_id: str = Query("anonymous"),
+    since: Optional[int] = Query(None),
+    coalesce_ms: Optional[int] = Query(None),
+):
     """WebSocket for users to watch their agent."""
-    await websocket.accept()
-    
-    if agent_id not in connections:
-        connections[agent_id] = {"users": set(), "agent": None}
-    connections[agent_id]["users"].add(websocket)
-    
-    await websocket.send_json({"type": "connected", "agent_id": agent_id})
-    
-    try:
-        while True:
-            data = await websocket.receive_json()
-            # Forward user message to agent
-            if connections[agent_id]["agent"]:
-                await connections[agent_id]["agent"].send_json({
-                    "type": "user_message",
-                    "content": data.get("content", ""),
-                    "user_id": user_id,
-                })
-    except:
-        connections[agent_id]["users"].discard(websocket)
+    await terminal.user_websocket_endpoint(websocket, agent_id, user_id, since, coalesce_ms)
 
 
 @app.websocket("/v1/ws/agent/{agent_id}")
 async def websocket_agent(websocket: WebSocket, agent_id: str, api_key: str = Query("test")):
     """WebSocket for agents to send messages to users."""
-    await websocket.accept()
-    
-    if agent_id not in connections:
-        connections[agent_id] = {"users": set(), "agent": None}
-    connections[agent_id]["agent"] = websocket
-    
-    await websocket.send_json({"type": "connected", "agent_id": agent_id})
-    
-    try:
-        while True:
-            data = await websocket.receive_json()
-            # Broadcast to all users watching this agent
-            dead = set()
-            for user_ws in connections[agent_id]["users"]:
-                try:
-                    await user_ws.send_json({
-                        "type": "agent_message",
-                        "content": data.get("content", ""),
-                        "agent_id": agent_id,
-                    })
-                except:
-                    dead.add(user_ws)
-            connections[agent_id]["users"] -= dead
-    except:
-        connections[agent_id]["agent"] = None
+    await terminal.agent_websocket_endpoint(websocket, agent_id, api_key)
 
 
 @app.get("/v1/ws/stats")
 async def ws_stats():
     """WebSocket stats."""
+    stats = terminal.manager.get_stats()
     return {
-        "agents": list(connections.keys()),
-        "total_connections": sum(len(c["users"]) + (1 if c["agent"] else 0) for c in connections.values()),
+        "agents": sorted(set(stats["agents_with_watchers"]) | set(stats["connected_agents"])),
+        "total_connections": len(terminal.manager.connections),
+        **stats,
     }
 
 
+# =============================================================================
+# Metrics
+# =============================================================================
+
+get_metrics().add_collector("ws", terminal.manager.get_stats)
+
+
+@app.get("/v1/metrics", response_class=PlainTextResponse)
+async def metrics(authorization: Optional[str] = Header(default=None)):
+    """
+    Operation latencies, token costs and component stats in Prometheus text format.
+
+    Requires "Authorization: Bearer <METRICS_TOKEN>"; without a token set
+    the endpoint does not exist.
+    """
+    token = get_settings().metrics_token
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest((authorization or "").encode(), f"Bearer {token}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token", headers={"WWW-Authenticate": "Bearer"})
+    return PlainTextResponse(get_metrics().render(), media_type="text/plain; version=0.0.4")
+
+
 # Startup message
 print(f"DELTA Platform v{__version__} starting...")
 print(f"Routes loaded: {routes_loaded}")
@@ -6,6 +6,10 @@ from uuid import UUID
 from fastapi import APIRouter, HTTPException, status
 from pydantic import BaseModel
 
+from delta.api.routes.sandboxes import sandbox_http_error
+from delta.core.agents import AgentService
+from delta.sandbox import SandboxError
+
 router = APIRouter()
 
 
@@ -57,19 +61,37 @@ async def get_agent(agent_id: UUID) -> dict:
 @router.delete("/{agent_id}")
 async def delete_agent(agent_id: UUID) -> dict:
     """Delete an agent."""
+    try:
+        await AgentService().destroy_agent(agent_id)
+    except SandboxError as e:
+        raise sandbox_http_error(e)
     return {"message": "Agent deleted"}
 
 
 @router.post("/{agent_id}/pause")
 async def pause_agent(agent_id: UUID) -> dict:
     """Pause an agent."""
-    return {"id": str(agent_id), "status": "paused"}
+    try:
+        result = await AgentService().pause_agent(agent_id)
+    except SandboxError as e:
+        raise sandbox_http_error(e)
+    response = {"id": str(agent_id), "status": "paused"}
+    if "checkpoint_id" in result:
+        response["checkpoint_id"] = result["checkpoint_id"]
+    return response
 
 
 @router.post("/{agent_id}/resume")
 async def resume_agent(agent_id: UUID) -> dict:
     """Resume a paused agent."""
-    return {"id": str(agent_id), "status": "running"}
+    try:
+        result = await AgentService().resume_agent(agent_id)
+    except SandboxError as e:
+        raise sandbox_http_error(e)
+    response = {"id": str(agent_id), "status": "running"}
+    if "checkpoint_id" in result:
+        response["checkpoint_id"] = result["checkpoint_id"]
+    return response
 
 
 # Bot management
@@ -1,7 +1,18 @@
 """Authentication routes."""
 
-from fastapi import APIRouter, HTTPException, status
+from datetime import datetime, timedelta
+
+from fastapi import APIRouter, Depends, Header, HTTPException, status
 from pydantic import BaseModel, EmailStr
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from delta.api.dependencies import get_current_user
+from delta.core.auth import get_auth_service
+from delta.core.credentials import CachedCredential
+from delta.core.hashing import HashingPoolBusyError
+from delta.database import get_session
+from delta.models.user import User
 
 router = APIRouter()
 
@@ -23,42 +34,109 @@ class TokenResponse(BaseModel):
     token_type: str = "bearer"
 
 
+PASSWORD_RESET_EXPIRY = timedelta(hours=1)
+
+
+def hashing_busy_error(error: HashingPoolBusyError) -> HTTPException:
+    """Map a saturated hashing pool to 503 so clients back off and retry."""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(error),
+        headers={"Retry-After": "1"},
+    )
+
+
+def _issue_tokens(user_id) -> TokenResponse:
+    auth = get_auth_service()
+    return TokenResponse(
+        access_token=auth.create_access_token(user_id),
+        refresh_token=auth.create_refresh_token(user_id),
+    )
+
+
 @router.post("/register", status_code=status.HTTP_201_CREATED)
-async def register(request: RegisterRequest) -> dict:
+async def register(request: RegisterRequest, session: AsyncSession = Depends(get_session)) -> dict:
     """Register a new user account."""
-    # TODO: Implement user registration
+    existing = await session.execute(select(User.id).where(User.email == request.email))
+    if existing.first() is not None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email already registered")
+    
+    auth = get_auth_service()
+    try:
+        password_hash = await auth.hash_password_async(request.password)
+    except HashingPoolBusyError as e:
+        raise hashing_busy_error(e)
+    user = User(
+        email=request.email,
+        password_hash=password_hash,
+        name=request.name,
+        email_verification_token=auth.generate_verification_token(),
+    )
+    session.add(user)
+    await session.commit()
     return {
         "message": "User registered successfully",
+        "id": str(user.id),
         "email": request.email,
     }
 
 
 @router.post("/login", response_model=TokenResponse)
-async def login(request: LoginRequest) -> TokenResponse:
+async def login(request: LoginRequest, session: AsyncSession = Depends(get_session)) -> TokenResponse:
     """Login and get access tokens."""
-    # TODO: Implement login
-    return TokenResponse(
-        access_token="placeholder",
-        refresh_token="placeholder",
-    )
+    user = (await session.execute(
+        select(User).where(User.email == request.email)
+    )).scalar_one_or_none()
+    try:
+        verified = user is not None and await get_auth_service().verify_password_async(
+            request.password, user.password_hash
+        )
+    except HashingPoolBusyError as e:
+        raise hashing_busy_error(e)
+    if not verified:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email or password")
+    
+    user.last_login = datetime.utcnow()
+    await session.commit()
+    return _issue_tokens(user.id)
 
 
 @router.post("/refresh", response_model=TokenResponse)
 async def refresh_token(refresh_token: str) -> TokenResponse:
-    """Refresh access token."""
-    # TODO: Implement token refresh
-    return TokenResponse(
-        access_token="placeholder",
-        refresh_token="placeholder",
-    )
+    """Refresh access token (the refresh token is rotated)."""
+    auth = get_auth_service()
+    user_id = auth.verify_token(refresh_token, "refresh")
+    if user_id is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    auth.revoke_token(refresh_token)
+    return _issue_tokens(user_id)
 
 
 @router.post("/logout")
-async def logout() -> dict:
+async def logout(authorization: str | None = Header(default=None)) -> dict:
     """Logout and invalidate tokens."""
+    if authorization and authorization.lower().startswith("bearer "):
+        get_auth_service().revoke_token(authorization[7:])
     return {"message": "Logged out successfully"}
 
 
+@router.post("/logout-all")
+async def logout_all(credential: CachedCredential = Depends(get_current_user)) -> dict:
+    """Invalidate every token the user holds (API keys stay valid)."""
+    get_auth_service().revoke_user_credentials(credential.user_id)
+    return {"message": "Logged out of all sessions"}
+
+
+@router.get("/me")
+async def me(credential: CachedCredential = Depends(get_current_user)) -> dict:
+    """The authenticated user and how they authenticated."""
+    return {
+        "user_id": str(credential.user_id),
+        "auth": credential.kind,
+        "scopes": list(credential.scopes),
+    }
+
+
 @router.post("/verify-email/{token}")
 async def verify_email(token: str) -> dict:
     """Verify email address."""
@@ -66,12 +144,40 @@ async def verify_email(token: str) -> dict:
 
 
 @router.post("/forgot-password")
-async def forgot_password(email: EmailStr) -> dict:
+async def forgot_password(email: EmailStr, session: AsyncSession = Depends(get_session)) -> dict:
     """Request password reset."""
+    user = (await session.execute(select(User).where(User.email == email))).scalar_one_or_none()
+    if user is not None:
+        # TODO: Email the token
+        user.password_reset_token = get_auth_service().generate_password_reset_token()
+        user.password_reset_expires = datetime.utcnow() + PASSWORD_RESET_EXPIRY
+        await session.commit()
     return {"message": "Password reset email sent"}
 
 
 @router.post("/reset-password/{token}")
-async def reset_password(token: str, new_password: str) -> dict:
-    """Reset password with token."""
+async def reset_password(
+    token: str,
+    new_password: str,
+    session: AsyncSession = Depends(get_session),
+) -> dict:
+    """Reset password with token, signing the user out everywhere."""
+    user = (await session.execute(
+        select(User).where(
+            User.password_reset_token == token,
+            User.password_reset_expires > datetime.utcnow(),
+        )
+    )).scalar_one_or_none()
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid or expired reset token")
+    
+    auth = get_auth_service()
+    try:
+        user.password_hash = await auth.hash_password_async(new_password)
+    except HashingPoolBusyError as e:
+        raise hashing_busy_error(e)
+    user.password_reset_token = None
+    user.password_reset_expires = None
+    await session.commit()
+    auth.revoke_user_credentials(user.id)
     return {"message": "Password reset successfully"}
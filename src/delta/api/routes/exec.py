@@ -1,9 +1,18 @@
 """Command execution routes."""
 
+import json
+from typing import AsyncIterator
 from uuid import UUID
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
+from delta.api.routes.sandboxes import sandbox_http_error
+from delta.core.agents import AgentService
+from delta.core.budget import BudgetExceededError, BudgetNotLoadedError
+from delta.core.exec_jobs import ExecJob, ExecJobsFullError, get_exec_jobs
+from delta.sandbox import SandboxError
+
 router = APIRouter()
 
 
@@ -14,25 +23,105 @@ class ExecRequest(BaseModel):
     env_vars: dict[str, str] | None = None
 
 
-@router.post("/{sandbox_id}/exec")
+@router.post("/{sandbox_id}/exec", status_code=status.HTTP_202_ACCEPTED)
 async def execute_command(sandbox_id: UUID, request: ExecRequest) -> dict:
-    """Execute a command in a sandbox."""
-    return {
-        "sandbox_id": str(sandbox_id),
-        "command": request.command,
-        "exit_code": 0,
-        "stdout": "",
-        "stderr": "",
-        "duration_ms": 0,
-    }
+    """
+    Submit a command to run in a sandbox.
+    
+    Returns the pending job right away; poll GET .../exec/{id}?wait=30
+    for the result.
+    """
+    try:
+        await get_exec_jobs().check(sandbox_id)
+        job = get_exec_jobs().submit(
+            sandbox_id,
+            request.command,
+            working_dir=request.working_dir,
+            timeout_seconds=request.timeout_seconds,
+            env_vars=request.env_vars,
+        )
+    except SandboxError as e:
+        raise sandbox_http_error(e)
+    except (BudgetExceededError, BudgetNotLoadedError) as e:
+        raise budget_http_error(e)
+    except ExecJobsFullError as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+    return _job_response(job)
+
+
+@router.post("/{sandbox_id}/exec/stream")
+async def stream_command(sandbox_id: UUID, request: ExecRequest) -> StreamingResponse:
+    """
+    Execute a command in a sandbox, streaming output as NDJSON while it runs.
+    
+    One JSON object per line: numbered {"seq", "stream": "stdout"|"stderr",
+    "data"} chunks, then a final {"seq", "stream": "exit", "exit_code",
+    "duration_ms", "timed_out"}.
+    """
+    service = AgentService()
+    try:
+        # Errors raised once the body is streaming could no longer set the status
+        await service.check(sandbox_id)
+    except SandboxError as e:
+        raise sandbox_http_error(e)
+    except (BudgetExceededError, BudgetNotLoadedError) as e:
+        raise budget_http_error(e)
+    events = service.stream_command(
+        sandbox_id,
+        request.command,
+        working_dir=request.working_dir,
+        timeout_seconds=request.timeout_seconds,
+        env_vars=request.env_vars,
+    )
+    return StreamingResponse(_ndjson(events), media_type="application/x-ndjson")
+
+
+def budget_http_error(error: Exception) -> HTTPException:
+    """Map a budget error to 402 (out of tokens) or 404 (no such agent)."""
+    if isinstance(error, BudgetExceededError):
+        return HTTPException(status_code=status.HTTP_402_PAYMENT_REQUIRED, detail=str(error))
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(error))
+
+
+async def _ndjson(events: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    try:
+        async for event in events:
+            yield json.dumps(event, separators=(",", ":")).encode() + b"\n"
+    finally:
+        # Stops the command right away if the client went away
+        await events.aclose()
 
 
 @router.get("/{sandbox_id}/exec/{exec_id}")
-async def get_execution_result(sandbox_id: UUID, exec_id: str) -> dict:
-    """Get the result of a command execution."""
-    return {
-        "id": exec_id,
-        "sandbox_id": str(sandbox_id),
-        "status": "completed",
-        "exit_code": 0,
-    }
+async def get_execution_result(
+    sandbox_id: UUID,
+    exec_id: str,
+    wait: float = Query(0, ge=0, le=60, description="Seconds to wait for the command to finish"),
+) -> dict:
+    """Get the result of a command execution, optionally long-polling until it finishes."""
+    job = await get_exec_jobs().wait(exec_id, wait)
+    if job is None or job.sandbox_id != sandbox_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Execution not found")
+    return _job_response(job)
+
+
+@router.get("/{sandbox_id}/exec/{exec_id}/{stream}")
+async def get_execution_output(sandbox_id: UUID, exec_id: str, stream: str) -> Response:
+    """Get the full stdout or stderr of a finished execution, including spilled output."""
+    job = get_exec_jobs().get(exec_id)
+    if job is None or job.sandbox_id != sandbox_id or stream not in ("stdout", "stderr"):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Output not found")
+    if not job.finished:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Execution still running")
+    output = getattr(job, stream)
+    if output.spilled:
+        return FileResponse(output.path, media_type="text/plain; charset=utf-8")
+    return PlainTextResponse(output.text())
+
+
+def _job_response(job: ExecJob) -> dict:
+    response = job.to_dict()
+    for stream in ("stdout", "stderr"):
+        if response[f"{stream}_spilled"]:
+            response[f"{stream}_url"] = f"/v1/sandboxes/{job.sandbox_id}/exec/{job.id}/{stream}"
+    return response
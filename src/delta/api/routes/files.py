@@ -4,6 +4,10 @@ from uuid import UUID
 from fastapi import APIRouter
 from pydantic import BaseModel
 
+from delta.api.routes.sandboxes import sandbox_http_error
+from delta.core.agents import AgentService
+from delta.sandbox import SandboxError
+
 router = APIRouter()
 
 
@@ -14,22 +18,39 @@ class WriteFileRequest(BaseModel):
 @router.get("/{sandbox_id}/files")
 async def list_files(sandbox_id: UUID, path: str = "/workspace") -> dict:
     """List files in a directory."""
-    return {"path": path, "files": []}
+    try:
+        files = await AgentService().list_files(sandbox_id, path)
+    except SandboxError as e:
+        raise sandbox_http_error(e)
+    return {"path": path, "files": files or []}
 
 
 @router.get("/{sandbox_id}/files/{path:path}")
 async def read_file(sandbox_id: UUID, path: str) -> dict:
     """Read a file."""
-    return {"path": path, "content": ""}
+    try:
+        content = await AgentService().read_file(sandbox_id, path)
+    except SandboxError as e:
+        raise sandbox_http_error(e)
+    content = content or ""
+    return {"path": path, "content": content, "size": len(content.encode())}
 
 
 @router.put("/{sandbox_id}/files/{path:path}")
 async def write_file(sandbox_id: UUID, path: str, request: WriteFileRequest) -> dict:
     """Write to a file."""
-    return {"path": path, "size": len(request.content)}
+    try:
+        size = await AgentService().write_file(sandbox_id, path, request.content)
+    except SandboxError as e:
+        raise sandbox_http_error(e)
+    return {"path": path, "size": len(request.content) if size is None else size}
 
 
 @router.delete("/{sandbox_id}/files/{path:path}")
 async def delete_file(sandbox_id: UUID, path: str) -> dict:
     """Delete a file."""
+    try:
+        await AgentService().delete_file(sandbox_id, path)
+    except SandboxError as e:
+        raise sandbox_http_error(e)
     return {"message": f"Deleted {path}"}
@@ -1,15 +1,50 @@
 """Sandbox management routes."""
 
-from uuid import UUID
-from fastapi import APIRouter
+from datetime import datetime
+from uuid import UUID, uuid4
+from fastapi import APIRouter, HTTPException, status
+from pydantic import BaseModel, Field
+
+from delta.sandbox import SandboxError, SandboxNotFoundError, get_sandbox_driver
 
 router = APIRouter()
 
 
+class CreateSandboxRequest(BaseModel):
+    template: str = "python-3.12"
+    memory_mb: int = Field(default=512, ge=256, le=4096)
+    cpu_cores: int = Field(default=1, ge=1, le=4)
+
+
+def sandbox_http_error(error: SandboxError) -> HTTPException:
+    """Map a driver error to the HTTP error for it."""
+    if isinstance(error, SandboxNotFoundError):
+        return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(error))
+    return HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(error))
+
+
 @router.post("/")
-async def create_sandbox() -> dict:
+async def create_sandbox(request: CreateSandboxRequest | None = None) -> dict:
     """Create a new sandbox."""
-    return {"id": "placeholder", "status": "creating"}
+    request = request or CreateSandboxRequest()
+    sandbox_id = uuid4()
+    try:
+        fields = await get_sandbox_driver().create(
+            sandbox_id,
+            template=request.template,
+            memory_mb=request.memory_mb,
+            cpu_cores=request.cpu_cores,
+        )
+    except SandboxError as e:
+        raise sandbox_http_error(e)
+    return {
+        **fields,
+        "id": str(sandbox_id),
+        "agent_id": str(sandbox_id),
+        "status": "running",
+        "template": request.template,
+        "created_at": datetime.utcnow().isoformat(),
+    }
 
 
 @router.get("/")
@@ -27,16 +62,28 @@ async def get_sandbox(sandbox_id: UUID) -> dict:
 @router.delete("/{sandbox_id}")
 async def delete_sandbox(sandbox_id: UUID) -> dict:
     """Delete a sandbox."""
+    try:
+        await get_sandbox_driver().destroy(sandbox_id)
+    except SandboxError as e:
+        raise sandbox_http_error(e)
     return {"message": "Sandbox deleted"}
 
 
 @router.post("/{sandbox_id}/pause")
 async def pause_sandbox(sandbox_id: UUID) -> dict:
     """Pause a sandbox."""
+    try:
+        await get_sandbox_driver().pause(sandbox_id)
+    except SandboxError as e:
+        raise sandbox_http_error(e)
     return {"id": str(sandbox_id), "status": "paused"}
 
 
 @router.post("/{sandbox_id}/resume")
 async def resume_sandbox(sandbox_id: UUID) -> dict:
     """Resume a sandbox."""
+    try:
+        await get_sandbox_driver().resume(sandbox_id)
+    except SandboxError as e:
+        raise sandbox_http_error(e)
     return {"id": str(sandbox_id), "status": "running"}
@@ -0,0 +1,223 @@
+"""Message brokers for routing WebSocket frames between workers.
+
+A ConnectionManager delivers each frame to its own local sockets and
+publishes it for its peers, which deliver frames from channels they are
+subscribed to (and ignore their own). With the in-memory broker the peers
+live in the same process; with the Redis broker any number of uvicorn
+workers on any number of nodes can hold an agent's socket and watchers.
+"""
+
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional
+
+from delta.api.websocket.protocol import Frame
+from delta.config import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+# handler(channel, seq, frame, origin)
+FrameHandler = Callable[[str, int, Frame, str], None]
+
+
+def users_channel(agent_id: str) -> str:
+    """Channel carrying frames for the users watching an agent."""
+    return f"delta:ws:{agent_id}:users"
+
+
+def agent_channel(agent_id: str) -> str:
+    """Channel carrying frames for the agent itself."""
+    return f"delta:ws:{agent_id}:agent"
+
+
+def channel_agent_id(channel: str) -> str:
+    """Agent id a channel belongs to."""
+    return channel.split(":", 2)[2].rsplit(":", 1)[0]
+
+
+class Broker(ABC):
+    """Publish/subscribe transport for encoded frames."""
+
+    def __init__(self):
+        self._handlers: Dict[str, List[FrameHandler]] = {}
+
+    @abstractmethod
+    async def publish(self, channel: str, seq: int, frame: Frame, origin: str):
+        """Publish a frame to every subscriber of a channel."""
+
+    @abstractmethod
+    async def next_seq(self, agent_id: str) -> int:
+        """Allocate the next history sequence number for an agent."""
+
+    async def subscribe(self, channel: str, handler: FrameHandler):
+        """Start delivering a channel's frames to handler."""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def unsubscribe(self, channel: str, handler: FrameHandler):
+        """Stop delivering a channel's frames to handler."""
+        handlers = self._handlers.get(channel)
+        if handlers and handler in handlers:
+            handlers.remove(handler)
+            if not handlers:
+                del self._handlers[channel]
+
+    def forget(self, agent_id: str):
+        """
+        Drop per-agent state that is safe to lose once an agent goes idle.
+
+        Sequence counters are not such state: a client reconnecting with an
+        old cursor would skip new frames until seq passed it again.
+        """
+
+    def dispatch(self, channel: str, seq: int, frame: Frame, origin: str):
+        """Deliver a received frame to local handlers."""
+        for handler in self._handlers.get(channel, ()):
+            handler(channel, seq, frame, origin)
+
+    async def close(self):
+        """Release connections and background tasks."""
+        self._handlers.clear()
+
+
+class InMemoryBroker(Broker):
+    """
+    Single-process broker: publish calls subscribers directly.
+
+    Sequence counters are kept for the life of the process (one int per
+    agent), so cursors stay valid after an agent's history is reaped.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._seqs: Dict[str, int] = {}
+
+    async def publish(self, channel: str, seq: int, frame: Frame, origin: str):
+        self.dispatch(channel, seq, frame, origin)
+
+    async def next_seq(self, agent_id: str) -> int:
+        seq = self._seqs.get(agent_id, 0) + 1
+        self._seqs[agent_id] = seq
+        return seq
+
+
+class RedisBroker(Broker):
+    """
+    Redis pub/sub broker shared by all workers.
+
+    Frames travel as "<origin> <seq> <json text>" so subscribers reuse the
+    publisher's encoding. Sequence numbers come from a per-agent INCR
+    counter, so every worker stamps the same seq on the same frame and
+    reconnect cursors work whichever worker a user lands on.
+
+    A frame that fails to decode or deliver is logged and skipped; if the
+    subscription connection fails, the reader resubscribes every channel
+    on a fresh connection, backing off up to MAX_BACKOFF_SECONDS.
+    """
+
+    SEQ_TTL_SECONDS = 7 * 24 * 3600
+    MAX_BACKOFF_SECONDS = 30.0
+
+    def __init__(self, url: Optional[str] = None, client=None):
+        super().__init__()
+        if client is None:
+            import redis.asyncio as redis
+
+            client = redis.from_url(url or get_settings().redis_url)
+        self._client = client
+        self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self._reader: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def publish(self, channel: str, seq: int, frame: Frame, origin: str):
+        await self._client.publish(channel, f"{origin} {seq} {frame.text}")
+
+    async def next_seq(self, agent_id: str) -> int:
+        key = f"delta:ws:{agent_id}:seq"
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.incr(key)
+            pipe.expire(key, self.SEQ_TTL_SECONDS)
+            seq, _ = await pipe.execute()
+        return int(seq)
+
+    async def subscribe(self, channel: str, handler: FrameHandler):
+        first = channel not in self._handlers
+        await super().subscribe(channel, handler)
+        if first:
+            await self._pubsub.subscribe(channel)
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._read_loop())
+
+    async def unsubscribe(self, channel: str, handler: FrameHandler):
+        await super().unsubscribe(channel, handler)
+        if channel not in self._handlers:
+            await self._pubsub.unsubscribe(channel)
+
+    async def _read_loop(self):
+        # get_message() may absorb a cancellation while waiting on its own
+        # timeout, so the loop also checks the closed flag.
+        backoff = 0.5
+        while not self._closed:
+            try:
+                message = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1.0
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if self._closed:
+                    break
+                logger.exception("Redis subscription failed; resubscribing in %.1fs", backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.MAX_BACKOFF_SECONDS)
+                await self._resubscribe()
+                continue
+            backoff = 0.5
+            if message is None:
+                if not self._pubsub.subscribed:
+                    await asyncio.sleep(0.05)
+                continue
+
+            try:
+                channel = message["channel"]
+                data = message["data"]
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                if isinstance(data, bytes):
+                    data = data.decode()
+
+                origin, seq, text = data.split(" ", 2)
+                self.dispatch(channel, int(seq), Frame(text=text), origin)
+            except Exception:
+                logger.exception("Dropped undeliverable frame on %s", message.get("channel"))
+
+    async def _resubscribe(self):
+        """Replace the subscription connection and subscribe to every channel again."""
+        old, self._pubsub = self._pubsub, self._client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await old.aclose()
+        except Exception:
+            pass  # Already broken
+        try:
+            if self._handlers:
+                await self._pubsub.subscribe(*self._handlers)
+        except Exception:
+            logger.exception("Redis resubscribe failed")  # Retried on the next read
+
+    async def close(self):
+        self._closed = True
+        if self._reader is not None:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+            self._reader = None
+        await self._pubsub.aclose()
+        await self._client.aclose()
+        await super().close()
+
+
+def create_broker(settings: Optional[Settings] = None) -> Broker:
+    """Create the broker selected by the ws_broker setting."""
+    settings = settings or get_settings()
+    if settings.ws_broker == "redis":
+        return RedisBroker(settings.redis_url)
+    return InMemoryBroker()
@@ -0,0 +1,64 @@
+"""Timer wheel for scheduling per-connection heartbeat checks."""
+
+from typing import Dict, Hashable, List
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: O(1) schedule and cancel, one tick drives everything.
+
+    Time is divided into ticks. An item scheduled `delay` seconds out lands
+    in the slot that many ticks ahead; delays longer than one revolution
+    carry a round count that is decremented each time the slot comes up.
+    A single loop calling advance() once per tick replaces one sleeping
+    task per connection.
+
+    Usage:
+        wheel = TimerWheel(tick=1.0, slots=128)
+        wheel.schedule(conn, 30)
+        for conn in wheel.advance():  # once per tick
+            ...
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 128):
+        self.tick = tick
+        self._slots: List[Dict[Hashable, int]] = [{} for _ in range(slots)]
+        self._where: Dict[Hashable, int] = {}
+        self._current = 0
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, item: Hashable) -> bool:
+        return item in self._where
+
+    def schedule(self, item: Hashable, delay: float):
+        """Schedule item to come due after delay seconds (replacing any earlier schedule)."""
+        self.cancel(item)
+        ticks = max(1, int(-(-delay // self.tick)))  # ceil, at least one tick
+        rounds, offset = divmod(ticks, len(self._slots))
+        if offset == 0:
+            rounds, offset = rounds - 1, len(self._slots)
+        slot = (self._current + offset) % len(self._slots)
+        self._slots[slot][item] = rounds
+        self._where[item] = slot
+
+    def cancel(self, item: Hashable):
+        """Forget a scheduled item."""
+        slot = self._where.pop(item, None)
+        if slot is not None:
+            del self._slots[slot][item]
+
+    def advance(self) -> list:
+        """Move forward one tick and return the items that came due."""
+        self._current = (self._current + 1) % len(self._slots)
+        bucket = self._slots[self._current]
+        due = []
+        for item, rounds in list(bucket.items()):
+            if rounds:
+                bucket[item] = rounds - 1
+            else:
+                del bucket[item]
+                del self._where[item]
+                due.append(item)
+        return due
@@ -0,0 +1,173 @@
+"""Bounded per-agent message history for WebSocket replay."""
+
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+from delta.api.websocket.protocol import Frame
+
+
+class RingBuffer:
+    """
+    Fixed-capacity buffer of encoded frames with their sequence numbers.
+
+    Appends overwrite the oldest slot, so they are O(1) and nothing is ever
+    copied or trimmed. Frames keep the seq they were published with, which
+    may skip numbers when another worker published frames this one did
+    not see.
+    """
+
+    __slots__ = ("capacity", "last_seq", "count", "last_used", "_head", "_seqs", "_frames")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.last_seq = 0
+        self.count = 0
+        self.last_used = time.monotonic()
+        self._head = 0
+        self._seqs: List[int] = [0] * capacity
+        self._frames: List[Optional[Frame]] = [None] * capacity
+
+    def append(self, frame: Frame, seq: Optional[int] = None) -> int:
+        """Append a frame and return its sequence number."""
+        if seq is None:
+            seq = self.last_seq + 1
+        slot = self._head
+        self._seqs[slot] = seq
+        self._frames[slot] = frame
+        self._head = (slot + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+        if seq > self.last_seq:
+            self.last_seq = seq
+        return seq
+
+    def since(self, cursor: int = 0, limit: Optional[int] = None) -> List[Frame]:
+        """Frames with sequence numbers greater than cursor, oldest first."""
+        start = self._head - self.count
+        frames = []
+        for i in range(start, self._head):
+            slot = i % self.capacity
+            if self._seqs[slot] > cursor:
+                frames.append(self._frames[slot])
+        if limit is not None:
+            frames = frames[-limit:] if limit > 0 else []
+        return frames
+
+
+class MessageHistory:
+    """
+    Per-agent ring buffers with a global frame budget.
+
+    Agents are kept in least-recently-used order. When the total number of
+    retained frames exceeds max_total_frames, whole histories are evicted
+    starting from the least recently used agent that has no live
+    connections (per the is_active callback). drop_idle() frees histories
+    nobody has touched for a while.
+
+    Usage:
+        history = MessageHistory(capacity_per_agent=100, max_total_frames=100_000)
+        seq = history.append(agent_id, frame)
+        missed = history.replay(agent_id, since=last_seen_seq)
+    """
+
+    def __init__(
+        self,
+        capacity_per_agent: int = 100,
+        max_total_frames: int = 100_000,
+        is_active: Optional[Callable[[str], bool]] = None,
+    ):
+        self.capacity_per_agent = capacity_per_agent
+        self.max_total_frames = max_total_frames
+        self.is_active = is_active or (lambda agent_id: False)
+        self._buffers: OrderedDict[str, RingBuffer] = OrderedDict()
+        self.total_frames = 0
+        self.evicted_agents = 0
+
+    def __contains__(self, agent_id: str) -> bool:
+        return agent_id in self._buffers
+
+    def __len__(self) -> int:
+        return len(self._buffers)
+
+    def append(self, agent_id: str, frame: Frame, seq: Optional[int] = None) -> int:
+        """Append a frame to an agent's history and return its sequence number."""
+        buffer = self._buffers.get(agent_id)
+        if buffer is None:
+            buffer = self._buffers[agent_id] = RingBuffer(self.capacity_per_agent)
+        else:
+            self._buffers.move_to_end(agent_id)
+        buffer.last_used = time.monotonic()
+
+        count = buffer.count
+        seq = buffer.append(frame, seq)
+        self.total_frames += buffer.count - count
+
+        if self.total_frames > self.max_total_frames:
+            self._evict(keep=agent_id)
+        return seq
+
+    def replay(self, agent_id: str, since: Optional[int] = None, limit: int = 50) -> List[Frame]:
+        """
+        Frames to replay to a (re)connecting watcher.
+
+        With a cursor, everything after it that is still retained; without
+        one, the last `limit` frames.
+        """
+        buffer = self._buffers.get(agent_id)
+        if buffer is None:
+            return []
+        self._buffers.move_to_end(agent_id)
+        buffer.last_used = time.monotonic()
+        if since is None:
+            return buffer.since(0, limit)
+        return buffer.since(since)
+
+    def last_seq(self, agent_id: str) -> int:
+        """Newest sequence number for an agent (0 if no history)."""
+        buffer = self._buffers.get(agent_id)
+        return buffer.last_seq if buffer is not None else 0
+
+    def drop(self, agent_id: str):
+        """Forget an agent's history."""
+        buffer = self._buffers.pop(agent_id, None)
+        if buffer is not None:
+            self.total_frames -= buffer.count
+
+    def drop_idle(self, max_idle: float, now: Optional[float] = None) -> List[str]:
+        """
+        Drop histories unused for max_idle seconds whose agents are inactive.
+
+        Buffers are kept in last-used order, so the scan stops at the first
+        recently used one. Returns the dropped agent ids.
+        """
+        cutoff = (now if now is not None else time.monotonic()) - max_idle
+        dropped = []
+        for agent_id, buffer in self._buffers.items():
+            if buffer.last_used > cutoff:
+                break
+            if not self.is_active(agent_id):
+                dropped.append(agent_id)
+        for agent_id in dropped:
+            self.drop(agent_id)
+        return dropped
+
+    def _evict(self, keep: str):
+        # Idle agents first, then anyone but the agent being appended to
+        for only_idle in (True, False):
+            for agent_id in list(self._buffers):
+                if self.total_frames <= self.max_total_frames:
+                    return
+                if agent_id == keep or (only_idle and self.is_active(agent_id)):
+                    continue
+                self.drop(agent_id)
+                self.evicted_agents += 1
+
+    def get_stats(self) -> dict:
+        """Get history statistics."""
+        return {
+            "agents": len(self._buffers),
+            "total_frames": self.total_frames,
+            "max_total_frames": self.max_total_frames,
+            "evicted_agents": self.evicted_agents,
+        }
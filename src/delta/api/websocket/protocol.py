@@ -0,0 +1,112 @@
+"""Wire encoding for WebSocket messages.
+
+JSON text frames are the default. Clients that offer the
+"delta.msgpack.v1" subprotocol get the same messages as MessagePack
+binary frames, which are smaller and cheaper to parse for agents
+streaming many small token chunks. MessagePack support needs the
+optional `msgpack` package; without it the subprotocol is never selected.
+
+Connections that opt into coalescing may also receive several messages
+in one frame: {"type": "batch", "messages": [...]}.
+"""
+
+import json
+from typing import Optional
+
+from pydantic import BaseModel
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+MSGPACK_SUBPROTOCOL = "delta.msgpack.v1"
+
+# {"type": "batch", "messages": <array follows>}
+_MSGPACK_BATCH_PREFIX = (
+    b"\x82" + msgpack.packb("type") + msgpack.packb("batch") + msgpack.packb("messages")
+    if msgpack is not None
+    else b""
+)
+
+
+def select_subprotocol(offered: list) -> Optional[str]:
+    """Pick the subprotocol to accept from those a client offered."""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in offered:
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+def encode_batch(frames: list, binary: bool = False):
+    """
+    Join frames into a single batch frame.
+
+    The messages are spliced in from each frame's cached encoding, so
+    batching never re-serializes anything.
+    """
+    if binary:
+        return b"".join([
+            _MSGPACK_BATCH_PREFIX,
+            msgpack.Packer().pack_array_header(len(frames)),
+            *(frame.binary for frame in frames),
+        ])
+    return '{"type":"batch","messages":[' + ",".join(frame.text for frame in frames) + "]}"
+
+
+def decode_message(message: dict) -> dict:
+    """Decode a received ASGI websocket.receive message into a dict."""
+    if message.get("bytes") is not None:
+        if msgpack is None:
+            raise ValueError("Binary frames require the msgpack subprotocol")
+        data = msgpack.unpackb(message["bytes"])
+    else:
+        data = json.loads(message.get("text") or "{}")
+    if not isinstance(data, dict):
+        raise ValueError("Expected an object")
+    return data
+
+
+class Frame:
+    """
+    A message encoded once and shared by every recipient.
+
+    Broadcasting hands the same Frame to every watcher's send queue and to
+    the history buffer, so a message is validated and serialized exactly
+    once per wire format no matter how many users are watching.
+    """
+
+    __slots__ = ("message", "_text", "_binary")
+
+    def __init__(self, message: Optional[BaseModel] = None, text: Optional[str] = None):
+        self.message = message
+        self._text = text
+        self._binary: Optional[bytes] = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Frame":
+        """Build a frame from a plain dict (control messages like pong)."""
+        return cls(text=json.dumps(data, separators=(",", ":")))
+
+    def set_seq(self, seq: int):
+        """Stamp the history sequence number onto the message before encoding."""
+        self.message.seq = seq
+        self._text = None
+        self._binary = None
+
+    @property
+    def text(self) -> str:
+        """JSON text of the message, encoded on first use."""
+        if self._text is None:
+            self._text = self.message.model_dump_json()
+        return self._text
+
+    @property
+    def binary(self) -> bytes:
+        """MessagePack encoding of the message, encoded on first use."""
+        if self._binary is None:
+            if self.message is not None:
+                data = self.message.model_dump(mode="json")
+            else:
+                data = json.loads(self._text)
+            self._binary = msgpack.packb(data)
+        return self._binary
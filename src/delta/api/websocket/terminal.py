@@ -9,12 +9,40 @@ This is the core communication layer that allows:
 import asyncio
 import json
 from datetime import datetime
-from typing import Dict, Optional, Set
+from typing import Dict, Optional, Set, Tuple
 from uuid import UUID, uuid4
 
 from fastapi import WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
 
+from delta.api.websocket.broker import (
+    Broker,
+    InMemoryBroker,
+    agent_channel,
+    channel_agent_id,
+    create_broker,
+    users_channel,
+)
+from delta.api.websocket.heartbeat import TimerWheel
+from delta.api.websocket.history import MessageHistory
+from delta.api.websocket.protocol import (
+    MSGPACK_SUBPROTOCOL,
+    Frame,
+    decode_message,
+    encode_batch,
+    select_subprotocol,
+)
+from delta.config import get_settings
+
+
+# Upper bound on a client-requested coalescing window
+MAX_COALESCE_WINDOW_MS = 250
+
+# Close code for connections reaped by the heartbeat (1001 = going away)
+IDLE_CLOSE_CODE = 1001
+
+PING_FRAME = Frame.from_dict({"type": "ping"})
+
 
 class Message(BaseModel):
     """A message in the agent-user communication."""
@@ -25,6 +53,172 @@ class Message(BaseModel):
     agent_id: Optional[str] = None
     timestamp: str
     metadata: Optional[dict] = None
+    seq: Optional[int] = None  # Per-agent history sequence number
+
+
+class Connection:
+    """
+    A registered WebSocket with its own bounded outbound queue.
+    
+    A dedicated writer task drains the queue, so a slow client only ever
+    delays itself. When the queue is full the slow-consumer policy either
+    drops the oldest queued frame or disconnects the client. Connections
+    that negotiated the msgpack subprotocol are sent binary frames.
+    
+    With a coalescing window, the writer holds the first queued frame for
+    up to that long (or until max_bytes are pending) and sends everything
+    queued meanwhile as one batch frame, so streamed token chunks cost one
+    send per window instead of one per chunk.
+    """
+    
+    def __init__(
+        self,
+        manager: "ConnectionManager",
+        websocket: WebSocket,
+        kind: str,
+        agent_id: str,
+        user_id: Optional[str] = None,
+        queue_size: int = 256,
+        subprotocol: Optional[str] = None,
+        coalesce_window_ms: int = 0,
+        coalesce_max_bytes: int = 16384,
+    ):
+        self.manager = manager
+        self.websocket = websocket
+        self.kind = kind  # "user" or "agent"
+        self.agent_id = agent_id
+        self.user_id = user_id
+        self.binary = subprotocol == MSGPACK_SUBPROTOCOL
+        self.coalesce_window = coalesce_window_ms / 1000
+        self.coalesce_max_bytes = coalesce_max_bytes
+        self.connected_at = datetime.utcnow().isoformat()
+        self.last_seen = asyncio.get_running_loop().time()
+        self.interactive = False  # Has sent at least one frame
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.batches = 0
+        self.closed = False
+        self._writer = asyncio.create_task(self._write_loop())
+    
+    @property
+    def info(self) -> dict:
+        """Connection metadata."""
+        info = {
+            "type": self.kind,
+            "agent_id": self.agent_id,
+            "connected_at": self.connected_at,
+            "encoding": "msgpack" if self.binary else "json",
+        }
+        if self.user_id is not None:
+            info["user_id"] = self.user_id
+        return info
+    
+    def enqueue(self, frame: Frame) -> bool:
+        """Queue a frame without waiting. Returns False if it was not queued."""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            pass
+        
+        if self.manager.slow_consumer_policy == "disconnect":
+            self.manager.slow_consumer_disconnects += 1
+            self.manager.disconnect(self.websocket)
+            asyncio.create_task(self.close(1008))
+            return False
+        
+        self.queue.get_nowait()
+        self.queue.put_nowait(frame)
+        self.dropped += 1
+        self.manager.dropped_messages += 1
+        return True
+    
+    def _payload(self, frame: Frame):
+        return frame.binary if self.binary else frame.text
+    
+    async def _collect(self, frame: Frame) -> list:
+        """Gather frames queued within the coalescing window, up to max_bytes."""
+        frames = [frame]
+        size = len(self._payload(frame))
+        deadline = asyncio.get_running_loop().time() + self.coalesce_window
+        while True:
+            while size < self.coalesce_max_bytes and not self.queue.empty():
+                frame = self.queue.get_nowait()
+                frames.append(frame)
+                size += len(self._payload(frame))
+            remaining = deadline - asyncio.get_running_loop().time()
+            if size >= self.coalesce_max_bytes or remaining <= 0:
+                return frames
+            await asyncio.sleep(remaining)
+    
+    async def _write_loop(self):
+        while True:
+            frame = await self.queue.get()
+            try:
+                if self.coalesce_window:
+                    frames = await self._collect(frame)
+                    if len(frames) > 1:
+                        self.batches += 1
+                        self.manager.coalesced_batches += 1
+                        payload = encode_batch(frames, self.binary)
+                    else:
+                        payload = self._payload(frame)
+                else:
+                    payload = self._payload(frame)
+                
+                if self.binary:
+                    await self.websocket.send_bytes(payload)
+                else:
+                    await self.websocket.send_text(payload)
+            except Exception:
+                # Connection is gone; stop writing and unregister
+                self.manager.disconnect(self.websocket)
+                return
+    
+    async def close(self, code: int = 1000):
+        """Close the socket, ignoring errors from already-dead connections."""
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+    
+    def stop(self):
+        """Stop the writer task."""
+        self.closed = True
+        self._writer.cancel()
+    
+    async def wait_stopped(self):
+        """Wait for the writer task to finish after stop()."""
+        await asyncio.gather(self._writer, return_exceptions=True)
+
+
+class ConnectionShard:
+    """
+    Registries for the agents that hash to one shard.
+    
+    Watcher sets are immutable tuples replaced on every change
+    (copy-on-write), so broadcasts iterate them without copying or locking
+    even if watchers come and go mid-broadcast.
+    """
+    
+    def __init__(self):
+        # Map: agent_id -> tuple of user connections watching that agent
+        self.user_connections: Dict[str, Tuple[Connection, ...]] = {}
+        
+        # Map: agent_id -> agent connection
+        self.agent_connections: Dict[str, Connection] = {}
+    
+    def add_watcher(self, conn: Connection):
+        self.user_connections[conn.agent_id] = self.user_connections.get(conn.agent_id, ()) + (conn,)
+    
+    def remove_watcher(self, conn: Connection):
+        watchers = tuple(c for c in self.user_connections.get(conn.agent_id, ()) if c is not conn)
+        if watchers:
+            self.user_connections[conn.agent_id] = watchers
+        else:
+            self.user_connections.pop(conn.agent_id, None)
 
 
 class ConnectionManager:
@@ -39,35 +233,126 @@ class ConnectionManager:
     1. User connects via WebSocket to watch an agent
     2. Agent connects via WebSocket to send messages
     3. Messages from agent are broadcast to all watching users
+    
+    Registries are sharded by agent_id. Broadcasting only enqueues onto each
+    watcher's bounded send queue; per-connection writer tasks do the actual
+    sends concurrently, so one slow watcher never blocks the others.
+    
+    Frames are also published through a Broker so watchers and agents
+    connected to other workers receive them. A manager subscribes to an
+    agent's channels only while it holds a socket for that agent.
+    
+    A single heartbeat task walks a timer wheel: connections quiet for
+    heartbeat_interval are sent {"type": "ping"}, and connections silent
+    for idle_timeout are closed. Clients keep themselves alive by sending
+    anything, e.g. {"type": "pong"}. Read-only watchers that have never
+    sent a frame (e.g. websocat) cannot answer, so they are only pinged;
+    dead ones are dropped by the server's protocol-level WebSocket pings
+    (uvicorn --ws-ping-interval), which fail their next send. The same
+    task frees the history of agents that have had no connections or
+    traffic for history_ttl.
     """
     
-    def __init__(self):
-        # Map: agent_id -> set of user websockets watching that agent
-        self.user_connections: Dict[str, Set[WebSocket]] = {}
+    def __init__(
+        self,
+        num_shards: int = 64,
+        send_queue_size: int = 256,
+        slow_consumer_policy: str = "drop_oldest",
+        history_per_agent: int = 100,
+        history_max_frames: int = 100_000,
+        broker: Optional[Broker] = None,
+        coalesce_window_ms: int = 0,
+        coalesce_max_bytes: int = 16384,
+        heartbeat_interval: float = 30.0,
+        idle_timeout: float = 90.0,
+        history_ttl: float = 3600.0,
+        heartbeat_tick: float = 1.0,
+    ):
+        self.node_id = uuid4().hex
+        self.broker = broker or InMemoryBroker()
+        self._subscribed: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
         
-        # Map: agent_id -> agent websocket
-        self.agent_connections: Dict[str, WebSocket] = {}
+        self.shards = [ConnectionShard() for _ in range(num_shards)]
+        self.send_queue_size = send_queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.coalesce_window_ms = coalesce_window_ms
+        self.coalesce_max_bytes = coalesce_max_bytes
+        
+        # Heartbeats and reaping
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.history_ttl = history_ttl
+        self.wheel = TimerWheel(tick=heartbeat_tick)
+        self._heartbeat: Optional[asyncio.Task] = None
+        
+        # Message history as encoded frames (in-memory for now, should be Redis in prod)
+        self.history = MessageHistory(
+            capacity_per_agent=history_per_agent,
+            max_total_frames=history_max_frames,
+            is_active=self.is_agent_active,
+        )
         
-        # Message history (in-memory for now, should be Redis in prod)
-        self.message_history: Dict[str, list] = {}
+        # Map: websocket -> connection
+        self.connections: Dict[WebSocket, Connection] = {}
         
-        # Connection metadata
-        self.connection_info: Dict[WebSocket, dict] = {}
+        # Counters
+        self.user_connection_count = 0
+        self.dropped_messages = 0
+        self.slow_consumer_disconnects = 0
+        self.coalesced_batches = 0
+        self.idle_disconnects = 0
+        self.reaped_agents = 0
     
-    async def connect_user(self, websocket: WebSocket, agent_id: str, user_id: str):
-        """Connect a user to watch an agent's activity."""
-        await websocket.accept()
+    def shard_for(self, agent_id: str) -> ConnectionShard:
+        """Get the shard holding an agent's registries."""
+        return self.shards[hash(agent_id) % len(self.shards)]
+    
+    @property
+    def connection_info(self) -> Dict[WebSocket, dict]:
+        """Connection metadata keyed by websocket."""
+        return {ws: conn.info for ws, conn in self.connections.items()}
+    
+    def get_watchers(self, agent_id: str) -> Tuple[Connection, ...]:
+        """Get the user connections watching an agent."""
+        return self.shard_for(agent_id).user_connections.get(agent_id, ())
+    
+    def is_agent_active(self, agent_id: str) -> bool:
+        """Whether an agent or any of its watchers is connected."""
+        shard = self.shard_for(agent_id)
+        return agent_id in shard.user_connections or agent_id in shard.agent_connections
+    
+    async def connect_user(
+        self,
+        websocket: WebSocket,
+        agent_id: str,
+        user_id: str,
+        since: Optional[int] = None,
+        subprotocol: Optional[str] = None,
+        coalesce_ms: Optional[int] = None,
+    ):
+        """
+        Connect a user to watch an agent's activity.
         
-        if agent_id not in self.user_connections:
-            self.user_connections[agent_id] = set()
+        Reconnecting users pass the last `seq` they saw as `since` and only
+        receive what they missed; otherwise the last 50 messages are replayed.
+        `coalesce_ms` overrides the manager's coalescing window for this
+        watcher (0 turns batching off).
+        """
+        await websocket.accept(subprotocol=subprotocol)
         
-        self.user_connections[agent_id].add(websocket)
-        self.connection_info[websocket] = {
-            "type": "user",
-            "user_id": user_id,
-            "agent_id": agent_id,
-            "connected_at": datetime.utcnow().isoformat(),
-        }
+        if coalesce_ms is None:
+            coalesce_ms = self.coalesce_window_ms
+        conn = Connection(
+            self, websocket, "user", agent_id, user_id, self.send_queue_size, subprotocol,
+            coalesce_window_ms=min(max(coalesce_ms, 0), MAX_COALESCE_WINDOW_MS),
+            coalesce_max_bytes=self.coalesce_max_bytes,
+        )
+        self.shard_for(agent_id).add_watcher(conn)
+        self.connections[websocket] = conn
+        self._track(conn)
+        self.user_connection_count += 1
+        await self._sync_subscriptions(agent_id)
         
         # Send connection confirmation
         await self.send_to_user(websocket, Message(
@@ -77,25 +362,48 @@ class ConnectionManager:
             sender="system",
             agent_id=agent_id,
             timestamp=datetime.utcnow().isoformat(),
+            metadata={"last_seq": self.history.last_seq(agent_id)},
         ))
         
-        # Send recent message history
-        if agent_id in self.message_history:
-            for msg in self.message_history[agent_id][-50:]:  # Last 50 messages
-                await self.send_to_user(websocket, Message(**msg))
+        # Send missed (or recent) message history
+        for frame in self.history.replay(agent_id, since):
+            conn.enqueue(frame)
     
-    async def connect_agent(self, websocket: WebSocket, agent_id: str, api_key: str):
+    async def connect_agent(
+        self,
+        websocket: WebSocket,
+        agent_id: str,
+        api_key: str,
+        subprotocol: Optional[str] = None,
+    ):
         """Connect an agent to send messages to users."""
-        await websocket.accept()
+        await websocket.accept(subprotocol=subprotocol)
         
         # TODO: Validate API key
         
-        self.agent_connections[agent_id] = websocket
-        self.connection_info[websocket] = {
-            "type": "agent",
-            "agent_id": agent_id,
-            "connected_at": datetime.utcnow().isoformat(),
-        }
+        shard = self.shard_for(agent_id)
+        previous = shard.agent_connections.get(agent_id)
+        if previous is not None:
+            self.disconnect(previous.websocket)
+        
+        conn = Connection(
+            self, websocket, "agent", agent_id,
+            queue_size=self.send_queue_size, subprotocol=subprotocol,
+        )
+        shard.agent_connections[agent_id] = conn
+        self.connections[websocket] = conn
+        self._track(conn)
+        await self._sync_subscriptions(agent_id)
+        
+        # Send connection confirmation
+        await self.send_to_user(websocket, Message(
+            id=str(uuid4()),
+            type="system",
+            content=f"Connected as agent {agent_id}",
+            sender="system",
+            agent_id=agent_id,
+            timestamp=datetime.utcnow().isoformat(),
+        ))
         
         # Notify watching users
         await self.broadcast_to_users(agent_id, Message(
@@ -109,52 +417,149 @@ class ConnectionManager:
     
     def disconnect(self, websocket: WebSocket):
         """Disconnect a websocket (user or agent)."""
-        info = self.connection_info.get(websocket)
-        if not info:
+        conn = self.connections.pop(websocket, None)
+        if conn is None:
             return
         
-        if info["type"] == "user":
-            agent_id = info["agent_id"]
-            if agent_id in self.user_connections:
-                self.user_connections[agent_id].discard(websocket)
+        shard = self.shard_for(conn.agent_id)
+        if conn.kind == "user":
+            shard.remove_watcher(conn)
+            self.user_connection_count -= 1
+        elif shard.agent_connections.get(conn.agent_id) is conn:
+            del shard.agent_connections[conn.agent_id]
         
-        elif info["type"] == "agent":
-            agent_id = info["agent_id"]
-            if agent_id in self.agent_connections:
-                del self.agent_connections[agent_id]
+        self.wheel.cancel(conn)
+        conn.stop()
+        self._spawn(self._sync_subscriptions(conn.agent_id))
+    
+    def touch(self, websocket: WebSocket):
+        """Record that a connection is alive (call on every received frame)."""
+        conn = self.connections.get(websocket)
+        if conn is not None:
+            conn.last_seen = asyncio.get_running_loop().time()
+            conn.interactive = True
+    
+    def _track(self, conn: Connection):
+        """Put a new connection on the heartbeat wheel."""
+        self.wheel.schedule(conn, self.heartbeat_interval)
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.get_running_loop().create_task(self._heartbeat_loop())
+    
+    async def _heartbeat_loop(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        next_reap = next_tick + self.wheel.tick * 60
+        while True:
+            next_tick += self.wheel.tick
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            now = loop.time()
+            for conn in self.wheel.advance():
+                self._check(conn, now)
+            if now >= next_reap:
+                self.reap(now)
+                next_reap = now + self.wheel.tick * 60
+    
+    def _check(self, conn: Connection, now: float):
+        """Ping a quiet connection, or close it once it has been silent too long."""
+        if self.connections.get(conn.websocket) is not conn:
+            return
+        idle = now - conn.last_seen
+        passive = conn.kind == "user" and not conn.interactive
+        if passive and idle >= self.heartbeat_interval:
+            conn.enqueue(PING_FRAME)  # Keeps traffic flowing; never answered
+            self.wheel.schedule(conn, self.heartbeat_interval)
+        elif idle >= self.idle_timeout:
+            self.idle_disconnects += 1
+            self.disconnect(conn.websocket)
+            self._spawn(conn.close(IDLE_CLOSE_CODE))
+        elif idle >= self.heartbeat_interval:
+            conn.enqueue(PING_FRAME)
+            self.wheel.schedule(conn, min(self.heartbeat_interval, self.idle_timeout - idle))
+        else:
+            self.wheel.schedule(conn, self.heartbeat_interval - idle)
+    
+    def reap(self, now: Optional[float] = None) -> int:
+        """Free history and broker state for agents idle longer than history_ttl."""
+        for agent_id in self.history.drop_idle(self.history_ttl, now):
+            self.broker.forget(agent_id)
+            self.reaped_agents += 1
+        return self.reaped_agents
+    
+    async def _sync_subscriptions(self, agent_id: str):
+        """Subscribe to (or leave) an agent's channels to match local sockets."""
+        shard = self.shard_for(agent_id)
+        has_agent = agent_id in shard.agent_connections
+        wanted = {
+            users_channel(agent_id): has_agent or agent_id in shard.user_connections,
+            agent_channel(agent_id): has_agent,
+        }
+        for channel, want in wanted.items():
+            handler = self._on_agent_frame if channel.endswith(":agent") else self._on_users_frame
+            if want and channel not in self._subscribed:
+                self._subscribed.add(channel)
+                await self.broker.subscribe(channel, handler)
+            elif not want and channel in self._subscribed:
+                self._subscribed.discard(channel)
+                await self.broker.unsubscribe(channel, handler)
+    
+    def _spawn(self, coro):
+        """Run a coroutine in the background, keeping a reference until done."""
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    def _on_users_frame(self, channel: str, seq: int, frame: Frame, origin: str):
+        """Deliver a frame published by another worker to local watchers."""
+        if origin != self.node_id:
+            self._deliver_to_users(channel_agent_id(channel), seq, frame)
+    
+    def _on_agent_frame(self, channel: str, seq: int, frame: Frame, origin: str):
+        """Deliver a frame published by another worker to the local agent."""
+        if origin != self.node_id:
+            self._deliver_to_agent(channel_agent_id(channel), frame)
+    
+    def _deliver_to_users(self, agent_id: str, seq: int, frame: Frame):
+        """Store a frame in local history and queue it for local watchers."""
+        self.history.append(agent_id, frame, seq)
         
-        del self.connection_info[websocket]
+        # Hand off to every watcher's writer; nothing here waits on a socket
+        for conn in self.get_watchers(agent_id):
+            conn.enqueue(frame)
+    
+    def _deliver_to_agent(self, agent_id: str, frame: Frame):
+        """Queue a frame for the agent if it is connected to this worker."""
+        agent = self.shard_for(agent_id).agent_connections.get(agent_id)
+        if agent is not None:
+            agent.enqueue(frame)
     
     async def send_to_user(self, websocket: WebSocket, message: Message):
         """Send a message to a specific user."""
+        frame = Frame(message)
+        conn = self.connections.get(websocket)
+        if conn is not None:
+            conn.enqueue(frame)
+            return
         try:
-            await websocket.send_json(message.model_dump())
+            await websocket.send_text(frame.text)
         except Exception:
             pass  # Connection might be closed
     
+    def send_control(self, websocket: WebSocket, data: dict):
+        """Queue a control message (e.g. pong) behind the connection's other frames."""
+        conn = self.connections.get(websocket)
+        if conn is not None:
+            conn.enqueue(Frame.from_dict(data))
+    
     async def broadcast_to_users(self, agent_id: str, message: Message):
         """Broadcast a message to all users watching an agent."""
-        # Store in history
-        if agent_id not in self.message_history:
-            self.message_history[agent_id] = []
-        self.message_history[agent_id].append(message.model_dump())
-        
-        # Keep only last 100 messages per agent
-        if len(self.message_history[agent_id]) > 100:
-            self.message_history[agent_id] = self.message_history[agent_id][-100:]
-        
-        # Broadcast to all watching users
-        if agent_id in self.user_connections:
-            dead_connections = set()
-            for websocket in self.user_connections[agent_id]:
-                try:
-                    await websocket.send_json(message.model_dump())
-                except Exception:
-                    dead_connections.add(websocket)
-            
-            # Clean up dead connections
-            for ws in dead_connections:
-                self.disconnect(ws)
+        await self.broadcast_frame(agent_id, Frame(message))
+    
+    async def broadcast_frame(self, agent_id: str, frame: Frame):
+        """Stamp a frame's seq, deliver it locally and publish it to other workers."""
+        seq = await self.broker.next_seq(agent_id)
+        frame.set_seq(seq)
+        self._deliver_to_users(agent_id, seq, frame)
+        await self.broker.publish(users_channel(agent_id), seq, frame, self.node_id)
     
     async def send_from_agent(self, agent_id: str, content: str, msg_type: str = "agent_message", metadata: dict = None):
         """Send a message from an agent to all watching users."""
@@ -181,60 +586,123 @@ class ConnectionManager:
             timestamp=datetime.utcnow().isoformat(),
             metadata={"user_id": user_id},
         )
+        frame = Frame(message)
         
-        # Store in history
-        if agent_id not in self.message_history:
-            self.message_history[agent_id] = []
-        self.message_history[agent_id].append(message.model_dump())
+        # Broadcast back to all watching users (and store in history)
+        await self.broadcast_frame(agent_id, frame)
         
-        # Send to agent if connected
-        if agent_id in self.agent_connections:
-            try:
-                await self.agent_connections[agent_id].send_json(message.model_dump())
-            except Exception:
-                pass
-        
-        # Also broadcast back to all watching users
-        await self.broadcast_to_users(agent_id, message)
+        # Send to the agent, wherever it is connected
+        self._deliver_to_agent(agent_id, frame)
+        await self.broker.publish(agent_channel(agent_id), frame.message.seq, frame, self.node_id)
         
         return message
     
+    async def close(self):
+        """Disconnect every connection and wait for writers to stop."""
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+        conns = list(self.connections.values())
+        for conn in conns:
+            self.disconnect(conn.websocket)
+        for conn in conns:
+            await conn.wait_stopped()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.broker.close()
+    
     def get_stats(self) -> dict:
         """Get connection statistics."""
+        agents_with_watchers = []
+        connected_agents = []
+        for shard in self.shards:
+            agents_with_watchers.extend(shard.user_connections)
+            connected_agents.extend(shard.agent_connections)
+        
         return {
-            "total_user_connections": sum(len(conns) for conns in self.user_connections.values()),
-            "total_agent_connections": len(self.agent_connections),
-            "agents_with_watchers": list(self.user_connections.keys()),
-            "connected_agents": list(self.agent_connections.keys()),
+            "total_user_connections": self.user_connection_count,
+            "total_agent_connections": len(self.connections) - self.user_connection_count,
+            "agents_with_watchers": agents_with_watchers,
+            "connected_agents": connected_agents,
+            "history": self.history.get_stats(),
+            "dropped_messages": self.dropped_messages,
+            "slow_consumer_disconnects": self.slow_consumer_disconnects,
+            "coalesced_batches": self.coalesced_batches,
+            "idle_disconnects": self.idle_disconnects,
+            "reaped_agents": self.reaped_agents,
+            "heartbeat_scheduled": len(self.wheel),
         }
 
 
 # Global connection manager
-manager = ConnectionManager()
+_settings = get_settings()
+manager = ConnectionManager(
+    num_shards=_settings.ws_shards,
+    send_queue_size=_settings.ws_send_queue_size,
+    slow_consumer_policy=_settings.ws_slow_consumer_policy,
+    history_per_agent=_settings.ws_history_per_agent,
+    history_max_frames=_settings.ws_history_max_frames,
+    broker=create_broker(_settings),
+    coalesce_window_ms=_settings.ws_coalesce_window_ms,
+    coalesce_max_bytes=_settings.ws_coalesce_max_bytes,
+    heartbeat_interval=_settings.ws_heartbeat_interval_seconds,
+    idle_timeout=_settings.ws_idle_timeout_seconds,
+    history_ttl=_settings.ws_history_ttl_seconds,
+)
+
 
+async def receive_data(websocket: WebSocket) -> dict:
+    """Receive one JSON text or msgpack binary frame as a dict."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    return decode_message(message)
 
-async def user_websocket_endpoint(websocket: WebSocket, agent_id: str, user_id: str):
+
+async def user_websocket_endpoint(
+    websocket: WebSocket,
+    agent_id: str,
+    user_id: str,
+    since: Optional[int] = None,
+    coalesce_ms: Optional[int] = None,
+):
     """
     WebSocket endpoint for users to watch their agent.
     
+    Offer the "delta.msgpack.v1" subprotocol to use binary frames. Pass
+    coalesce_ms to receive streamed output as {"type": "batch"} frames.
+    
     Usage:
         ws://localhost:8000/v1/ws/user/{agent_id}?user_id={user_id}
+        ws://localhost:8000/v1/ws/user/{agent_id}?user_id={user_id}&since={last_seq}
+        ws://localhost:8000/v1/ws/user/{agent_id}?user_id={user_id}&coalesce_ms=20
     """
-    await manager.connect_user(websocket, agent_id, user_id)
+    subprotocol = select_subprotocol(websocket.scope.get("subprotocols", []))
+    await manager.connect_user(websocket, agent_id, user_id, since, subprotocol, coalesce_ms)
     
     try:
         while True:
             # Receive messages from user
-            data = await websocket.receive_json()
+            try:
+                data = await receive_data(websocket)
+            except ValueError as e:
+                manager.send_control(websocket, {"type": "error", "content": str(e)})
+                continue
+            manager.touch(websocket)
+            
+            # Messages without a type are plain chat messages
+            msg_type = data.get("type", "message")
             
-            if data.get("type") == "message":
+            if msg_type == "message":
                 # User sending a message to the agent
                 await manager.send_from_user(agent_id, user_id, data.get("content", ""))
             
-            elif data.get("type") == "ping":
-                await websocket.send_json({"type": "pong"})
+            elif msg_type == "ping":
+                manager.send_control(websocket, {"type": "pong"})
     
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
 
@@ -242,17 +710,28 @@ async def agent_websocket_endpoint(websocket: WebSocket, agent_id: str, api_key:
     """
     WebSocket endpoint for agents to send messages to users.
     
+    Offer the "delta.msgpack.v1" subprotocol to use binary frames.
+    
     Usage:
         ws://localhost:8000/v1/ws/agent/{agent_id}?api_key={api_key}
     """
-    await manager.connect_agent(websocket, agent_id, api_key)
+    subprotocol = select_subprotocol(websocket.scope.get("subprotocols", []))
+    await manager.connect_agent(websocket, agent_id, api_key, subprotocol)
     
     try:
         while True:
             # Receive commands from agent
-            data = await websocket.receive_json()
+            try:
+                data = await receive_data(websocket)
+            except ValueError as e:
+                manager.send_control(websocket, {"type": "error", "content": str(e)})
+                continue
+            manager.touch(websocket)
+            
+            # Messages without a type are plain chat messages
+            msg_type = data.get("type", "message")
             
-            if data.get("type") == "message":
+            if msg_type == "message":
                 # Agent sending a message to users
                 await manager.send_from_agent(
                     agent_id,
@@ -261,7 +740,7 @@ async def agent_websocket_endpoint(websocket: WebSocket, agent_id: str, api_key:
                     data.get("metadata"),
                 )
             
-            elif data.get("type") == "status":
+            elif msg_type == "status":
                 # Agent sending a status update
                 await manager.send_from_agent(
                     agent_id,
@@ -270,18 +749,24 @@ async def agent_websocket_endpoint(websocket: WebSocket, agent_id: str, api_key:
                     data.get("metadata"),
                 )
             
-            elif data.get("type") == "ping":
-                await websocket.send_json({"type": "pong"})
+            elif msg_type == "ping":
+                manager.send_control(websocket, {"type": "pong"})
     
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Only announce the disconnect if a newer connection has not replaced this one
+        current = manager.shard_for(agent_id).agent_connections.get(agent_id)
+        replaced = current is not None and current.websocket is not websocket
         manager.disconnect(websocket)
         
-        # Notify users that agent disconnected
-        await manager.broadcast_to_users(agent_id, Message(
-            id=str(uuid4()),
-            type="status",
-            content="Agent disconnected",
-            sender="system",
-            agent_id=agent_id,
-            timestamp=datetime.utcnow().isoformat(),
-        ))
+        if not replaced:
+            # Notify users that agent disconnected
+            await manager.broadcast_to_users(agent_id, Message(
+                id=str(uuid4()),
+                type="status",
+                content="Agent disconnected",
+                sender="system",
+                agent_id=agent_id,
+                timestamp=datetime.utcnow().isoformat(),
+            ))
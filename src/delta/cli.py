@@ -0,0 +1,132 @@
+"""Operational commands for DELTA.
+
+Usage:
+    delta rollups rebuild [--since 2024-01-01] [--until 2024-02-01] [--user UUID]
+    delta tokens reset [--now 2024-02-01T00:00:00]
+    delta usage-log scan [--dir DIR] [--agent UUID] [--task ID] [--group-by model]
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+
+from delta.config import get_settings
+from delta.database import close_engine, get_engine
+
+
+async def rebuild_rollups(
+    since: Optional[datetime],
+    until: Optional[datetime],
+    user_id: Optional[UUID],
+) -> int:
+    from delta.core.rollups import UsageRollups
+
+    try:
+        return await UsageRollups(get_engine()).rebuild(since, until, user_id)
+    finally:
+        await close_engine()
+
+
+async def reset_tokens(now: Optional[datetime]) -> int:
+    from delta.core.token_reset import TokenResetJob
+
+    try:
+        job = TokenResetJob(get_engine(), chunk_size=get_settings().token_reset_chunk_size)
+        return await job.run(now)
+    finally:
+        await close_engine()
+
+
+def scan_usage_log(args) -> int:
+    from delta.core.usage_log import UsageLogReader
+
+    directory = args.dir or get_settings().usage_log_dir
+    if not directory:
+        print("No usage log directory (pass --dir or set USAGE_LOG_DIR)")
+        return 1
+    reader = UsageLogReader(directory)
+    start = time.perf_counter()
+    totals = reader.aggregate(
+        agent_id=args.agent,
+        task_id=args.task,
+        user_id=args.user,
+        since=args.since,
+        until=args.until,
+        group_by=args.group_by,
+    )
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.group_by:<40} {'tokens':>14} {'events':>12}")
+    for key, entry in sorted(totals.items(), key=lambda item: -item[1]["tokens"]):
+        print(f"{str(key):<40} {entry['tokens']:>14} {entry['events']:>12}")
+    rate = reader.events_scanned / elapsed / 1e6 if elapsed else 0.0
+    print(
+        f"Scanned {reader.events_scanned} events in {reader.segments_read} segments "
+        f"({reader.segments_skipped} skipped) in {elapsed:.3f}s, {rate:.1f}M events/s"
+    )
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="delta", description="DELTA operational commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rollups = commands.add_parser("rollups", help="Token usage rollups")
+    rollup_commands = rollups.add_subparsers(dest="action", required=True)
+    rebuild = rollup_commands.add_parser(
+        "rebuild", help="Recompute rollups from token_usage for whole days"
+    )
+    rebuild.add_argument(
+        "--since", type=datetime.fromisoformat, help="first day (default: first event)"
+    )
+    rebuild.add_argument(
+        "--until", type=datetime.fromisoformat, help="end day, exclusive (default: today)"
+    )
+    rebuild.add_argument("--user", type=UUID, help="only this user's rollups")
+
+    tokens = commands.add_parser("tokens", help="Token allocations")
+    token_commands = tokens.add_subparsers(dest="action", required=True)
+    reset = token_commands.add_parser(
+        "reset", help="Reset monthly usage for users whose reset date has passed"
+    )
+    reset.add_argument(
+        "--now", type=datetime.fromisoformat, help="treat this UTC time as now (default: now)"
+    )
+
+    usage_log = commands.add_parser("usage-log", help="Usage event audit segments")
+    usage_log_commands = usage_log.add_subparsers(dest="action", required=True)
+    scan = usage_log_commands.add_parser("scan", help="Aggregate events from the segments")
+    scan.add_argument("--dir", help="segment directory (default: USAGE_LOG_DIR)")
+    scan.add_argument("--agent", type=UUID, help="only this agent's events")
+    scan.add_argument("--user", type=UUID, help="only this user's events")
+    scan.add_argument("--task", help="only this task's events")
+    scan.add_argument("--since", type=datetime.fromisoformat, help="first UTC time")
+    scan.add_argument("--until", type=datetime.fromisoformat, help="end UTC time, exclusive")
+    scan.add_argument(
+        "--group-by", choices=["agent", "user", "type", "model", "task"], default="agent"
+    )
+
+    return parser
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.command == "rollups" and args.action == "rebuild":
+        rows = asyncio.run(rebuild_rollups(args.since, args.until, args.user))
+        print(f"Rebuilt rollups from {rows} usage rows")
+    elif args.command == "tokens" and args.action == "reset":
+        users = asyncio.run(reset_tokens(args.now))
+        print(f"Reset monthly usage for {users} users")
+    elif args.command == "usage-log" and args.action == "scan":
+        return scan_usage_log(args)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
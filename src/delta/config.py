@@ -35,6 +35,7 @@ class Settings(BaseSettings):
     fly_api_token: str = ""
     fly_org: str = ""
     fly_region: str = "sjc"  # San Jose, CA
+    fly_app_name: str = ""  # App the sandbox machines run in
 
     # JWT Authentication
     jwt_secret_key: str = "change-me-jwt-secret-min-32-characters"
@@ -46,6 +47,16 @@ class Settings(BaseSettings):
     argon2_time_cost: int = 3
     argon2_memory_cost: int = 65536
     argon2_parallelism: int = 4
+    argon2_max_workers: int = 0  # 0 = derive from available memory and CPUs
+    argon2_max_queue: int = 64
+    argon2_memory_fraction: float = 0.25  # Share of free RAM hashing may use
+
+    # API keys ("hmac" = keyed SHA-256 digest, "argon2" = slow hash at rest)
+    api_key_hash_scheme: Literal["hmac", "argon2"] = "hmac"
+
+    # Verified credential cache
+    credential_cache_max_entries: int = 10000
+    credential_cache_ttl_seconds: int = 300
 
     # Claude API
     anthropic_api_key: str = ""
@@ -88,6 +99,59 @@ class Settings(BaseSettings):
     default_agent_cpu_cores: int = 1
     max_agent_cpu_cores: int = 4
 
+    # WebSocket fan-out
+    ws_shards: int = 64
+    ws_send_queue_size: int = 256  # Per-connection outbound frames
+    ws_slow_consumer_policy: Literal["drop_oldest", "disconnect"] = "drop_oldest"
+    ws_history_per_agent: int = 100
+    ws_history_max_frames: int = 100000  # Across all agents
+    ws_broker: Literal["memory", "redis"] = "memory"  # "redis" for multiple workers
+    ws_coalesce_window_ms: int = 0  # Batch watcher frames for up to this long (0 = off)
+    ws_coalesce_max_bytes: int = 16384  # Flush a batch early once it reaches this size
+    ws_heartbeat_interval_seconds: float = 30.0  # Ping connections quiet for this long
+    ws_idle_timeout_seconds: float = 90.0  # Close connections silent for this long
+    ws_history_ttl_seconds: float = 3600.0  # Free history of agents idle this long
+
+    # Sandbox backend
+    sandbox_driver: Literal["noop", "local", "fly"] = "noop"  # "local" runs commands on this host
+    sandbox_local_root: str = ""  # Local sandbox directories (default: <tmp>/delta-sandboxes)
+    sandbox_local_isolate_network: bool = False  # Run local commands without network (unshare)
+
+    # Warm sandbox pool
+    warm_pool_enabled: bool = False
+    warm_pool_shapes: str = "python-3.12:512:1"  # Always kept warm; template:memory_mb:cpu_cores, comma-separated
+    warm_pool_min_idle: int = 1  # Per configured shape
+    warm_pool_max_idle: int = 10  # Per shape
+    warm_pool_window_seconds: float = 300.0  # Demand history used for sizing
+
+    # Workspace checkpoints
+    checkpoint_store: Literal["", "local", "r2"] = ""  # Checkpoint workspaces on pause; "r2" uses the R2 settings
+    checkpoint_local_dir: str = ""  # Local chunk store (default: <tmp>/delta-checkpoints)
+    checkpoint_workers: int = 8  # Concurrent chunk uploads/downloads per checkpoint or restore
+
+    # Command execution jobs
+    exec_max_concurrent_per_sandbox: int = 4  # Further commands queue on the sandbox
+    exec_max_jobs: int = 10000  # Results kept (finished ones are dropped first)
+    exec_result_ttl_seconds: float = 3600.0  # Keep finished results this long
+    exec_spill_threshold_bytes: int = 1048576  # Per stream; larger output goes to disk
+    exec_spill_dir: str = ""  # Where spilled output goes (default: system temp dir)
+    exec_memory_budget_bytes: int = 268435456  # All jobs' in-memory output; past it output spills
+
+    # Token budgets
+    budget_enforced: bool = False  # Reserve tokens for commands and bot messages before running them
+    budget_shards: int = 64
+    budget_reconcile_interval_seconds: float = 5.0  # Write committed usage back this often
+    token_reset_interval_seconds: float = 0.0  # Run the monthly reset this often (0 = off)
+    token_reset_chunk_size: int = 1000  # Users reset per transaction
+
+    # Token usage persistence (write-behind)
+    usage_flush_batch_size: int = 500
+    usage_flush_interval_seconds: float = 1.0
+    usage_buffer_size: int = 10000  # Rows held in memory before spilling to the spool
+    usage_spool_path: str = ""  # Append-only crash spool; empty to disable
+    usage_rollups_enabled: bool = True  # Maintain minute/hour/day rollups on flush
+    usage_log_dir: str = ""  # Daily audit segments of usage events; empty to disable
+
     # Rate Limiting
     rate_limit_per_minute: int = 60
     rate_limit_per_hour: int = 1000
@@ -95,6 +159,7 @@ class Settings(BaseSettings):
     # Logging
     log_level: str = "INFO"
     sentry_dsn: str = ""
+    metrics_token: str = ""  # Bearer token /v1/metrics requires; empty disables the endpoint
 
 
 @lru_cache
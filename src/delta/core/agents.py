@@ -1,10 +1,41 @@
 """Agent lifecycle management service."""
 
+import asyncio
+import os
+import posixpath
+from contextlib import nullcontext
 from datetime import datetime
-from typing import Optional
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Optional
 from uuid import UUID, uuid4
 
+from delta.config import get_settings
+from delta.core.budget import BudgetEngine, get_budget_engine
+from delta.core.metrics import get_metrics
+from delta.core.tokens import TokenService
 from delta.models.agent import AgentConfig, AgentStatus, AgentType
+from delta.models.token_usage import TokenUsageType
+from delta.sandbox import (
+    WORKSPACE,
+    SandboxDriver,
+    SandboxError,
+    SandboxNotFoundError,
+    get_checkpointer,
+    get_sandbox_driver,
+    get_warm_pool,
+)
+
+if TYPE_CHECKING:
+    from delta.sandbox.checkpoint import Checkpointer
+    from delta.sandbox.pool import WarmPool
+
+
+def workspace_relpath(path: str) -> str:
+    """A sandbox path ("/workspace/src/a.py" or "src/a.py") relative to the workspace ("." for its root)."""
+    path = posixpath.normpath("/" + path.lstrip("/"))
+    if path == WORKSPACE or path.startswith(WORKSPACE + "/"):
+        path = path[len(WORKSPACE):]
+    return path.lstrip("/") or "."
 
 
 class AgentService:
@@ -15,10 +46,43 @@ class AgentService:
     - Main Agent: Full permissions, can create bots, allocate tokens
     - Bot Agent: Limited permissions, specific task, requests tokens from main
     - Messenger Bot: Ultra-limited, can only send pre-approved messages
+    
+    Sandboxes are provisioned and commands run through a SandboxDriver
+    (the shared one selected by SANDBOX_DRIVER unless one is passed).
+    With a warm pool, new agents take a pre-booted sandbox of their shape.
+    With a checkpointer, pausing snapshots the workspace (for drivers with
+    a host workspace), and resuming a sandbox that no longer exists boots
+    a new one of the agent's shape and restores the snapshot into it
+    lazily: resume returns once the directory layout is in place, a
+    command starts once the files under its working directory are
+    restored, and file operations fetch the files they touch first.
+    
+    File operations work on drivers with a host workspace (with others
+    they return None) and are observed as file_operation latencies.
+    
+    With a budget engine (the shared one when BUDGET_ENFORCED is set), each
+    command holds a tool_execution reservation while it runs, committed
+    when it finishes and refunded if it fails.
     """
     
-    def __init__(self):
+    def __init__(
+        self,
+        driver: Optional[SandboxDriver] = None,
+        pool: Optional["WarmPool"] = None,
+        checkpoints: Optional["Checkpointer"] = None,
+        budgets: Optional[BudgetEngine] = None,
+    ):
         self.default_config = AgentConfig()
+        if driver is None:
+            driver = get_sandbox_driver()
+            pool = pool or get_warm_pool()  # The shared pool boots on the shared driver
+            checkpoints = checkpoints or get_checkpointer()
+            if budgets is None and get_settings().budget_enforced:
+                budgets = get_budget_engine()
+        self.driver = driver
+        self.pool = pool
+        self.checkpoints = checkpoints
+        self.budgets = budgets
     
     async def create_agent(
         self,
@@ -37,7 +101,18 @@ class AgentService:
         if config is None:
             config = self.default_config
         
-        agent_id = uuid4()
+        if self.pool is not None:
+            agent_id, sandbox_fields = await self.pool.acquire(
+                config.template, config.memory_mb, config.cpu_cores
+            )
+        else:
+            agent_id = uuid4()
+            sandbox_fields = await self.driver.create(
+                agent_id,
+                template=config.template,
+                memory_mb=config.memory_mb,
+                cpu_cores=config.cpu_cores,
+            )
         
         # Prepare agent data
         agent_data = {
@@ -55,10 +130,8 @@ class AgentService:
             "created_at": datetime.utcnow(),
         }
         
-        # TODO: Create Fly.io machine
-        # machine = await self.fly_client.create_machine(...)
-        # agent_data["fly_machine_id"] = machine.id
-        # agent_data["fly_app_name"] = machine.app_name
+        # Backend identifiers, e.g. fly_machine_id and fly_app_name
+        agent_data.update(sandbox_fields)
         
         agent_data["status"] = AgentStatus.RUNNING
         
@@ -103,32 +176,84 @@ class AgentService:
         return bot_data
     
     async def pause_agent(self, agent_id: UUID) -> dict:
-        """Pause an agent, preserving its state."""
-        # TODO: Pause Fly.io machine
-        return {
+        """Pause an agent, preserving its state (and checkpointing its workspace)."""
+        await self.driver.pause(agent_id)
+        result = {
             "id": agent_id,
             "status": AgentStatus.PAUSED,
             "paused_at": datetime.utcnow(),
         }
+        workspace = self.driver.workspace_path(agent_id) if self.checkpoints else None
+        if workspace is not None:
+            # Taken while the sandbox is stopped and any restore into it has
+            # finished, so the snapshot is consistent
+            await self.checkpoints.ready(agent_id)
+            manifest = await self.checkpoints.checkpoint(agent_id, workspace)
+            result["checkpoint_id"] = manifest["id"]
+        return result
     
-    async def resume_agent(self, agent_id: UUID) -> dict:
-        """Resume a paused agent."""
-        # TODO: Resume Fly.io machine
-        return {
+    async def resume_agent(self, agent_id: UUID, config: Optional[AgentConfig] = None) -> dict:
+        """
+        Resume a paused agent, restoring it from its last checkpoint if its sandbox is gone.
+        
+        config is the agent's stored shape, used to boot the replacement sandbox.
+        """
+        if config is None:
+            config = self.default_config
+        result = {
             "id": agent_id,
             "status": AgentStatus.RUNNING,
             "resumed_at": datetime.utcnow(),
         }
+        try:
+            await self.driver.resume(agent_id)
+        except SandboxNotFoundError:
+            if self.checkpoints is None:
+                raise
+            if await asyncio.to_thread(self.checkpoints.latest, agent_id) is None:
+                raise
+            result.update(await self.driver.create(
+                agent_id,
+                template=config.template,
+                memory_mb=config.memory_mb,
+                cpu_cores=config.cpu_cores,
+            ))
+            workspace = self.driver.workspace_path(agent_id)
+            if workspace is None:
+                await self.driver.destroy(agent_id)
+                raise SandboxError(f"The {self.driver.name} driver cannot restore checkpoints")
+            restore = await self.checkpoints.restore(agent_id, workspace)
+            result["checkpoint_id"] = restore.manifest["id"]
+        return result
     
     async def destroy_agent(self, agent_id: UUID) -> dict:
         """Destroy an agent and release resources."""
-        # TODO: Destroy Fly.io machine
+        await self.driver.destroy(agent_id)
         return {
             "id": agent_id,
             "status": AgentStatus.STOPPED,
             "destroyed_at": datetime.utcnow(),
         }
     
+    async def check(self, agent_id: UUID):
+        """
+        Raise unless the agent's sandbox can run a command and its budget covers one.
+        
+        Raises:
+            SandboxError: as SandboxDriver.check
+            BudgetExceededError: if the agent or its user lacks the tokens
+            BudgetNotLoadedError: if budgets are enforced and the agent does not exist
+        """
+        await self.driver.check(agent_id)
+        if self.budgets is not None:
+            await self.budgets.require(agent_id, TokenService.COSTS[TokenUsageType.TOOL_EXECUTION])
+    
+    def _charge(self, agent_id: UUID):
+        """Hold a command's cost against the agent's budget, if one is enforced."""
+        if self.budgets is None:
+            return nullcontext()
+        return self.budgets.hold(agent_id, TokenService.COSTS[TokenUsageType.TOOL_EXECUTION])
+    
     async def execute_command(
         self,
         agent_id: UUID,
@@ -137,16 +262,134 @@ class AgentService:
         timeout_seconds: int = 300,
     ) -> dict:
         """Execute a command in the agent's sandbox."""
-        # TODO: Execute via Fly.io machine
+        if self.checkpoints is not None:
+            await self.checkpoints.ensure(agent_id, workspace_relpath(working_dir))
+        async with self._charge(agent_id):
+            result = await self.driver.exec(
+                agent_id, command, working_dir=working_dir, timeout_seconds=timeout_seconds
+            )
         return {
             "agent_id": agent_id,
             "command": command,
-            "exit_code": 0,
-            "stdout": "",
-            "stderr": "",
-            "duration_ms": 0,
+            "exit_code": result["exit_code"],
+            "stdout": result["stdout"],
+            "stderr": result["stderr"],
+            "duration_ms": result["duration_ms"],
         }
     
+    def stream_command(
+        self,
+        agent_id: UUID,
+        command: str,
+        working_dir: str = "/workspace",
+        timeout_seconds: int = 300,
+        env_vars: Optional[dict[str, str]] = None,
+    ) -> AsyncIterator[dict]:
+        """
+        Execute a command in the agent's sandbox, yielding output as it is produced.
+        
+        Events are those of delta.core.exec_stream.stream_process: numbered
+        stdout/stderr chunks followed by one "exit" event.
+        """
+        events = self.driver.exec_stream(
+            agent_id,
+            command,
+            working_dir=working_dir,
+            timeout_seconds=timeout_seconds,
+            env_vars=env_vars,
+        )
+        if self.checkpoints is None and self.budgets is None:
+            return events
+        return self._prepared(agent_id, working_dir, events)
+    
+    async def _prepared(
+        self, agent_id: UUID, working_dir: str, events: AsyncIterator[dict]
+    ) -> AsyncIterator[dict]:
+        try:
+            if self.checkpoints is not None:
+                await self.checkpoints.ensure(agent_id, workspace_relpath(working_dir))
+            async with self._charge(agent_id):
+                async for event in events:
+                    yield event
+        finally:
+            await events.aclose()
+    
+    async def list_files(self, agent_id: UUID, path: str = WORKSPACE) -> Optional[list[dict]]:
+        """Entries of a workspace directory: name, path, size, is_dir and modified_at."""
+        rel = workspace_relpath(path)
+        base = WORKSPACE if rel == "." else f"{WORKSPACE}/{rel}"
+        
+        def scan(directory: Path) -> list[dict]:
+            entries = []
+            with os.scandir(directory) as it:
+                for entry in sorted(it, key=lambda entry: entry.name):
+                    st = entry.stat(follow_symlinks=False)
+                    entries.append({
+                        "name": entry.name,
+                        "path": f"{base}/{entry.name}",
+                        "size": st.st_size,
+                        "is_dir": entry.is_dir(follow_symlinks=False),
+                        "modified_at": datetime.utcfromtimestamp(st.st_mtime),
+                    })
+            return entries
+        
+        return await self._file_op(agent_id, path, scan, recursive=False)
+    
+    async def read_file(self, agent_id: UUID, path: str) -> Optional[str]:
+        """Read a workspace file as text."""
+        return await self._file_op(agent_id, path, lambda target: target.read_text(errors="replace"))
+    
+    async def write_file(self, agent_id: UUID, path: str, content: str) -> Optional[int]:
+        """Write a workspace file, creating its directories. Returns the bytes written."""
+        data = content.encode()
+        
+        def write(target: Path) -> int:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(data)
+            return len(data)
+        
+        return await self._file_op(agent_id, path, write)
+    
+    async def delete_file(self, agent_id: UUID, path: str) -> Optional[bool]:
+        """Delete a workspace file."""
+        def delete(target: Path) -> bool:
+            target.unlink()
+            return True
+        
+        return await self._file_op(agent_id, path, delete)
+    
+    async def _file_op(
+        self,
+        agent_id: UUID,
+        path: str,
+        operation: Callable[[Path], Any],
+        recursive: bool = True,
+    ) -> Any:
+        """
+        Run operation on the host path of a workspace path in a thread, timed
+        as a file_operation. Returns None if the driver has no host workspace.
+        
+        A pending restore fetches the path's files first, so reads see them
+        and writes are not overwritten by the restore later.
+        """
+        cost = TokenService.COSTS[TokenUsageType.FILE_OPERATION]
+        with get_metrics().time(TokenUsageType.FILE_OPERATION, agent_id, cost):
+            workspace = self.driver.workspace_path(agent_id)
+            if workspace is None:
+                return None
+            rel = workspace_relpath(path)
+            if self.checkpoints is not None:
+                await self.checkpoints.ensure(agent_id, rel, recursive)
+            target = (workspace / rel).resolve()
+            if not target.is_relative_to(workspace.resolve()):
+                raise SandboxError(f"Path escapes the workspace: {path}")
+            try:
+                return await asyncio.to_thread(operation, target)
+            except FileNotFoundError:
+                raise SandboxNotFoundError(f"File not found: {path}")
+            except OSError as e:
+                raise SandboxError(f"{path}: {e.strerror}")
+    
     async def request_tokens(
         self,
         bot_id: UUID,
@@ -161,8 +404,17 @@ class AgentService:
         1. Bot sends request with reason
         2. Parent agent (or user) reviews
         3. If approved, tokens are transferred
+        
+        With an enforced budget tree, a request the parent's effective
+        budget cannot cover is denied right away.
         """
         request_id = uuid4()
+        status = "pending"
+        if self.budgets is not None and self.budgets.tree is not None:
+            await self.budgets.ensure_loaded(parent_agent_id)
+            allowed, _ = self.budgets.tree.check(parent_agent_id, amount)
+            if not allowed:
+                status = "denied"
         
         return {
             "id": request_id,
@@ -170,7 +422,7 @@ class AgentService:
             "parent_agent_id": parent_agent_id,
             "amount": amount,
             "reason": reason,
-            "status": "pending",
+            "status": status,
             "created_at": datetime.utcnow(),
         }
     
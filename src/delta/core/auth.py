@@ -1,15 +1,28 @@
 """Authentication service for DELTA platform."""
 
+import hashlib
+import hmac
+import json
 import secrets
-from datetime import datetime, timedelta
+import time
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from uuid import UUID
 
 from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
+from argon2.exceptions import InvalidHashError, VerifyMismatchError
 from jose import JWTError, jwt
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from delta.config import get_settings
+from delta.core.credentials import CachedCredential, CredentialCache
+from delta.core.hashing import get_hashing_pool
+from delta.core.metrics import get_metrics
+from delta.models.user import APIKey
+
+API_KEY_PREFIX = "delta_sk_"
+API_KEY_LOOKUP_LENGTH = 12  # Stored in APIKey.key_prefix
 
 
 class AuthService:
@@ -22,6 +35,10 @@ class AuthService:
             memory_cost=self.settings.argon2_memory_cost,
             parallelism=self.settings.argon2_parallelism,
         )
+        self.credential_cache = CredentialCache(
+            max_entries=self.settings.credential_cache_max_entries,
+            ttl_seconds=self.settings.credential_cache_ttl_seconds,
+        )
     
     def hash_password(self, password: str) -> str:
         """Hash a password using Argon2id."""
@@ -32,9 +49,17 @@ class AuthService:
         try:
             self.hasher.verify(password_hash, password)
             return True
-        except VerifyMismatchError:
+        except (VerifyMismatchError, InvalidHashError):
             return False
     
+    async def hash_password_async(self, password: str) -> str:
+        """Hash a password on the hashing pool without blocking the event loop."""
+        return await get_hashing_pool().run(self.hash_password, password)
+    
+    async def verify_password_async(self, password: str, password_hash: str) -> bool:
+        """Verify a password on the hashing pool without blocking the event loop."""
+        return await get_hashing_pool().run(self.verify_password, password, password_hash)
+    
     def create_access_token(
         self,
         user_id: UUID,
@@ -48,6 +73,7 @@ class AuthService:
         to_encode = {
             "sub": str(user_id),
             "exp": expire,
+            "iat": time.time(),
             "type": "access",
         }
         
@@ -65,6 +91,7 @@ class AuthService:
         to_encode = {
             "sub": str(user_id),
             "exp": expire,
+            "iat": time.time(),
             "type": "refresh",
         }
         
@@ -76,6 +103,20 @@ class AuthService:
     
     def verify_token(self, token: str, token_type: str = "access") -> Optional[UUID]:
         """Verify a JWT token and return the user ID."""
+        credential = self.verify_token_cached(token)
+        if credential is None or credential.kind != token_type:
+            return None
+        return credential.user_id
+    
+    def verify_token_cached(self, token: str) -> Optional[CachedCredential]:
+        """Verify a JWT token, consulting the credential cache first."""
+        digest = self.credential_cache.digest(token)
+        credential = self.credential_cache.get(digest)
+        if credential is not None:
+            return credential
+        if self.credential_cache.is_revoked(digest):
+            return None
+        
         try:
             payload = jwt.decode(
                 token,
@@ -83,27 +124,149 @@ class AuthService:
                 algorithms=[self.settings.jwt_algorithm],
             )
             
-            if payload.get("type") != token_type:
-                return None
-            
             user_id = payload.get("sub")
-            if user_id is None:
+            if user_id is None or payload.get("type") is None:
                 return None
             
-            return UUID(user_id)
-        except JWTError:
+            credential = CachedCredential(
+                user_id=UUID(user_id),
+                kind=payload["type"],
+                scopes=tuple(payload.get("scopes", ())),
+                expires_at=payload.get("exp"),
+                issued_at=payload.get("iat"),
+            )
+        except (JWTError, ValueError):
+            return None
+        
+        revoked_before = self.credential_cache.revoked_before(credential.user_id)
+        if revoked_before is not None and (credential.issued_at or 0) <= revoked_before:
             return None
+        
+        self.credential_cache.put(digest, credential)
+        return credential
+    
+    def revoke_token(self, token: str) -> None:
+        """Revoke a JWT (e.g. on logout) so cached and fresh verifications fail."""
+        try:
+            expires_at = float(jwt.get_unverified_claims(token)["exp"])
+        except (JWTError, KeyError, TypeError, ValueError):
+            expires_at = time.time() + timedelta(
+                days=self.settings.jwt_refresh_token_expire_days
+            ).total_seconds()
+        self.credential_cache.revoke(self.credential_cache.digest(token), expires_at)
+    
+    def revoke_api_key(self, key_id: UUID) -> None:
+        """Evict a cached API key after it is deactivated or deleted."""
+        self.credential_cache.revoke_api_key(key_id)
+    
+    def revoke_user_credentials(self, user_id: UUID) -> None:
+        """
+        Revoke every credential of a user (e.g. password change).
+        
+        Cached credentials are evicted and every JWT issued until now is
+        refused, even though its signature still verifies; tokens issued
+        afterwards work as usual. API keys are re-checked on their next use.
+        """
+        keep_until = time.time() + timedelta(
+            days=self.settings.jwt_refresh_token_expire_days
+        ).total_seconds()
+        self.credential_cache.revoke_user(user_id, keep_until)
     
     def generate_api_key(self) -> tuple[str, str]:
-        """Generate a new API key. Returns (full_key, key_hash)."""
+        """
+        Generate a new API key. Returns (full_key, key_hash).
+        
+        The hash is a keyed HMAC-SHA256 digest by default, which doubles as an
+        indexed lookup key. With api_key_hash_scheme="argon2" it is an Argon2id
+        hash instead, and lookups go through the key prefix.
+        """
         # Format: delta_sk_<random>
-        key = f"delta_sk_{secrets.token_urlsafe(32)}"
-        key_hash = self.hasher.hash(key)
-        return key, key_hash
+        key = f"{API_KEY_PREFIX}{secrets.token_urlsafe(32)}"
+        if self.settings.api_key_hash_scheme == "argon2":
+            return key, self.hasher.hash(key)
+        return key, self.digest_api_key(key)
+    
+    async def generate_api_key_async(self) -> tuple[str, str]:
+        """Generate a new API key, hashing on the pool when Argon2 is used."""
+        if self.settings.api_key_hash_scheme == "argon2":
+            return await get_hashing_pool().run(self.generate_api_key)
+        return self.generate_api_key()
+    
+    def digest_api_key(self, key: str) -> str:
+        """Compute the keyed HMAC-SHA256 digest of an API key."""
+        return hmac.new(
+            self.settings.secret_key.encode(),
+            key.encode(),
+            hashlib.sha256,
+        ).hexdigest()
+    
+    def get_api_key_prefix(self, key: str) -> str:
+        """Get the non-secret prefix stored alongside an API key."""
+        return key[:API_KEY_LOOKUP_LENGTH]
     
     def verify_api_key(self, key: str, key_hash: str) -> bool:
-        """Verify an API key."""
-        return self.verify_password(key, key_hash)
+        """Verify an API key against an HMAC digest or an Argon2 hash."""
+        if key_hash.startswith("$argon2"):
+            return self.verify_password(key, key_hash)
+        return hmac.compare_digest(self.digest_api_key(key), key_hash)
+    
+    async def authenticate_api_key(self, session: AsyncSession, key: str) -> Optional[APIKey]:
+        """
+        Look up and verify an API key.
+        
+        HMAC keys are found with a single indexed lookup on key_hash. Argon2
+        keys are narrowed down by key_prefix and verified one by one.
+        """
+        if not key.startswith(API_KEY_PREFIX):
+            return None
+        
+        result = await session.execute(
+            select(APIKey).where(APIKey.key_hash == self.digest_api_key(key))
+        )
+        api_key = result.scalar_one_or_none()
+        
+        if api_key is None:
+            result = await session.execute(
+                select(APIKey).where(
+                    APIKey.key_prefix == self.get_api_key_prefix(key),
+                    APIKey.key_hash.startswith("$argon2"),
+                )
+            )
+            for candidate in result.scalars():
+                if await self.verify_password_async(key, candidate.key_hash):
+                    api_key = candidate
+                    break
+        
+        if api_key is None or not api_key.is_active:
+            return None
+        if api_key.expires_at is not None and api_key.expires_at <= datetime.utcnow():
+            return None
+        return api_key
+    
+    async def resolve_api_key(self, session: AsyncSession, key: str) -> Optional[CachedCredential]:
+        """Authenticate an API key, serving repeat lookups from the credential cache."""
+        digest = self.credential_cache.digest(key)
+        credential = self.credential_cache.get(digest)
+        if credential is not None:
+            return credential
+        
+        api_key = await self.authenticate_api_key(session, key)
+        if api_key is None:
+            return None
+        
+        expires_at = None
+        if api_key.expires_at is not None:
+            expires_at = api_key.expires_at.replace(tzinfo=timezone.utc).timestamp()
+        
+        credential = CachedCredential(
+            user_id=api_key.user_id,
+            kind="api_key",
+            scopes=tuple(json.loads(api_key.scopes)) if api_key.scopes else (),
+            expires_at=expires_at,
+            key_id=api_key.id,
+        )
+        self.credential_cache.put(digest, credential)
+        return credential
     
     def generate_verification_token(self) -> str:
         """Generate a random token for email verification."""
@@ -123,4 +286,5 @@ def get_auth_service() -> AuthService:
     global _auth_service
     if _auth_service is None:
         _auth_service = AuthService()
+        get_metrics().add_collector("credential_cache", _auth_service.credential_cache.get_stats)
     return _auth_service
@@ -0,0 +1,475 @@
+"""Reservation-based token budgets for concurrent agents."""
+
+import asyncio
+import itertools
+import logging
+import threading
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Optional
+from uuid import UUID
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from delta.config import get_settings
+from delta.core.metrics import get_metrics
+from delta.database import get_engine
+from delta.models.agent import Agent
+from delta.models.token_usage import UNLIMITED
+from delta.models.user import User
+
+if TYPE_CHECKING:
+    from delta.core.budget_tree import BudgetTree
+
+logger = logging.getLogger(__name__)
+
+
+class BudgetExceededError(Exception):
+    """Raised when a reservation does not fit in the remaining budget."""
+
+    def __init__(self, message: str, remaining: int):
+        super().__init__(message)
+        self.remaining = remaining
+
+
+class BudgetNotLoadedError(Exception):
+    """Raised when reserving against an agent whose budget is not loaded."""
+    pass
+
+
+class Counter:
+    """Limit, committed usage and outstanding reservations for one budget."""
+
+    __slots__ = ("limit", "used", "reserved", "unsynced")
+
+    def __init__(self, limit: int, used: int):
+        self.limit = limit
+        self.used = used
+        self.reserved = 0
+        self.unsynced = 0  # Committed here but not yet written to the database
+
+    @property
+    def remaining(self) -> int:
+        if self.limit == UNLIMITED:
+            return UNLIMITED
+        return self.limit - self.used - self.reserved
+
+    def fits(self, amount: int) -> bool:
+        return self.limit == UNLIMITED or amount <= self.remaining
+
+
+class Reservation:
+    """Tokens held for an operation until it is committed or refunded."""
+
+    __slots__ = ("id", "agent_id", "user_id", "amount", "settled")
+
+    def __init__(self, id: int, agent_id: UUID, user_id: UUID, amount: int):
+        self.id = id
+        self.agent_id = agent_id
+        self.user_id = user_id
+        self.amount = amount
+        self.settled = False
+
+
+class _Shard:
+    __slots__ = ("lock", "counters")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[UUID, Counter] = {}
+
+
+class BudgetEngine:
+    """
+    Reserve, commit and refund tokens against agent and user budgets.
+
+    Check-then-write against Agent.tokens_used lets two concurrent
+    operations both pass and overspend. Here a reservation atomically
+    checks and holds tokens against both the agent's token_budget and its
+    owner's monthly allocation; commit() turns the hold into usage (the
+    actual amount may differ) and refund() releases it.
+
+    Counters live in memory, partitioned into shards by id with one lock
+    per shard, so checks for different agents never contend and a check
+    never touches the database. Committed usage is written back
+    periodically as `tokens_used = tokens_used + delta` updates batched
+    into one statement per table, which never holds a row lock across a
+    read.
+
+    Counters are per process: run one engine per worker and route an
+    agent's operations to a single worker if budgets must be exact
+    across workers.
+
+    With a BudgetTree, a reservation must also fit the budgets of the
+    agent's ancestors (a bot's main agent funds it), checked against
+    their committed usage, and committed usage is charged to the tree.
+    The tree loads an agent's user the first time its budget is loaded
+    from the database.
+
+    Usage:
+        budgets = get_budget_engine()
+        reservation = await budgets.acquire(agent_id, 50)
+        try:
+            cost = run_operation()
+            budgets.commit(reservation, cost)
+        except Exception:
+            budgets.refund(reservation)
+            raise
+
+        # Or, committing the reserved amount unless the block commits itself
+        async with budgets.hold(agent_id, 5) as reservation:
+            run_operation()
+    """
+
+    def __init__(
+        self,
+        engine: Optional[AsyncEngine] = None,
+        num_shards: int = 64,
+        reconcile_interval: float = 5.0,
+        tree: Optional["BudgetTree"] = None,
+    ):
+        self.engine = engine
+        self.reconcile_interval = reconcile_interval
+        self.tree = tree
+        self._agent_shards = [_Shard() for _ in range(num_shards)]
+        self._user_shards = [_Shard() for _ in range(num_shards)]
+        self._owners: Dict[UUID, UUID] = {}  # agent_id -> user_id
+        self._ids = itertools.count(1)
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters
+        self.reservations = 0
+        self.rejections = 0
+        self.reconciles = 0
+
+    def _agent_shard(self, agent_id: UUID) -> _Shard:
+        return self._agent_shards[hash(agent_id) % len(self._agent_shards)]
+
+    def _user_shard(self, user_id: UUID) -> _Shard:
+        return self._user_shards[hash(user_id) % len(self._user_shards)]
+
+    def load(
+        self,
+        agent_id: UUID,
+        user_id: UUID,
+        agent_limit: int,
+        agent_used: int,
+        user_limit: int = UNLIMITED,
+        user_used: int = 0,
+    ):
+        """Prime counters from stored values (no-op for budgets already loaded)."""
+        shard = self._user_shard(user_id)
+        with shard.lock:
+            if user_id not in shard.counters:
+                shard.counters[user_id] = Counter(user_limit, user_used)
+        shard = self._agent_shard(agent_id)
+        with shard.lock:
+            if agent_id not in shard.counters:
+                shard.counters[agent_id] = Counter(agent_limit, agent_used)
+                self._owners[agent_id] = user_id
+
+    def is_loaded(self, agent_id: UUID) -> bool:
+        """Whether an agent's budget is held in memory."""
+        return agent_id in self._owners
+
+    async def ensure_loaded(self, agent_id: UUID):
+        """Load an agent's budget from the database unless it is held already."""
+        if not self.is_loaded(agent_id):
+            await self.load_from_db(agent_id)
+
+    def set_limit(self, agent_id: UUID, limit: int):
+        """Change an agent's budget (e.g. after an allocation)."""
+        shard = self._agent_shard(agent_id)
+        with shard.lock:
+            shard.counters[agent_id].limit = limit
+        if self.tree is not None and self.tree.has_agent(agent_id):
+            self.tree.set_budget(agent_id, limit)
+
+    def reset_user(self, user_id: UUID):
+        """
+        Zero a user's monthly usage after the database has been reset.
+
+        Usage committed but not yet reconciled belongs to the old month and
+        is discarded; outstanding reservations stay held.
+        """
+        shard = self._user_shard(user_id)
+        with shard.lock:
+            counter = shard.counters.get(user_id)
+            if counter is not None:
+                counter.used = 0
+                counter.unsynced = 0
+        if self.tree is not None:
+            self.tree.reset_user(user_id)
+
+    def reserve(self, agent_id: UUID, amount: int) -> Reservation:
+        """
+        Hold tokens for an operation.
+
+        Raises:
+            BudgetExceededError: if the agent or its user lacks the tokens
+            BudgetNotLoadedError: if the agent's budget has not been loaded
+        """
+        user_id = self._owners.get(agent_id)
+        if user_id is None:
+            raise BudgetNotLoadedError(f"Budget for agent {agent_id} is not loaded")
+        if self.tree is not None and self.tree.has_agent(agent_id):
+            allowed, remaining = self.tree.check(agent_id, amount)
+            if not allowed:
+                self.rejections += 1
+                raise BudgetExceededError("Token budget exceeded", remaining)
+
+        # Lock order is always agent shard, then user shard
+        agent_shard = self._agent_shard(agent_id)
+        user_shard = self._user_shard(user_id)
+        with agent_shard.lock:
+            agent = agent_shard.counters[agent_id]
+            if not agent.fits(amount):
+                self.rejections += 1
+                raise BudgetExceededError("Agent token budget exceeded", agent.remaining)
+            with user_shard.lock:
+                user = user_shard.counters[user_id]
+                if not user.fits(amount):
+                    self.rejections += 1
+                    raise BudgetExceededError("Monthly token allocation exceeded", user.remaining)
+                user.reserved += amount
+            agent.reserved += amount
+
+        self.reservations += 1
+        return Reservation(next(self._ids), agent_id, user_id, amount)
+
+    async def acquire(self, agent_id: UUID, amount: int) -> Reservation:
+        """Reserve tokens, loading the agent's budget from the database if needed."""
+        if self._task is None and self.engine is not None:
+            self.start()
+        await self.ensure_loaded(agent_id)
+        return self.reserve(agent_id, amount)
+
+    async def require(self, agent_id: UUID, amount: int):
+        """
+        Check that an operation fits right now without holding anything.
+
+        For rejecting a request before starting work whose reservation is
+        taken later (e.g. inside a streamed response).
+
+        Raises:
+            BudgetExceededError: if the agent or its user lacks the tokens
+            BudgetNotLoadedError: if the agent does not exist
+        """
+        await self.ensure_loaded(agent_id)
+        allowed, remaining = self.check(agent_id, amount)
+        if not allowed:
+            self.rejections += 1
+            raise BudgetExceededError("Token budget exceeded", remaining)
+
+    @asynccontextmanager
+    async def hold(self, agent_id: UUID, amount: int) -> AsyncIterator[Reservation]:
+        """
+        Reserve tokens for the duration of a block.
+
+        The reserved amount is committed when the block finishes unless it
+        committed an actual cost itself, and refunded if the block raises.
+        """
+        reservation = await self.acquire(agent_id, amount)
+        try:
+            yield reservation
+        except BaseException:
+            self.refund(reservation)
+            raise
+        self.commit(reservation)
+
+    def commit(self, reservation: Reservation, actual: Optional[int] = None):
+        """Charge the operation's actual cost (defaults to the reserved amount)."""
+        if actual is None:
+            actual = reservation.amount
+        self._settle(reservation, actual)
+
+    def refund(self, reservation: Reservation):
+        """Release a reservation without charging anything."""
+        self._settle(reservation, 0)
+
+    def _settle(self, reservation: Reservation, actual: int):
+        agent_shard = self._agent_shard(reservation.agent_id)
+        user_shard = self._user_shard(reservation.user_id)
+        with agent_shard.lock:
+            if reservation.settled:
+                return
+            reservation.settled = True
+            agent = agent_shard.counters[reservation.agent_id]
+            agent.reserved -= reservation.amount
+            agent.used += actual
+            agent.unsynced += actual
+            with user_shard.lock:
+                user = user_shard.counters[reservation.user_id]
+                user.reserved -= reservation.amount
+                user.used += actual
+                user.unsynced += actual
+        if actual and self.tree is not None and self.tree.has_agent(reservation.agent_id):
+            self.tree.charge(reservation.agent_id, actual, enforce=False)
+
+    def check(self, agent_id: UUID, amount: int) -> tuple[bool, int]:
+        """
+        Check if an operation would fit without reserving anything.
+
+        Returns:
+            (allowed, remaining) - as TokenService.check_budget
+        """
+        user_id = self._owners[agent_id]
+        agent = self._agent_shard(agent_id).counters[agent_id]
+        user = self._user_shard(user_id).counters[user_id]
+        remaining = min(
+            (r for r in (agent.remaining, user.remaining) if r != UNLIMITED),
+            default=UNLIMITED,
+        )
+        if remaining != UNLIMITED and amount > remaining:
+            return False, remaining
+        return True, remaining if remaining == UNLIMITED else remaining - amount
+
+    def get_usage(self, agent_id: UUID) -> dict:
+        """Current counters for an agent."""
+        counter = self._agent_shard(agent_id).counters[agent_id]
+        return {
+            "limit": counter.limit,
+            "used": counter.used,
+            "reserved": counter.reserved,
+            "remaining": counter.remaining,
+        }
+
+    async def load_from_db(self, agent_id: UUID):
+        """Load an agent's and its user's budget from the database."""
+        async with self.engine.connect() as conn:
+            row = (await conn.execute(
+                select(
+                    Agent.user_id,
+                    Agent.token_budget,
+                    Agent.tokens_used,
+                    User.total_tokens_allocated,
+                    User.tokens_used_this_month,
+                )
+                .join(User, User.id == Agent.user_id)
+                .where(Agent.id == agent_id)
+            )).one_or_none()
+        if row is None:
+            raise BudgetNotLoadedError(f"Agent {agent_id} not found")
+        if self.tree is not None and not self.tree.has_agent(agent_id):
+            await self.tree.load_user(self.engine, row[0])
+        self.load(agent_id, row[0], row[1], row[2], row[3], row[4])
+
+    def _take_deltas(self, shards: list) -> Dict[UUID, int]:
+        deltas = {}
+        for shard in shards:
+            with shard.lock:
+                for key, counter in shard.counters.items():
+                    if counter.unsynced:
+                        deltas[key] = counter.unsynced
+                        counter.unsynced = 0
+        return deltas
+
+    def _restore_deltas(self, deltas: Dict[UUID, int], shard_for):
+        for key, delta in deltas.items():
+            shard = shard_for(key)
+            with shard.lock:
+                shard.counters[key].unsynced += delta
+
+    async def reconcile(self) -> int:
+        """Write committed usage to Agent.tokens_used and User.tokens_used_this_month."""
+        agent_deltas = self._take_deltas(self._agent_shards)
+        user_deltas = self._take_deltas(self._user_shards)
+        if not agent_deltas and not user_deltas:
+            return 0
+
+        try:
+            async with self.engine.begin() as conn:
+                if agent_deltas:
+                    await conn.execute(
+                        update(Agent.__table__)
+                        .where(Agent.__table__.c.id == bindparam("b_id"))
+                        .values(tokens_used=Agent.__table__.c.tokens_used + bindparam("b_delta")),
+                        [{"b_id": k, "b_delta": v} for k, v in agent_deltas.items()],
+                    )
+                if user_deltas:
+                    table = User.__table__
+                    await conn.execute(
+                        update(table)
+                        .where(table.c.id == bindparam("b_id"))
+                        .values(
+                            tokens_used_this_month=table.c.tokens_used_this_month
+                            + bindparam("b_delta")
+                        ),
+                        [{"b_id": k, "b_delta": v} for k, v in user_deltas.items()],
+                    )
+        except Exception:
+            self._restore_deltas(agent_deltas, self._agent_shard)
+            self._restore_deltas(user_deltas, self._user_shard)
+            raise
+
+        self.reconciles += 1
+        return len(agent_deltas) + len(user_deltas)
+
+    def start(self):
+        """Start periodic reconciliation."""
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        """Stop reconciling and write any remaining usage."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.engine is not None:
+            try:
+                await self.reconcile()
+            except Exception:
+                logger.exception("Final budget reconciliation failed")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await self.reconcile()
+            except Exception:
+                logger.exception("Budget reconciliation failed; will retry")
+
+    def get_stats(self) -> dict:
+        """Get engine statistics."""
+        return {
+            "agents": len(self._owners),
+            "reservations": self.reservations,
+            "rejections": self.rejections,
+            "reconciles": self.reconciles,
+        }
+
+
+_budget_engine: Optional[BudgetEngine] = None
+
+
+def get_budget_engine() -> BudgetEngine:
+    """Get the shared budget engine, enforcing bot budgets up the agent tree."""
+    global _budget_engine
+    if _budget_engine is None:
+        from delta.core.budget_tree import BudgetTree
+
+        settings = get_settings()
+        _budget_engine = BudgetEngine(
+            get_engine(),
+            num_shards=settings.budget_shards,
+            reconcile_interval=settings.budget_reconcile_interval_seconds,
+            tree=BudgetTree(),
+        )
+        get_metrics().add_collector("budget", _budget_engine.get_stats)
+    return _budget_engine
+
+
+def reset_user_budgets(user_ids: list[UUID]):
+    """Clear the shared engine's counters of users whose monthly usage was reset, if it exists."""
+    if _budget_engine is not None:
+        for user_id in user_ids:
+            _budget_engine.reset_user(user_id)
+
+
+async def close_budget_engine():
+    """Reconcile and close the shared budget engine if one was created."""
+    global _budget_engine
+    if _budget_engine is not None:
+        await _budget_engine.close()
+        get_metrics().remove_collector("budget")
+        _budget_engine = None
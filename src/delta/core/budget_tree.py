@@ -0,0 +1,291 @@
+"""In-memory budget tree over the main agent / bot hierarchy."""
+
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Optional
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from delta.core.budget import BudgetExceededError
+from delta.core.rollups import UsageRollups, floor_to
+from delta.core.tokens import TokenService
+from delta.models.agent import Agent
+from delta.models.token_usage import UNLIMITED, TokenSummary, TokenUsageType
+from delta.models.user import User
+
+
+class BudgetNode:
+    """An agent's own budget and usage plus the usage of its whole subtree."""
+
+    __slots__ = ("agent_id", "parent", "children", "budget", "used", "subtree_used", "month_used")
+
+    def __init__(
+        self,
+        agent_id: UUID,
+        parent: Optional["BudgetNode"],
+        budget: int,
+        used: int,
+        month_used: int = 0,
+    ):
+        self.agent_id = agent_id
+        self.parent = parent
+        self.children: Dict[UUID, "BudgetNode"] = {}
+        self.budget = budget
+        self.used = used  # All-time, like Agent.tokens_used, which token_budget caps
+        self.subtree_used = used
+        self.month_used = month_used  # Since the user's last monthly reset
+
+    @property
+    def remaining(self) -> int:
+        """Budget left for this agent and everything below it."""
+        if self.budget == UNLIMITED:
+            return UNLIMITED
+        return self.budget - self.subtree_used
+
+
+class UserBudget:
+    """Root of one user's tree: the tier limit and every agent's node."""
+
+    __slots__ = ("user_id", "limit", "used", "nodes", "usage_by_type", "lock")
+
+    def __init__(self, user_id: UUID, limit: int, used: int = 0):
+        self.user_id = user_id
+        self.limit = limit
+        self.used = used
+        self.nodes: Dict[UUID, BudgetNode] = {}
+        self.usage_by_type: Dict[str, int] = defaultdict(int)
+        self.lock = threading.Lock()
+
+    @property
+    def remaining(self) -> int:
+        if self.limit == UNLIMITED:
+            return UNLIMITED
+        return self.limit - self.used
+
+
+class BudgetTree:
+    """
+    Effective budgets across Agent.parent_agent_id chains and the user's tier.
+
+    Tokens a bot spends also count against every ancestor's budget, since
+    a main agent funds its bots, and against the user's monthly tier
+    limit. Each node caches its subtree's usage, so a charge walks only
+    the path to the root (O(depth)) and the effective remaining budget is
+    the tightest limit on that path. Summaries read the cached totals
+    rather than aggregating usage rows; like the tier limit they cover the
+    current month, while agent budgets cap all-time usage.
+
+    The shared budget engine keeps one (see get_budget_engine): it refuses
+    reservations the agent's ancestors cannot cover and charges committed
+    usage here.
+
+    Usage:
+        tree = BudgetTree()
+        tree.add_user(user_id, tier="pro")
+        tree.add_agent(main_id, user_id, budget=1000)
+        tree.add_agent(bot_id, user_id, parent_id=main_id, budget=50)
+        tree.charge(bot_id, 20, TokenUsageType.TOOL_EXECUTION)
+        summary = tree.get_summary(user_id)
+    """
+
+    def __init__(self):
+        self._users: Dict[UUID, UserBudget] = {}
+        self._owners: Dict[UUID, UUID] = {}  # agent_id -> user_id
+
+    def add_user(
+        self,
+        user_id: UUID,
+        tier: str = "free",
+        used: int = 0,
+        limit: Optional[int] = None,
+    ) -> UserBudget:
+        """Add a user's root; the limit defaults to the tier's monthly limit."""
+        if limit is None:
+            limit = TokenService().get_tier_limit(tier)
+        root = self._users.get(user_id)
+        if root is None:
+            root = self._users[user_id] = UserBudget(user_id, limit, used)
+        return root
+
+    def add_agent(
+        self,
+        agent_id: UUID,
+        user_id: UUID,
+        parent_id: Optional[UUID] = None,
+        budget: int = UNLIMITED,
+        used: int = 0,
+        month_used: int = 0,
+    ) -> BudgetNode:
+        """Add an agent under its parent (or the user's root) with its stored usage."""
+        root = self._users[user_id]
+        with root.lock:
+            parent = root.nodes[parent_id] if parent_id is not None else None
+            node = BudgetNode(agent_id, parent, budget, used, month_used)
+            root.nodes[agent_id] = node
+            self._owners[agent_id] = user_id
+            if parent is not None:
+                parent.children[agent_id] = node
+            ancestor = parent
+            while ancestor is not None:
+                ancestor.subtree_used += used
+                ancestor = ancestor.parent
+        return node
+
+    def remove_agent(self, agent_id: UUID):
+        """
+        Remove a childless agent (e.g. a destroyed bot).
+
+        Tokens it spent stay counted against its ancestors and the user.
+        """
+        root = self._users[self._owners[agent_id]]
+        with root.lock:
+            node = root.nodes[agent_id]
+            if node.children:
+                raise ValueError("Cannot remove an agent that still has bots")
+            del root.nodes[agent_id]
+            del self._owners[agent_id]
+            if node.parent is not None:
+                del node.parent.children[agent_id]
+
+    def has_agent(self, agent_id: UUID) -> bool:
+        """Whether an agent is in the tree."""
+        return agent_id in self._owners
+
+    def set_budget(self, agent_id: UUID, budget: int):
+        """Change an agent's own budget (e.g. an approved token request)."""
+        root = self._users[self._owners[agent_id]]
+        with root.lock:
+            root.nodes[agent_id].budget = budget
+
+    def reset_user(self, user_id: UUID):
+        """Zero a user's monthly usage (agents keep their own usage)."""
+        root = self._users.get(user_id)
+        if root is not None:
+            with root.lock:
+                root.used = 0
+                root.usage_by_type.clear()
+                for node in root.nodes.values():
+                    node.month_used = 0
+
+    def _remaining(self, root: UserBudget, node: BudgetNode) -> int:
+        remaining = root.remaining
+        while node is not None:
+            if node.budget != UNLIMITED and (remaining == UNLIMITED or node.remaining < remaining):
+                remaining = node.remaining
+            node = node.parent
+        return remaining
+
+    def get_remaining(self, agent_id: UUID) -> int:
+        """Effective remaining budget for an agent (UNLIMITED if nothing caps it)."""
+        root = self._users[self._owners[agent_id]]
+        with root.lock:
+            return self._remaining(root, root.nodes[agent_id])
+
+    def check(self, agent_id: UUID, amount: int) -> tuple[bool, int]:
+        """
+        Check if an operation fits everywhere on the agent's path.
+
+        Returns:
+            (allowed, remaining) - as TokenService.check_budget
+        """
+        remaining = self.get_remaining(agent_id)
+        if remaining == UNLIMITED:
+            return True, UNLIMITED
+        if amount > remaining:
+            return False, remaining
+        return True, remaining - amount
+
+    def charge(
+        self,
+        agent_id: UUID,
+        amount: int,
+        usage_type: Optional[TokenUsageType] = None,
+        enforce: bool = True,
+    ) -> int:
+        """
+        Charge tokens to an agent and all of its ancestors. Returns the remaining budget.
+
+        Raises:
+            BudgetExceededError: if enforce is set and the charge does not fit
+        """
+        root = self._users[self._owners[agent_id]]
+        with root.lock:
+            node = root.nodes[agent_id]
+            remaining = self._remaining(root, node)
+            if enforce and remaining != UNLIMITED and amount > remaining:
+                raise BudgetExceededError("Token budget exceeded", remaining)
+
+            node.used += amount
+            node.month_used += amount
+            while node is not None:
+                node.subtree_used += amount
+                node = node.parent
+            root.used += amount
+            if usage_type is not None:
+                root.usage_by_type[TokenUsageType(usage_type).value] += amount
+            return remaining if remaining == UNLIMITED else remaining - amount
+
+    def get_subtree_usage(self, agent_id: UUID) -> int:
+        """Tokens used by an agent and all of its bots."""
+        root = self._users[self._owners[agent_id]]
+        return root.nodes[agent_id].subtree_used
+
+    def get_summary(self, user_id: UUID) -> TokenSummary:
+        """This month's usage summary for a user from the cached totals."""
+        root = self._users[user_id]
+        with root.lock:
+            return TokenSummary(
+                total_allocated=root.limit,
+                total_used=root.used,
+                remaining=root.remaining,
+                usage_by_agent={str(agent_id): node.month_used for agent_id, node in root.nodes.items()},
+                usage_by_type=dict(root.usage_by_type),
+            )
+
+    async def load_user(self, engine: AsyncEngine, user_id: UUID) -> UserBudget:
+        """
+        Build a user's tree from the users and agents tables, with this
+        month's usage per agent and type from the usage rollups.
+
+        Loading a user already in the tree adds only agents it lacks.
+        """
+        now = datetime.utcnow()
+        async with engine.connect() as conn:
+            user = (await conn.execute(
+                select(User.tier, User.tokens_used_this_month).where(User.id == user_id)
+            )).one()
+            agents = (await conn.execute(
+                select(Agent.id, Agent.parent_agent_id, Agent.token_budget, Agent.tokens_used)
+                .where(Agent.user_id == user_id)
+            )).all()
+            month = await UsageRollups(engine).get_usage(
+                user_id, floor_to(now, "day").replace(day=1), now, conn
+            )
+
+        tier = user.tier.value if hasattr(user.tier, "value") else user.tier
+        loaded = user_id in self._users
+        root = self.add_user(user_id, tier, user.tokens_used_this_month)
+        month_by_agent: Dict[UUID, int] = defaultdict(int)
+        for agent_id, usage_type, tokens in month:
+            month_by_agent[agent_id] += tokens
+            if not loaded:
+                root.usage_by_type[usage_type] += tokens
+
+        # Add parents before children; a parent outside this user's agents
+        # (or a cycle) leaves the agent directly under the user
+        pending = {row.id: row for row in agents if row.id not in root.nodes}
+        while pending:
+            ready = [row for row in pending.values() if row.parent_agent_id not in pending]
+            if not ready:
+                ready = list(pending.values())
+            for row in ready:
+                parent_id = row.parent_agent_id if row.parent_agent_id in root.nodes else None
+                self.add_agent(
+                    row.id, user_id, parent_id, row.token_budget, row.tokens_used,
+                    month_by_agent[row.id],
+                )
+                del pending[row.id]
+        return root
@@ -0,0 +1,205 @@
+"""In-process cache of verified credentials (JWTs and API keys)."""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from uuid import UUID
+
+
+@dataclass(frozen=True)
+class CachedCredential:
+    """A credential that has already been verified."""
+    user_id: UUID
+    kind: str  # "access", "refresh", "api_key"
+    scopes: tuple[str, ...] = ()
+    expires_at: Optional[float] = None  # Unix timestamp, None = never
+    key_id: Optional[UUID] = None  # APIKey.id for API keys
+    issued_at: Optional[float] = None  # Unix timestamp ("iat") for JWTs
+
+
+class CredentialCache:
+    """
+    LRU cache of verified credentials keyed by token digest.
+
+    Tokens are never stored, only their SHA-256 digest. Entries live until
+    the earlier of the credential's own expiry and the cache TTL, so a
+    deactivated API key is picked up within one TTL even without an explicit
+    revocation. Revoked JWTs are remembered until they expire so a logged-out
+    token cannot be re-verified from its (still valid) signature; likewise a
+    user-wide revocation records a cutoff that JWTs issued earlier fail.
+
+    Usage:
+        cache = CredentialCache(max_entries=10000, ttl_seconds=300)
+        digest = cache.digest(token)
+        credential = cache.get(digest)
+        if credential is None and not cache.is_revoked(digest):
+            credential = ...  # verify the slow way
+            cache.put(digest, credential)
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        # digest -> (credential, cached_until)
+        self._entries: OrderedDict[str, tuple[CachedCredential, float]] = OrderedDict()
+        # Reverse indexes for revocation
+        self._by_user: dict[UUID, set[str]] = {}
+        self._by_key: dict[UUID, str] = {}
+        # digest -> expiry of revoked tokens
+        self._revoked: dict[str, float] = {}
+        # user_id -> (tokens issued before this are revoked, cutoff kept until)
+        self._revoked_before: dict[UUID, tuple[float, float]] = {}
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revocations = 0
+
+    @staticmethod
+    def digest(token: str) -> str:
+        """Digest used as the cache key for a token."""
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, digest: str) -> Optional[CachedCredential]:
+        """Get a cached credential, or None on a miss or expiry."""
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            credential, cached_until = entry
+            if cached_until <= time.time():
+                self._remove(digest)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return credential
+
+    def put(self, digest: str, credential: CachedCredential) -> None:
+        """Cache a verified credential."""
+        cached_until = time.time() + self.ttl_seconds
+        if credential.expires_at is not None:
+            cached_until = min(cached_until, credential.expires_at)
+
+        with self._lock:
+            if digest in self._revoked:
+                return
+            if digest in self._entries:
+                self._remove(digest)
+
+            self._entries[digest] = (credential, cached_until)
+            self._by_user.setdefault(credential.user_id, set()).add(digest)
+            if credential.key_id is not None:
+                self._by_key[credential.key_id] = digest
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def is_revoked(self, digest: str) -> bool:
+        """Check whether a token digest has been revoked."""
+        with self._lock:
+            expires_at = self._revoked.get(digest)
+            if expires_at is None:
+                return False
+            if expires_at <= time.time():
+                del self._revoked[digest]
+                return False
+            return True
+
+    def revoke(self, digest: str, expires_at: float) -> None:
+        """Evict a token and refuse it until it expires (e.g. on logout)."""
+        with self._lock:
+            self._remove(digest)
+            self._revoked[digest] = expires_at
+            self.revocations += 1
+
+            now = time.time()
+            for expired in [d for d, exp in self._revoked.items() if exp <= now]:
+                del self._revoked[expired]
+
+    def revoke_user(self, user_id: UUID, keep_until: Optional[float] = None) -> int:
+        """
+        Evict every cached credential of a user. Returns entries evicted.
+
+        With keep_until (the expiry of the longest-lived token the user may
+        hold), JWTs issued before now are also refused until then.
+        """
+        with self._lock:
+            digests = list(self._by_user.get(user_id, ()))
+            for digest in digests:
+                self._remove(digest)
+            self.revocations += len(digests)
+
+            now = time.time()
+            if keep_until is not None:
+                self._revoked_before[user_id] = (now, keep_until)
+            for expired in [u for u, (_, until) in self._revoked_before.items() if until <= now]:
+                del self._revoked_before[expired]
+            return len(digests)
+
+    def revoked_before(self, user_id: UUID) -> Optional[float]:
+        """Cutoff before which the user's JWTs are revoked, if there is one."""
+        with self._lock:
+            entry = self._revoked_before.get(user_id)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._revoked_before[user_id]
+                return None
+            return entry[0]
+
+    def revoke_api_key(self, key_id: UUID) -> bool:
+        """Evict a cached API key (e.g. on deactivation)."""
+        with self._lock:
+            digest = self._by_key.get(key_id)
+            if digest is None:
+                return False
+            self._remove(digest)
+            self.revocations += 1
+            return True
+
+    def clear(self) -> None:
+        """Drop all cached credentials (revocations are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+            self._by_key.clear()
+
+    def get_stats(self) -> dict:
+        """Get cache statistics."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "revocations": self.revocations,
+            "revoked_tokens": len(self._revoked),
+            "revoked_users": len(self._revoked_before),
+        }
+
+    def _remove(self, digest: str) -> None:
+        """Remove an entry and its reverse index references. Caller holds the lock."""
+        entry = self._entries.pop(digest, None)
+        if entry is None:
+            return
+
+        credential = entry[0]
+        user_digests = self._by_user.get(credential.user_id)
+        if user_digests is not None:
+            user_digests.discard(digest)
+            if not user_digests:
+                del self._by_user[credential.user_id]
+        if credential.key_id is not None and self._by_key.get(credential.key_id) == digest:
+            del self._by_key[credential.key_id]
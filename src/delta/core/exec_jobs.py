@@ -0,0 +1,421 @@
+"""Asynchronous command execution jobs with a bounded result store."""
+
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+from uuid import UUID, uuid4
+
+from delta.config import get_settings
+from delta.core.agents import AgentService
+from delta.core.budget import BudgetExceededError
+from delta.core.metrics import get_metrics
+from delta.sandbox import SandboxError
+
+logger = logging.getLogger(__name__)
+
+# Called like AgentService.stream_command; yields exec_stream events
+Runner = Callable[..., AsyncIterator[dict]]
+# Called like AgentService.check; raises SandboxError for unusable sandboxes
+# and BudgetExceededError when the budget cannot cover a command
+Checker = Callable[[UUID], Awaitable[None]]
+
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class ExecJobsFullError(Exception):
+    """Raised when the store is full of unfinished jobs."""
+    pass
+
+
+class MemoryBudget:
+    """Bytes of job output held in memory across all jobs of a store."""
+
+    __slots__ = ("limit", "used")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+
+    @property
+    def exceeded(self) -> bool:
+        return self.used > self.limit
+
+
+class JobOutput:
+    """
+    One output stream of a job, kept in memory up to spill_threshold bytes.
+
+    Past the threshold everything written so far moves to a temporary file
+    and later chunks are appended to it, so a job's memory use is bounded
+    however much the command prints. With a shared budget, a write that
+    takes the store past the budget spills its stream early, so the store
+    as a whole is bounded too.
+    """
+
+    __slots__ = ("spill_threshold", "spill_dir", "budget", "size", "path", "_chunks", "_file")
+
+    def __init__(
+        self,
+        spill_threshold: int,
+        spill_dir: Optional[str] = None,
+        budget: Optional[MemoryBudget] = None,
+    ):
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir
+        self.budget = budget
+        self.size = 0  # Bytes written
+        self.path: Optional[str] = None  # Set once spilled
+        self._chunks: list[bytes] = []
+        self._file = None
+
+    @property
+    def spilled(self) -> bool:
+        return self.path is not None
+
+    def write(self, text: str):
+        data = text.encode()
+        self.size += len(data)
+        if self._file is not None:
+            self._file.write(data)
+            return
+        self._chunks.append(data)
+        if self.budget is not None:
+            self.budget.used += len(data)
+        if self.size > self.spill_threshold or (self.budget is not None and self.budget.exceeded):
+            fd, self.path = tempfile.mkstemp(prefix="exec-", suffix=".out", dir=self.spill_dir)
+            self._file = os.fdopen(fd, "wb")
+            self._file.write(b"".join(self._chunks))
+            self._release()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def text(self) -> Optional[str]:
+        """The output, or None if it was spilled to path."""
+        if self.spilled:
+            return None
+        return b"".join(self._chunks).decode()
+
+    def discard(self):
+        self.close()
+        self._release()
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    def _release(self):
+        """Drop the in-memory chunks and return their bytes to the budget."""
+        if self.budget is not None and self._chunks:
+            self.budget.used -= sum(len(chunk) for chunk in self._chunks)
+        self._chunks = []
+
+
+class ExecJob:
+    """A submitted command and, once it finishes, its result."""
+
+    def __init__(
+        self,
+        sandbox_id: UUID,
+        command: str,
+        working_dir: str,
+        timeout_seconds: int,
+        env_vars: Optional[dict[str, str]],
+        spill_threshold: int,
+        spill_dir: Optional[str],
+        budget: Optional[MemoryBudget] = None,
+    ):
+        self.id = str(uuid4())
+        self.sandbox_id = sandbox_id
+        self.command = command
+        self.working_dir = working_dir
+        self.timeout_seconds = timeout_seconds
+        self.env_vars = env_vars
+        self.status = PENDING
+        self.exit_code: Optional[int] = None
+        self.timed_out = False
+        self.error: Optional[str] = None
+        self.duration_ms: Optional[int] = None
+        self.stdout = JobOutput(spill_threshold, spill_dir, budget)
+        self.stderr = JobOutput(spill_threshold, spill_dir, budget)
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.expires_at = 0.0  # time.monotonic() deadline once finished
+        self.done = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.done.is_set()
+
+    def to_dict(self) -> dict:
+        """The job's state; spilled output is None here and read from its file."""
+        return {
+            "id": self.id,
+            "sandbox_id": str(self.sandbox_id),
+            "command": self.command,
+            "status": self.status,
+            "exit_code": self.exit_code,
+            "timed_out": self.timed_out,
+            "error": self.error,
+            "stdout": self.stdout.text(),
+            "stderr": self.stderr.text(),
+            "stdout_bytes": self.stdout.size,
+            "stderr_bytes": self.stderr.size,
+            "stdout_spilled": self.stdout.spilled,
+            "stderr_spilled": self.stderr.spilled,
+            "duration_ms": self.duration_ms,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class ExecJobs:
+    """
+    Run commands in the background and keep their results for a while.
+
+    check() raises SandboxError for a sandbox that cannot run commands,
+    so callers can reject a submission up front. submit() returns a
+    pending job at once; the command runs on its
+    sandbox's lane, a semaphore that lets at most
+    max_concurrent_per_sandbox commands of one sandbox run together while
+    the rest wait their turn. wait() long-polls a job until it finishes or
+    the timeout passes.
+
+    Finished jobs are kept ttl_seconds. The store holds at most max_jobs
+    jobs: when full, the oldest finished ones are dropped early, and if
+    every job is still unfinished submit() raises ExecJobsFullError.
+    Output beyond spill_threshold per stream, or beyond memory_budget
+    across all jobs, is spilled to files in spill_dir.
+
+    Usage:
+        jobs = get_exec_jobs()
+        job = jobs.submit(sandbox_id, "pytest -x")
+        job = await jobs.wait(job.id, timeout=30)
+    """
+
+    def __init__(
+        self,
+        runner: Optional[Runner] = None,
+        max_concurrent_per_sandbox: int = 4,
+        max_jobs: int = 10000,
+        ttl_seconds: float = 3600.0,
+        spill_threshold: int = 1024 * 1024,
+        spill_dir: Optional[str] = None,
+        memory_budget: int = 256 * 1024 * 1024,
+        checker: Optional[Checker] = None,
+    ):
+        if runner is None:
+            service = AgentService()
+            runner = service.stream_command
+            checker = checker or service.check
+        self.runner = runner
+        self.checker = checker
+        self.max_concurrent_per_sandbox = max_concurrent_per_sandbox
+        self.max_jobs = max_jobs
+        self.ttl_seconds = ttl_seconds
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir or None
+        self.memory = MemoryBudget(memory_budget)
+        self._jobs: Dict[str, ExecJob] = {}
+        self._finished: OrderedDict[str, ExecJob] = OrderedDict()  # In expiry order
+        self._lanes: Dict[UUID, asyncio.Semaphore] = {}
+        self._lane_jobs: Dict[UUID, int] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+        # Counters
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.evicted = 0
+        self.spilled = 0
+
+    def submit(
+        self,
+        sandbox_id: UUID,
+        command: str,
+        working_dir: str = "/workspace",
+        timeout_seconds: int = 300,
+        env_vars: Optional[dict[str, str]] = None,
+    ) -> ExecJob:
+        """Queue a command on its sandbox's lane and return the pending job."""
+        self._evict(time.monotonic())
+        if len(self._jobs) >= self.max_jobs:
+            self.rejected += 1
+            raise ExecJobsFullError(f"{len(self._jobs)} exec jobs are still running")
+
+        job = ExecJob(
+            sandbox_id, command, working_dir, timeout_seconds, env_vars,
+            self.spill_threshold, self.spill_dir, self.memory,
+        )
+        self._jobs[job.id] = job
+        lane = self._lanes.get(sandbox_id)
+        if lane is None:
+            lane = self._lanes[sandbox_id] = asyncio.Semaphore(self.max_concurrent_per_sandbox)
+            self._lane_jobs[sandbox_id] = 0
+        self._lane_jobs[sandbox_id] += 1
+        self.submitted += 1
+
+        task = asyncio.get_running_loop().create_task(self._run(job, lane))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def check(self, sandbox_id: UUID):
+        """Raise unless the sandbox can run a command now (see AgentService.check)."""
+        if self.checker is not None:
+            await self.checker(sandbox_id)
+
+    def get(self, job_id: str) -> Optional[ExecJob]:
+        """A job that has not expired yet, if it exists."""
+        self._evict(time.monotonic())
+        return self._jobs.get(job_id)
+
+    async def wait(self, job_id: str, timeout: float = 0.0) -> Optional[ExecJob]:
+        """Get a job, first waiting up to timeout seconds for it to finish."""
+        job = self.get(job_id)
+        if job is not None and not job.finished and timeout > 0:
+            try:
+                await asyncio.wait_for(job.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    async def _run(self, job: ExecJob, lane: asyncio.Semaphore):
+        try:
+            async with lane:
+                job.status = RUNNING
+                job.started_at = datetime.utcnow()
+                start = time.monotonic()
+                try:
+                    async for event in self.runner(
+                        job.sandbox_id,
+                        job.command,
+                        working_dir=job.working_dir,
+                        timeout_seconds=job.timeout_seconds,
+                        env_vars=job.env_vars,
+                    ):
+                        stream = event["stream"]
+                        if stream == "stdout":
+                            job.stdout.write(event["data"])
+                        elif stream == "stderr":
+                            job.stderr.write(event["data"])
+                        elif stream == "exit":
+                            job.exit_code = event["exit_code"]
+                            job.timed_out = event.get("timed_out", False)
+                            job.duration_ms = event.get("duration_ms")
+                    job.status = COMPLETED
+                    self.completed += 1
+                except Exception as e:
+                    if isinstance(e, (SandboxError, BudgetExceededError)):
+                        # E.g. the sandbox was destroyed or paused while queued
+                        logger.warning("Exec job %s failed: %s", job.id, e)
+                    else:
+                        logger.exception("Exec job %s failed", job.id)
+                    job.status = FAILED
+                    job.error = str(e)
+                    self.failed += 1
+                if job.duration_ms is None:
+                    job.duration_ms = int((time.monotonic() - start) * 1000)
+        except asyncio.CancelledError:
+            job.status = CANCELLED
+            raise
+        finally:
+            self._finish(job)
+
+    def _finish(self, job: ExecJob):
+        job.stdout.close()
+        job.stderr.close()
+        self.spilled += job.stdout.spilled + job.stderr.spilled
+        job.finished_at = datetime.utcnow()
+        job.expires_at = time.monotonic() + self.ttl_seconds
+        job.done.set()
+        if job.id in self._jobs:
+            self._finished[job.id] = job
+
+        self._lane_jobs[job.sandbox_id] -= 1
+        if not self._lane_jobs[job.sandbox_id]:
+            del self._lane_jobs[job.sandbox_id]
+            del self._lanes[job.sandbox_id]
+
+    def _evict(self, now: float):
+        """Drop expired jobs, then the oldest finished ones while the store is full."""
+        while self._finished:
+            job = next(iter(self._finished.values()))
+            if job.expires_at > now and len(self._jobs) < self.max_jobs:
+                break
+            self._drop(job)
+            self.evicted += 1
+
+    def _drop(self, job: ExecJob):
+        self._finished.pop(job.id, None)
+        self._jobs.pop(job.id, None)
+        job.stdout.discard()
+        job.stderr.discard()
+
+    async def close(self):
+        """Cancel unfinished jobs and delete all results."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for job in list(self._jobs.values()):
+            self._drop(job)
+
+    def get_stats(self) -> dict:
+        """Get job statistics."""
+        return {
+            "jobs": len(self._jobs),
+            "pending": sum(1 for job in self._jobs.values() if job.status == PENDING),
+            "running": sum(1 for job in self._jobs.values() if job.status == RUNNING),
+            "sandboxes": len(self._lanes),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "evicted": self.evicted,
+            "spilled": self.spilled,
+            "memory_bytes": self.memory.used,
+        }
+
+
+_exec_jobs: Optional[ExecJobs] = None
+
+
+def get_exec_jobs() -> ExecJobs:
+    """Get the shared exec job store."""
+    global _exec_jobs
+    if _exec_jobs is None:
+        settings = get_settings()
+        _exec_jobs = ExecJobs(
+            max_concurrent_per_sandbox=settings.exec_max_concurrent_per_sandbox,
+            max_jobs=settings.exec_max_jobs,
+            ttl_seconds=settings.exec_result_ttl_seconds,
+            spill_threshold=settings.exec_spill_threshold_bytes,
+            spill_dir=settings.exec_spill_dir,
+            memory_budget=settings.exec_memory_budget_bytes,
+        )
+        get_metrics().add_collector("exec_jobs", _exec_jobs.get_stats)
+    return _exec_jobs
+
+
+async def close_exec_jobs():
+    """Cancel the shared store's jobs if one was created."""
+    global _exec_jobs
+    if _exec_jobs is not None:
+        await _exec_jobs.close()
+        get_metrics().remove_collector("exec_jobs")
+        _exec_jobs = None
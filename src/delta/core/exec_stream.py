@@ -0,0 +1,110 @@
+"""Incremental output streaming for sandbox commands."""
+
+import asyncio
+import codecs
+import logging
+import time
+from typing import AsyncIterator, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_PENDING = 16
+
+
+async def stream_process(
+    process: asyncio.subprocess.Process,
+    timeout: Optional[float] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_pending: int = DEFAULT_MAX_PENDING,
+) -> AsyncIterator[dict]:
+    """
+    Yield a process's stdout and stderr as numbered chunks while it runs, then its exit.
+
+    Each pipe is read at most chunk_size bytes at a time into a queue of
+    at most max_pending chunks. When the consumer falls behind, the
+    readers stop, the pipes fill and the process blocks on write, so an
+    exec holds roughly (max_pending + 2) * chunk_size bytes however much
+    it prints. Output is decoded incrementally, so a UTF-8 character split
+    across reads is never mangled.
+
+    The process is killed when timeout seconds pass or when the consumer
+    stops iterating (e.g. the client disconnected).
+
+    Events:
+        {"seq": 0, "stream": "stdout", "data": "building...\\n"}
+        {"seq": 9, "stream": "exit", "exit_code": 0, "duration_ms": 1520, "timed_out": False}
+    """
+    start = time.monotonic()
+    deadline = None if timeout is None else start + timeout
+    queue: asyncio.Queue = asyncio.Queue(max_pending)
+    readers = [
+        asyncio.create_task(_pump(name, pipe, queue, chunk_size))
+        for name, pipe in (("stdout", process.stdout), ("stderr", process.stderr))
+        if pipe is not None
+    ]
+    open_pipes = len(readers)
+    timed_out = False
+    seq = 0
+
+    try:
+        while open_pipes:
+            try:
+                item = await asyncio.wait_for(queue.get(), _remaining(deadline))
+            except asyncio.TimeoutError:
+                timed_out = True
+                break
+            if item is None:
+                open_pipes -= 1
+                continue
+            yield {"seq": seq, "stream": item[0], "data": item[1]}
+            seq += 1
+
+        if not timed_out:
+            try:
+                await asyncio.wait_for(process.wait(), _remaining(deadline))
+            except asyncio.TimeoutError:
+                timed_out = True
+        if timed_out:
+            _kill(process)
+        exit_code = await process.wait()
+
+        yield {
+            "seq": seq,
+            "stream": "exit",
+            "exit_code": exit_code,
+            "duration_ms": int((time.monotonic() - start) * 1000),
+            "timed_out": timed_out,
+        }
+    finally:
+        for reader in readers:
+            reader.cancel()
+        if process.returncode is None:
+            _kill(process)
+            await process.wait()
+        await asyncio.gather(*readers, return_exceptions=True)
+
+
+async def _pump(name: str, pipe: asyncio.StreamReader, queue: asyncio.Queue, chunk_size: int):
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    while True:
+        data = await pipe.read(chunk_size)
+        text = decoder.decode(data, final=not data)
+        if text:
+            await queue.put((name, text))
+        if not data:
+            await queue.put(None)
+            return
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def _kill(process: asyncio.subprocess.Process):
+    try:
+        process.kill()
+    except ProcessLookupError:
+        pass
@@ -0,0 +1,150 @@
+"""Bounded worker pool for Argon2 hashing off the event loop."""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from delta.config import get_settings
+from delta.core.metrics import get_metrics
+
+
+class HashingPoolBusyError(Exception):
+    """Raised when the hashing queue is full."""
+    pass
+
+
+class HashingPool:
+    """
+    Run Argon2 operations on a dedicated, size-limited thread pool.
+
+    argon2-cffi releases the GIL while hashing, so threads give real
+    parallelism. Each in-flight hash holds `memory_cost` KiB, so the worker
+    count is capped by available memory as well as CPU. At most `max_queue`
+    calls wait behind the workers; beyond that calls fail fast with
+    HashingPoolBusyError instead of piling up.
+
+    Usage:
+        pool = get_hashing_pool()
+        password_hash = await pool.run(hasher.hash, password)
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        max_queue: int = 64,
+        memory_cost_kib: int = 65536,
+        parallelism: int = 1,
+        memory_fraction: float = 0.25,
+    ):
+        if not max_workers:
+            max_workers = self.workers_for_memory(memory_cost_kib, parallelism, memory_fraction)
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="argon2")
+        self._lock = threading.Lock()
+
+        self.pending = 0  # Running + queued
+        self.running = 0
+        self.peak_queue_depth = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @staticmethod
+    def available_memory() -> int:
+        """Available system memory in bytes."""
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        try:
+            return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (ValueError, OSError, AttributeError):
+            return 1024 * 1024 * 1024  # Assume 1 GiB
+
+    @classmethod
+    def workers_for_memory(
+        cls,
+        memory_cost_kib: int,
+        parallelism: int = 1,
+        memory_fraction: float = 0.25,
+    ) -> int:
+        """Worker count that fits the memory budget and the CPU count."""
+        memory_cap = int(cls.available_memory() * memory_fraction) // (memory_cost_kib * 1024)
+        cpu_cap = (os.cpu_count() or 1) // max(1, parallelism)
+        return max(1, min(memory_cap, cpu_cap))
+
+    @property
+    def queued(self) -> int:
+        """Calls waiting for a worker."""
+        return max(0, self.pending - self.running)
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run fn(*args) on the pool, raising HashingPoolBusyError if saturated."""
+        with self._lock:
+            if self.pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise HashingPoolBusyError(
+                    f"Hashing queue full ({self.max_queue} waiting)"
+                )
+            self.pending += 1
+            self.peak_queue_depth = max(self.peak_queue_depth, self.queued)
+
+        future = self._executor.submit(self._call, fn, args)
+        future.add_done_callback(self._on_done)
+        return await asyncio.wrap_future(future)
+
+    def _call(self, fn: Callable[..., Any], args: tuple) -> Any:
+        with self._lock:
+            self.running += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def _on_done(self, future: Future) -> None:
+        # Also fires for calls cancelled before they started
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+
+    def get_stats(self) -> dict:
+        """Get pool statistics."""
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queued": self.queued,
+            "peak_queue_depth": self.peak_queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self) -> None:
+        """Stop the worker threads."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Singleton instance
+_hashing_pool: Optional[HashingPool] = None
+
+
+def get_hashing_pool() -> HashingPool:
+    """Get the hashing pool singleton."""
+    global _hashing_pool
+    if _hashing_pool is None:
+        settings = get_settings()
+        _hashing_pool = HashingPool(
+            max_workers=settings.argon2_max_workers,
+            max_queue=settings.argon2_max_queue,
+            memory_cost_kib=settings.argon2_memory_cost,
+            parallelism=settings.argon2_parallelism,
+            memory_fraction=settings.argon2_memory_fraction,
+        )
+        get_metrics().add_collector("hashing", _hashing_pool.get_stats)
+    return _hashing_pool
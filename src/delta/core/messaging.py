@@ -1,11 +1,16 @@
 """Messaging service for agent-to-user communication."""
 
+import time
+from contextlib import nullcontext
 from datetime import datetime
 from enum import Enum
 from typing import Optional
 from uuid import UUID, uuid4
 
+from delta.core.budget import BudgetEngine, BudgetExceededError
+from delta.core.metrics import get_metrics
 from delta.models.message_log import MessageStatus, MessageType
+from delta.models.token_usage import TokenUsageType
 
 
 class MessagingService:
@@ -219,6 +224,9 @@ class BotMessenger:
     - Send to pre-approved recipients
     - Within their rate limits
     - Using their allocated tokens
+    
+    Given a budget engine, each message's cost is reserved against the
+    bot's budget before it is sent and committed once it is.
     """
     
     def __init__(
@@ -229,6 +237,7 @@ class BotMessenger:
         max_messages_per_day: int,
         approved_templates: list[str],
         approved_recipients: Optional[list[str]] = None,
+        budgets: Optional[BudgetEngine] = None,
     ):
         self.bot_id = bot_id
         self.user_id = user_id
@@ -237,6 +246,7 @@ class BotMessenger:
         self.approved_templates = approved_templates
         self.approved_recipients = approved_recipients
         self.service = MessagingService()
+        self.budgets = budgets
         self.messages_sent_today = 0
     
     def can_send(self, channel: str, recipient: str, template_id: str) -> tuple[bool, str]:
@@ -272,21 +282,40 @@ class BotMessenger:
         if content is None:
             return {"error": "Template not found", "status": "rejected"}
         
-        # Send based on channel
-        if channel == "email":
-            result = await self.service.send_email(
-                self.bot_id, self.user_id, recipient, subject or "", content, template_id
-            )
-        elif channel == "sms":
-            result = await self.service.send_sms(
-                self.bot_id, self.user_id, recipient, content, template_id
-            )
-        elif channel == "voice_call":
-            result = await self.service.make_call(
-                self.bot_id, self.user_id, recipient, content, template_id
-            )
-        else:
+        if channel not in ("email", "sms", "voice_call"):
             return {"error": f"Unknown channel: {channel}", "status": "rejected"}
         
+        held = nullcontext()
+        if self.budgets is not None:
+            cost = self.service.get_message_cost(MessageType(channel))
+            held = self.budgets.hold(self.bot_id, cost)
+        
+        # Send based on channel
+        try:
+            async with held as reservation:
+                start = time.perf_counter()
+                if channel == "email":
+                    result = await self.service.send_email(
+                        self.bot_id, self.user_id, recipient, subject or "", content, template_id
+                    )
+                elif channel == "sms":
+                    result = await self.service.send_sms(
+                        self.bot_id, self.user_id, recipient, content, template_id
+                    )
+                else:
+                    result = await self.service.make_call(
+                        self.bot_id, self.user_id, recipient, content, template_id
+                    )
+                if reservation is not None:
+                    self.budgets.commit(reservation, result["tokens_used"])
+        except BudgetExceededError as e:
+            return {"error": str(e), "status": "rejected"}
+        
+        get_metrics().observe(
+            TokenUsageType.MESSAGE_SEND,
+            time.perf_counter() - start,
+            self.bot_id,
+            result["tokens_used"],
+        )
         self.messages_sent_today += 1
         return result
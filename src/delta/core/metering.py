@@ -0,0 +1,163 @@
+"""Metering of streamed LLM responses against a budget reservation."""
+
+import logging
+from typing import Callable, Optional
+
+from delta.core.budget import BudgetEngine, BudgetExceededError, Reservation
+from delta.core.pricing import PricingTable, get_pricing
+from delta.core.tokens import TokenTracker
+
+logger = logging.getLogger(__name__)
+
+# Completion counts are searched up to this bound (exact float math ends here)
+MAX_TOKENS = 2**53
+
+
+class StreamingMeter:
+    """
+    Running cost of a streamed LLM response, cancelled before it overspends.
+
+    The meter converts what is left of the reservation into the number of
+    completion tokens it pays for, once up front, so each chunk costs an
+    integer add and a compare instead of a price calculation. When a
+    chunk would pass that limit the meter tries to extend the reservation
+    by `top_up` tokens; if that fails (or top_up is 0) it marks itself
+    exceeded, calls `on_exceeded` and returns False so the caller stops
+    reading the stream.
+
+    finish() commits the actual cost, including tokens that arrived in
+    the chunk that crossed the limit, since the provider bills for them.
+
+    Usage:
+        reservation = await budgets.acquire(agent_id, 200)
+        meter = StreamingMeter(budgets, reservation, "claude-3-sonnet", prompt_tokens=1200)
+        async for chunk in response:
+            if not meter.add(chunk.output_tokens):
+                await response.aclose()
+                break
+        cost = meter.finish()
+    """
+
+    def __init__(
+        self,
+        budgets: BudgetEngine,
+        reservation: Reservation,
+        model: str,
+        prompt_tokens: int = 0,
+        top_up: int = 0,
+        pricing: Optional[PricingTable] = None,
+        tracker: Optional[TokenTracker] = None,
+        on_exceeded: Optional[Callable[[], None]] = None,
+    ):
+        self.budgets = budgets
+        self.model = model
+        self.top_up = top_up
+        self.pricing = pricing or get_pricing()
+        self.tracker = tracker
+        self.on_exceeded = on_exceeded
+
+        self.reservations = [reservation]
+        self.reserved = reservation.amount
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = 0
+        self.exceeded = False
+        self.finished = False
+        self.cost = 0
+
+        self._limit = self._completion_limit()
+        if self._limit < 0:
+            self._exceed()
+
+    def _completion_limit(self) -> int:
+        """Most completion tokens whose cost fits in the reservation (-1 if none do)."""
+        cost = self.pricing.llm_cost
+        prompt, model, reserved = self.prompt_tokens, self.model, self.reserved
+        if cost(prompt, 0, model) > reserved:
+            return -1
+        if cost(prompt, MAX_TOKENS, model) <= reserved:
+            return MAX_TOKENS
+        lo, hi = 0, 1
+        while cost(prompt, hi, model) <= reserved:
+            lo, hi = hi, hi * 2
+        while hi - lo > 1:  # cost(lo) fits, cost(hi) does not
+            mid = (lo + hi) // 2
+            if cost(prompt, mid, model) <= reserved:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+
+    def add(self, completion_tokens: int) -> bool:
+        """Add a chunk's completion tokens. Returns False once the stream must stop."""
+        self.completion_tokens += completion_tokens
+        if self.completion_tokens > self._limit:
+            return self._over_limit()
+        return not self.exceeded
+
+    def set_total(self, completion_tokens: int) -> bool:
+        """Set the cumulative completion count (for providers that report totals)."""
+        self.completion_tokens = completion_tokens
+        if completion_tokens > self._limit:
+            return self._over_limit()
+        return not self.exceeded
+
+    def add_prompt(self, prompt_tokens: int) -> bool:
+        """Add prompt tokens reported mid-stream (e.g. by the first event)."""
+        self.prompt_tokens += prompt_tokens
+        self._limit = self._completion_limit()
+        if self.completion_tokens > self._limit:
+            return self._over_limit()
+        return not self.exceeded
+
+    def _over_limit(self) -> bool:
+        if self.exceeded:
+            return False
+        while self.top_up > 0 and self.completion_tokens > self._limit:
+            try:
+                extra = self.budgets.reserve(self.reservations[0].agent_id, self.top_up)
+            except BudgetExceededError:
+                break
+            self.reservations.append(extra)
+            self.reserved += extra.amount
+            self._limit = self._completion_limit()
+        if self.completion_tokens > self._limit:
+            self._exceed()
+            return False
+        return True
+
+    def _exceed(self):
+        self.exceeded = True
+        if self.on_exceeded is not None:
+            try:
+                self.on_exceeded()
+            except Exception:
+                logger.exception("on_exceeded callback failed")
+
+    @property
+    def running_cost(self) -> int:
+        """Cost of the tokens seen so far."""
+        return self.pricing.llm_cost(self.prompt_tokens, self.completion_tokens, self.model)
+
+    @property
+    def remaining(self) -> int:
+        """Completion tokens the reservation still pays for."""
+        return max(0, self._limit - self.completion_tokens)
+
+    def finish(self) -> int:
+        """Commit the actual cost against the reservations. Returns the cost."""
+        if self.finished:
+            return self.cost
+        self.finished = True
+        self.cost = self.running_cost
+
+        # Spread the cost over the reservations; any overshoot lands on the last
+        left = self.cost
+        for i, reservation in enumerate(self.reservations):
+            last = i == len(self.reservations) - 1
+            charge = left if last else min(left, reservation.amount)
+            self.budgets.commit(reservation, charge)
+            left -= charge
+
+        if self.tracker is not None:
+            self.tracker.record_llm_usage(self.prompt_tokens, self.completion_tokens, self.model)
+        return self.cost
@@ -0,0 +1,210 @@
+"""Latency histograms for metered operations, exported in Prometheus text format."""
+
+import logging
+import re
+import time
+from array import array
+from bisect import bisect_left
+from typing import Callable, Dict, Hashable, Optional
+
+from delta.models.token_usage import TokenUsageType
+
+logger = logging.getLogger(__name__)
+
+# Seconds; upper bounds of the finite buckets
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+OTHER_AGENT = "other"
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram over a preallocated int64 array.
+
+    observe() is a binary search and two in-place adds; nothing is
+    allocated per sample. Bucket i counts values <= bounds[i] that are
+    above bounds[i - 1]; the last slot counts everything above the last
+    bound (Prometheus' +Inf bucket).
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "tokens")
+
+    def __init__(self, bounds: tuple = DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = array("q", bytes(8 * (len(bounds) + 1)))
+        self.sum = 0.0
+        self.tokens = 0  # Token cost of the observed operations
+
+    def observe(self, value: float, tokens: int = 0):
+        """Record one sample."""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.tokens += tokens
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (inf past the last bound)."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return bound
+        return float("inf") if self.counts[-1] else 0.0
+
+
+class _Timer:
+    __slots__ = ("metrics", "operation", "agent_id", "tokens", "start")
+
+    def __init__(self, metrics: "OperationMetrics", operation, agent_id, tokens: int):
+        self.metrics = metrics
+        self.operation = operation
+        self.agent_id = agent_id
+        self.tokens = tokens
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(
+            self.operation, time.perf_counter() - self.start, self.agent_id, self.tokens
+        )
+
+
+class OperationMetrics:
+    """
+    Latency and token cost per metered operation (TokenUsageType) and agent.
+
+    Series are kept in nested dicts (operation, then agent) so recording a
+    sample builds no key tuple. Agents beyond max_agents per operation
+    share one "other" series to bound memory and scrape size.
+
+    Components can also register stats callables (get_stats() methods);
+    their numeric values are exported as gauges next to the histograms.
+
+    Usage:
+        metrics = get_metrics()
+        with metrics.time(TokenUsageType.TOOL_EXECUTION, agent_id, tokens=5):
+            run_tool()
+        text = metrics.render()
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS, max_agents: int = 1000):
+        self.buckets = tuple(buckets)
+        self.max_agents = max_agents
+        self._series: Dict[TokenUsageType, Dict[Hashable, Histogram]] = {
+            usage_type: {} for usage_type in TokenUsageType
+        }
+        self._collectors: Dict[str, Callable[[], dict]] = {}
+
+    def observe(
+        self,
+        operation: TokenUsageType,
+        seconds: float,
+        agent_id: Optional[Hashable] = None,
+        tokens: int = 0,
+    ):
+        """Record how long one operation took and what it cost."""
+        series = self._series[operation]
+        histogram = series.get(agent_id)
+        if histogram is None:
+            if len(series) >= self.max_agents:
+                agent_id = OTHER_AGENT
+                histogram = series.get(agent_id)
+            if histogram is None:
+                histogram = series[agent_id] = Histogram(self.buckets)
+        histogram.observe(seconds, tokens)
+
+    def time(
+        self,
+        operation: TokenUsageType,
+        agent_id: Optional[Hashable] = None,
+        tokens: int = 0,
+    ) -> _Timer:
+        """Context manager that observes the duration of its block."""
+        return _Timer(self, operation, agent_id, tokens)
+
+    def get(self, operation: TokenUsageType, agent_id: Optional[Hashable] = None) -> Optional[Histogram]:
+        """The histogram for an operation and agent, if any samples were recorded."""
+        return self._series[operation].get(agent_id)
+
+    def add_collector(self, name: str, collect: Callable[[], dict]):
+        """Export collect()'s numeric values as delta_<name>_<key> gauges."""
+        self._collectors[name] = collect
+
+    def remove_collector(self, name: str):
+        self._collectors.pop(name, None)
+
+    def reset(self):
+        """Forget all samples (collectors are kept)."""
+        for series in self._series.values():
+            series.clear()
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (0.0.4)."""
+        lines = [
+            "# HELP delta_operation_seconds Latency of metered operations.",
+            "# TYPE delta_operation_seconds histogram",
+        ]
+        tokens = [
+            "# HELP delta_operation_tokens_total Token cost of metered operations.",
+            "# TYPE delta_operation_tokens_total counter",
+        ]
+        for operation, series in self._series.items():
+            for agent_id, histogram in list(series.items()):
+                labels = f'operation="{operation.value}",agent="{_escape(agent_id)}"'
+                cumulative = 0
+                for bound, count in zip(histogram.bounds, histogram.counts):
+                    cumulative += count
+                    lines.append(f'delta_operation_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                cumulative += histogram.counts[-1]
+                lines.append(f'delta_operation_seconds_bucket{{{labels},le="+Inf"}} {cumulative}')
+                lines.append(f"delta_operation_seconds_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"delta_operation_seconds_count{{{labels}}} {cumulative}")
+                tokens.append(f"delta_operation_tokens_total{{{labels}}} {histogram.tokens}")
+        lines.extend(tokens)
+
+        for name, collect in list(self._collectors.items()):
+            try:
+                stats = collect()
+            except Exception:
+                logger.exception("Metrics collector %s failed", name)
+                continue
+            for key, value in _flatten(stats, f"delta_{name}"):
+                lines.append(f"# TYPE {key} gauge")
+                lines.append(f"{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    if value is None:
+        return ""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _flatten(stats: dict, prefix: str):
+    """(metric name, value) for every number in a nested stats dict."""
+    for key, value in stats.items():
+        name = re.sub(r"[^a-zA-Z0-9_]", "_", f"{prefix}_{key}")
+        if isinstance(value, bool):
+            yield name, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, value
+        elif isinstance(value, dict):
+            yield from _flatten(value, name)
+
+
+_metrics: Optional[OperationMetrics] = None
+
+
+def get_metrics() -> OperationMetrics:
+    """Get the shared operation metrics."""
+    global _metrics
+    if _metrics is None:
+        _metrics = OperationMetrics()
+    return _metrics
@@ -0,0 +1,116 @@
+"""Versioned LLM pricing with a vectorized batch path.
+
+The batch path needs the optional `numpy` package; the scalar path does not.
+"""
+
+from dataclasses import dataclass, field
+from typing import Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+
+@dataclass(frozen=True)
+class PricingTable:
+    """
+    Token costs for LLM calls under one version of the price list.
+
+    llm_costs() prices whole columns at once and gives exactly the same
+    result as llm_cost() row by row: both evaluate the same float64
+    expression in the same order and truncate toward zero (exact for
+    token counts below 2**53).
+
+    Usage:
+        pricing = get_pricing()
+        cost = pricing.llm_cost(1000, 500, "claude-3-opus")
+        costs = pricing.llm_costs(prompt_column, completion_column, model_column)
+    """
+    version: str
+    prompt_per_1k: int
+    completion_per_1k: int
+    model_multipliers: dict[str, float] = field(default_factory=dict)
+    default_multiplier: float = 1.0
+
+    def multiplier(self, model: str) -> float:
+        """Price multiplier for a model."""
+        return self.model_multipliers.get(model, self.default_multiplier)
+
+    def llm_cost(self, prompt_tokens: int, completion_tokens: int, model: str) -> int:
+        """Token cost of one LLM call."""
+        prompt_cost = (prompt_tokens / 1000) * self.prompt_per_1k
+        completion_cost = (completion_tokens / 1000) * self.completion_per_1k
+        return int((prompt_cost + completion_cost) * self.multiplier(model))
+
+    def llm_costs(
+        self,
+        prompt_tokens: Sequence[int],
+        completion_tokens: Sequence[int],
+        models: Sequence,
+        names: Optional[Sequence[str]] = None,
+    ):
+        """
+        Token costs of many LLM calls as an int64 array.
+
+        Args:
+            prompt_tokens: Prompt token counts
+            completion_tokens: Completion token counts
+            models: Model names, or integer codes into `names` (as in
+                TokenTracker.export_buffer())
+            names: Model name for each code, if models are codes
+        """
+        if np is None:
+            raise RuntimeError("Batch pricing requires numpy (install the 'numpy' extra)")
+
+        prompt = np.asarray(prompt_tokens, dtype=np.float64)
+        completion = np.asarray(completion_tokens, dtype=np.float64)
+        if names is None:
+            # Factorize in one pass; np.unique would sort the strings
+            index: dict = {}
+            codes = np.fromiter(
+                (index.setdefault(model, len(index)) for model in models),
+                dtype=np.intp,
+                count=len(models),
+            )
+            names = list(index)
+        else:
+            codes = np.asarray(models, dtype=np.intp)
+        multipliers = np.array([self.multiplier(str(name)) for name in names], dtype=np.float64)
+
+        # Same operations, in the same order, as llm_cost()
+        prompt_cost = (prompt / 1000) * self.prompt_per_1k
+        completion_cost = (completion / 1000) * self.completion_per_1k
+        costs = (prompt_cost + completion_cost) * multipliers[codes]
+        return costs.astype(np.int64)  # Truncates toward zero, like int()
+
+
+PRICING_TABLES: dict[str, PricingTable] = {}
+CURRENT_PRICING_VERSION = "2024-03"
+
+
+def register_pricing(table: PricingTable):
+    """Add a price list version (versions are never changed once published)."""
+    if table.version in PRICING_TABLES:
+        raise ValueError(f"Pricing version {table.version} already exists")
+    PRICING_TABLES[table.version] = table
+
+
+def get_pricing(version: Optional[str] = None) -> PricingTable:
+    """Get a price list by version (defaults to the current one)."""
+    try:
+        return PRICING_TABLES[version or CURRENT_PRICING_VERSION]
+    except KeyError:
+        raise ValueError(f"Unknown pricing version: {version}") from None
+
+
+register_pricing(PricingTable(
+    version="2024-03",
+    prompt_per_1k=1,
+    completion_per_1k=3,  # More expensive than prompt tokens
+    model_multipliers={
+        "claude-3-opus": 3.0,
+        "claude-3-sonnet": 1.0,
+        "claude-3-haiku": 0.5,
+    },
+))
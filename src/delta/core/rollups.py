@@ -0,0 +1,274 @@
+"""Minute, hour and day rollups of token usage."""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+from uuid import UUID
+
+from sqlalchemy import and_, delete, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from delta.models.token_usage import UNLIMITED, TokenSummary, TokenUsage, TokenUsageRollup, TokenUsageType
+from delta.models.user import User
+
+logger = logging.getLogger(__name__)
+
+# Coarsest first
+GRANULARITIES = ("day", "hour", "minute")
+STEPS = {
+    "day": timedelta(days=1),
+    "hour": timedelta(hours=1),
+    "minute": timedelta(minutes=1),
+}
+
+
+def floor_to(ts: datetime, granularity: str) -> datetime:
+    """Start of the bucket containing ts."""
+    ts = ts.replace(second=0, microsecond=0)
+    if granularity in ("hour", "day"):
+        ts = ts.replace(minute=0)
+    if granularity == "day":
+        ts = ts.replace(hour=0)
+    return ts
+
+
+def ceil_to(ts: datetime, granularity: str) -> datetime:
+    """Start of the first bucket at or after ts."""
+    floor = floor_to(ts, granularity)
+    return floor if floor == ts else floor + STEPS[granularity]
+
+
+def cover(start: datetime, end: datetime) -> list[tuple[str, datetime, datetime]]:
+    """
+    Cover [start, end) with the fewest buckets, coarsest first.
+
+    Both ends are widened to whole minutes. A range of any length needs at
+    most 2*23 hour and 2*59 minute buckets besides its whole days.
+
+    Returns:
+        (granularity, first bucket, end) spans
+    """
+    spans = []
+
+    def split(lo: datetime, hi: datetime, level: int):
+        if lo >= hi or level == len(GRANULARITIES):
+            return
+        granularity = GRANULARITIES[level]
+        inner_lo, inner_hi = ceil_to(lo, granularity), floor_to(hi, granularity)
+        if inner_lo < inner_hi:
+            spans.append((granularity, inner_lo, inner_hi))
+            split(lo, inner_lo, level + 1)
+            split(inner_hi, hi, level + 1)
+        else:
+            split(lo, hi, level + 1)
+
+    split(floor_to(start, "minute"), ceil_to(end, "minute"), 0)
+    return spans
+
+
+def rollup_deltas(rows: Iterable[dict], into: Optional[dict] = None) -> dict[tuple, list[int]]:
+    """Aggregate token_usage rows into [tokens_used, events] per rollup key."""
+    deltas: dict[tuple, list[int]] = {} if into is None else into
+    for row in rows:
+        for granularity in GRANULARITIES:
+            key = (
+                granularity,
+                floor_to(row["created_at"], granularity),
+                row["user_id"],
+                row["agent_id"],
+                TokenUsageType(row["usage_type"]),
+                row.get("model") or "",
+            )
+            totals = deltas.get(key)
+            if totals is None:
+                deltas[key] = [row["tokens_used"], 1]
+            else:
+                totals[0] += row["tokens_used"]
+                totals[1] += 1
+    return deltas
+
+
+def _upsert(conn: AsyncConnection):
+    name = conn.dialect.name
+    if name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Rollups are not supported on {name}")
+
+    table = TokenUsageRollup.__table__
+    stmt = insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[c.name for c in table.primary_key.columns],
+        set_={
+            "tokens_used": table.c.tokens_used + stmt.excluded.tokens_used,
+            "events": table.c.events + stmt.excluded.events,
+        },
+    )
+
+
+async def apply_rollups(conn: AsyncConnection, rows: list[dict]) -> int:
+    """
+    Add token_usage rows to the rollups within the caller's transaction.
+
+    Returns:
+        Number of rollup rows touched
+    """
+    return await _write_deltas(conn, rollup_deltas(rows))
+
+
+async def _write_deltas(conn: AsyncConnection, deltas: dict[tuple, list[int]]) -> int:
+    if not deltas:
+        return 0
+    columns = ("granularity", "bucket_start", "user_id", "agent_id", "usage_type", "model")
+    # Sorted so concurrent writers take row locks in the same order
+    params = [
+        {**dict(zip(columns, key)), "tokens_used": tokens, "events": events}
+        for key, (tokens, events) in sorted(deltas.items())
+    ]
+    await conn.execute(_upsert(conn), params)
+    return len(params)
+
+
+class UsageRollups:
+    """
+    Serve usage summaries from pre-aggregated rollups.
+
+    UsageWriter adds every row it inserts to the minute, hour and day
+    rollups in the same transaction, so rollups never disagree with
+    token_usage. A query reads the coarsest buckets that tile its range
+    (see cover()), so its cost depends on the range and the number of
+    agents, never on how many events were recorded.
+
+    Usage:
+        rollups = UsageRollups(engine)
+        summary = await rollups.get_summary(user_id)
+        await rollups.rebuild(since=datetime(2024, 1, 1))
+    """
+
+    def __init__(self, engine: AsyncEngine, rebuild_batch: int = 5000):
+        self.engine = engine
+        self.rebuild_batch = rebuild_batch
+
+    async def get_usage(
+        self,
+        user_id: UUID,
+        start: datetime,
+        end: datetime,
+        conn: Optional[AsyncConnection] = None,
+    ) -> list[tuple[UUID, str, int]]:
+        """Tokens used per (agent_id, usage_type) in [start, end)."""
+        spans = cover(start, end)
+        if not spans:
+            return []
+        rollup = TokenUsageRollup
+        query = (
+            select(rollup.agent_id, rollup.usage_type, func.sum(rollup.tokens_used))
+            .where(rollup.user_id == user_id)
+            .where(or_(*(
+                and_(
+                    rollup.granularity == granularity,
+                    rollup.bucket_start >= lo,
+                    rollup.bucket_start < hi,
+                )
+                for granularity, lo, hi in spans
+            )))
+            .group_by(rollup.agent_id, rollup.usage_type)
+        )
+        if conn is not None:
+            result = await conn.execute(query)
+        else:
+            async with self.engine.connect() as conn:
+                result = await conn.execute(query)
+        return [(agent_id, TokenUsageType(kind).value, int(total)) for agent_id, kind, total in result]
+
+    async def get_summary(
+        self,
+        user_id: UUID,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> TokenSummary:
+        """Usage summary for a user (defaults to the current calendar month)."""
+        now = datetime.utcnow()
+        start = start or floor_to(now, "day").replace(day=1)
+        end = end or now
+
+        async with self.engine.connect() as conn:
+            allocated = (await conn.execute(
+                select(User.total_tokens_allocated).where(User.id == user_id)
+            )).scalar_one()
+            usage = await self.get_usage(user_id, start, end, conn)
+
+        by_agent: dict[str, int] = {}
+        by_type: dict[str, int] = {}
+        for agent_id, usage_type, tokens in usage:
+            by_agent[str(agent_id)] = by_agent.get(str(agent_id), 0) + tokens
+            by_type[usage_type] = by_type.get(usage_type, 0) + tokens
+        used = sum(by_type.values())
+
+        return TokenSummary(
+            total_allocated=allocated,
+            total_used=used,
+            remaining=UNLIMITED if allocated == UNLIMITED else max(0, allocated - used),
+            usage_by_agent=by_agent,
+            usage_by_type=by_type,
+        )
+
+    async def rebuild(
+        self,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        user_id: Optional[UUID] = None,
+    ) -> int:
+        """
+        Recompute rollups from token_usage for whole days in [since, until).
+
+        since defaults to the first event and until to the start of today,
+        so only closed days are rebuilt. Rebuilding a range that is still
+        receiving events can miss rows committed while it runs.
+
+        Returns:
+            Number of token_usage rows read
+        """
+        async with self.engine.begin() as conn:
+            if since is None:
+                query = select(func.min(TokenUsage.created_at))
+                if user_id is not None:
+                    query = query.where(TokenUsage.user_id == user_id)
+                since = (await conn.execute(query)).scalar()
+                if since is None:
+                    return 0
+            since = floor_to(since, "day")
+            until = ceil_to(until, "day") if until else floor_to(datetime.utcnow(), "day")
+            if since >= until:
+                return 0
+
+            stale = delete(TokenUsageRollup).where(
+                TokenUsageRollup.bucket_start >= since,
+                TokenUsageRollup.bucket_start < until,
+            )
+            rows = select(
+                TokenUsage.user_id,
+                TokenUsage.agent_id,
+                TokenUsage.usage_type,
+                TokenUsage.tokens_used,
+                TokenUsage.model,
+                TokenUsage.created_at,
+            ).where(TokenUsage.created_at >= since, TokenUsage.created_at < until)
+            if user_id is not None:
+                stale = stale.where(TokenUsageRollup.user_id == user_id)
+                rows = rows.where(TokenUsage.user_id == user_id)
+            await conn.execute(stale)
+
+            # Aggregate everything first: memory grows with rollup keys, not rows
+            count = 0
+            deltas: dict[tuple, list[int]] = {}
+            result = await conn.stream(rows.execution_options(yield_per=self.rebuild_batch))
+            async for partition in result.mappings().partitions():
+                rollup_deltas(partition, deltas)
+                count += len(partition)
+            await _write_deltas(conn, deltas)
+
+        logger.info("Rebuilt usage rollups for %d rows from %s to %s", count, since, until)
+        return count
@@ -0,0 +1,166 @@
+"""Scheduled monthly reset of users' token usage."""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Callable, Optional
+from uuid import UUID
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from delta.config import get_settings
+from delta.core.budget import reset_user_budgets
+from delta.core.metrics import get_metrics
+from delta.core.tokens import TokenService
+from delta.database import get_engine
+from delta.models.user import User
+
+logger = logging.getLogger(__name__)
+
+
+class TokenResetJob:
+    """
+    Reset tokens_used_this_month for every user whose reset date has passed.
+
+    Users are processed in id order, chunk_size at a time, each chunk in
+    its own short transaction. Each UPDATE only touches rows still due
+    (token_reset_date <= now) and moves their reset date to the next
+    month, so running the job twice, or in several workers at once, never
+    resets a user twice, and a run that dies part-way is finished by the
+    next one. Users without a reset date get one without losing their
+    current usage.
+
+    Listeners are called with each chunk's reset user ids after it
+    commits, to clear in-memory copies such as BudgetEngine counters.
+
+    Usage:
+        job = TokenResetJob(engine)
+        job.add_listener(invalidate_cached_budgets)  # Called with each chunk's user ids
+        await job.run()
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        chunk_size: int = 1000,
+        interval: float = 300.0,
+    ):
+        self.engine = engine
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self.service = TokenService()
+        self._listeners: list[Callable[[list[UUID]], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters
+        self.runs = 0
+        self.users_reset = 0
+
+    def add_listener(self, listener: Callable[[list[UUID]], None]):
+        """Call listener(user_ids) after each chunk of users is reset."""
+        self._listeners.append(listener)
+
+    async def run(self, now: Optional[datetime] = None) -> int:
+        """Reset all users that are due. Returns the number of users reset."""
+        now = now or datetime.utcnow()
+        next_reset = self.service.calculate_reset_date(now=now)
+        users = User.__table__
+        total = 0
+
+        async with self.engine.begin() as conn:
+            await conn.execute(
+                update(users)
+                .where(users.c.token_reset_date.is_(None))
+                .values(token_reset_date=next_reset)
+            )
+
+        last_id = None
+        while True:
+            async with self.engine.begin() as conn:
+                query = (
+                    select(users.c.id)
+                    .where(users.c.token_reset_date <= now)
+                    .order_by(users.c.id)
+                    .limit(self.chunk_size)
+                )
+                if last_id is not None:
+                    query = query.where(users.c.id > last_id)
+                ids = list((await conn.execute(query)).scalars())
+                if not ids:
+                    break
+                result = await conn.execute(
+                    update(users)
+                    .where(users.c.id.in_(ids), users.c.token_reset_date <= now)
+                    .values(tokens_used_this_month=0, token_reset_date=next_reset)
+                    .returning(users.c.id)
+                )
+                reset = list(result.scalars())
+            last_id = ids[-1]
+            total += len(reset)
+            self._notify(reset)
+
+        self.runs += 1
+        self.users_reset += total
+        if total:
+            logger.info("Reset monthly token usage for %d users", total)
+        return total
+
+    def _notify(self, user_ids: list[UUID]):
+        if not user_ids:
+            return
+        for listener in self._listeners:
+            try:
+                listener(user_ids)
+            except Exception:
+                logger.exception("Token reset listener failed")
+
+    def start(self):
+        """Run the job every interval seconds."""
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        """Stop the scheduled runs."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run()
+            except Exception:
+                logger.exception("Token reset failed; will retry")
+            await asyncio.sleep(self.interval)
+
+    def get_stats(self) -> dict:
+        """Get job statistics."""
+        return {"runs": self.runs, "users_reset": self.users_reset}
+
+
+_token_reset_job: Optional[TokenResetJob] = None
+
+
+def get_token_reset_job() -> TokenResetJob:
+    """Get the shared reset job, wired to clear the shared budget engine's counters."""
+    global _token_reset_job
+    if _token_reset_job is None:
+        settings = get_settings()
+        _token_reset_job = TokenResetJob(
+            get_engine(),
+            chunk_size=settings.token_reset_chunk_size,
+            interval=settings.token_reset_interval_seconds,
+        )
+        _token_reset_job.add_listener(reset_user_budgets)
+        get_metrics().add_collector("token_reset", _token_reset_job.get_stats)
+    return _token_reset_job
+
+
+async def close_token_reset_job():
+    """Stop the shared reset job if one was created."""
+    global _token_reset_job
+    if _token_reset_job is not None:
+        await _token_reset_job.close()
+        get_metrics().remove_collector("token_reset")
+        _token_reset_job = None
@@ -1,10 +1,17 @@
 """Token metering and allocation service."""
 
+import time
+from array import array
 from datetime import datetime, timedelta
 from typing import Optional
 from uuid import UUID
 
-from delta.models.token_usage import TokenUsageType
+from delta.core.metrics import get_metrics
+from delta.core.pricing import PricingTable, get_pricing
+from delta.core.usage_writer import UsageWriter, usage_row
+from delta.models.token_usage import UNLIMITED, TokenUsageType
+
+EPOCH = datetime(1970, 1, 1)
 
 
 class TokenService:
@@ -33,9 +40,12 @@ class TokenService:
         "free": 1000,
         "developer": 10000,
         "pro": 100000,
-        "enterprise": -1,  # Unlimited
+        "enterprise": UNLIMITED,
     }
     
+    def __init__(self, pricing: Optional[PricingTable] = None):
+        self.pricing = pricing or get_pricing()
+    
     def calculate_llm_cost(
         self,
         prompt_tokens: int,
@@ -43,17 +53,11 @@ class TokenService:
         model: str = "claude-3-sonnet",
     ) -> int:
         """Calculate token cost for an LLM call."""
-        # Adjust for model (more expensive models cost more)
-        model_multiplier = {
-            "claude-3-opus": 3.0,
-            "claude-3-sonnet": 1.0,
-            "claude-3-haiku": 0.5,
-        }.get(model, 1.0)
-        
-        prompt_cost = (prompt_tokens / 1000) * self.COSTS[TokenUsageType.LLM_PROMPT]
-        completion_cost = (completion_tokens / 1000) * self.COSTS[TokenUsageType.LLM_COMPLETION]
-        
-        return int((prompt_cost + completion_cost) * model_multiplier)
+        return self.pricing.llm_cost(prompt_tokens, completion_tokens, model)
+    
+    def calculate_llm_costs(self, prompt_tokens, completion_tokens, models, names=None):
+        """Calculate token costs for many LLM calls at once (see PricingTable.llm_costs)."""
+        return self.pricing.llm_costs(prompt_tokens, completion_tokens, models, names)
     
     def calculate_message_cost(self, message_type: str) -> int:
         """Calculate token cost for sending a message."""
@@ -85,9 +89,13 @@ class TokenService:
             return False, remaining
         return True, remaining - requested
     
-    def calculate_reset_date(self, current_reset: Optional[datetime] = None) -> datetime:
+    def calculate_reset_date(
+        self,
+        current_reset: Optional[datetime] = None,
+        now: Optional[datetime] = None,
+    ) -> datetime:
         """Calculate the next token reset date (monthly)."""
-        now = datetime.utcnow()
+        now = now or datetime.utcnow()
         if current_reset and current_reset > now:
             return current_reset
         
@@ -101,73 +109,209 @@ class TokenTracker:
     """
     Track token usage for a specific session/task.
     
+    Events are stored column-wise in typed arrays (kind, interned name code,
+    prompt/completion tokens, cost, epoch-microsecond timestamp), so each
+    one costs a few dozen bytes instead of a dict and a datetime. Totals
+    per kind and per model are kept up to date as events are recorded,
+    so get_total_cost() and get_summary() are O(1).
+    
+    Given a user_id and a UsageWriter, every event is also queued for
+    write-behind persistence as a TokenUsage row.
+    
     Usage:
-        tracker = TokenTracker(agent_id, task_id)
+        tracker = TokenTracker(agent_id, task_id, user_id=user_id, writer=get_usage_writer())
         tracker.record_llm_usage(100, 50, "claude-3-sonnet")
         tracker.record_message("email")
         summary = tracker.get_summary()
     """
     
-    def __init__(self, agent_id: UUID, task_id: Optional[str] = None):
+    KINDS = ("llm", "tool", "message")
+    LLM, TOOL, MESSAGE = range(3)
+    
+    # TokenUsage row type and extra_data key for each kind (LLM rows use `model`)
+    USAGE_TYPES = (
+        (TokenUsageType.LLM_COMPLETION, None),
+        (TokenUsageType.TOOL_EXECUTION, "tool_name"),
+        (TokenUsageType.MESSAGE_SEND, "message_type"),
+    )
+    
+    def __init__(
+        self,
+        agent_id: UUID,
+        task_id: Optional[str] = None,
+        user_id: Optional[UUID] = None,
+        writer: Optional[UsageWriter] = None,
+    ):
         self.agent_id = agent_id
         self.task_id = task_id
+        self.user_id = user_id
+        self.writer = writer if user_id is not None else None
         self.service = TokenService()
-        self.usage: list[dict] = []
+        
+        # Interned model / tool / message type names
+        self.names: list[str] = []
+        self._name_codes: dict[str, int] = {}
+        
+        # Event columns
+        self._kinds = array("B")
+        self._name_ids = array("I")
+        self._prompt_tokens = array("q")
+        self._completion_tokens = array("q")
+        self._costs = array("q")
+        self._timestamps = array("q")  # Microseconds since the Unix epoch (UTC)
+        
+        # Running totals
+        self.total_cost = 0
+        self._cost_by_kind = [0] * len(self.KINDS)
+        self._model_totals: dict[int, list[int]] = {}  # code -> [calls, prompt, completion, cost]
+    
+    def __len__(self) -> int:
+        return len(self._kinds)
+    
+    def _intern(self, name: str) -> int:
+        code = self._name_codes.get(name)
+        if code is None:
+            code = self._name_codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+    
+    def _record(self, kind: int, name: str, cost: int, prompt: int = 0, completion: int = 0) -> int:
+        code = self._intern(name)
+        self._kinds.append(kind)
+        self._name_ids.append(code)
+        self._prompt_tokens.append(prompt)
+        self._completion_tokens.append(completion)
+        self._costs.append(cost)
+        timestamp = time.time_ns() // 1000
+        self._timestamps.append(timestamp)
+        
+        self.total_cost += cost
+        self._cost_by_kind[kind] += cost
+        if kind == self.LLM:
+            totals = self._model_totals.get(code)
+            if totals is None:
+                totals = self._model_totals[code] = [0, 0, 0, 0]
+            totals[0] += 1
+            totals[1] += prompt
+            totals[2] += completion
+            totals[3] += cost
+        
+        if self.writer is not None:
+            usage_type, name_key = self.USAGE_TYPES[kind]
+            if kind == self.LLM:
+                extra = {"prompt_tokens": prompt, "completion_tokens": completion}
+            else:
+                extra = {name_key: name}
+            self.writer.record(usage_row(
+                self.user_id,
+                self.agent_id,
+                usage_type,
+                cost,
+                model=name if kind == self.LLM else None,
+                task_id=self.task_id,
+                extra_data=extra,
+                created_at=EPOCH + timedelta(microseconds=timestamp),
+            ))
+        return cost
     
     def record_llm_usage(
         self,
         prompt_tokens: int,
         completion_tokens: int,
         model: str = "claude-3-sonnet",
+        duration: Optional[float] = None,
+        time_to_first_token: Optional[float] = None,
     ) -> int:
-        """Record LLM token usage. Returns cost."""
+        """
+        Record LLM token usage. Returns cost.
+        
+        A duration (seconds for the whole call) and time to first token
+        are observed as llm_completion and llm_prompt latencies.
+        """
         cost = self.service.calculate_llm_cost(prompt_tokens, completion_tokens, model)
-        self.usage.append({
-            "type": "llm",
-            "prompt_tokens": prompt_tokens,
-            "completion_tokens": completion_tokens,
-            "model": model,
-            "cost": cost,
-            "timestamp": datetime.utcnow(),
-        })
-        return cost
+        if time_to_first_token is not None:
+            get_metrics().observe(TokenUsageType.LLM_PROMPT, time_to_first_token, self.agent_id)
+        if duration is not None:
+            get_metrics().observe(TokenUsageType.LLM_COMPLETION, duration, self.agent_id, cost)
+        return self._record(self.LLM, model, cost, prompt_tokens, completion_tokens)
     
-    def record_tool_usage(self, tool_name: str) -> int:
+    def record_tool_usage(self, tool_name: str, duration: Optional[float] = None) -> int:
         """Record tool execution. Returns cost."""
         cost = TokenService.COSTS[TokenUsageType.TOOL_EXECUTION]
-        self.usage.append({
-            "type": "tool",
-            "tool_name": tool_name,
-            "cost": cost,
-            "timestamp": datetime.utcnow(),
-        })
-        return cost
+        if duration is not None:
+            get_metrics().observe(TokenUsageType.TOOL_EXECUTION, duration, self.agent_id, cost)
+        return self._record(self.TOOL, tool_name, cost)
     
-    def record_message(self, message_type: str) -> int:
+    def record_message(self, message_type: str, duration: Optional[float] = None) -> int:
         """Record message sending. Returns cost."""
         cost = self.service.calculate_message_cost(message_type)
-        self.usage.append({
-            "type": "message",
-            "message_type": message_type,
-            "cost": cost,
-            "timestamp": datetime.utcnow(),
-        })
-        return cost
+        if duration is not None:
+            get_metrics().observe(TokenUsageType.MESSAGE_SEND, duration, self.agent_id, cost)
+        return self._record(self.MESSAGE, message_type, cost)
     
     def get_total_cost(self) -> int:
         """Get total token cost for this session."""
-        return sum(u["cost"] for u in self.usage)
+        return self.total_cost
     
     def get_summary(self) -> dict:
         """Get usage summary."""
         return {
             "agent_id": str(self.agent_id),
             "task_id": self.task_id,
-            "total_cost": self.get_total_cost(),
+            "total_cost": self.total_cost,
             "breakdown": {
-                "llm": sum(u["cost"] for u in self.usage if u["type"] == "llm"),
-                "tools": sum(u["cost"] for u in self.usage if u["type"] == "tool"),
-                "messages": sum(u["cost"] for u in self.usage if u["type"] == "message"),
+                "llm": self._cost_by_kind[self.LLM],
+                "tools": self._cost_by_kind[self.TOOL],
+                "messages": self._cost_by_kind[self.MESSAGE],
             },
-            "operations": len(self.usage),
+            "operations": len(self._kinds),
+        }
+    
+    def get_model_breakdown(self) -> dict:
+        """Get LLM calls, tokens and cost per model."""
+        return {
+            self.names[code]: {
+                "calls": calls,
+                "prompt_tokens": prompt,
+                "completion_tokens": completion,
+                "cost": cost,
+            }
+            for code, (calls, prompt, completion, cost) in self._model_totals.items()
         }
+    
+    def export_buffer(self) -> dict:
+        """
+        Export the event columns without copying.
+        
+        Returns memoryviews over the underlying arrays plus the name table
+        that `name_id` indexes into (`kind` indexes KINDS). The arrays cannot
+        grow while a view is alive, so release the views (or use them as
+        context managers) before recording more events.
+        """
+        return {
+            "kind": memoryview(self._kinds),
+            "name_id": memoryview(self._name_ids),
+            "prompt_tokens": memoryview(self._prompt_tokens),
+            "completion_tokens": memoryview(self._completion_tokens),
+            "cost": memoryview(self._costs),
+            "timestamp_us": memoryview(self._timestamps),
+            "names": list(self.names),
+        }
+    
+    @property
+    def usage(self) -> list[dict]:
+        """Events as dicts, built on demand (O(n); prefer the totals or export_buffer)."""
+        name_keys = {self.LLM: "model", self.TOOL: "tool_name", self.MESSAGE: "message_type"}
+        events = []
+        for i, kind in enumerate(self._kinds):
+            event = {
+                "type": self.KINDS[kind],
+                name_keys[kind]: self.names[self._name_ids[i]],
+                "cost": self._costs[i],
+                "timestamp": EPOCH + timedelta(microseconds=self._timestamps[i]),
+            }
+            if kind == self.LLM:
+                event["prompt_tokens"] = self._prompt_tokens[i]
+                event["completion_tokens"] = self._completion_tokens[i]
+            events.append(event)
+        return events
@@ -0,0 +1,443 @@
+"""Append-only segment files of token usage events for audit scans.
+
+Each day's events go to a segment file of fixed-width little-endian
+records, with a small JSON index next to it. A segment has one writer at
+a time (an exclusive lock); other processes writing the same day use
+numbered segments next to it. Scans mmap the segments and read them
+without copying; the fast path needs the optional `numpy` package and
+falls back to struct unpacking without it.
+"""
+
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Iterator, Optional
+from uuid import UUID
+
+from delta.models.token_usage import TokenUsageType
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+EPOCH = datetime(1970, 1, 1)
+
+# timestamp_us, user_id, agent_id, task hash, model hash, tokens_used, usage type, padding
+RECORD = struct.Struct("<q16s16sQQqB7x")
+RECORD_SIZE = RECORD.size  # 72 bytes
+USAGE_TYPES = list(TokenUsageType)
+TYPE_CODES = {
+    **{usage_type: code for code, usage_type in enumerate(USAGE_TYPES)},
+    **{usage_type.value: code for code, usage_type in enumerate(USAGE_TYPES)},
+}
+_MICROSECOND = timedelta(microseconds=1)
+INDEX_VERSION = 1
+
+RECORD_DTYPE = (
+    np.dtype([
+        ("timestamp_us", "<i8"),
+        ("user_id", "V16"),
+        ("agent_id", "V16"),
+        ("task", "<u8"),
+        ("model", "<u8"),
+        ("tokens_used", "<i8"),
+        ("usage_type", "u1"),
+        ("_pad", "V7"),
+    ])
+    if np is not None
+    else None
+)
+
+# aggregate(group_by=...) -> record field
+GROUP_COLUMNS = {
+    "agent": "agent_id",
+    "user": "user_id",
+    "type": "usage_type",
+    "model": "model",
+    "task": "task",
+}
+
+
+def name_hash(name: Optional[str]) -> int:
+    """64-bit hash stored in place of a task id or model name (0 for none)."""
+    if not name:
+        return 0
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "little") or 1
+
+
+def segment_name(day: date, number: int = 0) -> str:
+    """usage-YYYYMMDD.seg, or usage-YYYYMMDD.<number>.seg for further writers."""
+    return f"usage-{day:%Y%m%d}.seg" if not number else f"usage-{day:%Y%m%d}.{number}.seg"
+
+
+def _segment_day(path: Path) -> date:
+    return datetime.strptime(path.name[6:14], "%Y%m%d").date()
+
+
+def _index_path(segment: Path) -> Path:
+    return segment.with_suffix(".idx")
+
+
+class _Segment:
+    """An open segment being appended to, with its index."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.agents: set[bytes] = set()
+        self.tasks: dict[str, Optional[str]] = {}
+        self.models: dict[str, Optional[str]] = {}
+        self.file = open(path, "ab")
+        try:
+            # Raises BlockingIOError if another process is appending here
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.file.close()
+            raise
+
+        self.events = path.stat().st_size // RECORD_SIZE
+        index = _read_index(path)
+        if index is not None and index["events"] == self.events:
+            self.agents = {bytes.fromhex(agent) for agent in index["agents"]}
+            self.tasks = index["tasks"]
+            self.models = index["models"]
+        elif self.events:
+            # Crashed after appending, before the index caught up: re-derive
+            # the keys from the records, keeping the names the index had
+            rebuilt = _build_index(path)
+            self.agents = {bytes.fromhex(agent) for agent in rebuilt["agents"]}
+            self.tasks = {**rebuilt["tasks"], **(index["tasks"] if index else {})}
+            self.models = {**rebuilt["models"], **(index["models"] if index else {})}
+        self.file.truncate(self.events * RECORD_SIZE)  # Drop a torn last record
+
+    def write_index(self):
+        tmp = _index_path(self.path).with_suffix(".idx.tmp")
+        tmp.write_text(json.dumps({
+            "version": INDEX_VERSION,
+            "events": self.events,
+            "agents": sorted(agent.hex() for agent in self.agents),
+            "tasks": self.tasks,
+            "models": self.models,
+        }))
+        os.replace(tmp, _index_path(self.path))
+
+
+def _read_index(segment: Path) -> Optional[dict]:
+    try:
+        index = json.loads(_index_path(segment).read_text())
+    except (OSError, ValueError):
+        return None
+    return index if index.get("version") == INDEX_VERSION else None
+
+
+def _build_index(segment: Path) -> dict:
+    """Index a segment's agents, tasks and models from its records (names unknown)."""
+    agents: set[str] = set()
+    tasks: set[int] = set()
+    models: set[int] = set()
+    with open(segment, "rb") as f:
+        data = f.read()
+    for record in RECORD.iter_unpack(data[: len(data) - len(data) % RECORD_SIZE]):
+        agents.add(record[2].hex())
+        tasks.add(record[3])
+        models.add(record[4])
+    tasks.discard(0)
+    models.discard(0)
+    return {
+        "version": INDEX_VERSION,
+        "events": len(data) // RECORD_SIZE,
+        "agents": sorted(agents),
+        "tasks": {format(code, "x"): None for code in tasks},
+        "models": {format(code, "x"): None for code in models},
+    }
+
+
+class UsageLog:
+    """
+    Append usage events to daily fixed-width segment files.
+
+    Events are written to the segment of the day they happened
+    (created_at, UTC). flush() pushes appended records to the OS and then
+    rewrites the segment's index, so an index never lists fewer events
+    than it covers; readers scan records past the indexed count without
+    skipping. Reopening a segment after a crash truncates a torn last
+    record and rebuilds the index keys of unindexed records. Segments are
+    locked while open, so several processes can share a directory.
+
+    Usage:
+        log = UsageLog("/var/lib/delta/usage-log")
+        log.append(usage_row(user_id, agent_id, TokenUsageType.TOOL_EXECUTION, 5))
+        log.flush()
+    """
+
+    def __init__(self, directory: str, fsync: bool = False):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+        self._segment: Optional[_Segment] = None
+        self._day: Optional[date] = None
+        self._dirty = False
+        self._hashes: dict[str, int] = {}
+
+    def _hash(self, name: Optional[str]) -> int:
+        code = self._hashes.get(name)
+        if code is None:
+            if len(self._hashes) >= 100_000:
+                self._hashes.clear()
+            code = self._hashes[name] = name_hash(name)
+        return code
+
+    def append(self, row: dict):
+        """Append one token_usage row (see usage_row)."""
+        created_at = row["created_at"]
+        day = created_at.date()
+        if day != self._day:
+            self._open(day)
+        segment = self._segment
+
+        agent = row["agent_id"].bytes
+        task_id = row.get("task_id")
+        model = row.get("model")
+        task = self._hash(task_id)
+        model_code = self._hash(model)
+        segment.agents.add(agent)
+        if task:
+            key = format(task, "x")
+            if segment.tasks.get(key) is None:  # Also names keys rebuilt after a crash
+                segment.tasks[key] = task_id
+        if model_code:
+            key = format(model_code, "x")
+            if segment.models.get(key) is None:
+                segment.models[key] = model
+
+        segment.file.write(RECORD.pack(
+            (created_at - EPOCH) // _MICROSECOND,
+            row["user_id"].bytes,
+            agent,
+            task,
+            model_code,
+            row["tokens_used"],
+            TYPE_CODES[row["usage_type"]],
+        ))
+        segment.events += 1
+        self._dirty = True
+
+    def _open(self, day: date):
+        self.flush()
+        if self._segment is not None:
+            self._segment.file.close()
+        number = 0
+        while True:
+            try:
+                self._segment = _Segment(self.directory / segment_name(day, number))
+                break
+            except BlockingIOError:
+                number += 1  # Held by another writer
+        self._day = day
+
+    def flush(self):
+        """Make appended events visible to readers and update the index."""
+        if self._segment is None or not self._dirty:
+            return
+        self._segment.file.flush()
+        if self.fsync:
+            os.fsync(self._segment.file.fileno())
+        self._segment.write_index()
+        self._dirty = False
+
+    def close(self):
+        self.flush()
+        if self._segment is not None:
+            self._segment.file.close()
+            self._segment = None
+            self._day = None
+
+
+class UsageLogReader:
+    """
+    Scan and aggregate usage segments.
+
+    Segments are chosen by day from their file names; a segment whose
+    index shows it never saw the requested agent or task is skipped
+    without being opened.
+
+    Usage:
+        reader = UsageLogReader("/var/lib/delta/usage-log")
+        totals = reader.aggregate(agent_id=agent_id, task_id="task-1", group_by="model")
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.segments_read = 0
+        self.segments_skipped = 0
+        self.events_scanned = 0
+
+    def segments(self, since: Optional[date] = None, until: Optional[date] = None) -> list[Path]:
+        """Segment files for days in [since, until), oldest first."""
+        paths = sorted(self.directory.glob("usage-*.seg"))
+        return [
+            path for path in paths
+            if (since is None or _segment_day(path) >= since)
+            and (until is None or _segment_day(path) < until)
+        ]
+
+    def _candidates(
+        self,
+        agent_id: Optional[UUID],
+        task_id: Optional[str],
+        since: Optional[datetime],
+        until: Optional[datetime],
+    ) -> Iterator[tuple[Path, dict, int]]:
+        """(segment, index, first record the index does not cover) for segments to read."""
+        last_day = (until - timedelta(microseconds=1)).date() + timedelta(days=1) if until else None
+        for path in self.segments(since.date() if since else None, last_day):
+            index = _read_index(path) or {"events": 0, "agents": [], "tasks": {}, "models": {}}
+            events = path.stat().st_size // RECORD_SIZE
+            unindexed = events > index["events"]
+            if not unindexed and (
+                (agent_id is not None and agent_id.hex not in index["agents"])
+                or (task_id is not None and format(name_hash(task_id), "x") not in index["tasks"])
+            ):
+                self.segments_skipped += 1
+                continue
+            self.segments_read += 1
+            yield path, index, events
+
+    def aggregate(
+        self,
+        agent_id: Optional[UUID] = None,
+        task_id: Optional[str] = None,
+        user_id: Optional[UUID] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        group_by: str = "agent",
+    ) -> dict:
+        """
+        Total tokens and events per group for matching events.
+
+        Returns:
+            {group key: {"tokens": int, "events": int}}, keyed by UUID for
+            agent/user, usage type value for type, and name for model/task
+        """
+        if group_by not in GROUP_COLUMNS:
+            raise ValueError(f"group_by must be one of {tuple(GROUP_COLUMNS)}")
+        scan = _aggregate_numpy if np is not None else _aggregate_struct
+        totals: dict = {}
+        for path, index, events in self._candidates(agent_id, task_id, since, until):
+            if not events:
+                continue
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                by_code = scan(mm, events, agent_id, task_id, user_id, since, until, group_by)
+            self.events_scanned += events
+            _merge(totals, index, group_by, by_code)
+        return totals
+
+
+def _group_key(group_by: str, index: dict, code):
+    """Turn a raw grouping column value into the key aggregate() returns."""
+    if group_by in ("agent", "user"):
+        return UUID(bytes=bytes(code))
+    if group_by == "type":
+        return USAGE_TYPES[code].value
+    if not code:
+        return None
+    names = index["models"] if group_by == "model" else index["tasks"]
+    return names.get(format(code, "x")) or format(code, "x")
+
+
+def _merge(totals: dict, index: dict, group_by: str, by_code: dict):
+    for code, (tokens, events) in by_code.items():
+        key = _group_key(group_by, index, code)
+        entry = totals.get(key)
+        if entry is None:
+            totals[key] = {"tokens": tokens, "events": events}
+        else:
+            entry["tokens"] += tokens
+            entry["events"] += events
+
+
+def _bounds(since: Optional[datetime], until: Optional[datetime]) -> tuple:
+    lo = (since - EPOCH) // timedelta(microseconds=1) if since is not None else None
+    hi = (until - EPOCH) // timedelta(microseconds=1) if until is not None else None
+    return lo, hi
+
+
+def _aggregate_numpy(mm, events, agent_id, task_id, user_id, since, until, group_by) -> dict:
+    records = np.frombuffer(mm, dtype=RECORD_DTYPE, count=events)
+    try:
+        lo, hi = _bounds(since, until)
+        mask = None
+        for matches in (
+            records["agent_id"] == np.void(agent_id.bytes) if agent_id is not None else None,
+            records["user_id"] == np.void(user_id.bytes) if user_id is not None else None,
+            records["task"] == name_hash(task_id) if task_id is not None else None,
+            records["timestamp_us"] >= lo if lo is not None else None,
+            records["timestamp_us"] < hi if hi is not None else None,
+        ):
+            if matches is not None:
+                mask = matches if mask is None else mask & matches
+
+        column = records[GROUP_COLUMNS[group_by]]
+        tokens = records["tokens_used"]
+        if mask is not None:
+            column, tokens = column[mask], tokens[mask]
+        codes, inverse = _factorize(column)
+        sums = np.bincount(inverse, weights=tokens, minlength=len(codes))
+        counts = np.bincount(inverse, minlength=len(codes))
+        return {
+            code: (int(total), count)
+            for code, total, count in zip(codes.tolist(), sums.tolist(), counts.tolist())
+        }
+    finally:
+        del records  # Release the buffer before the mmap closes
+
+
+def _factorize(column) -> tuple:
+    """np.unique(column, return_inverse=True), faster for 16-byte ids."""
+    if column.dtype.kind != "V":
+        return np.unique(column, return_inverse=True)
+    # Sorting uint64s is much faster than sorting 16-byte voids; the first
+    # half of a UUID identifies it unless two ids collide, which is checked
+    column = np.ascontiguousarray(column)
+    halves = column.view("<u8").reshape(-1, 2)
+    _, first, inverse = np.unique(halves[:, 0], return_index=True, return_inverse=True)
+    if np.array_equal(halves[first, 1][inverse], halves[:, 1]):
+        return column[first], inverse
+    return np.unique(column, return_inverse=True)
+
+
+def _aggregate_struct(mm, events, agent_id, task_id, user_id, since, until, group_by) -> dict:
+    agent = agent_id.bytes if agent_id is not None else None
+    user = user_id.bytes if user_id is not None else None
+    task_code = name_hash(task_id) if task_id is not None else None
+    lo, hi = _bounds(since, until)
+    position = ("timestamp_us", "user_id", "agent_id", "task", "model", "tokens_used", "usage_type")
+    group = position.index(GROUP_COLUMNS[group_by])
+
+    by_code: dict = {}
+    view = memoryview(mm)[: events * RECORD_SIZE]
+    try:
+        for record in RECORD.iter_unpack(view):
+            ts, u, a, task = record[0], record[1], record[2], record[3]
+            if (
+                (agent is not None and a != agent)
+                or (user is not None and u != user)
+                or (task_code is not None and task != task_code)
+                or (lo is not None and ts < lo)
+                or (hi is not None and ts >= hi)
+            ):
+                continue
+            entry = by_code.get(record[group])
+            if entry is None:
+                by_code[record[group]] = [record[5], 1]
+            else:
+                entry[0] += record[5]
+                entry[1] += 1
+    finally:
+        view.release()
+    return by_code
@@ -0,0 +1,345 @@
+"""Write-behind persistence of TokenUsage events."""
+
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Optional
+from uuid import UUID, uuid4
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from delta.config import get_settings
+from delta.core.metrics import get_metrics
+from delta.core.rollups import apply_rollups
+from delta.core.usage_log import UsageLog
+from delta.database import get_engine
+from delta.models.token_usage import TokenUsage, TokenUsageType
+
+logger = logging.getLogger(__name__)
+
+
+def usage_row(
+    user_id: UUID,
+    agent_id: UUID,
+    usage_type: TokenUsageType,
+    tokens_used: int,
+    model: Optional[str] = None,
+    task_id: Optional[str] = None,
+    extra_data: Optional[dict] = None,
+    created_at: Optional[datetime] = None,
+) -> dict:
+    """Build a token_usage row for UsageWriter.record()."""
+    return {
+        "id": uuid4(),
+        "user_id": user_id,
+        "agent_id": agent_id,
+        "usage_type": usage_type,
+        "tokens_used": tokens_used,
+        "model": model,
+        "task_id": task_id,
+        "extra_data": json.dumps(extra_data) if extra_data else None,
+        "created_at": created_at or datetime.utcnow(),
+    }
+
+
+def _dump_row(row: dict) -> str:
+    return json.dumps({
+        **row,
+        "id": str(row["id"]),
+        "user_id": str(row["user_id"]),
+        "agent_id": str(row["agent_id"]),
+        "usage_type": TokenUsageType(row["usage_type"]).value,
+        "created_at": row["created_at"].isoformat(),
+    })
+
+
+def _load_row(line: str) -> dict:
+    row = json.loads(line)
+    row["id"] = UUID(row["id"])
+    row["user_id"] = UUID(row["user_id"])
+    row["agent_id"] = UUID(row["agent_id"])
+    row["usage_type"] = TokenUsageType(row["usage_type"])
+    row["created_at"] = datetime.fromisoformat(row["created_at"])
+    return row
+
+
+class UsageWriter:
+    """
+    Buffer TokenUsage rows in memory and insert them in bulk.
+
+    record() is synchronous and never touches the database. A background
+    task flushes the buffer with multi-row INSERTs whenever max_batch rows
+    are waiting or every flush_interval seconds, and close() flushes what
+    is left on shutdown.
+
+    With a spool_path, every row is also appended to a local spool file
+    before it is buffered. Each flush rotates the spool into a segment
+    that is deleted once its rows are committed, so rows survive a crash
+    and are inserted by the next writer started on the same path. If the
+    database is unavailable, or more than max_buffer rows pile up, the
+    spool becomes the source of truth and later flushes replay it (rows
+    carry their primary key, so a replay never inserts a row twice).
+    Without a spool, rows beyond max_buffer are dropped and counted.
+
+    With rollups enabled, each batch also updates the minute, hour and
+    day rollups (see delta.core.rollups) in the same transaction. With a
+    UsageLog, every row is also appended to the audit segments as it is
+    recorded, independently of the database.
+
+    Usage:
+        writer = UsageWriter(engine, spool_path="/var/lib/delta/usage.spool")
+        await writer.start()
+        writer.record(usage_row(user_id, agent_id, TokenUsageType.TOOL_EXECUTION, 5))
+        await writer.close()
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        max_batch: int = 500,
+        flush_interval: float = 1.0,
+        max_buffer: int = 10_000,
+        spool_path: Optional[str] = None,
+        rollups: bool = True,
+        log: Optional[UsageLog] = None,
+    ):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.spool_path = Path(spool_path) if spool_path else None
+        self.rollups = rollups
+        self.log = log
+
+        self._buffer: deque = deque()
+        self._from_spool = False  # Spool holds rows the buffer does not
+        self._unbuffered = 0  # Rows only in the active spool since the last rotation
+        self._spool = None
+        self._segments: list[Path] = []
+        self._next_segment = 0
+
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters
+        self.written = 0
+        self.flushes = 0
+        self.failures = 0
+        self.spilled = 0
+        self.dropped = 0
+
+    async def start(self):
+        """Pick up rows spooled by a previous run and start the flush loop."""
+        if self._task is not None:
+            return
+        if self.spool_path is not None:
+            self.spool_path.parent.mkdir(parents=True, exist_ok=True)
+            leftovers = sorted(
+                self.spool_path.parent.glob(self.spool_path.name + ".*"),
+                key=lambda p: int(p.suffix[1:]) if p.suffix[1:].isdigit() else -1,
+            )
+            self._segments = [p for p in leftovers if p.suffix[1:].isdigit()]
+            if self._segments:
+                self._next_segment = int(self._segments[-1].suffix[1:]) + 1
+            has_active = self.spool_path.exists() and self.spool_path.stat().st_size > 0
+            self._from_spool = bool(self._segments) or has_active
+            self._spool = open(self.spool_path, "a", encoding="utf-8")
+
+        if self._from_spool:
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Replaying usage spool failed; will retry")
+
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def record(self, row: dict):
+        """Queue a row for insertion (see usage_row)."""
+        if self.log is not None:
+            self.log.append(row)
+        if self._spool is not None:
+            self._spool.write(_dump_row(row) + "\n")
+            self._spool.flush()
+            if self._from_spool:
+                self._unbuffered += 1
+                return
+
+        if len(self._buffer) >= self.max_buffer:
+            if self._spool is not None:
+                # Everything is on disk; let the next flush replay the spool
+                self._from_spool = True
+                self._unbuffered += len(self._buffer) + 1
+                self._buffer.clear()
+                self.spilled += 1
+            else:
+                self.dropped += 1
+            self._wake.set()
+            return
+
+        self._buffer.append(row)
+        if len(self._buffer) >= self.max_batch:
+            self._wake.set()
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    async def flush(self) -> int:
+        """Insert everything recorded so far. Returns the number of rows written."""
+        async with self._lock:
+            if self.log is not None:
+                self.log.flush()
+            self._rotate_spool()
+
+            from_spool = self._from_spool
+            pending = list(self._buffer)
+            self._buffer.clear()
+            # A replay streams the segments max_batch rows at a time
+            batches = self._read_segments() if from_spool else [pending]
+
+            written = 0
+            try:
+                for rows in batches:
+                    if rows:
+                        await self._insert(rows, skip_existing=from_spool)
+                        written += len(rows)
+            except Exception:
+                self.failures += 1
+                if self._spool is not None:
+                    self._from_spool = True
+                else:
+                    # Put the rows back in front of anything recorded meanwhile
+                    keep = pending[: max(0, self.max_buffer - len(self._buffer))]
+                    self.dropped += len(pending) - len(keep)
+                    self._buffer.extendleft(reversed(keep))
+                raise
+
+            for segment in self._segments:
+                segment.unlink(missing_ok=True)
+            self._segments = []
+            # Rows recorded to the spool alone during a replay still need one
+            self._from_spool = self._unbuffered > 0
+            self.written += written
+            self.flushes += 1
+            return written
+
+    async def close(self):
+        """Stop the flush loop and flush remaining rows."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Final usage flush failed; rows remain in the spool")
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        if self.log is not None:
+            self.log.close()
+
+    def get_stats(self) -> dict:
+        """Get writer statistics."""
+        return {
+            "buffered": len(self._buffer),
+            "written": self.written,
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "spilled": self.spilled,
+            "dropped": self.dropped,
+            "replaying_spool": self._from_spool,
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Usage flush failed; will retry")
+
+    def _rotate_spool(self):
+        """Move the active spool aside as a segment owned by this flush."""
+        if self._spool is None or self._spool.tell() == 0:
+            return
+        self._spool.close()
+        segment = self.spool_path.with_name(f"{self.spool_path.name}.{self._next_segment}")
+        self._next_segment += 1
+        os.replace(self.spool_path, segment)
+        self._segments.append(segment)
+        self._unbuffered = 0
+        self._spool = open(self.spool_path, "a", encoding="utf-8")
+
+    def _read_segments(self) -> Iterator[list[dict]]:
+        """Spooled rows in batches of up to max_batch, read lazily."""
+        rows = []
+        for segment in self._segments:
+            with open(segment, encoding="utf-8") as f:
+                for line in f:
+                    if line.endswith("\n"):  # A torn last line was never acknowledged
+                        rows.append(_load_row(line))
+                        if len(rows) >= self.max_batch:
+                            yield rows
+                            rows = []
+        if rows:
+            yield rows
+
+    async def _insert(self, rows: list[dict], skip_existing: bool = False):
+        table = TokenUsage.__table__
+        async with self.engine.begin() as conn:
+            for start in range(0, len(rows), self.max_batch):
+                chunk = rows[start:start + self.max_batch]
+                if skip_existing:
+                    chunk = await self._missing(conn, chunk)
+                    if not chunk:
+                        continue
+                await conn.execute(insert(table), chunk)
+                if self.rollups:
+                    await apply_rollups(conn, chunk)
+
+    async def _missing(self, conn, rows: list[dict]) -> list[dict]:
+        """Rows whose ids are not in the table yet (spool replays)."""
+        ids = [row["id"] for row in rows]
+        result = await conn.execute(select(TokenUsage.id).where(TokenUsage.id.in_(ids)))
+        existing = set(result.scalars())
+        return [row for row in rows if row["id"] not in existing]
+
+
+_usage_writer: Optional[UsageWriter] = None
+
+
+def get_usage_writer() -> UsageWriter:
+    """Get the shared usage writer (the API lifespan starts it)."""
+    global _usage_writer
+    if _usage_writer is None:
+        settings = get_settings()
+        _usage_writer = UsageWriter(
+            get_engine(),
+            max_batch=settings.usage_flush_batch_size,
+            flush_interval=settings.usage_flush_interval_seconds,
+            max_buffer=settings.usage_buffer_size,
+            spool_path=settings.usage_spool_path or None,
+            rollups=settings.usage_rollups_enabled,
+            log=UsageLog(settings.usage_log_dir) if settings.usage_log_dir else None,
+        )
+        get_metrics().add_collector("usage_writer", _usage_writer.get_stats)
+    return _usage_writer
+
+
+async def close_usage_writer():
+    """Flush and close the shared usage writer if one was created."""
+    global _usage_writer
+    if _usage_writer is not None:
+        await _usage_writer.close()
+        get_metrics().remove_collector("usage_writer")
+        _usage_writer = None
@@ -0,0 +1,49 @@
+"""The process-wide database engine and session factory."""
+
+from typing import AsyncIterator, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+
+from delta.config import get_settings
+
+_engine: Optional[AsyncEngine] = None
+_session_factory: Optional[async_sessionmaker[AsyncSession]] = None
+
+
+def get_engine() -> AsyncEngine:
+    """Get the shared engine for DATABASE_URL, so a process holds one connection pool."""
+    global _engine
+    if _engine is None:
+        settings = get_settings()
+        options = {}
+        if not settings.database_url.startswith("sqlite"):
+            options = {
+                "pool_size": settings.database_pool_size,
+                "max_overflow": settings.database_max_overflow,
+                "pool_pre_ping": True,
+            }
+        _engine = create_async_engine(settings.database_url, **options)
+    return _engine
+
+
+def get_session_factory() -> async_sessionmaker[AsyncSession]:
+    """Get the shared session factory bound to the shared engine."""
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = async_sessionmaker(get_engine(), expire_on_commit=False)
+    return _session_factory
+
+
+async def get_session() -> AsyncIterator[AsyncSession]:
+    """FastAPI dependency: a session on the shared engine for one request."""
+    async with get_session_factory()() as session:
+        yield session
+
+
+async def close_engine():
+    """Dispose the shared engine if one was created (after everything using it is closed)."""
+    global _engine, _session_factory
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
+        _session_factory = None
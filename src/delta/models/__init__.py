@@ -2,7 +2,7 @@
 
 from delta.models.user import User, UserTier, UserStatus
 from delta.models.agent import Agent, AgentType, AgentStatus
-from delta.models.token_usage import TokenUsage, TokenAllocation
+from delta.models.token_usage import TokenUsage, TokenAllocation, TokenUsageRollup
 from delta.models.message_log import MessageLog, MessageType, MessageStatus
 
 __all__ = [
@@ -14,6 +14,7 @@ __all__ = [
     "AgentStatus",
     "TokenUsage",
     "TokenAllocation",
+    "TokenUsageRollup",
     "MessageLog",
     "MessageType",
     "MessageStatus",
@@ -6,11 +6,14 @@ from typing import Optional
 from uuid import UUID, uuid4
 
 from pydantic import BaseModel
-from sqlalchemy import Column, DateTime, Enum as SQLEnum, ForeignKey, Integer, String, Text
+from sqlalchemy import BigInteger, Column, DateTime, Enum as SQLEnum, ForeignKey, Index, Integer, String, Text
 from sqlalchemy.dialects.postgresql import UUID as PGUUID
 
 from delta.models.user import Base
 
+# A token limit or budget with no cap (e.g. the enterprise tier)
+UNLIMITED = -1
+
 
 class TokenUsageType(str, Enum):
     """Types of token usage."""
@@ -68,6 +71,27 @@ class TokenAllocation(Base):
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
 
+class TokenUsageRollup(Base):
+    """Pre-aggregated token usage per minute, hour or day bucket."""
+    
+    __tablename__ = "token_usage_rollups"
+
+    granularity = Column(String(8), primary_key=True)  # "minute", "hour" or "day"
+    bucket_start = Column(DateTime, primary_key=True)
+    user_id = Column(PGUUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    agent_id = Column(PGUUID(as_uuid=True), ForeignKey("agents.id"), primary_key=True)
+    usage_type = Column(SQLEnum(TokenUsageType), primary_key=True)
+    model = Column(String(100), primary_key=True, default="")  # "" when no model
+    
+    # Aggregates
+    tokens_used = Column(BigInteger, nullable=False, default=0)
+    events = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        Index("ix_token_usage_rollups_user_bucket", "user_id", "granularity", "bucket_start"),
+    )
+
+
 # Pydantic Schemas
 
 class TokenUsageRecord(BaseModel):
@@ -6,7 +6,7 @@ from typing import Optional
 from uuid import UUID, uuid4
 
 from pydantic import BaseModel, EmailStr, Field
-from sqlalchemy import Boolean, Column, DateTime, Enum as SQLEnum, Integer, String, Text
+from sqlalchemy import Boolean, Column, DateTime, Enum as SQLEnum, ForeignKey, Integer, String, Text
 from sqlalchemy.dialects.postgresql import UUID as PGUUID
 from sqlalchemy.orm import DeclarativeBase, relationship
 
@@ -86,10 +86,10 @@ class APIKey(Base):
     __tablename__ = "api_keys"
 
     id = Column(PGUUID(as_uuid=True), primary_key=True, default=uuid4)
-    user_id = Column(PGUUID(as_uuid=True), nullable=False, index=True)
+    user_id = Column(PGUUID(as_uuid=True), ForeignKey("users.id"), nullable=False, index=True)
     
-    key_hash = Column(String(255), nullable=False, unique=True)
-    key_prefix = Column(String(12), nullable=False)  # First 8 chars for identification
+    key_hash = Column(String(255), nullable=False, unique=True)  # HMAC digest or Argon2 hash
+    key_prefix = Column(String(12), nullable=False, index=True)  # First 12 chars for lookup
     name = Column(String(255), nullable=False)
     
     # Permissions & Limits
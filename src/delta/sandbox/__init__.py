@@ -0,0 +1,133 @@
+"""Sandbox backends: where agents' workspaces live and their commands run."""
+
+import os
+import tempfile
+from typing import TYPE_CHECKING, Optional
+
+from delta.config import get_settings
+from delta.sandbox.base import WORKSPACE, SandboxDriver, SandboxError, SandboxNotFoundError
+
+if TYPE_CHECKING:
+    from delta.sandbox.checkpoint import Checkpointer
+    from delta.sandbox.pool import WarmPool
+
+__all__ = [
+    "WORKSPACE",
+    "SandboxDriver",
+    "SandboxError",
+    "SandboxNotFoundError",
+    "create_sandbox_driver",
+    "get_sandbox_driver",
+    "close_sandbox_driver",
+    "get_warm_pool",
+    "close_warm_pool",
+    "get_checkpointer",
+    "close_checkpointer",
+]
+
+
+def create_sandbox_driver(name: str) -> SandboxDriver:
+    """Build the driver called name ("noop", "local" or "fly") from settings."""
+    settings = get_settings()
+    if name == "noop":
+        from delta.sandbox.noop import NoopDriver
+        return NoopDriver()
+    if name == "local":
+        from delta.sandbox.local import LocalProcessDriver
+        return LocalProcessDriver(
+            settings.sandbox_local_root or None,
+            isolate_network=settings.sandbox_local_isolate_network,
+        )
+    if name == "fly":
+        from delta.sandbox.fly import FlyMachinesDriver
+        return FlyMachinesDriver(settings.fly_api_token, settings.fly_app_name, settings.fly_region)
+    raise ValueError(f"Unknown sandbox driver: {name}")
+
+
+_sandbox_driver: Optional[SandboxDriver] = None
+
+
+def get_sandbox_driver() -> SandboxDriver:
+    """Get the shared driver selected by SANDBOX_DRIVER."""
+    global _sandbox_driver
+    if _sandbox_driver is None:
+        _sandbox_driver = create_sandbox_driver(get_settings().sandbox_driver)
+    return _sandbox_driver
+
+
+async def close_sandbox_driver():
+    """Close the shared driver if one was created."""
+    global _sandbox_driver
+    if _sandbox_driver is not None:
+        await _sandbox_driver.close()
+        _sandbox_driver = None
+
+
+_warm_pool: Optional["WarmPool"] = None
+
+
+def get_warm_pool() -> Optional["WarmPool"]:
+    """Get the shared warm pool over the shared driver, or None if WARM_POOL_ENABLED is off."""
+    global _warm_pool
+    settings = get_settings()
+    if _warm_pool is None and settings.warm_pool_enabled:
+        from delta.core.metrics import get_metrics
+        from delta.sandbox.pool import Shape, WarmPool
+
+        _warm_pool = WarmPool(
+            get_sandbox_driver(),
+            shapes=[Shape.parse(shape) for shape in settings.warm_pool_shapes.split(",") if shape.strip()],
+            min_idle=settings.warm_pool_min_idle,
+            max_idle=settings.warm_pool_max_idle,
+            window_seconds=settings.warm_pool_window_seconds,
+        )
+        get_metrics().add_collector("warm_pool", _warm_pool.get_stats)
+    return _warm_pool
+
+
+async def close_warm_pool():
+    """Stop the shared warm pool and destroy its idle sandboxes, if one was created."""
+    global _warm_pool
+    if _warm_pool is not None:
+        await _warm_pool.close()
+        from delta.core.metrics import get_metrics
+        get_metrics().remove_collector("warm_pool")
+        _warm_pool = None
+
+
+_checkpointer: Optional["Checkpointer"] = None
+
+
+def get_checkpointer() -> Optional["Checkpointer"]:
+    """Get the shared workspace checkpointer, or None if CHECKPOINT_STORE is unset."""
+    global _checkpointer
+    settings = get_settings()
+    if _checkpointer is None and settings.checkpoint_store:
+        from delta.core.metrics import get_metrics
+        from delta.sandbox.checkpoint import Checkpointer
+        from delta.sandbox.chunk_store import LocalChunkStore, S3ChunkStore
+
+        if settings.checkpoint_store == "r2":
+            store = S3ChunkStore(
+                settings.r2_bucket_name,
+                endpoint_url=settings.r2_endpoint,
+                access_key_id=settings.r2_access_key_id,
+                secret_access_key=settings.r2_secret_access_key,
+            )
+        else:
+            store = LocalChunkStore(
+                settings.checkpoint_local_dir or os.path.join(tempfile.gettempdir(), "delta-checkpoints")
+            )
+        _checkpointer = Checkpointer(store, workers=settings.checkpoint_workers)
+        get_metrics().add_collector("checkpoints", _checkpointer.get_stats)
+    return _checkpointer
+
+
+async def close_checkpointer():
+    """Wait for restores in progress and drop the shared checkpointer, if one was created."""
+    global _checkpointer
+    if _checkpointer is not None:
+        await _checkpointer.close()
+        from delta.core.metrics import get_metrics
+        get_metrics().remove_collector("checkpoints")
+        _checkpointer = None
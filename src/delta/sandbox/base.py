@@ -0,0 +1,107 @@
+"""Sandbox driver interface."""
+
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import AsyncIterator, Optional
+from uuid import UUID
+
+
+# Where a sandbox's files live, as seen by its commands
+WORKSPACE = "/workspace"
+
+
+class SandboxError(Exception):
+    """Raised when a sandbox operation cannot be carried out."""
+    pass
+
+
+class SandboxNotFoundError(SandboxError):
+    """Raised when a sandbox does not exist (or no longer exists)."""
+    pass
+
+
+class SandboxDriver(ABC):
+    """
+    Backend that provisions sandboxes and runs commands in them.
+
+    Sandboxes are addressed by the id of the agent that owns them. Drivers
+    keep whatever backend identifiers they need (machine ids, directories)
+    themselves; create() returns the ones worth storing on the agent.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    async def create(
+        self,
+        sandbox_id: UUID,
+        template: str = "python-3.12",
+        memory_mb: int = 512,
+        cpu_cores: int = 1,
+    ) -> dict:
+        """Provision and boot a sandbox. Returns backend fields for the agent record."""
+
+    @abstractmethod
+    async def pause(self, sandbox_id: UUID):
+        """Suspend a sandbox, keeping its workspace."""
+
+    @abstractmethod
+    async def resume(self, sandbox_id: UUID):
+        """Resume a paused sandbox."""
+
+    @abstractmethod
+    async def destroy(self, sandbox_id: UUID):
+        """Stop a sandbox and release everything it holds."""
+
+    @abstractmethod
+    def exec_stream(
+        self,
+        sandbox_id: UUID,
+        command: str,
+        working_dir: str = "/workspace",
+        timeout_seconds: int = 300,
+        env_vars: Optional[dict[str, str]] = None,
+    ) -> AsyncIterator[dict]:
+        """Run a shell command, yielding delta.core.exec_stream events."""
+
+    async def exec(
+        self,
+        sandbox_id: UUID,
+        command: str,
+        working_dir: str = "/workspace",
+        timeout_seconds: int = 300,
+        env_vars: Optional[dict[str, str]] = None,
+    ) -> dict:
+        """Run a shell command and collect its whole output."""
+        output = {"stdout": [], "stderr": []}
+        result = {"exit_code": None, "duration_ms": 0, "timed_out": False}
+        async for event in self.exec_stream(
+            sandbox_id, command, working_dir, timeout_seconds, env_vars
+        ):
+            if event["stream"] == "exit":
+                result.update(
+                    exit_code=event["exit_code"],
+                    duration_ms=event["duration_ms"],
+                    timed_out=event.get("timed_out", False),
+                )
+            else:
+                output[event["stream"]].append(event["data"])
+        result["stdout"] = "".join(output["stdout"])
+        result["stderr"] = "".join(output["stderr"])
+        return result
+
+    async def check(self, sandbox_id: UUID):
+        """
+        Raise unless the sandbox can run commands now.
+
+        SandboxNotFoundError if it does not exist, SandboxError if it exists
+        but cannot run commands (e.g. it is paused). Lets callers report the
+        error before they start streaming a response.
+        """
+
+    def workspace_path(self, sandbox_id: UUID) -> Optional[Path]:
+        """Host directory holding the sandbox's /workspace, if this driver has one."""
+        return None
+
+    async def close(self):
+        """Release driver resources such as HTTP clients."""
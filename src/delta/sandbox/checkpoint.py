@@ -0,0 +1,345 @@
+"""Incremental workspace checkpoints and lazy restores."""
+
+import asyncio
+import json
+import logging
+import os
+import stat
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+from uuid import UUID
+
+from delta.sandbox.base import SandboxError
+from delta.sandbox.chunk_store import ChunkStore
+from delta.sandbox.chunking import MASK_BITS, MAX_CHUNK, MIN_CHUNK, chunk_key, iter_chunks
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+LATEST = "latest.json"
+RESTORE_PREFIX = ".restore-"  # Files a LazyRestore is still writing
+
+
+class LazyRestore:
+    """
+    A workspace being rebuilt from a checkpoint manifest.
+
+    start() creates the directories and symlinks, then fills in files on
+    a thread pool, smallest first. ensure(path) fetches a file, or the
+    files under a directory, right away if they are not there yet, so
+    reading a file or running a command in a directory does not wait for
+    the whole workspace; wait() returns once every file is in place.
+    Each file is written under a temporary name and hard-linked into
+    place, so a path is either absent or complete, and a file the sandbox
+    writes before its turn comes is kept rather than overwritten.
+    """
+
+    def __init__(self, store: ChunkStore, manifest: dict, target: Path, workers: int = 8):
+        self.store = store
+        self.manifest = manifest
+        self.target = target
+        self._files: Dict[str, dict] = manifest["files"]
+        self._locks = {rel: threading.Lock() for rel in self._files}
+        self._done: set[str] = set()
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="restore")
+        self._futures: list[Future] = []
+        self._stats_lock = threading.Lock()
+
+        # Counters
+        self.files_restored = 0
+        self.chunks_fetched = 0
+        self.bytes_fetched = 0
+
+    @property
+    def complete(self) -> bool:
+        return len(self._done) == len(self._files)
+
+    def start(self):
+        """Lay out directories and symlinks and start fetching files in the background."""
+        self.target.mkdir(parents=True, exist_ok=True)
+        for entry in self.manifest["dirs"]:
+            (self.target / entry["path"]).mkdir(parents=True, exist_ok=True)
+        for rel, link in self.manifest["symlinks"].items():
+            path = self.target / rel
+            if not path.is_symlink():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.symlink(link, path)
+        for rel in sorted(self._files, key=lambda rel: self._files[rel]["size"]):
+            self._futures.append(self._pool.submit(self._materialize, rel))
+
+    def _materialize(self, rel: str):
+        with self._locks[rel]:
+            if rel in self._done:
+                return
+            entry = self._files[rel]
+            path = self.target / rel
+            if os.path.lexists(path):
+                self._done.add(rel)  # Written by the sandbox since the restore started
+                return
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=RESTORE_PREFIX)
+            fetched = 0
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for key, _ in entry["chunks"]:
+                        data = self.store.get(key)
+                        f.write(data)
+                        fetched += len(data)
+                os.chmod(tmp, entry["mode"])
+                os.utime(tmp, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+                try:
+                    os.link(tmp, path)  # Unlike a rename, never replaces what the sandbox wrote
+                except FileExistsError:
+                    pass
+            finally:
+                os.unlink(tmp)
+            self._done.add(rel)
+        with self._stats_lock:
+            self.files_restored += 1
+            self.chunks_fetched += len(entry["chunks"])
+            self.bytes_fetched += fetched
+
+    async def ensure(self, path: str, recursive: bool = True):
+        """
+        Make sure the file at path (relative to the workspace) is restored.
+
+        For a directory, every file under it is fetched in parallel (only
+        its own entries unless recursive).
+        """
+        rel = os.path.normpath(path.lstrip("/"))
+        prefix = "" if rel == "." else rel + "/"
+        missing = [
+            name for name in self._files
+            if name not in self._done and (
+                name == rel
+                or (name.startswith(prefix) and (recursive or "/" not in name[len(prefix):]))
+            )
+        ]
+        if missing:
+            await asyncio.gather(*(asyncio.to_thread(self._materialize, name) for name in missing))
+
+    async def wait(self):
+        """Wait for every file, then apply directory modes."""
+        try:
+            await asyncio.gather(*(asyncio.wrap_future(future) for future in self._futures))
+        finally:
+            self._pool.shutdown(wait=False)
+        for entry in self.manifest["dirs"]:
+            os.chmod(self.target / entry["path"], entry["mode"])
+
+    def get_stats(self) -> dict:
+        return {
+            "files": len(self._files),
+            "files_restored": self.files_restored,
+            "chunks_fetched": self.chunks_fetched,
+            "bytes_fetched": self.bytes_fetched,
+        }
+
+
+class Checkpointer:
+    """
+    Snapshot sandbox workspaces into a ChunkStore, uploading only what changed.
+
+    A checkpoint records every directory, symlink and regular file of the
+    workspace in a JSON manifest; file contents are split into
+    content-defined chunks (delta.sandbox.chunking) stored by content
+    hash. Checkpoints are incremental in two ways: files whose size and
+    mtime match the previous manifest are not read at all, and only
+    chunks the store does not already have are uploaded. Editing a few
+    lines of a large file uploads a chunk or two, not the file.
+
+    restore() rebuilds a workspace from the latest (or a named) manifest
+    lazily with a LazyRestore; ensure() fetches the files under one path
+    of a sandbox's pending restore ahead of the rest, ready() waits for
+    all of it, and get_restore() gives access to the restore itself.
+
+    Usage:
+        checkpoints = Checkpointer(LocalChunkStore("/var/lib/delta/checkpoints"))
+        manifest = await checkpoints.checkpoint(agent_id, workspace)
+        restore = await checkpoints.restore(agent_id, workspace)
+        await restore.ensure("src/main.py")
+    """
+
+    def __init__(
+        self,
+        store: ChunkStore,
+        workers: int = 8,
+        min_size: int = MIN_CHUNK,
+        mask_bits: int = MASK_BITS,
+        max_size: int = MAX_CHUNK,
+    ):
+        self.store = store
+        self.workers = workers
+        self.min_size = min_size
+        self.mask_bits = mask_bits
+        self.max_size = max_size
+        self._restores: Dict[UUID, LazyRestore] = {}
+
+        # Counters
+        self.checkpoints = 0
+        self.restores = 0
+        self.chunks_uploaded = 0
+        self.bytes_uploaded = 0
+
+    def latest(self, sandbox_id: UUID, name: str = LATEST) -> Optional[dict]:
+        """The sandbox's latest (or named) manifest, if it has one."""
+        data = self.store.get_manifest(str(sandbox_id), name)
+        return json.loads(data) if data else None
+
+    async def checkpoint(self, sandbox_id: UUID, workspace: Path) -> dict:
+        """Snapshot workspace; returns the manifest, with upload stats under "stats"."""
+        manifest = await asyncio.to_thread(self._checkpoint, sandbox_id, Path(workspace))
+        self.checkpoints += 1
+        self.chunks_uploaded += manifest["stats"]["chunks_uploaded"]
+        self.bytes_uploaded += manifest["stats"]["bytes_uploaded"]
+        return manifest
+
+    def _checkpoint(self, sandbox_id: UUID, workspace: Path) -> dict:
+        start = time.monotonic()
+        parent = self.latest(sandbox_id)
+        previous = parent["files"] if parent else {}
+        # Chunks the last checkpoint stored need no existence check
+        known = {key for entry in previous.values() for key, _ in entry["chunks"]}
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "id": datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ"),
+            "sandbox_id": str(sandbox_id),
+            "parent": parent["id"] if parent else None,
+            "created_at": datetime.utcnow().isoformat(),
+            "dirs": [],
+            "symlinks": {},
+            "files": {},
+        }
+        stats = {
+            "files_read": 0,
+            "files_reused": 0,
+            "bytes_read": 0,
+            "chunks": 0,
+            "chunks_uploaded": 0,
+            "bytes_uploaded": 0,
+        }
+        stats_lock = threading.Lock()
+        in_flight = threading.BoundedSemaphore(self.workers * 2)  # Bounds chunk data held
+        uploads: list[Future] = []
+
+        def upload(key: str, data: bytes):
+            try:
+                if not self.store.has(key):
+                    self.store.put(key, data)
+                    with stats_lock:
+                        stats["chunks_uploaded"] += 1
+                        stats["bytes_uploaded"] += len(data)
+            finally:
+                in_flight.release()
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="checkpoint") as pool:
+            for root, dirs, files in os.walk(workspace):
+                dirs.sort()
+                for name in dirs + sorted(files):
+                    path = os.path.join(root, name)
+                    rel = os.path.relpath(path, workspace)
+                    st = os.lstat(path)
+                    if stat.S_ISLNK(st.st_mode):
+                        manifest["symlinks"][rel] = os.readlink(path)
+                    elif stat.S_ISDIR(st.st_mode):
+                        manifest["dirs"].append({"path": rel, "mode": stat.S_IMODE(st.st_mode)})
+                    elif stat.S_ISREG(st.st_mode):
+                        if name.startswith(RESTORE_PREFIX):
+                            continue  # A LazyRestore's partial file
+                        entry = previous.get(rel)
+                        if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+                            stats["files_reused"] += 1
+                            chunks = entry["chunks"]
+                        else:
+                            stats["files_read"] += 1
+                            chunks = []
+                            with open(path, "rb") as f:
+                                for data in iter_chunks(f, self.min_size, self.mask_bits, self.max_size):
+                                    key = chunk_key(data)
+                                    chunks.append([key, len(data)])
+                                    stats["bytes_read"] += len(data)
+                                    if key not in known:
+                                        known.add(key)
+                                        in_flight.acquire()
+                                        uploads.append(pool.submit(upload, key, data))
+                        stats["chunks"] += len(chunks)
+                        manifest["files"][rel] = {
+                            "mode": stat.S_IMODE(st.st_mode),
+                            "size": st.st_size,
+                            "mtime_ns": st.st_mtime_ns,
+                            "chunks": chunks,
+                        }
+                    # Sockets, FIFOs and devices are not checkpointed
+                dirs[:] = [name for name in dirs if not os.path.islink(os.path.join(root, name))]
+            for future in uploads:
+                future.result()  # Never write a manifest whose chunks failed to upload
+
+        stats["seconds"] = round(time.monotonic() - start, 3)
+        manifest["stats"] = stats
+        data = json.dumps(manifest, separators=(",", ":")).encode()
+        self.store.put_manifest(str(sandbox_id), f"{manifest['id']}.json", data)
+        self.store.put_manifest(str(sandbox_id), LATEST, data)
+        logger.info(
+            "Checkpointed %s: %d files read, %d reused, %d/%d chunks uploaded (%d bytes) in %.2fs",
+            sandbox_id, stats["files_read"], stats["files_reused"], stats["chunks_uploaded"],
+            stats["chunks"], stats["bytes_uploaded"], stats["seconds"],
+        )
+        return manifest
+
+    async def restore(
+        self,
+        sandbox_id: UUID,
+        workspace: Path,
+        manifest_id: Optional[str] = None,
+    ) -> LazyRestore:
+        """Start restoring the latest (or the named) checkpoint into workspace."""
+        name = f"{manifest_id}.json" if manifest_id else LATEST
+        manifest = await asyncio.to_thread(self.latest, sandbox_id, name)
+        if manifest is None:
+            raise SandboxError(f"No checkpoint {name} for sandbox {sandbox_id}")
+        restore = LazyRestore(self.store, manifest, Path(workspace), self.workers)
+        await asyncio.to_thread(restore.start)
+        self._restores[sandbox_id] = restore
+        self.restores += 1
+        return restore
+
+    def get_restore(self, sandbox_id: UUID) -> Optional[LazyRestore]:
+        """The sandbox's restore if one is still in progress."""
+        return self._restores.get(sandbox_id)
+
+    async def ensure(self, sandbox_id: UUID, path: str, recursive: bool = True):
+        """Restore the files at path first if the sandbox has a pending restore."""
+        restore = self._restores.get(sandbox_id)
+        if restore is not None:
+            await restore.ensure(path, recursive)
+
+    async def ready(self, sandbox_id: UUID):
+        """Wait until the sandbox's pending restore, if any, has finished."""
+        restore = self._restores.get(sandbox_id)
+        if restore is not None:
+            await restore.wait()
+            if self._restores.get(sandbox_id) is restore:
+                del self._restores[sandbox_id]
+
+    async def close(self):
+        """Let restores in progress finish, so no workspace is left half-written."""
+        for sandbox_id in list(self._restores):
+            try:
+                await self.ready(sandbox_id)
+            except Exception:
+                logger.exception("Restore of sandbox %s failed", sandbox_id)
+
+    def get_stats(self) -> dict:
+        """Get checkpoint statistics."""
+        return {
+            "checkpoints": self.checkpoints,
+            "restores": self.restores,
+            "restores_in_progress": len(self._restores),
+            "chunks_uploaded": self.chunks_uploaded,
+            "bytes_uploaded": self.bytes_uploaded,
+        }
@@ -0,0 +1,166 @@
+"""Content-addressed chunk and manifest storage for workspace checkpoints."""
+
+import os
+import tempfile
+import zlib
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# Chunks are compressed at rest; level 1 keeps checkpoints I/O-bound
+COMPRESS_LEVEL = 1
+
+
+class ChunkStore(ABC):
+    """
+    Where checkpoint chunks (by content key) and manifests (by sandbox) live.
+
+    Methods are blocking; the checkpointer calls them from worker threads.
+    Chunks are immutable, so put() of an existing key may be skipped and
+    concurrent puts of one key are harmless.
+    """
+
+    @abstractmethod
+    def has(self, key: str) -> bool:
+        """Whether a chunk is stored."""
+
+    @abstractmethod
+    def put(self, key: str, data: bytes):
+        """Store a chunk."""
+
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        """Read a chunk."""
+
+    @abstractmethod
+    def put_manifest(self, sandbox_id: str, name: str, data: bytes):
+        """Store a manifest, replacing any of the same name."""
+
+    @abstractmethod
+    def get_manifest(self, sandbox_id: str, name: str) -> Optional[bytes]:
+        """Read a manifest, or None if there is none of that name."""
+
+
+class LocalChunkStore(ChunkStore):
+    """
+    Chunks and manifests as files under root_dir.
+
+    Layout: chunks/<key[:2]>/<key> (zlib-compressed) and
+    manifests/<sandbox_id>/<name>. Writes go to a temporary file renamed
+    into place, so readers never see a partial chunk.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root = Path(root_dir)
+        (self.root / "chunks").mkdir(parents=True, exist_ok=True)
+        (self.root / "manifests").mkdir(parents=True, exist_ok=True)
+
+    def _chunk_path(self, key: str) -> Path:
+        return self.root / "chunks" / key[:2] / key
+
+    def has(self, key: str) -> bool:
+        return self._chunk_path(key).exists()
+
+    def put(self, key: str, data: bytes):
+        self._write(self._chunk_path(key), zlib.compress(data, COMPRESS_LEVEL))
+
+    def get(self, key: str) -> bytes:
+        return zlib.decompress(self._chunk_path(key).read_bytes())
+
+    def put_manifest(self, sandbox_id: str, name: str, data: bytes):
+        self._write(self.root / "manifests" / sandbox_id / name, data)
+
+    def get_manifest(self, sandbox_id: str, name: str) -> Optional[bytes]:
+        try:
+            return (self.root / "manifests" / sandbox_id / name).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+class S3ChunkStore(ChunkStore):
+    """
+    Chunks and manifests as objects in an S3-compatible bucket (Cloudflare R2).
+
+    Keys: <prefix>chunks/<key> (zlib-compressed) and
+    <prefix>manifests/<sandbox_id>/<name>.
+
+    Usage:
+        store = S3ChunkStore(
+            settings.r2_bucket_name,
+            endpoint_url=settings.r2_endpoint,
+            access_key_id=settings.r2_access_key_id,
+            secret_access_key=settings.r2_secret_access_key,
+        )
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        endpoint_url: Optional[str] = None,
+        access_key_id: Optional[str] = None,
+        secret_access_key: Optional[str] = None,
+        prefix: str = "checkpoints/",
+        client=None,
+    ):
+        if client is None:
+            client = boto3.client(
+                "s3",
+                endpoint_url=endpoint_url or None,
+                aws_access_key_id=access_key_id or None,
+                aws_secret_access_key=secret_access_key or None,
+                region_name="auto" if endpoint_url else None,
+                config=Config(max_pool_connections=32, retries={"mode": "adaptive"}),
+            )
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def has(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=f"{self.prefix}chunks/{key}")
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def put(self, key: str, data: bytes):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}chunks/{key}",
+            Body=zlib.compress(data, COMPRESS_LEVEL),
+        )
+
+    def get(self, key: str) -> bytes:
+        response = self.client.get_object(Bucket=self.bucket, Key=f"{self.prefix}chunks/{key}")
+        return zlib.decompress(response["Body"].read())
+
+    def put_manifest(self, sandbox_id: str, name: str, data: bytes):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}manifests/{sandbox_id}/{name}",
+            Body=data,
+            ContentType="application/json",
+        )
+
+    def get_manifest(self, sandbox_id: str, name: str) -> Optional[bytes]:
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket, Key=f"{self.prefix}manifests/{sandbox_id}/{name}"
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return response["Body"].read()
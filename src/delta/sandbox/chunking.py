@@ -0,0 +1,111 @@
+"""Content-defined chunking of byte streams for deduplicated workspace checkpoints."""
+
+import hashlib
+from typing import BinaryIO, Iterator
+
+try:
+    import numpy as np
+except ImportError:  # Optional; the pure-Python scan finds the same boundaries
+    np = None
+
+MIN_CHUNK = 16 * 1024
+MASK_BITS = 16  # A boundary every 2**16 bytes on average past MIN_CHUNK
+MAX_CHUNK = 256 * 1024
+BLOCK_SIZE = 1024 * 1024
+
+WINDOW = 32  # Bytes that decide whether a position is a boundary
+_HASH_MASK = (1 << WINDOW) - 1
+
+# Gear table: one fixed pseudo-random 32-bit value per byte value
+GEAR = [
+    int.from_bytes(hashlib.blake2b(bytes([i]), digest_size=4).digest(), "little")
+    for i in range(256)
+]
+_GEAR_ARRAY = np.array(GEAR, dtype=np.uint32) if np is not None else None
+
+
+def chunk_key(data: bytes) -> str:
+    """Content address of a chunk."""
+    return hashlib.blake2b(data, digest_size=32).hexdigest()
+
+
+def _candidates_numpy(context: bytes, block: bytes, mask_bits: int, offset: int) -> list[int]:
+    """Boundary candidates in block, as absolute end offsets (block starts at offset)."""
+    data = np.frombuffer(context + block, dtype=np.uint8)
+    h = _GEAR_ARRAY[data]
+    # h[i] = sum(gear[data[i - k]] << k for k < 32), built by doubling the window
+    width = 1
+    while width < WINDOW:
+        shifted = h[:-width] << np.uint32(width)
+        h[width:] += shifted
+        width *= 2
+    hits = np.flatnonzero((h >> np.uint32(WINDOW - mask_bits)) == 0)
+    hits = hits[hits >= len(context)]
+    return (hits + (offset - len(context) + 1)).tolist()
+
+
+def _candidates_python(block: bytes, mask_bits: int, offset: int, h: int) -> tuple[list[int], int]:
+    shift = WINDOW - mask_bits
+    gear = GEAR
+    hits = []
+    for i, byte in enumerate(block):
+        h = ((h << 1) + gear[byte]) & _HASH_MASK
+        if not h >> shift:
+            hits.append(offset + i + 1)
+    return hits, h
+
+
+def iter_chunks(
+    stream: BinaryIO,
+    min_size: int = MIN_CHUNK,
+    mask_bits: int = MASK_BITS,
+    max_size: int = MAX_CHUNK,
+    block_size: int = BLOCK_SIZE,
+) -> Iterator[bytes]:
+    """
+    Split a stream into chunks whose boundaries depend only on nearby content.
+
+    A position is a boundary when the gear hash of the 32 bytes before it
+    has its top mask_bits bits clear; chunks are cut at the first boundary
+    at least min_size bytes in, or at max_size if none comes. Because a
+    boundary depends only on its window, an insert or delete shifts the
+    boundaries after it along with the data, and every chunk past the
+    edit is the same as before, so only chunks around the edit are new.
+
+    The scan is vectorised with NumPy when it is installed (the hash over
+    a block is built in log2(32) shifted adds) and falls back to a byte
+    loop; both cut at exactly the same places. At most one block plus one
+    chunk is held in memory.
+    """
+    start = 0  # Absolute offset of the chunk being built
+    offset = 0  # Absolute offset of the next block
+    pending = b""  # Bytes from start up to offset
+    context = b""
+    h = 0
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        if np is not None:
+            candidates = _candidates_numpy(context, block, mask_bits, offset)
+            context = (context + block)[-(WINDOW - 1):]
+        else:
+            candidates, h = _candidates_python(block, mask_bits, offset, h)
+
+        data = pending + block
+        base = start
+        for end in candidates:
+            while end - start > max_size:
+                yield data[start - base:start - base + max_size]
+                start += max_size
+            if end - start >= min_size:
+                yield data[start - base:end - base]
+                start = end
+        offset += len(block)
+        while offset - start > max_size:
+            yield data[start - base:start - base + max_size]
+            start += max_size
+        pending = data[start - base:]
+
+    if pending:
+        yield pending
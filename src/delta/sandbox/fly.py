@@ -0,0 +1,183 @@
+"""Sandboxes as Fly.io Machines."""
+
+import logging
+import re
+import shlex
+import time
+from typing import AsyncIterator, Dict, Optional
+from uuid import UUID
+
+import httpx
+
+from delta.sandbox.base import SandboxDriver, SandboxError, SandboxNotFoundError
+
+logger = logging.getLogger(__name__)
+
+FLY_API_URL = "https://api.machines.dev/v1"
+ENV_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# Image booted for each agent template
+TEMPLATE_IMAGES = {
+    "python-3.12": "python:3.12-slim",
+    "python-3.11": "python:3.11-slim",
+    "node-20": "node:20-slim",
+}
+
+
+class FlyMachinesDriver(SandboxDriver):
+    """
+    Run each sandbox as a Fly Machine in one app.
+
+    Machines are tagged with their sandbox id in metadata, so a driver
+    that did not create a machine (another worker, or after a restart)
+    finds it with one lookup. pause() suspends the machine (memory is
+    snapshotted) and resume() starts it again.
+
+    The Machines exec endpoint returns output only when the command ends,
+    so exec_stream() yields stdout and stderr as one chunk each.
+
+    Usage:
+        driver = FlyMachinesDriver(api_token, "delta-sandboxes", region="sjc")
+        fields = await driver.create(agent_id, template="python-3.12")
+    """
+
+    name = "fly"
+
+    def __init__(
+        self,
+        api_token: str,
+        app_name: str,
+        region: str = "sjc",
+        images: Optional[dict[str, str]] = None,
+        base_url: str = FLY_API_URL,
+        boot_timeout_seconds: int = 60,
+        client: Optional[httpx.AsyncClient] = None,
+    ):
+        if not api_token or not app_name:
+            raise SandboxError("The Fly driver needs FLY_API_TOKEN and FLY_APP_NAME")
+        self.app_name = app_name
+        self.region = region
+        self.images = images or TEMPLATE_IMAGES
+        self.boot_timeout_seconds = boot_timeout_seconds
+        self._client = client or httpx.AsyncClient(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {api_token}"},
+            timeout=30.0,
+        )
+        self._machines: Dict[UUID, str] = {}
+
+    async def _request(self, method: str, path: str, **kwargs) -> dict:
+        response = await self._client.request(method, f"/apps/{self.app_name}{path}", **kwargs)
+        if response.status_code == 404:
+            raise SandboxNotFoundError(f"Fly resource not found: {path}")
+        if response.is_error:
+            raise SandboxError(f"Fly API {method} {path} failed: {response.status_code} {response.text}")
+        return response.json() if response.content else {}
+
+    async def _machine_id(self, sandbox_id: UUID) -> str:
+        machine_id = self._machines.get(sandbox_id)
+        if machine_id is None:
+            machines = await self._request(
+                "GET", "/machines", params={"metadata.delta_sandbox_id": str(sandbox_id)}
+            )
+            if not machines:
+                raise SandboxNotFoundError(f"Sandbox {sandbox_id} not found")
+            machine_id = self._machines[sandbox_id] = machines[0]["id"]
+        return machine_id
+
+    async def create(
+        self,
+        sandbox_id: UUID,
+        template: str = "python-3.12",
+        memory_mb: int = 512,
+        cpu_cores: int = 1,
+    ) -> dict:
+        image = self.images.get(template)
+        if image is None:
+            raise SandboxError(f"Unknown template: {template}")
+        machine = await self._request("POST", "/machines", json={
+            "name": f"sandbox-{sandbox_id}",
+            "region": self.region,
+            "config": {
+                "image": image,
+                "guest": {"cpu_kind": "shared", "cpus": cpu_cores, "memory_mb": memory_mb},
+                "init": {"exec": ["sleep", "inf"]},
+                "restart": {"policy": "no"},
+                "metadata": {"delta_sandbox_id": str(sandbox_id)},
+            },
+        })
+        self._machines[sandbox_id] = machine["id"]
+        try:
+            await self._wait(machine["id"], "started")
+        except BaseException:
+            # A machine that never booted would otherwise be billed until found by hand
+            try:
+                await self.destroy(sandbox_id)
+            except Exception:
+                logger.exception("Could not destroy machine %s after a failed boot", machine["id"])
+            raise
+        return {"fly_machine_id": machine["id"], "fly_app_name": self.app_name}
+
+    async def _wait(self, machine_id: str, state: str):
+        await self._request(
+            "GET",
+            f"/machines/{machine_id}/wait",
+            params={"state": state, "timeout": self.boot_timeout_seconds},
+            timeout=self.boot_timeout_seconds + 10,
+        )
+
+    async def check(self, sandbox_id: UUID):
+        await self._machine_id(sandbox_id)
+
+    async def pause(self, sandbox_id: UUID):
+        await self._request("POST", f"/machines/{await self._machine_id(sandbox_id)}/suspend")
+
+    async def resume(self, sandbox_id: UUID):
+        machine_id = await self._machine_id(sandbox_id)
+        await self._request("POST", f"/machines/{machine_id}/start")
+        await self._wait(machine_id, "started")
+
+    async def destroy(self, sandbox_id: UUID):
+        machine_id = await self._machine_id(sandbox_id)
+        await self._request("DELETE", f"/machines/{machine_id}", params={"force": "true"})
+        self._machines.pop(sandbox_id, None)
+
+    async def exec_stream(
+        self,
+        sandbox_id: UUID,
+        command: str,
+        working_dir: str = "/workspace",
+        timeout_seconds: int = 300,
+        env_vars: Optional[dict[str, str]] = None,
+    ) -> AsyncIterator[dict]:
+        for name in env_vars or {}:
+            if not ENV_NAME.fullmatch(name):
+                raise SandboxError(f"Invalid environment variable name: {name!r}")
+        machine_id = await self._machine_id(sandbox_id)
+        exports = "".join(
+            f"export {name}={shlex.quote(value)}; " for name, value in (env_vars or {}).items()
+        )
+        script = f"mkdir -p {shlex.quote(working_dir)} && cd {shlex.quote(working_dir)} && {exports}{command}"
+        start = time.monotonic()
+        result = await self._request(
+            "POST",
+            f"/machines/{machine_id}/exec",
+            json={"command": ["/bin/sh", "-c", script], "timeout": timeout_seconds},
+            timeout=timeout_seconds + 30,
+        )
+
+        seq = 0
+        for stream in ("stdout", "stderr"):
+            if result.get(stream):
+                yield {"seq": seq, "stream": stream, "data": result[stream]}
+                seq += 1
+        yield {
+            "seq": seq,
+            "stream": "exit",
+            "exit_code": result.get("exit_code", -1),
+            "duration_ms": int((time.monotonic() - start) * 1000),
+            "timed_out": False,
+        }
+
+    async def close(self):
+        await self._client.aclose()
@@ -0,0 +1,215 @@
+"""Sandboxes as local directories and process groups, for development and load testing."""
+
+import asyncio
+import logging
+import os
+import shutil
+import signal
+import tempfile
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional
+from uuid import UUID
+
+from delta.core.exec_stream import DEFAULT_CHUNK_SIZE, DEFAULT_MAX_PENDING, stream_process
+from delta.sandbox.base import WORKSPACE, SandboxDriver, SandboxError, SandboxNotFoundError
+
+logger = logging.getLogger(__name__)
+
+
+class LocalSandbox:
+    """One sandbox's directory, shape and running commands."""
+
+    __slots__ = ("sandbox_id", "root", "memory_mb", "cpus", "paused", "processes")
+
+    def __init__(self, sandbox_id: UUID, root: Path, memory_mb: int, cpus: Optional[set[int]]):
+        self.sandbox_id = sandbox_id
+        self.root = root
+        self.memory_mb = memory_mb
+        self.cpus = cpus  # CPU affinity, None to run anywhere
+        self.paused = False
+        self.processes: set[asyncio.subprocess.Process] = set()
+
+    @property
+    def workspace(self) -> Path:
+        return self.root / "workspace"
+
+    def resolve(self, path: str) -> Path:
+        """Map a path under /workspace to the sandbox's directory."""
+        if path != WORKSPACE and not path.startswith(WORKSPACE + "/"):
+            raise SandboxError(f"Working directory must be under {WORKSPACE}: {path}")
+        resolved = (self.workspace / path[len(WORKSPACE):].lstrip("/")).resolve()
+        if not resolved.is_relative_to(self.workspace.resolve()):
+            raise SandboxError(f"Working directory escapes the workspace: {path}")
+        return resolved
+
+    def signal(self, signum: int):
+        """Send signum to the process group of every running command."""
+        for process in list(self.processes):
+            try:
+                os.killpg(process.pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def limits(self, prlimit: Optional[str], taskset: Optional[str]) -> list[str]:
+        """Command prefix applying the memory cap and CPU affinity with the given tools."""
+        prefix = []
+        if prlimit:
+            memory = self.memory_mb * 1024 * 1024
+            prefix += [prlimit, f"--data={memory}:{memory}"]
+        if taskset and self.cpus:
+            prefix += [taskset, "-c", ",".join(map(str, sorted(self.cpus)))]
+        return prefix
+
+
+class LocalProcessDriver(SandboxDriver):
+    """
+    Run each sandbox as a directory on this machine and its commands as local processes.
+
+    A sandbox's /workspace is <root_dir>/<sandbox_id>/workspace. Commands
+    run under /bin/sh in their own session with HOME at the workspace, a
+    data-segment rlimit of memory_mb and, where supported, CPU affinity to
+    cpu_cores CPUs handed out round-robin across sandboxes. Both are set
+    by exec'ing through prlimit and taskset (util-linux) rather than in a
+    preexec_fn, which is not safe in a threaded server; without those
+    tools the limits are skipped. With
+    isolate_network they also run in fresh user and network namespaces
+    (unshare), so they have no network access. pause() and resume() stop
+    and continue the sandbox's process groups.
+
+    This gives real exec latency and throughput on one Linux box with no
+    network access, for benchmarks and local development. It is not a
+    security boundary, and templates are ignored: commands use the host's
+    tools.
+
+    Usage:
+        driver = LocalProcessDriver("/tmp/delta-sandboxes")
+        await driver.create(agent_id, memory_mb=512, cpu_cores=1)
+        result = await driver.exec(agent_id, "python -V")
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        root_dir: Optional[str] = None,
+        isolate_network: bool = False,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        max_pending: int = DEFAULT_MAX_PENDING,
+    ):
+        self.root_dir = Path(root_dir or os.path.join(tempfile.gettempdir(), "delta-sandboxes"))
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        self.isolate_network = isolate_network
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending
+        self._sandboxes: Dict[UUID, LocalSandbox] = {}
+        self._cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+        self._next_cpu = 0
+        self._prefix = ["unshare", "--user", "--map-root-user", "--net", "--"] if isolate_network else []
+        self._prlimit = shutil.which("prlimit")
+        self._taskset = shutil.which("taskset")
+        if not self._prlimit:
+            logger.warning("prlimit not found; local sandboxes run without a memory cap")
+
+    async def create(
+        self,
+        sandbox_id: UUID,
+        template: str = "python-3.12",
+        memory_mb: int = 512,
+        cpu_cores: int = 1,
+    ) -> dict:
+        if sandbox_id in self._sandboxes:
+            raise SandboxError(f"Sandbox {sandbox_id} already exists")
+        sandbox = LocalSandbox(
+            sandbox_id, self.root_dir / str(sandbox_id), memory_mb, self._assign_cpus(cpu_cores)
+        )
+        sandbox.workspace.mkdir(parents=True, exist_ok=True)
+        self._sandboxes[sandbox_id] = sandbox
+        return {}
+
+    def _assign_cpus(self, count: int) -> Optional[set[int]]:
+        if not self._cpus or count >= len(self._cpus):
+            return None
+        cpus = {self._cpus[(self._next_cpu + i) % len(self._cpus)] for i in range(count)}
+        self._next_cpu = (self._next_cpu + count) % len(self._cpus)
+        return cpus
+
+    def _get(self, sandbox_id: UUID) -> LocalSandbox:
+        sandbox = self._sandboxes.get(sandbox_id)
+        if sandbox is None:
+            # Left by an earlier process: adopt it with the default shape
+            root = self.root_dir / str(sandbox_id)
+            if not (root / "workspace").is_dir():
+                raise SandboxNotFoundError(f"Sandbox {sandbox_id} not found")
+            sandbox = self._sandboxes[sandbox_id] = LocalSandbox(sandbox_id, root, 512, None)
+        return sandbox
+
+    async def check(self, sandbox_id: UUID):
+        if self._get(sandbox_id).paused:
+            raise SandboxError(f"Sandbox {sandbox_id} is paused")
+
+    def workspace_path(self, sandbox_id: UUID) -> Optional[Path]:
+        return self._get(sandbox_id).workspace
+
+    async def pause(self, sandbox_id: UUID):
+        sandbox = self._get(sandbox_id)
+        sandbox.signal(signal.SIGSTOP)
+        sandbox.paused = True
+
+    async def resume(self, sandbox_id: UUID):
+        sandbox = self._get(sandbox_id)
+        sandbox.paused = False
+        sandbox.signal(signal.SIGCONT)
+
+    async def destroy(self, sandbox_id: UUID):
+        sandbox = self._get(sandbox_id)
+        sandbox.signal(signal.SIGKILL)
+        del self._sandboxes[sandbox_id]
+        await asyncio.to_thread(shutil.rmtree, sandbox.root, True)
+
+    async def exec_stream(
+        self,
+        sandbox_id: UUID,
+        command: str,
+        working_dir: str = "/workspace",
+        timeout_seconds: int = 300,
+        env_vars: Optional[dict[str, str]] = None,
+    ) -> AsyncIterator[dict]:
+        await self.check(sandbox_id)
+        sandbox = self._get(sandbox_id)
+        cwd = sandbox.resolve(working_dir)
+        cwd.mkdir(parents=True, exist_ok=True)
+        env = {
+            "PATH": os.environ.get("PATH", "/usr/bin:/bin"),
+            "HOME": str(sandbox.workspace),
+            "LANG": "C.UTF-8",
+            "DELTA_SANDBOX_ID": str(sandbox_id),
+            **(env_vars or {}),
+        }
+
+        process = await asyncio.create_subprocess_exec(
+            *sandbox.limits(self._prlimit, self._taskset), *self._prefix, "/bin/sh", "-c", command,
+            cwd=cwd,
+            env=env,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+        sandbox.processes.add(process)
+        try:
+            async for event in stream_process(
+                process, timeout_seconds, self.chunk_size, self.max_pending
+            ):
+                yield event
+        finally:
+            sandbox.processes.discard(process)
+            # Anything the command left running in the background
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    async def close(self):
+        """Kill running commands; sandbox directories are kept."""
+        for sandbox in self._sandboxes.values():
+            sandbox.signal(signal.SIGKILL)
@@ -0,0 +1,51 @@
+"""Driver that provisions nothing, for running the API without a sandbox backend."""
+
+from typing import AsyncIterator, Optional
+from uuid import UUID
+
+from delta.sandbox.base import SandboxDriver
+
+
+class NoopDriver(SandboxDriver):
+    """
+    Accept every operation and run nothing.
+
+    Commands succeed at once with no output. This is the default, so the
+    API and SDK can be exercised without provisioning anything.
+    """
+
+    name = "noop"
+
+    async def create(
+        self,
+        sandbox_id: UUID,
+        template: str = "python-3.12",
+        memory_mb: int = 512,
+        cpu_cores: int = 1,
+    ) -> dict:
+        return {}
+
+    async def pause(self, sandbox_id: UUID):
+        pass
+
+    async def resume(self, sandbox_id: UUID):
+        pass
+
+    async def destroy(self, sandbox_id: UUID):
+        pass
+
+    async def exec_stream(
+        self,
+        sandbox_id: UUID,
+        command: str,
+        working_dir: str = "/workspace",
+        timeout_seconds: int = 300,
+        env_vars: Optional[dict[str, str]] = None,
+    ) -> AsyncIterator[dict]:
+        yield {
+            "seq": 0,
+            "stream": "exit",
+            "exit_code": 0,
+            "duration_ms": 0,
+            "timed_out": False,
+        }
@@ -0,0 +1,237 @@
+"""Pre-booted sandboxes handed out on agent creation."""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Dict, Iterable, NamedTuple, Optional
+from uuid import UUID, uuid4
+
+from delta.core.metrics import Histogram
+from delta.sandbox.base import SandboxDriver
+
+logger = logging.getLogger(__name__)
+
+# Seconds; from a pool hit (~immediate) to a slow machine boot
+READY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Shape(NamedTuple):
+    """What a sandbox is booted with; only identical shapes are interchangeable."""
+    template: str
+    memory_mb: int
+    cpu_cores: int
+
+    @classmethod
+    def parse(cls, text: str) -> "Shape":
+        """Parse "template:memory_mb:cpu_cores", e.g. "python-3.12:512:1"."""
+        template, memory_mb, cpu_cores = text.strip().rsplit(":", 2)
+        return cls(template, int(memory_mb), int(cpu_cores))
+
+    def __str__(self) -> str:
+        return f"{self.template}:{self.memory_mb}:{self.cpu_cores}"
+
+
+class _ShapePool:
+    __slots__ = ("idle", "booting", "demand", "boot_seconds")
+
+    def __init__(self):
+        self.idle: deque[tuple[UUID, dict]] = deque()  # (id, driver fields), oldest first
+        self.booting = 0
+        self.demand: deque[float] = deque(maxlen=10000)  # acquire() times
+        self.boot_seconds: Optional[float] = None  # Moving average
+
+
+class WarmPool:
+    """
+    Keep booted, idle sandboxes per shape so agent creation does not wait for a boot.
+
+    acquire() hands out the oldest idle sandbox of the requested shape (a
+    hit) or boots one on the spot (a miss). A refill loop sizes each shape
+    from observed demand: the target is the most acquisitions seen within
+    any one boot time over the last window_seconds, times headroom, i.e.
+    enough to absorb the worst recent burst while replacements boot. The
+    target is clamped between min_idle and max_idle. Idle sandboxes above
+    the target are destroyed.
+
+    Only the configured shapes are pooled. Any other shape a client asks
+    for is a miss booted straight on the driver, so arbitrary requests
+    cannot grow the pool's state or its idle machines.
+
+    Usage:
+        pool = WarmPool(driver, shapes=[Shape("python-3.12", 512, 1)])
+        pool.start()
+        sandbox_id, fields = await pool.acquire("python-3.12", 512, 1)
+    """
+
+    def __init__(
+        self,
+        driver: SandboxDriver,
+        shapes: Iterable[Shape] = (),
+        min_idle: int = 1,
+        max_idle: int = 10,
+        headroom: float = 1.5,
+        window_seconds: float = 300.0,
+        interval: float = 1.0,
+        max_concurrent_boots: int = 4,
+    ):
+        self.driver = driver
+        self.min_idle = min_idle
+        self.max_idle = max_idle
+        self.headroom = headroom
+        self.window_seconds = window_seconds
+        self.interval = interval
+        self._pools: Dict[Shape, _ShapePool] = {shape: _ShapePool() for shape in shapes}
+        self._boots = asyncio.Semaphore(max_concurrent_boots)
+        self._boot_tasks: set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.booted = 0
+        self.boot_failures = 0
+        self.trimmed = 0
+        self.ready = {"hit": Histogram(READY_BUCKETS), "miss": Histogram(READY_BUCKETS)}
+
+    async def acquire(self, template: str, memory_mb: int, cpu_cores: int) -> tuple[UUID, dict]:
+        """A running sandbox of this shape: its id and the driver's fields for it."""
+        start = time.monotonic()
+        shape = Shape(template, memory_mb, cpu_cores)
+        pool = self._pools.get(shape)
+        if pool is not None:
+            pool.demand.append(start)
+            self._wakeup.set()
+
+        if pool is not None and pool.idle:
+            sandbox_id, fields = pool.idle.popleft()
+            self.hits += 1
+            self.ready["hit"].observe(time.monotonic() - start)
+            return sandbox_id, fields
+
+        self.misses += 1
+        sandbox_id = uuid4()
+        fields = await self.driver.create(sandbox_id, *shape)
+        elapsed = time.monotonic() - start
+        if pool is not None:
+            self._record_boot(pool, elapsed)
+        self.ready["miss"].observe(elapsed)
+        return sandbox_id, fields
+
+    def _record_boot(self, pool: _ShapePool, seconds: float):
+        if pool.boot_seconds is None:
+            pool.boot_seconds = seconds
+        else:
+            pool.boot_seconds += 0.2 * (seconds - pool.boot_seconds)
+
+    def target(self, shape: Shape, now: Optional[float] = None) -> int:
+        """How many idle sandboxes of shape to keep right now (0 if it is not pooled)."""
+        pool = self._pools.get(shape)
+        if pool is None:
+            return 0
+        now = time.monotonic() if now is None else now
+        while pool.demand and pool.demand[0] < now - self.window_seconds:
+            pool.demand.popleft()
+
+        # Most acquisitions within any one boot time (two-pointer sweep)
+        span = pool.boot_seconds or 1.0
+        peak = 0
+        first = 0
+        demand = pool.demand
+        for last in range(len(demand)):
+            while demand[last] - demand[first] > span:
+                first += 1
+            peak = max(peak, last - first + 1)
+        return max(self.min_idle, min(self.max_idle, math.ceil(peak * self.headroom)))
+
+    async def refill(self):
+        """Boot or trim sandboxes so every shape is at its target."""
+        now = time.monotonic()
+        for shape, pool in list(self._pools.items()):
+            target = self.target(shape, now)
+            for _ in range(target - len(pool.idle) - pool.booting):
+                pool.booting += 1
+                task = asyncio.get_running_loop().create_task(self._boot(shape, pool))
+                self._boot_tasks.add(task)
+                task.add_done_callback(self._boot_tasks.discard)
+            while len(pool.idle) > target:
+                sandbox_id, _ = pool.idle.popleft()  # Longest idle first
+                self.trimmed += 1
+                await self._destroy(sandbox_id)
+
+    async def _boot(self, shape: Shape, pool: _ShapePool):
+        try:
+            async with self._boots:
+                sandbox_id = uuid4()
+                start = time.monotonic()
+                fields = await self.driver.create(sandbox_id, *shape)
+                self._record_boot(pool, time.monotonic() - start)
+                pool.idle.append((sandbox_id, fields))
+                self.booted += 1
+        except Exception:
+            self.boot_failures += 1
+            logger.exception("Warm pool boot failed for %s", shape)
+        finally:
+            pool.booting -= 1
+
+    async def _destroy(self, sandbox_id: UUID):
+        try:
+            await self.driver.destroy(sandbox_id)
+        except Exception:
+            logger.exception("Could not destroy pooled sandbox %s", sandbox_id)
+
+    def start(self):
+        """Refill every interval seconds, and right after each acquire()."""
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refill()
+            except Exception:
+                logger.exception("Warm pool refill failed")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def close(self):
+        """Stop refilling and destroy every idle sandbox."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.gather(*self._boot_tasks, return_exceptions=True)
+        for pool in self._pools.values():
+            while pool.idle:
+                await self._destroy(pool.idle.popleft()[0])
+
+    def get_stats(self) -> dict:
+        """Get pool statistics, including time-to-ready quantiles in seconds."""
+        acquired = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / acquired if acquired else 0.0,
+            "booted": self.booted,
+            "boot_failures": self.boot_failures,
+            "trimmed": self.trimmed,
+            "idle": sum(len(pool.idle) for pool in self._pools.values()),
+            "booting": sum(pool.booting for pool in self._pools.values()),
+            "ready_seconds": {
+                outcome: {
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "p50": histogram.quantile(0.5),
+                    "p99": histogram.quantile(0.99),
+                }
+                for outcome, histogram in self.ready.items()
+            },
+            "shapes": {
+                str(shape): {"idle": len(pool.idle), "target": self.target(shape)}
+                for shape, pool in self._pools.items()
+            },
+        }
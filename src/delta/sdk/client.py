@@ -2,8 +2,10 @@
 
 from __future__ import annotations
 
+import json as jsonlib
+import time
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator, Optional
+from typing import AsyncGenerator, AsyncIterator, Optional
 from uuid import UUID
 
 import httpx
@@ -12,6 +14,8 @@ from delta.sdk.models import (
     Agent,
     AgentConfig,
     AgentStatus,
+    ExecChunk,
+    ExecJob,
     ExecResult,
     FileContent,
     FileInfo,
@@ -22,6 +26,10 @@ from delta.sdk.models import (
 )
 
 
+# Seconds each result request waits server-side for a command to finish
+LONG_POLL_SECONDS = 20
+
+
 class DeltaError(Exception):
     """Base exception for DELTA SDK errors."""
     pass
@@ -179,7 +187,26 @@ class DeltaAgent:
         working_dir: str = "/workspace",
         env_vars: Optional[dict[str, str]] = None,
     ) -> ExecResult:
-        """Execute a command in the agent's sandbox."""
+        """Execute a command in the agent's sandbox and wait for its result."""
+        return await self._client._run_exec(
+            self._sandbox_id,
+            {
+                "command": command,
+                "timeout_seconds": timeout_seconds,
+                "working_dir": working_dir,
+                "env_vars": env_vars or {},
+            },
+        )
+
+    async def submit(
+        self,
+        command: str,
+        *,
+        timeout_seconds: int = 300,
+        working_dir: str = "/workspace",
+        env_vars: Optional[dict[str, str]] = None,
+    ) -> ExecJob:
+        """Start a command in the agent's sandbox without waiting for it."""
         response = await self._client._request(
             "POST",
             f"/v1/sandboxes/{self._sandbox_id}/exec",
@@ -190,7 +217,42 @@ class DeltaAgent:
                 "env_vars": env_vars or {},
             },
         )
-        return ExecResult(**response)
+        return ExecJob(**response)
+
+    async def get_exec(self, exec_id: str, *, wait: float = 0) -> ExecJob:
+        """Get a submitted command's state, waiting up to wait seconds for it to finish."""
+        return await self._client._get_exec(self._sandbox_id, exec_id, wait)
+
+    async def exec_stream(
+        self,
+        command: str,
+        *,
+        timeout_seconds: int = 300,
+        working_dir: str = "/workspace",
+        env_vars: Optional[dict[str, str]] = None,
+    ) -> AsyncIterator[ExecChunk]:
+        """
+        Execute a command in the agent's sandbox, yielding output as it is produced.
+
+        Usage:
+            async for chunk in agent.exec_stream("pytest -x"):
+                if chunk.stream == "exit":
+                    print("exit code", chunk.exit_code)
+                else:
+                    print(chunk.data, end="")
+        """
+        async for event in self._client._stream(
+            "POST",
+            f"/v1/sandboxes/{self._sandbox_id}/exec/stream",
+            json={
+                "command": command,
+                "timeout_seconds": timeout_seconds,
+                "working_dir": working_dir,
+                "env_vars": env_vars or {},
+            },
+            read_timeout=timeout_seconds + self._client._timeout,
+        ):
+            yield ExecChunk(**event)
 
     async def pause(self) -> None:
         """Pause the agent."""
@@ -255,12 +317,17 @@ class DeltaSandbox:
         return self._data.id
 
     async def exec(self, command: str, **kwargs) -> ExecResult:
-        response = await self._client._request(
+        return await self._client._run_exec(self.id, {"command": command, **kwargs})
+
+    async def exec_stream(self, command: str, **kwargs) -> AsyncIterator[ExecChunk]:
+        timeout_seconds = kwargs.get("timeout_seconds", 300)
+        async for event in self._client._stream(
             "POST",
-            f"/v1/sandboxes/{self.id}/exec",
+            f"/v1/sandboxes/{self.id}/exec/stream",
             json={"command": command, **kwargs},
-        )
-        return ExecResult(**response)
+            read_timeout=timeout_seconds + self._client._timeout,
+        ):
+            yield ExecChunk(**event)
 
 
 class AgentManager:
@@ -341,22 +408,92 @@ class Delta:
         *,
         params: Optional[dict] = None,
         json: Optional[dict] = None,
+        timeout: Optional[float] = None,
     ) -> dict:
         client = await self._get_client()
-        response = await client.request(method, path, params=params, json=json)
+        response = await client.request(
+            method, path, params=params, json=json, timeout=timeout or self._timeout
+        )
+        self._check_response(response, path)
+
+        if response.status_code == 204:
+            return {}
+
+        return response.json()
 
+    @staticmethod
+    def _check_response(response: httpx.Response, path: str) -> None:
+        """Raise the DeltaError for an error response (its body must have been read)."""
         if response.status_code == 404:
             raise AgentNotFoundError(f"Resource not found: {path}")
 
         if response.status_code == 402:
             raise InsufficientTokensError("Insufficient tokens")
 
-        response.raise_for_status()
+        if response.is_error:
+            try:
+                body = response.json()
+            except ValueError:
+                body = None
+            detail = body.get("detail", response.text) if isinstance(body, dict) else response.text
+            raise DeltaError(f"{response.request.method} {path} failed ({response.status_code}): {detail}")
 
-        if response.status_code == 204:
-            return {}
+    async def _get_exec(self, sandbox_id, exec_id: str, wait: float = 0) -> ExecJob:
+        response = await self._request(
+            "GET",
+            f"/v1/sandboxes/{sandbox_id}/exec/{exec_id}",
+            params={"wait": wait},
+            timeout=self._timeout + wait,
+        )
+        return ExecJob(**response)
+
+    async def _run_exec(self, sandbox_id, payload: dict) -> ExecResult:
+        """Submit a command, long-poll until it finishes and return its output."""
+        response = await self._request("POST", f"/v1/sandboxes/{sandbox_id}/exec", json=payload)
+        job = ExecJob(**response)
+        # The command's timeout runs from when it leaves its sandbox's queue
+        timeout = payload.get("timeout_seconds", 300) + self._timeout
+        deadline = None
+        while not job.finished:
+            if deadline is None and job.status != "pending":
+                deadline = time.monotonic() + timeout
+            if deadline is not None and time.monotonic() > deadline:
+                raise DeltaError(f"Execution {job.id} did not finish in time")
+            job = await self._get_exec(sandbox_id, job.id, LONG_POLL_SECONDS)
+        if job.status != "completed":
+            raise DeltaError(f"Execution {job.id} {job.status}: {job.error}")
 
-        return response.json()
+        client = await self._get_client()
+        output = {}
+        for stream in ("stdout", "stderr"):
+            url = getattr(job, f"{stream}_url")
+            if url:
+                response = await client.get(url)
+                self._check_response(response, url)
+                output[stream] = response.text
+            else:
+                output[stream] = getattr(job, stream) or ""
+        return ExecResult(exit_code=job.exit_code, duration_ms=job.duration_ms or 0, **output)
+
+    async def _stream(
+        self,
+        method: str,
+        path: str,
+        *,
+        json: Optional[dict] = None,
+        read_timeout: Optional[float] = None,
+    ) -> AsyncIterator[dict]:
+        """Yield the objects of an NDJSON response as they arrive."""
+        client = await self._get_client()
+        timeout = httpx.Timeout(self._timeout, read=read_timeout)
+        async with client.stream(method, path, json=json, timeout=timeout) as response:
+            if response.is_error:
+                await response.aread()
+            self._check_response(response, path)
+
+            async for line in response.aiter_lines():
+                if line:
+                    yield jsonlib.loads(line)
 
     async def close(self) -> None:
         if self._client:
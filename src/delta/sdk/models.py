@@ -64,6 +64,36 @@ class ExecResult(BaseModel):
     duration_ms: int
 
 
+class ExecJob(BaseModel):
+    """A submitted command execution and, once finished, its result."""
+    id: str
+    status: str  # "pending", "running", "completed", "failed" or "cancelled"
+    exit_code: Optional[int] = None
+    timed_out: bool = False
+    error: Optional[str] = None
+    stdout: Optional[str] = None  # None when spilled; fetch stdout_url instead
+    stderr: Optional[str] = None
+    stdout_spilled: bool = False
+    stderr_spilled: bool = False
+    stdout_url: Optional[str] = None
+    stderr_url: Optional[str] = None
+    duration_ms: Optional[int] = None
+    
+    @property
+    def finished(self) -> bool:
+        return self.status not in ("pending", "running")
+
+
+class ExecChunk(BaseModel):
+    """One event of a streamed command execution."""
+    seq: int
+    stream: str  # "stdout", "stderr" or "exit" (always last)
+    data: str = ""
+    exit_code: Optional[int] = None
+    duration_ms: Optional[int] = None
+    timed_out: bool = False
+
+
 class FileInfo(BaseModel):
     """File information."""
     name: str
@@ -1,9 +1,69 @@
 """Authentication tests for DELTA v0.1."""
 
+import asyncio
+import threading
+
+import httpx
 import pytest
+from datetime import datetime, timedelta
 from uuid import uuid4
 
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import delta.core.auth
 from delta.core.auth import AuthService, get_auth_service
+from delta.core.credentials import CachedCredential, CredentialCache
+from delta.core.hashing import HashingPool, HashingPoolBusyError, get_hashing_pool
+from delta.database import get_session
+from delta.models.user import APIKey, Base, User
+
+
+def argon2_service() -> AuthService:
+    """AuthService configured to store API keys as Argon2 hashes."""
+    service = AuthService()
+    service.settings = service.settings.model_copy(update={"api_key_hash_scheme": "argon2"})
+    return service
+
+
+@pytest.fixture
+async def db_session():
+    """In-memory SQLite session with all tables created."""
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+        yield session
+    await engine.dispose()
+
+
+@pytest.fixture
+async def api(db_session, monkeypatch):
+    """Client for the app with its own auth service and requests on db_session."""
+    from delta.api.main import app
+    
+    async def session():
+        yield db_session
+    
+    monkeypatch.setattr(delta.core.auth, "_auth_service", AuthService())
+    app.dependency_overrides[get_session] = session
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+        yield http
+    app.dependency_overrides.pop(get_session)
+
+
+async def store_api_key(session, service: AuthService, **kwargs) -> str:
+    """Generate an API key, persist it and return the full key."""
+    key, key_hash = service.generate_api_key()
+    session.add(APIKey(
+        user_id=uuid4(),
+        key_hash=key_hash,
+        key_prefix=service.get_api_key_prefix(key),
+        name="test-key",
+        **kwargs,
+    ))
+    await session.commit()
+    return key
 
 
 class TestPasswordHashing:
@@ -88,7 +148,18 @@ class TestAPIKeys:
         key, key_hash = service.generate_api_key()
         
         assert key.startswith("delta_sk_")
+        assert key_hash == service.digest_api_key(key)
+        assert len(key_hash) == 64
+    
+    def test_generate_api_key_argon2(self):
+        """Test API key generation with Argon2 at-rest hashing."""
+        service = argon2_service()
+        
+        key, key_hash = service.generate_api_key()
+        
         assert key_hash.startswith("$argon2id$")
+        assert service.verify_api_key(key, key_hash) is True
+        assert service.verify_api_key("delta_sk_wrong", key_hash) is False
     
     def test_verify_api_key(self):
         """Test API key verification."""
@@ -103,6 +174,231 @@ class TestAPIKeys:
         _, key_hash = service.generate_api_key()
         
         assert service.verify_api_key("delta_sk_wrong", key_hash) is False
+    
+    def test_api_key_prefix(self):
+        """Test the stored prefix fits the key_prefix column."""
+        service = AuthService()
+        key, _ = service.generate_api_key()
+        
+        prefix = service.get_api_key_prefix(key)
+        
+        assert key.startswith(prefix)
+        assert len(prefix) == 12
+
+
+class TestAPIKeyAuthentication:
+    """Test API key lookup against the database."""
+    
+    async def test_authenticate_hmac_key(self, db_session):
+        """Test that HMAC keys are found by digest."""
+        service = AuthService()
+        key = await store_api_key(db_session, service)
+        
+        api_key = await service.authenticate_api_key(db_session, key)
+        
+        assert api_key is not None
+        assert api_key.key_prefix == key[:12]
+    
+    async def test_authenticate_argon2_key(self, db_session):
+        """Test that Argon2 keys are found by prefix."""
+        service = argon2_service()
+        key = await store_api_key(db_session, service)
+        
+        api_key = await service.authenticate_api_key(db_session, key)
+        
+        assert api_key is not None
+    
+    async def test_authenticate_unknown_key(self, db_session):
+        """Test that unknown keys are rejected."""
+        service = AuthService()
+        await store_api_key(db_session, service)
+        
+        assert await service.authenticate_api_key(db_session, "delta_sk_unknown") is None
+        assert await service.authenticate_api_key(db_session, "not-a-key") is None
+    
+    async def test_authenticate_inactive_key(self, db_session):
+        """Test that deactivated keys are rejected."""
+        service = AuthService()
+        key = await store_api_key(db_session, service, is_active=False)
+        
+        assert await service.authenticate_api_key(db_session, key) is None
+    
+    async def test_authenticate_expired_key(self, db_session):
+        """Test that expired keys are rejected."""
+        service = AuthService()
+        key = await store_api_key(
+            db_session, service, expires_at=datetime.utcnow() - timedelta(days=1)
+        )
+        
+        assert await service.authenticate_api_key(db_session, key) is None
+
+
+class TestCredentialCache:
+    """Test the verified credential cache."""
+    
+    def test_verify_token_uses_cache(self):
+        """Test that repeat verifications are cache hits."""
+        service = AuthService()
+        user_id = uuid4()
+        token = service.create_access_token(user_id)
+        
+        assert service.verify_token(token) == user_id
+        assert service.verify_token(token) == user_id
+        
+        stats = service.credential_cache.get_stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+    
+    def test_cached_token_type_checked(self):
+        """Test that a cached refresh token is not accepted as an access token."""
+        service = AuthService()
+        token = service.create_refresh_token(uuid4())
+        
+        assert service.verify_token(token, "refresh") is not None
+        assert service.verify_token(token, "access") is None
+    
+    def test_revoked_token_rejected(self):
+        """Test that logout revokes a token that is still validly signed."""
+        service = AuthService()
+        token = service.create_access_token(uuid4())
+        service.verify_token(token)
+        
+        service.revoke_token(token)
+        
+        assert service.verify_token(token) is None
+    
+    def test_expired_entry_not_served(self):
+        """Test that entries are not served past the credential expiry."""
+        cache = CredentialCache()
+        digest = cache.digest("token")
+        cache.put(digest, CachedCredential(user_id=uuid4(), kind="access", expires_at=0))
+        
+        assert cache.get(digest) is None
+    
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted."""
+        cache = CredentialCache(max_entries=2)
+        for token in ("a", "b"):
+            cache.put(cache.digest(token), CachedCredential(user_id=uuid4(), kind="access"))
+        cache.get(cache.digest("a"))
+        
+        cache.put(cache.digest("c"), CachedCredential(user_id=uuid4(), kind="access"))
+        
+        assert cache.get(cache.digest("a")) is not None
+        assert cache.get(cache.digest("b")) is None
+        assert cache.get_stats()["evictions"] == 1
+    
+    def test_revoke_user(self):
+        """Test evicting all credentials of a user."""
+        service = AuthService()
+        user_id = uuid4()
+        token = service.create_access_token(user_id)
+        service.verify_token(token)
+        
+        service.revoke_user_credentials(user_id)
+        
+        assert service.credential_cache.get_stats()["size"] == 0
+        assert service.verify_token(token) is None  # Signature still valid, but issued before
+        assert service.verify_token(service.create_refresh_token(user_id), "refresh") == user_id
+        assert service.verify_token(service.create_access_token(uuid4())) is not None
+    
+    async def test_resolve_api_key_cached(self, db_session):
+        """Test that API key lookups are cached and evicted on deactivation."""
+        service = AuthService()
+        key = await store_api_key(db_session, service, scopes='["exec"]')
+        
+        credential = await service.resolve_api_key(db_session, key)
+        assert credential.kind == "api_key"
+        assert credential.scopes == ("exec",)
+        assert await service.resolve_api_key(db_session, key) == credential
+        assert service.credential_cache.get_stats()["hits"] == 1
+        
+        api_key = await db_session.get(APIKey, credential.key_id)
+        api_key.is_active = False
+        await db_session.commit()
+        service.revoke_api_key(credential.key_id)
+        
+        assert await service.resolve_api_key(db_session, key) is None
+
+
+class TestCurrentUser:
+    """Test the get_current_user dependency."""
+    
+    async def test_jwt_and_logout_all(self, api):
+        """Test that access tokens authenticate until the user logs out everywhere."""
+        service = get_auth_service()
+        user_id = uuid4()
+        token = service.create_access_token(user_id)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        me = await api.get("/v1/auth/me", headers=headers)
+        refresh = await api.get("/v1/auth/me", headers={
+            "Authorization": f"Bearer {service.create_refresh_token(user_id)}",
+        })
+        missing = await api.get("/v1/auth/me")
+        assert (await api.post("/v1/auth/logout-all", headers=headers)).status_code == 200
+        revoked = await api.get("/v1/auth/me", headers=headers)
+        
+        assert me.status_code == 200
+        assert me.json() == {"user_id": str(user_id), "auth": "access", "scopes": []}
+        assert refresh.status_code == 401
+        assert missing.status_code == 401
+        assert revoked.status_code == 401
+    
+    async def test_api_key_served_from_cache(self, api, db_session):
+        """Test that API keys are resolved through the credential cache."""
+        service = get_auth_service()
+        key = await store_api_key(db_session, service, scopes='["exec"]')
+        
+        first = await api.get("/v1/auth/me", headers={"Authorization": f"Bearer {key}"})
+        second = await api.get("/v1/auth/me", headers={"X-API-Key": key})
+        wrong = await api.get("/v1/auth/me", headers={"X-API-Key": key + "x"})
+        
+        assert first.status_code == second.status_code == 200
+        assert second.json()["auth"] == "api_key"
+        assert second.json()["scopes"] == ["exec"]
+        assert service.credential_cache.get_stats()["hits"] == 1
+        assert wrong.status_code == 401
+
+
+class TestAuthRoutes:
+    """Test registration, login and password reset."""
+    
+    async def test_register_login_reset(self, api, db_session):
+        """Test the account flow end to end, hashing on the pool."""
+        account = {"email": "flow@example.com", "password": "first-password"}
+        
+        registered = await api.post("/v1/auth/register", json=account)
+        duplicate = await api.post("/v1/auth/register", json=account)
+        wrong = await api.post("/v1/auth/login", json={**account, "password": "nope"})
+        login = await api.post("/v1/auth/login", json=account)
+        assert registered.status_code == 201
+        assert duplicate.status_code == 409
+        assert wrong.status_code == 401
+        assert login.status_code == 200
+        tokens = login.json()
+        
+        refreshed = await api.post("/v1/auth/refresh", params={"refresh_token": tokens["refresh_token"]})
+        reused = await api.post("/v1/auth/refresh", params={"refresh_token": tokens["refresh_token"]})
+        assert refreshed.status_code == 200
+        assert reused.status_code == 401
+        
+        await api.post("/v1/auth/forgot-password", params={"email": account["email"]})
+        user = (await db_session.execute(select(User).where(User.email == account["email"]))).scalar_one()
+        await db_session.refresh(user)
+        reset_url = f"/v1/auth/reset-password/{user.password_reset_token}"
+        reset = await api.post(reset_url, params={"new_password": "second-password"})
+        replayed = await api.post(reset_url, params={"new_password": "third-password"})
+        me = await api.get("/v1/auth/me", headers={"Authorization": f"Bearer {tokens['access_token']}"})
+        old = await api.post("/v1/auth/login", json=account)
+        new = await api.post("/v1/auth/login", json={**account, "password": "second-password"})
+        
+        assert reset.status_code == 200
+        assert replayed.status_code == 400
+        assert me.status_code == 401  # Issued before the reset
+        assert old.status_code == 401
+        assert new.status_code == 200
+        assert get_hashing_pool().get_stats()["completed"] >= 6
 
 
 class TestTokenGeneration:
@@ -136,3 +432,50 @@ class TestSingleton:
         service2 = get_auth_service()
         
         assert service1 is service2
+
+
+class TestHashingPool:
+    """Test offloading Argon2 to the hashing pool."""
+    
+    async def test_hash_password_async(self):
+        """Test async hashing produces verifiable hashes."""
+        service = AuthService()
+        
+        hashed = await service.hash_password_async("secure_password_123")
+        
+        assert hashed.startswith("$argon2id$")
+        assert await service.verify_password_async("secure_password_123", hashed) is True
+        assert await service.verify_password_async("wrong_password", hashed) is False
+    
+    async def test_generate_api_key_async(self):
+        """Test async API key generation."""
+        service = argon2_service()
+        
+        key, key_hash = await service.generate_api_key_async()
+        
+        assert service.verify_api_key(key, key_hash) is True
+    
+    async def test_pool_rejects_when_full(self):
+        """Test backpressure when workers and queue are saturated."""
+        pool = HashingPool(max_workers=1, max_queue=1)
+        release = threading.Event()
+        
+        running = asyncio.ensure_future(pool.run(release.wait))
+        queued = asyncio.ensure_future(pool.run(release.wait))
+        await asyncio.sleep(0.05)
+        
+        with pytest.raises(HashingPoolBusyError):
+            await pool.run(release.wait)
+        assert pool.get_stats()["queued"] == 1
+        assert pool.get_stats()["rejected"] == 1
+        
+        release.set()
+        await asyncio.gather(running, queued)
+        assert pool.get_stats()["completed"] == 2
+        pool.shutdown()
+    
+    def test_workers_capped_by_memory(self):
+        """Test that the worker count respects the memory budget."""
+        huge_cost_kib = HashingPool.available_memory() // 1024
+        
+        assert HashingPool.workers_for_memory(huge_cost_kib) == 1
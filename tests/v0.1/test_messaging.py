@@ -3,6 +3,7 @@
 import pytest
 from uuid import uuid4
 
+from delta.core.budget import BudgetEngine
 from delta.core.messaging import MessagingService, BotMessenger
 from delta.models.message_log import MessageType, MessageStatus
 
@@ -205,6 +206,34 @@ class TestBotMessenger:
         can_send, reason = messenger.can_send("email", "notallowed@example.com", "report")
         assert can_send is False
         assert "not in approved" in reason
+    
+    @pytest.mark.asyncio
+    async def test_messages_charge_budget(self, monkeypatch):
+        """Test that sends are reserved against the bot's budget and refused past it."""
+        budgets = BudgetEngine(num_shards=4)
+        bot_id = uuid4()
+        budgets.load(bot_id, uuid4(), 15, 0)
+        messenger = BotMessenger(
+            bot_id=bot_id,
+            user_id=uuid4(),
+            allowed_channels=["email"],
+            max_messages_per_day=10,
+            approved_templates=["report"],
+            budgets=budgets,
+        )
+        
+        async def render_template(template_id, variables):
+            return "Report", "All good"
+        
+        monkeypatch.setattr(messenger.service, "render_template", render_template)
+        
+        sent = await messenger.send("email", "user@example.com", "report", {})
+        refused = await messenger.send("email", "user@example.com", "report", {})
+        
+        assert sent["status"] != "rejected"
+        assert refused["status"] == "rejected"
+        assert "budget exceeded" in refused["error"]
+        assert budgets.get_usage(bot_id)["used"] == 10
 
 
 class TestInternalMessages:
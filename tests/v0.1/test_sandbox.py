@@ -1,9 +1,33 @@
 """Sandbox tests for DELTA v0.1."""
 
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import threading
+from datetime import datetime
+
+import httpx
 import pytest
 from uuid import uuid4
 
 from delta.core.agents import AgentService
+from delta.core.budget import BudgetEngine
+from delta.core.exec_jobs import ExecJobs, ExecJobsFullError, close_exec_jobs, get_exec_jobs
+from delta.core.exec_stream import stream_process
+from delta.core.metrics import get_metrics
+from delta.models.agent import AgentConfig, AgentStatus
+from delta.models.token_usage import TokenUsageType
+from delta.sandbox import SandboxError, SandboxNotFoundError, chunking
+from delta.sandbox.checkpoint import Checkpointer
+from delta.sandbox.chunk_store import LocalChunkStore
+from delta.sandbox.fly import FlyMachinesDriver
+from delta.sandbox.local import LocalProcessDriver, LocalSandbox
+from delta.sandbox.noop import NoopDriver
+from delta.sandbox.pool import Shape, WarmPool
+from delta.sdk import Delta, DeltaSandbox
 
 
 class TestCommandExecution:
@@ -69,6 +93,675 @@ class TestSandboxResponse:
             assert field in result
 
 
+async def spawn(code: str) -> asyncio.subprocess.Process:
+    return await asyncio.create_subprocess_exec(
+        sys.executable, "-c", code,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+
+class TestStreamingExecution:
+    """Test incremental output streaming."""
+    
+    @pytest.mark.asyncio
+    async def test_chunks_are_numbered_and_complete(self):
+        """Test that all output arrives in order-numbered chunks before the exit."""
+        process = await spawn(
+            "import sys\n"
+            "for i in range(2000): print('line', i, 'é' * 50)\n"
+            "sys.stderr.write('done')\n"
+            "sys.exit(3)"
+        )
+        
+        events = [event async for event in stream_process(process, chunk_size=1000, max_pending=2)]
+        
+        assert [event["seq"] for event in events] == list(range(len(events)))
+        stdout = "".join(e["data"] for e in events if e["stream"] == "stdout")
+        assert stdout == "".join(f"line {i} {'é' * 50}\n" for i in range(2000))
+        assert "".join(e["data"] for e in events if e["stream"] == "stderr") == "done"
+        assert events[-1]["stream"] == "exit"
+        assert events[-1]["exit_code"] == 3
+        assert not events[-1]["timed_out"]
+    
+    @pytest.mark.asyncio
+    async def test_timeout_kills_process(self):
+        """Test that a command running past its timeout is killed."""
+        process = await spawn("import time; print('started', flush=True); time.sleep(30)")
+        
+        events = [event async for event in stream_process(process, timeout=0.5)]
+        
+        assert "".join(e["data"] for e in events[:-1]) == "started\n"
+        assert events[-1]["timed_out"]
+        assert events[-1]["exit_code"] != 0
+    
+    @pytest.mark.asyncio
+    async def test_consumer_stop_kills_process(self):
+        """Test that closing the stream early stops an endlessly printing command."""
+        process = await spawn("while True: print('x' * 1000)")
+        events = stream_process(process, max_pending=1)
+        
+        assert (await events.__anext__())["stream"] == "stdout"
+        await events.aclose()
+        
+        assert process.returncode is not None
+    
+    @pytest.mark.asyncio
+    async def test_route_and_sdk_stream(self):
+        """Test that the SDK iterates the NDJSON events of the stream route."""
+        from delta.api.main import app
+        
+        client = Delta("test-key", base_url="http://test")
+        client._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+        sandbox = DeltaSandbox(client, {
+            "id": uuid4(),
+            "agent_id": uuid4(),
+            "status": "running",
+            "template": "python-3.12",
+            "created_at": datetime.utcnow(),
+        })
+        
+        chunks = [chunk async for chunk in sandbox.exec_stream("make test")]
+        await client.close()
+        
+        assert chunks[-1].stream == "exit"
+        assert chunks[-1].exit_code == 0
+
+    @pytest.mark.asyncio
+    async def test_stream_route_errors(self, monkeypatch, tmp_path):
+        """Test that a missing or paused sandbox is an HTTP error, not a broken stream."""
+        import delta.sandbox
+        from delta.api.main import app
+
+        driver = LocalProcessDriver(str(tmp_path))
+        monkeypatch.setattr(delta.sandbox, "_sandbox_driver", driver)
+        paused = uuid4()
+        await driver.create(paused)
+        await driver.pause(paused)
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            missing = await http.post(f"/v1/sandboxes/{uuid4()}/exec/stream", json={"command": "ls"})
+            stopped = await http.post(f"/v1/sandboxes/{paused}/exec/stream", json={"command": "ls"})
+        await driver.close()
+
+        assert missing.status_code == 404
+        assert stopped.status_code == 409
+        assert "paused" in stopped.json()["detail"]
+
+    @pytest.mark.asyncio
+    async def test_commands_charge_budget(self, monkeypatch, tmp_path):
+        """Test that commands hold their cost against the budget and are refused past it."""
+        import delta.core.budget
+        import delta.sandbox
+        from delta.api.main import app
+        from delta.config import get_settings
+
+        driver = LocalProcessDriver(str(tmp_path))
+        budgets = BudgetEngine(num_shards=4)
+        agent_id, paused = uuid4(), uuid4()
+        budgets.load(agent_id, uuid4(), 7, 0)
+        budgets.load(paused, uuid4(), 100, 0)
+        await driver.create(agent_id)
+        await driver.create(paused)
+        await driver.pause(paused)
+        service = AgentService(driver=driver, budgets=budgets)
+
+        result = await service.execute_command(agent_id, "echo hi")
+        with pytest.raises(SandboxError):
+            await service.execute_command(paused, "echo hi")
+        assert result["exit_code"] == 0
+        assert budgets.get_usage(agent_id)["used"] == 5
+        assert budgets.get_usage(paused) == {"limit": 100, "used": 0, "reserved": 0, "remaining": 100}
+
+        monkeypatch.setattr(delta.sandbox, "_sandbox_driver", driver)
+        monkeypatch.setattr(delta.core.budget, "_budget_engine", budgets)
+        monkeypatch.setattr(get_settings(), "budget_enforced", True)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            refused = await http.post(f"/v1/sandboxes/{agent_id}/exec/stream", json={"command": "ls"})
+        await driver.close()
+
+        assert refused.status_code == 402
+        assert budgets.get_usage(agent_id)["used"] == 5
+
+
+class FakeRunner:
+    """Runner that emits given output and waits for release before exiting."""
+    
+    def __init__(self, output=("hello\n",)):
+        self.output = output
+        self.release = asyncio.Event()
+        self.running = {}
+        self.peak = {}
+    
+    async def __call__(self, sandbox_id, command, **kwargs):
+        self.running[sandbox_id] = self.running.get(sandbox_id, 0) + 1
+        self.peak[sandbox_id] = max(self.peak.get(sandbox_id, 0), self.running[sandbox_id])
+        try:
+            for seq, data in enumerate(self.output):
+                yield {"seq": seq, "stream": "stdout", "data": data}
+            await self.release.wait()
+            yield {"seq": len(self.output), "stream": "exit", "exit_code": 0, "duration_ms": 5}
+        finally:
+            self.running[sandbox_id] -= 1
+
+
+class TestExecJobs:
+    """Test background exec jobs and their result store."""
+    
+    @pytest.mark.asyncio
+    async def test_per_sandbox_concurrency(self):
+        """Test that a sandbox runs at most its limit of commands at once."""
+        runner = FakeRunner()
+        jobs = ExecJobs(runner, max_concurrent_per_sandbox=2)
+        busy, other = uuid4(), uuid4()
+        
+        submitted = [jobs.submit(busy, f"task {i}") for i in range(5)] + [jobs.submit(other, "task")]
+        await asyncio.sleep(0.01)
+        
+        assert runner.running == {busy: 2, other: 1}
+        assert jobs.get_stats()["pending"] == 3
+        runner.release.set()
+        for job in submitted:
+            job = await jobs.wait(job.id, timeout=1)
+            assert job.status == "completed"
+            assert job.stdout.text() == "hello\n"
+        assert runner.peak[busy] == 2
+        assert jobs.get_stats()["sandboxes"] == 0
+    
+    @pytest.mark.asyncio
+    async def test_long_poll(self):
+        """Test that wait() returns early when the job finishes and otherwise times out."""
+        runner = FakeRunner()
+        jobs = ExecJobs(runner)
+        job = jobs.submit(uuid4(), "make")
+        
+        assert (await jobs.wait(job.id, timeout=0.05)).status == "running"
+        asyncio.get_running_loop().call_later(0.05, runner.release.set)
+        assert (await jobs.wait(job.id, timeout=5)).exit_code == 0
+        assert await jobs.wait("missing", timeout=0.01) is None
+    
+    @pytest.mark.asyncio
+    async def test_spill_and_expiry(self, tmp_path):
+        """Test that large output goes to disk and expired results are deleted."""
+        runner = FakeRunner(output=["a" * 1000, "b" * 1000, "c" * 1000])
+        runner.release.set()
+        jobs = ExecJobs(runner, ttl_seconds=0.05, spill_threshold=1500, spill_dir=str(tmp_path))
+        job = await jobs.wait(jobs.submit(uuid4(), "cat big").id, timeout=1)
+        
+        assert job.to_dict()["stdout"] is None
+        with open(job.stdout.path) as f:
+            assert f.read() == "a" * 1000 + "b" * 1000 + "c" * 1000
+        
+        await asyncio.sleep(0.06)
+        assert jobs.get(job.id) is None
+        assert list(tmp_path.iterdir()) == []
+    
+    @pytest.mark.asyncio
+    async def test_memory_budget(self, tmp_path):
+        """Test that output past the store-wide budget spills even under the per-stream threshold."""
+        runner = FakeRunner(output=["x" * 1000])
+        jobs = ExecJobs(runner, spill_threshold=1500, spill_dir=str(tmp_path), memory_budget=2500)
+        submitted = [jobs.submit(uuid4(), "cat") for _ in range(3)]
+        await asyncio.sleep(0.01)
+
+        assert [job.stdout.spilled for job in submitted] == [False, False, True]
+        assert jobs.get_stats()["memory_bytes"] == 2000
+        runner.release.set()
+        for job in submitted:
+            await jobs.wait(job.id, timeout=1)
+        await jobs.close()
+        assert jobs.get_stats()["memory_bytes"] == 0
+        assert list(tmp_path.iterdir()) == []
+
+    @pytest.mark.asyncio
+    async def test_full_store(self):
+        """Test that finished results make room and unfinished ones reject submissions."""
+        runner = FakeRunner()
+        jobs = ExecJobs(runner, max_jobs=2)
+        sandbox_id = uuid4()
+        first = jobs.submit(sandbox_id, "one")
+        runner.release.set()
+        await jobs.wait(first.id, timeout=1)
+        runner.release.clear()
+        
+        jobs.submit(sandbox_id, "two")
+        jobs.submit(sandbox_id, "three")
+        with pytest.raises(ExecJobsFullError):
+            jobs.submit(sandbox_id, "four")
+        
+        assert jobs.get(first.id) is None
+        assert jobs.get_stats()["rejected"] == 1
+        await jobs.close()
+    
+    @pytest.mark.asyncio
+    async def test_sdk_exec_long_polls(self):
+        """Test that SDK exec submits a job and waits for its result."""
+        from delta.api.main import app
+        
+        client = Delta("test-key", base_url="http://test")
+        client._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+        sandbox_id = uuid4()
+        
+        try:
+            result = await client._run_exec(sandbox_id, {"command": "make test"})
+            submitted = await client._request("POST", f"/v1/sandboxes/{sandbox_id}/exec", json={"command": "ls"})
+            elsewhere = await client._client.get(f"/v1/sandboxes/{uuid4()}/exec/{submitted['id']}")
+        finally:
+            await client.close()
+            await close_exec_jobs()
+        
+        assert result.exit_code == 0
+        assert submitted["status"] == "pending"
+        assert elsewhere.status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_submit_checks_sandbox(self, monkeypatch, tmp_path):
+        """Test that submitting to a missing or paused sandbox fails at once with an SDK error."""
+        import delta.sandbox
+        from delta.api.main import app
+        from delta.sdk.client import AgentNotFoundError, DeltaError
+
+        driver = LocalProcessDriver(str(tmp_path))
+        monkeypatch.setattr(delta.sandbox, "_sandbox_driver", driver)
+        paused = uuid4()
+        await driver.create(paused)
+        await driver.pause(paused)
+        client = Delta("test-key", base_url="http://test")
+        client._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+        try:
+            with pytest.raises(AgentNotFoundError):
+                await client._run_exec(uuid4(), {"command": "ls"})
+            with pytest.raises(DeltaError, match="409"):
+                await client._run_exec(paused, {"command": "ls"})
+            assert get_exec_jobs().get_stats()["submitted"] == 0
+        finally:
+            await client.close()
+            await close_exec_jobs()
+            await driver.close()
+
+
+class TestLocalProcessDriver:
+    """Test sandboxes run as local directories and processes."""
+    
+    @pytest.fixture
+    async def driver(self, tmp_path):
+        driver = LocalProcessDriver(str(tmp_path))
+        yield driver
+        await driver.close()
+    
+    @pytest.mark.asyncio
+    async def test_agent_lifecycle(self, driver, tmp_path):
+        """Test creating an agent, running commands in its workspace and destroying it."""
+        service = AgentService(driver)
+        agent = await service.create_agent(uuid4(), "builder", config=AgentConfig(memory_mb=256))
+        agent_id = agent["id"]
+        
+        assert agent["status"] == AgentStatus.RUNNING
+        await driver.exec(agent_id, "mkdir -p src && echo $GREETING > src/hello.txt", env_vars={"GREETING": "hi"})
+        result = await service.execute_command(agent_id, "cat hello.txt; pwd", working_dir="/workspace/src")
+        assert result["exit_code"] == 0
+        assert result["stdout"] == f"hi\n{tmp_path / str(agent_id) / 'workspace' / 'src'}\n"
+        
+        await service.destroy_agent(agent_id)
+        assert not (tmp_path / str(agent_id)).exists()
+        with pytest.raises(SandboxNotFoundError):
+            await driver.exec(agent_id, "true")
+    
+    @pytest.mark.asyncio
+    async def test_pause_and_resume(self, driver):
+        """Test that a paused sandbox refuses commands and stops running ones."""
+        sandbox_id = uuid4()
+        await driver.create(sandbox_id)
+        events = driver.exec_stream(sandbox_id, "echo start; sleep 0.3; echo end")
+        assert (await events.__anext__())["data"] == "start\n"
+        
+        await driver.pause(sandbox_id)
+        with pytest.raises(SandboxError):
+            await driver.exec(sandbox_id, "true")
+        await asyncio.sleep(0.5)
+        await driver.resume(sandbox_id)
+        
+        rest = [event async for event in events]
+        assert rest[0]["data"] == "end\n"
+        assert rest[-1]["exit_code"] == 0
+        assert rest[-1]["duration_ms"] >= 500
+    
+    @pytest.mark.asyncio
+    async def test_limits(self, driver):
+        """Test that the workspace confines working directories and memory_mb caps memory."""
+        sandbox_id = uuid4()
+        await driver.create(sandbox_id, memory_mb=64)
+        
+        with pytest.raises(SandboxError):
+            await driver.exec(sandbox_id, "ls", working_dir="/workspace/../..")
+        result = await driver.exec(sandbox_id, f"{sys.executable} -c 'b = bytearray(256 * 1024 * 1024)'")
+        assert result["exit_code"] != 0
+        assert "MemoryError" in result["stderr"]
+
+    def test_limits_prefix(self, tmp_path):
+        """Test that limits are applied by exec'ing through prlimit and taskset."""
+        sandbox = LocalSandbox(uuid4(), tmp_path, 64, {2, 0})
+
+        assert sandbox.limits("prlimit", "taskset") == [
+            "prlimit", f"--data={64 * 1024 * 1024}:{64 * 1024 * 1024}", "taskset", "-c", "0,2",
+        ]
+        assert sandbox.limits(None, None) == []
+
+
+class TestFlyMachinesDriver:
+    """Test the Fly Machines driver against a recorded API."""
+    
+    @pytest.mark.asyncio
+    async def test_create_exec_destroy(self):
+        """Test the Machines API calls behind each driver operation."""
+        requests = []
+        
+        def handler(request: httpx.Request) -> httpx.Response:
+            body = json.loads(request.content) if request.content else None
+            requests.append((request.method, request.url.path, dict(request.url.params), body))
+            if request.url.path.endswith("/exec"):
+                return httpx.Response(200, json={"exit_code": 2, "stdout": "out", "stderr": ""})
+            if request.method == "GET" and request.url.path.endswith("/machines"):
+                return httpx.Response(200, json=[{"id": "m-found"}])
+            return httpx.Response(200, json={"id": "m-1"})
+        
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="https://fly.test/v1")
+        driver = FlyMachinesDriver("token", "sandboxes", client=client)
+        sandbox_id = uuid4()
+        
+        assert await driver.create(sandbox_id, memory_mb=1024, cpu_cores=2) == {
+            "fly_machine_id": "m-1", "fly_app_name": "sandboxes",
+        }
+        result = await driver.exec(sandbox_id, "make", env_vars={"CI": "1"})
+        await FlyMachinesDriver("token", "sandboxes", client=client).destroy(sandbox_id)
+        
+        method, path, _, body = requests[0]
+        assert (method, path) == ("POST", "/v1/apps/sandboxes/machines")
+        assert body["config"]["guest"] == {"cpu_kind": "shared", "cpus": 2, "memory_mb": 1024}
+        assert body["config"]["metadata"] == {"delta_sandbox_id": str(sandbox_id)}
+        assert requests[1][1] == "/v1/apps/sandboxes/machines/m-1/wait"
+        assert requests[2][3]["command"][-1] == "mkdir -p /workspace && cd /workspace && export CI=1; make"
+        assert (result["exit_code"], result["stdout"]) == (2, "out")
+        assert requests[3][2] == {"metadata.delta_sandbox_id": str(sandbox_id)}
+        assert requests[4][:2] == ("DELETE", "/v1/apps/sandboxes/machines/m-found")
+        
+        with pytest.raises(SandboxError):
+            await driver.exec(sandbox_id, "env", env_vars={"A;rm -rf /": "x"})
+
+    @pytest.mark.asyncio
+    async def test_failed_boot_destroys_machine(self):
+        """Test that a machine which never starts is destroyed rather than leaked."""
+        requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append((request.method, request.url.path))
+            if request.url.path.endswith("/wait"):
+                return httpx.Response(408, text="timeout")
+            return httpx.Response(200, json={"id": "m-1"})
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="https://fly.test/v1")
+        driver = FlyMachinesDriver("token", "sandboxes", client=client)
+
+        with pytest.raises(SandboxError):
+            await driver.create(uuid4())
+        assert requests[-1] == ("DELETE", "/v1/apps/sandboxes/machines/m-1")
+        assert driver._machines == {}
+
+
+class SlowDriver(NoopDriver):
+    """Driver whose sandboxes take a while to boot."""
+    
+    def __init__(self, boot_seconds=0.05):
+        self.boot_seconds = boot_seconds
+        self.live = set()
+    
+    async def create(self, sandbox_id, template="python-3.12", memory_mb=512, cpu_cores=1):
+        await asyncio.sleep(self.boot_seconds)
+        self.live.add(sandbox_id)
+        return {"machine": str(sandbox_id)}
+    
+    async def destroy(self, sandbox_id):
+        self.live.discard(sandbox_id)
+
+
+class TestWarmPool:
+    """Test pre-booted sandbox pools."""
+    
+    @pytest.mark.asyncio
+    async def test_agent_gets_warm_local_sandbox(self, tmp_path):
+        """Test that create_agent takes a pooled local sandbox that can run commands."""
+        driver = LocalProcessDriver(str(tmp_path))
+        pool = WarmPool(driver, shapes=[Shape("python-3.12", 512, 1)], min_idle=2)
+        await pool.refill()
+        await asyncio.sleep(0.01)
+        pooled = {path.name for path in tmp_path.iterdir()}
+        
+        service = AgentService(driver, pool)
+        agent = await service.create_agent(uuid4(), "fast")
+        cold = await service.create_agent(uuid4(), "cold", config=AgentConfig(memory_mb=1024))
+        
+        assert len(pooled) == 2 and str(agent["id"]) in pooled
+        assert str(cold["id"]) not in pooled
+        assert (await service.execute_command(agent["id"], "echo ok"))["stdout"] == "ok\n"
+        stats = pool.get_stats()
+        assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+        assert stats["ready_seconds"]["hit"]["count"] == 1
+        assert list(stats["shapes"]) == ["python-3.12:512:1"]  # The cold shape is not pooled
+        
+        await pool.close()
+        assert {path.name for path in tmp_path.iterdir()} == {str(agent["id"]), str(cold["id"])}
+    
+    @pytest.mark.asyncio
+    async def test_sizes_to_bursts(self):
+        """Test that the target follows the worst recent burst within the watermarks."""
+        driver = SlowDriver()
+        shape = Shape("python-3.12", 512, 1)
+        pool = WarmPool(driver, shapes=[shape], min_idle=1, max_idle=5, window_seconds=0.5)
+        
+        await pool.acquire(*shape)  # Cold: measures the boot time
+        assert pool.target(shape) == 2
+        await asyncio.gather(*(pool.acquire(*shape) for _ in range(3)))
+        assert pool.target(shape) == 5
+        
+        await pool.refill()
+        await asyncio.sleep(0.2)  # Two rounds of max_concurrent_boots=4
+        assert pool.get_stats()["idle"] == 5
+        
+        await asyncio.sleep(0.5)
+        await pool.refill()
+        assert pool.target(shape) == 1
+        assert pool.get_stats()["idle"] == 1
+        assert pool.trimmed == 4
+        await pool.close()
+        assert len(driver.live) == 4  # The acquired ones
+    
+    def test_shape_parse(self):
+        """Test parsing configured shapes."""
+        assert Shape.parse(" node-20:1024:2") == Shape("node-20", 1024, 2)
+        assert str(Shape("python-3.12", 512, 1)) == "python-3.12:512:1"
+
+
+class GatedChunkStore(LocalChunkStore):
+    """Chunk store whose reads block until the gate opens, except for open_keys."""
+    
+    def __init__(self, root_dir):
+        super().__init__(root_dir)
+        self.gate = threading.Event()
+        self.open_keys = set()
+    
+    def get(self, key):
+        if key not in self.open_keys:
+            assert self.gate.wait(5)
+        return super().get(key)
+
+
+class TestCheckpoints:
+    """Test incremental workspace checkpoints and lazy restores."""
+    
+    @pytest.fixture
+    def checkpoints(self, tmp_path):
+        return Checkpointer(LocalChunkStore(str(tmp_path / "store")), workers=2)
+    
+    def test_chunk_boundaries(self, monkeypatch):
+        """Test that chunking is vectorised and byte-loop alike, bounded, and stable under inserts."""
+        data = random.Random(0).randbytes(1024 * 1024)
+        chunks = list(chunking.iter_chunks(io.BytesIO(data), min_size=2048, mask_bits=12, max_size=16384, block_size=65536))
+        assert b"".join(chunks) == data
+        assert all(2048 <= len(chunk) <= 16384 for chunk in chunks[:-1])
+        
+        monkeypatch.setattr(chunking, "np", None)
+        assert list(chunking.iter_chunks(io.BytesIO(data), min_size=2048, mask_bits=12, max_size=16384, block_size=65536)) == chunks
+        
+        edited = data[:500000] + b"hello" + data[500000:]
+        after = list(chunking.iter_chunks(io.BytesIO(edited), min_size=2048, mask_bits=12, max_size=16384))
+        assert len(set(after) - set(chunks)) <= 2
+    
+    @pytest.mark.asyncio
+    async def test_incremental_checkpoint(self, checkpoints, tmp_path):
+        """Test that a second checkpoint only uploads chunks of what changed."""
+        workspace = tmp_path / "workspace"
+        (workspace / "src").mkdir(parents=True)
+        (workspace / "src" / "main.py").write_text("print('hi')\n")
+        (workspace / "data.bin").write_bytes(random.Random(1).randbytes(2 * 1024 * 1024))
+        os.symlink("src/main.py", workspace / "main.py")
+        (workspace / "src" / ".restore-abc123").write_bytes(b"partial")
+        sandbox_id = uuid4()
+        
+        first = await checkpoints.checkpoint(sandbox_id, workspace)
+        assert first["parent"] is None
+        assert first["symlinks"] == {"main.py": "src/main.py"}
+        assert set(first["files"]) == {"data.bin", "src/main.py"}
+        assert first["stats"]["chunks_uploaded"] == first["stats"]["chunks"]
+        
+        with open(workspace / "data.bin", "r+b") as f:
+            f.seek(1024 * 1024)
+            f.write(b"changed")
+        second = await checkpoints.checkpoint(sandbox_id, workspace)
+        assert second["parent"] == first["id"]
+        assert second["stats"]["files_reused"] == 1  # src/main.py is not even read
+        assert 1 <= second["stats"]["chunks_uploaded"] <= 2
+        assert second["stats"]["bytes_uploaded"] < first["stats"]["bytes_uploaded"] / 4
+        assert checkpoints.latest(sandbox_id)["id"] == second["id"]
+    
+    @pytest.mark.asyncio
+    async def test_lazy_restore(self, checkpoints, tmp_path):
+        """Test that single files can be fetched ahead of the full restore."""
+        workspace = tmp_path / "workspace"
+        workspace.mkdir()
+        for i in range(50):
+            (workspace / f"file{i}.txt").write_text(str(i) * 1000)
+        (workspace / "empty").mkdir()
+        sandbox_id = uuid4()
+        await checkpoints.checkpoint(sandbox_id, workspace)
+        
+        target = tmp_path / "restored"
+        restore = await checkpoints.restore(sandbox_id, target)
+        await restore.ensure("/file49.txt")
+        assert (target / "file49.txt").read_text() == "49" * 1000
+        assert checkpoints.get_restore(sandbox_id) is restore
+        
+        await checkpoints.ready(sandbox_id)
+        assert restore.complete and checkpoints.get_restore(sandbox_id) is None
+        assert (target / "empty").is_dir()
+        for i in range(50):
+            path = target / f"file{i}.txt"
+            assert path.read_text() == str(i) * 1000
+            assert path.stat().st_mtime_ns == (workspace / f"file{i}.txt").stat().st_mtime_ns
+        with pytest.raises(SandboxError):
+            await checkpoints.restore(uuid4(), target)
+    
+    @pytest.mark.asyncio
+    async def test_resume_after_sandbox_lost(self, checkpoints, tmp_path):
+        """Test pausing a local agent, losing its sandbox and resuming from the checkpoint."""
+        driver = LocalProcessDriver(str(tmp_path / "sandboxes"))
+        service = AgentService(driver, checkpoints=checkpoints)
+        agent_id = (await service.create_agent(uuid4(), "durable"))["id"]
+        await service.execute_command(agent_id, "mkdir notes && echo remember > notes/todo.txt && chmod 600 notes/todo.txt")
+        
+        paused = await service.pause_agent(agent_id)
+        assert "checkpoint_id" in paused
+        await driver.destroy(agent_id)
+        
+        resumed = await service.resume_agent(agent_id)
+        assert resumed["checkpoint_id"] == paused["checkpoint_id"]
+        # Pausing again right away snapshots the finished restore, not a partial one
+        await service.pause_agent(agent_id)
+        assert set(checkpoints.latest(agent_id)["files"]) == {"notes/todo.txt"}
+        assert checkpoints.get_restore(agent_id) is None
+        await driver.resume(agent_id)
+        result = await service.execute_command(agent_id, "cat notes/todo.txt && stat -c %a notes/todo.txt")
+        assert result["stdout"] == "remember\n600\n"
+        
+        await service.destroy_agent(agent_id)
+        with pytest.raises(SandboxNotFoundError):
+            await service.resume_agent(uuid4())
+        await driver.close()
+    
+    @pytest.mark.asyncio
+    async def test_lazy_resume(self, tmp_path):
+        """Test that commands and file reads only wait for the files they use."""
+        store = GatedChunkStore(str(tmp_path / "store"))
+        store.gate.set()
+        checkpoints = Checkpointer(store, workers=2)
+        driver = LocalProcessDriver(str(tmp_path / "sandboxes"))
+        service = AgentService(driver, checkpoints=checkpoints)
+        agent_id = (await service.create_agent(uuid4(), "lazy"))["id"]
+        await service.write_file(agent_id, "/workspace/src/app.py", "print('hi')\n")
+        await service.write_file(agent_id, "data/big.txt", "x" * 100000)
+        
+        await service.pause_agent(agent_id)
+        await driver.destroy(agent_id)
+        store.gate.clear()
+        store.open_keys = {key for key, _ in checkpoints.latest(agent_id)["files"]["src/app.py"]["chunks"]}
+        
+        await service.resume_agent(agent_id)
+        assert await service.read_file(agent_id, "src/app.py") == "print('hi')\n"
+        result = await service.execute_command(
+            agent_id, "cat app.py && echo mine > ../data/big.txt", working_dir="/workspace/src"
+        )
+        assert result["stdout"] == "print('hi')\n"
+        assert not checkpoints.get_restore(agent_id).complete
+        assert [entry["name"] for entry in await service.list_files(agent_id, "/workspace/src")] == ["app.py"]
+        
+        store.gate.set()
+        await checkpoints.ready(agent_id)
+        assert await service.read_file(agent_id, "data/big.txt") == "mine\n"  # Not clobbered by the restore
+        with pytest.raises(SandboxNotFoundError):
+            await service.read_file(agent_id, "missing.txt")
+        assert get_metrics().get(TokenUsageType.FILE_OPERATION, agent_id).count == 6
+        await driver.close()
+    
+    @pytest.mark.asyncio
+    async def test_resume_boots_agent_shape(self, checkpoints, tmp_path):
+        """Test that the replacement sandbox has the agent's shape and needs a host workspace."""
+        driver = LocalProcessDriver(str(tmp_path / "sandboxes"))
+        service = AgentService(driver, checkpoints=checkpoints)
+        config = AgentConfig(memory_mb=1024, cpu_cores=2)
+        agent_id = (await service.create_agent(uuid4(), "big", config=config))["id"]
+        await service.pause_agent(agent_id)
+        await driver.destroy(agent_id)
+        
+        await service.resume_agent(agent_id, config)
+        assert driver._sandboxes[agent_id].memory_mb == 1024
+        await checkpoints.ready(agent_id)
+        await driver.close()
+        
+        class GoneDriver(NoopDriver):
+            destroyed = []
+            
+            async def resume(self, sandbox_id):
+                raise SandboxNotFoundError(str(sandbox_id))
+            
+            async def destroy(self, sandbox_id):
+                self.destroyed.append(sandbox_id)
+        
+        remote = AgentService(GoneDriver(), checkpoints=checkpoints)
+        with pytest.raises(SandboxError):
+            await remote.resume_agent(agent_id)
+        assert GoneDriver.destroyed == [agent_id]
+
+
 # These tests will be more meaningful once Fly.io is integrated
 class TestSandboxLifecycle:
     """Test sandbox lifecycle (placeholder for Fly.io integration)."""
@@ -1,10 +1,45 @@
 """Token metering tests for DELTA v0.1."""
 
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 from uuid import uuid4
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import create_async_engine
 
+from delta.core.budget import BudgetEngine, BudgetExceededError
+from delta.core.budget_tree import BudgetTree
+from delta.core.metering import StreamingMeter
+from delta.core.metrics import Histogram, OperationMetrics, get_metrics
+from delta.core.pricing import PricingTable, get_pricing, register_pricing
+from delta.core.rollups import UsageRollups, cover
+from delta.core.token_reset import TokenResetJob
 from delta.core.tokens import TokenService, TokenTracker
+from delta.core import usage_log
+from delta.core.usage_log import UsageLog, UsageLogReader
+from delta.core.usage_writer import UsageWriter, usage_row
+from delta.models.agent import Agent
+from delta.models.token_usage import UNLIMITED, TokenUsage, TokenUsageRollup, TokenUsageType
+from delta.models.user import Base, User
+
+
+@pytest.fixture
+async def engine(tmp_path):
+    """SQLite database file with all tables created."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/usage.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+async def count_usage(engine) -> int:
+    async with engine.connect() as conn:
+        return (await conn.execute(select(func.count()).select_from(TokenUsage))).scalar()
 
 
 class TestTokenService:
@@ -145,6 +180,749 @@ class TestTokenTracker:
         
         assert summary["operations"] == 4
         assert summary["breakdown"]["messages"] == 20
+    
+    def test_model_breakdown(self):
+        """Test that per-model totals are kept as events are recorded."""
+        tracker = TokenTracker(uuid4())
+        
+        tracker.record_llm_usage(1000, 1000, "claude-3-opus")
+        tracker.record_llm_usage(2000, 0, "claude-3-opus")
+        tracker.record_llm_usage(1000, 0, "claude-3-haiku")
+        
+        breakdown = tracker.get_model_breakdown()
+        
+        assert breakdown["claude-3-opus"]["calls"] == 2
+        assert breakdown["claude-3-opus"]["prompt_tokens"] == 3000
+        assert breakdown["claude-3-opus"]["cost"] == 12 + 6
+        assert set(breakdown) == {"claude-3-opus", "claude-3-haiku"}
+    
+    def test_export_buffer(self):
+        """Test that exported columns share memory with the tracker."""
+        tracker = TokenTracker(uuid4())
+        tracker.record_llm_usage(1000, 500, "claude-3-sonnet")
+        tracker.record_tool_usage("exec")
+        
+        exported = tracker.export_buffer()
+        
+        assert exported["cost"].tolist() == [2, 5]
+        assert [tracker.KINDS[k] for k in exported["kind"]] == ["llm", "tool"]
+        assert [exported["names"][i] for i in exported["name_id"]] == ["claude-3-sonnet", "exec"]
+        assert exported["timestamp_us"].obj is tracker._timestamps
+    
+    def test_usage_view(self):
+        """Test that the dict view matches the original event format."""
+        tracker = TokenTracker(uuid4())
+        tracker.record_llm_usage(100, 50, "claude-3-haiku")
+        tracker.record_message("sms")
+        
+        llm, message = tracker.usage
+        
+        assert llm["type"] == "llm" and llm["model"] == "claude-3-haiku"
+        assert llm["prompt_tokens"] == 100
+        assert message == {
+            "type": "message",
+            "message_type": "sms",
+            "cost": 20,
+            "timestamp": message["timestamp"],
+        }
+        assert abs((datetime.utcnow() - message["timestamp"]).total_seconds()) < 5
+
+
+class TestUsageWriter:
+    """Test write-behind persistence of token usage."""
+    
+    async def test_tracker_rows_flushed_in_bulk(self, engine):
+        """Test that tracked events are inserted together on flush."""
+        writer = UsageWriter(engine, flush_interval=60)
+        await writer.start()
+        tracker = TokenTracker(uuid4(), "task", user_id=uuid4(), writer=writer)
+        
+        tracker.record_llm_usage(1000, 500, "claude-3-sonnet")
+        tracker.record_tool_usage("exec")
+        tracker.record_message("email")
+        assert await count_usage(engine) == 0
+        
+        assert await writer.flush() == 3
+        await writer.close()
+        
+        async with engine.connect() as conn:
+            rows = (await conn.execute(select(TokenUsage.usage_type, TokenUsage.model))).all()
+        assert sorted(r.usage_type.value for r in rows) == [
+            "llm_completion", "message_send", "tool_execution",
+        ]
+        assert await count_usage(engine) == 3
+    
+    async def test_batch_size_triggers_flush(self, engine):
+        """Test that reaching max_batch wakes the flusher."""
+        writer = UsageWriter(engine, max_batch=10, flush_interval=60)
+        await writer.start()
+        
+        for _ in range(10):
+            writer.record(usage_row(uuid4(), uuid4(), TokenUsageType.TOOL_EXECUTION, 5))
+        for _ in range(100):
+            if await count_usage(engine) == 10:
+                break
+            await asyncio.sleep(0.01)
+        
+        assert await count_usage(engine) == 10
+        await writer.close()
+    
+    async def test_close_flushes(self, engine):
+        """Test that shutdown writes buffered rows."""
+        writer = UsageWriter(engine, flush_interval=60)
+        await writer.start()
+        writer.record(usage_row(uuid4(), uuid4(), TokenUsageType.MESSAGE_SEND, 10))
+        
+        await writer.close()
+        
+        assert await count_usage(engine) == 1
+    
+    async def test_spool_replayed_after_crash(self, engine, tmp_path):
+        """Test that spooled rows from a dead writer are inserted exactly once."""
+        spool = tmp_path / "usage.spool"
+        crashed = UsageWriter(engine, spool_path=str(spool))
+        await crashed.start()
+        for _ in range(5):
+            crashed.record(usage_row(uuid4(), uuid4(), TokenUsageType.TOOL_EXECUTION, 5))
+        await crashed.flush()
+        for _ in range(3):
+            crashed.record(usage_row(uuid4(), uuid4(), TokenUsageType.TOOL_EXECUTION, 5))
+        crashed._task.cancel()
+        
+        # Dies after committing 2 of the last 3 rows but before deleting their segment
+        crashed._rotate_spool()
+        crashed.max_batch = 2
+        assert [len(rows) for rows in crashed._read_segments()] == [2, 1]  # Streamed, not loaded
+        await crashed._insert(next(crashed._read_segments()))
+        crashed._spool.close()
+        assert await count_usage(engine) == 7
+        
+        recovered = UsageWriter(engine, spool_path=str(spool))
+        await recovered.start()
+        await recovered.close()
+        
+        assert await count_usage(engine) == 8
+        assert list(tmp_path.glob("usage.spool.*")) == []
+    
+    async def test_database_outage_spills_to_spool(self, tmp_path):
+        """Test that rows recorded while the database is down are kept."""
+        broken = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/missing-tables.db")
+        writer = UsageWriter(
+            broken, max_buffer=2, flush_interval=60, spool_path=str(tmp_path / "usage.spool")
+        )
+        await writer.start()
+        writer.record(usage_row(uuid4(), uuid4(), TokenUsageType.TOOL_EXECUTION, 5))
+        
+        with pytest.raises(Exception):
+            await writer.flush()
+        for _ in range(4):
+            writer.record(usage_row(uuid4(), uuid4(), TokenUsageType.TOOL_EXECUTION, 5))
+        
+        async with broken.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        assert await writer.flush() == 5
+        assert writer.get_stats()["failures"] == 1
+        await writer.close()
+        await broken.dispose()
+
+
+class TestBudgetEngine:
+    """Test reservation-based budgets."""
+    
+    def make_engine(self, agent_limit=100, user_limit=1000):
+        budgets = BudgetEngine(num_shards=4)
+        agent_id, user_id = uuid4(), uuid4()
+        budgets.load(agent_id, user_id, agent_limit, 0, user_limit, 0)
+        return budgets, agent_id, user_id
+    
+    def test_reserve_commit_refund(self):
+        """Test that reservations hold tokens until settled."""
+        budgets, agent_id, _ = self.make_engine()
+        
+        held = budgets.reserve(agent_id, 60)
+        assert budgets.check(agent_id, 50) == (False, 40)
+        
+        budgets.commit(held, 30)  # Actual cost was lower
+        budgets.commit(held, 30)  # Settling twice is a no-op
+        refunded = budgets.reserve(agent_id, 70)
+        budgets.refund(refunded)
+        
+        assert budgets.get_usage(agent_id) == {
+            "limit": 100, "used": 30, "reserved": 0, "remaining": 70,
+        }
+    
+    def test_reservation_over_budget_rejected(self):
+        """Test that a reservation larger than what is left fails."""
+        budgets, agent_id, _ = self.make_engine()
+        budgets.reserve(agent_id, 80)
+        
+        with pytest.raises(BudgetExceededError) as exc:
+            budgets.reserve(agent_id, 30)
+        assert exc.value.remaining == 20
+    
+    def test_user_allocation_shared_by_agents(self):
+        """Test that agents of one user draw from the same monthly allocation."""
+        budgets, first, user_id = self.make_engine(agent_limit=100, user_limit=150)
+        second = uuid4()
+        budgets.load(second, user_id, 100, 0)
+        
+        budgets.commit(budgets.reserve(first, 100))
+        with pytest.raises(BudgetExceededError):
+            budgets.reserve(second, 60)
+        budgets.reserve(second, 50)
+    
+    def test_concurrent_reservations_never_overspend(self):
+        """Test that racing reservations cannot exceed the budget."""
+        budgets, agent_id, _ = self.make_engine(agent_limit=500)
+        
+        def try_reserve(_):
+            try:
+                budgets.reserve(agent_id, 1)
+                return True
+            except BudgetExceededError:
+                return False
+        
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            granted = sum(pool.map(try_reserve, range(2000)))
+        
+        assert granted == 500
+        assert budgets.get_usage(agent_id)["remaining"] == 0
+    
+    async def test_hold_commits_or_refunds(self):
+        """Test that a held reservation is committed after the block and refunded on errors."""
+        budgets, agent_id, _ = self.make_engine(agent_limit=30)
+        
+        async with budgets.hold(agent_id, 10):
+            assert budgets.get_usage(agent_id)["reserved"] == 10
+        async with budgets.hold(agent_id, 10) as reservation:
+            budgets.commit(reservation, 4)  # The block's actual cost wins
+        with pytest.raises(RuntimeError):
+            async with budgets.hold(agent_id, 10):
+                raise RuntimeError("operation failed")
+        await budgets.require(agent_id, 16)
+        with pytest.raises(BudgetExceededError):
+            await budgets.require(agent_id, 17)
+        
+        assert budgets.get_usage(agent_id) == {"limit": 30, "used": 14, "reserved": 0, "remaining": 16}
+    
+    async def test_reconcile_to_database(self, engine):
+        """Test that committed usage is loaded from and written back to the database."""
+        async with engine.begin() as conn:
+            await conn.execute(User.__table__.insert(), [{
+                "id": uuid4(), "email": "budget@example.com", "password_hash": "x",
+                "total_tokens_allocated": 1000, "tokens_used_this_month": 100,
+            }])
+            user_id = (await conn.execute(select(User.id))).scalar()
+            agent_id = uuid4()
+            await conn.execute(Agent.__table__.insert(), [{
+                "id": agent_id, "user_id": user_id, "name": "agent",
+                "token_budget": 200, "tokens_used": 50,
+            }])
+        budgets = BudgetEngine(engine, num_shards=4, reconcile_interval=60)
+        
+        reservation = await budgets.acquire(agent_id, 100)
+        assert budgets.get_usage(agent_id)["remaining"] == 50
+        budgets.commit(reservation, 40)
+        assert await budgets.reconcile() == 2
+        await budgets.close()
+        
+        async with engine.connect() as conn:
+            assert (await conn.execute(select(Agent.tokens_used))).scalar() == 90
+            assert (await conn.execute(select(User.tokens_used_this_month))).scalar() == 140
+
+
+class TestBudgetTree:
+    """Test hierarchical budgets over main agents and bots."""
+    
+    def make_tree(self):
+        tree = BudgetTree()
+        user_id, main_id, bot_id = uuid4(), uuid4(), uuid4()
+        tree.add_user(user_id, tier="free")  # 1000 tokens
+        tree.add_agent(main_id, user_id, budget=300)
+        tree.add_agent(bot_id, user_id, parent_id=main_id, budget=100)
+        return tree, user_id, main_id, bot_id
+    
+    def test_charge_propagates_to_ancestors(self):
+        """Test that a bot's usage counts against its main agent and user."""
+        tree, user_id, main_id, bot_id = self.make_tree()
+        
+        assert tree.charge(bot_id, 40, TokenUsageType.TOOL_EXECUTION) == 60
+        tree.charge(main_id, 200)
+        
+        assert tree.get_subtree_usage(main_id) == 240
+        assert tree.get_remaining(bot_id) == 60  # Main agent has 60 left as well
+        assert tree.check(bot_id, 61) == (False, 60)
+        
+        summary = tree.get_summary(user_id)
+        assert summary.total_used == 240
+        assert summary.remaining == 760
+        assert summary.usage_by_agent == {str(main_id): 200, str(bot_id): 40}
+        assert summary.usage_by_type == {"tool_execution": 40}
+    
+    def test_tightest_limit_wins(self):
+        """Test that the parent's budget and the tier limit cap a bot."""
+        tree, user_id, main_id, bot_id = self.make_tree()
+        tree.set_budget(bot_id, UNLIMITED)
+        
+        with pytest.raises(BudgetExceededError) as exc:
+            tree.charge(bot_id, 301)
+        assert exc.value.remaining == 300
+        
+        tree.set_budget(main_id, UNLIMITED)
+        assert tree.get_remaining(bot_id) == 1000
+        tree.charge(bot_id, 1000)
+        assert tree.check(bot_id, 1) == (False, 0)
+    
+    def test_removed_bot_usage_stays_charged(self):
+        """Test that destroying a bot keeps its spend on the main agent."""
+        tree, user_id, main_id, bot_id = self.make_tree()
+        tree.charge(bot_id, 50)
+        
+        with pytest.raises(ValueError):
+            tree.remove_agent(main_id)
+        tree.remove_agent(bot_id)
+        
+        assert tree.get_remaining(main_id) == 250
+        assert tree.get_summary(user_id).usage_by_agent == {str(main_id): 0}
+    
+    async def test_load_user(self, engine):
+        """Test that a user's tree is built from stored budgets and usage."""
+        user_id, main_id, bot_id = uuid4(), uuid4(), uuid4()
+        async with engine.begin() as conn:
+            await conn.execute(User.__table__.insert(), [{
+                "id": user_id, "email": "tree@example.com", "password_hash": "x",
+                "tier": "PRO", "tokens_used_this_month": 70,
+            }])
+            # Bot listed first: load must still add the parent before it
+            await conn.execute(Agent.__table__.insert(), [
+                {"id": bot_id, "user_id": user_id, "parent_agent_id": main_id,
+                 "name": "bot", "token_budget": 50, "tokens_used": 20},
+                {"id": main_id, "user_id": user_id, "parent_agent_id": None, "name": "main",
+                 "token_budget": 500, "tokens_used": 50},
+            ])
+        tree = BudgetTree()
+        
+        writer = UsageWriter(engine, max_batch=50, flush_interval=60)
+        writer.record(usage_row(user_id, bot_id, TokenUsageType.TOOL_EXECUTION, 15))
+        writer.record(usage_row(
+            user_id, bot_id, TokenUsageType.TOOL_EXECUTION, 5,
+            created_at=datetime.utcnow().replace(day=1) - timedelta(days=1),  # Last month
+        ))
+        await writer.close()
+        tree = BudgetTree()
+        
+        await tree.load_user(engine, user_id)
+        await tree.load_user(engine, user_id)  # Reloading adds nothing twice
+        
+        assert tree.get_subtree_usage(main_id) == 70
+        assert tree.get_remaining(bot_id) == 30
+        summary = tree.get_summary(user_id)
+        assert (summary.total_allocated, summary.total_used) == (100000, 70)
+        # Per-agent usage covers the same month as the total, not all time
+        assert summary.usage_by_agent == {str(main_id): 0, str(bot_id): 15}
+        assert summary.usage_by_type == {"tool_execution": 15}
+    
+    async def test_engine_enforces_parent_budgets(self, engine):
+        """Test that the budget engine refuses a bot what its main agent cannot cover."""
+        user_id, main_id, bot_id = uuid4(), uuid4(), uuid4()
+        async with engine.begin() as conn:
+            await conn.execute(User.__table__.insert(), [{
+                "id": user_id, "email": "tree-engine@example.com", "password_hash": "x",
+                "tier": "PRO", "total_tokens_allocated": 100000,
+            }])
+            await conn.execute(Agent.__table__.insert(), [
+                {"id": main_id, "user_id": user_id, "parent_agent_id": None, "name": "main",
+                 "token_budget": 100, "tokens_used": 60},
+                {"id": bot_id, "user_id": user_id, "parent_agent_id": main_id,
+                 "name": "bot", "token_budget": 50, "tokens_used": 0},
+            ])
+        tree = BudgetTree()
+        budgets = BudgetEngine(engine, num_shards=4, reconcile_interval=60, tree=tree)
+        
+        async with budgets.hold(bot_id, 30):
+            pass
+        with pytest.raises(BudgetExceededError) as exc:
+            await budgets.acquire(bot_id, 20)  # The bot has 20 left, its main agent 10
+        budgets.reset_user(user_id)
+        await budgets.close()
+        
+        assert exc.value.remaining == 10
+        assert tree.get_subtree_usage(main_id) == 90
+        assert tree.get_summary(user_id).usage_by_agent[str(bot_id)] == 0
+
+
+class TestUsageRollups:
+    """Test pre-aggregated usage rollups."""
+    
+    def test_cover_uses_coarsest_buckets(self):
+        """Test that a range is tiled by days, then hours, then minutes."""
+        spans = cover(datetime(2024, 1, 1, 22, 30), datetime(2024, 1, 4, 1, 15, 20))
+        
+        assert spans == [
+            ("day", datetime(2024, 1, 2), datetime(2024, 1, 4)),
+            ("hour", datetime(2024, 1, 1, 23), datetime(2024, 1, 2)),
+            ("minute", datetime(2024, 1, 1, 22, 30), datetime(2024, 1, 1, 23)),
+            ("hour", datetime(2024, 1, 4), datetime(2024, 1, 4, 1)),
+            ("minute", datetime(2024, 1, 4, 1), datetime(2024, 1, 4, 1, 16)),
+        ]
+    
+    async def record_month(self, engine):
+        user_id, agents = uuid4(), [uuid4(), uuid4()]
+        async with engine.begin() as conn:
+            await conn.execute(User.__table__.insert(), [{
+                "id": user_id, "email": "rollup@example.com", "password_hash": "x",
+                "total_tokens_allocated": 10000,
+            }])
+        writer = UsageWriter(engine, max_batch=50, flush_interval=60)
+        start = datetime(2024, 3, 1)
+        for i in range(300):
+            writer.record(usage_row(
+                user_id, agents[i % 2],
+                TokenUsageType.LLM_COMPLETION if i % 3 else TokenUsageType.TOOL_EXECUTION,
+                i % 7 + 1, model="claude-3-haiku" if i % 3 else None,
+                created_at=start + timedelta(minutes=37 * i),
+            ))
+        await writer.close()
+        return user_id, start
+    
+    async def summarize_rows(self, engine, user_id, start, end) -> dict:
+        async with engine.connect() as conn:
+            rows = (await conn.execute(
+                select(TokenUsage.agent_id, TokenUsage.usage_type, TokenUsage.tokens_used)
+                .where(TokenUsage.created_at >= start, TokenUsage.created_at < end)
+            )).all()
+        by_agent, by_type = {}, {}
+        for agent_id, usage_type, tokens in rows:
+            by_agent[str(agent_id)] = by_agent.get(str(agent_id), 0) + tokens
+            by_type[usage_type.value] = by_type.get(usage_type.value, 0) + tokens
+        return {"usage_by_agent": by_agent, "usage_by_type": by_type}
+    
+    async def test_summary_matches_raw_rows(self, engine):
+        """Test that rollups written on flush agree with scanning token_usage."""
+        user_id, start = await self.record_month(engine)
+        rollups = UsageRollups(engine)
+        
+        for lo, hi in [
+            (start, start + timedelta(days=8)),
+            (start + timedelta(hours=5, minutes=13), start + timedelta(days=6, minutes=1)),
+        ]:
+            summary = await rollups.get_summary(user_id, lo, hi)
+            expected = await self.summarize_rows(engine, user_id, lo, hi)
+            assert summary.usage_by_agent == expected["usage_by_agent"]
+            assert summary.usage_by_type == expected["usage_by_type"]
+            assert summary.remaining == 10000 - summary.total_used
+    
+    async def test_rebuild_restores_rollups(self, engine):
+        """Test that a rebuild from token_usage reproduces the incremental rollups."""
+        user_id, start = await self.record_month(engine)
+        rollups = UsageRollups(engine)
+        end = start + timedelta(days=8)
+        before = await rollups.get_summary(user_id, start, end)
+        
+        async with engine.begin() as conn:
+            await conn.execute(TokenUsageRollup.__table__.delete())
+        assert (await rollups.get_summary(user_id, start, end)).total_used == 0
+        
+        assert await rollups.rebuild(since=start, until=end) == 300
+        assert await rollups.get_summary(user_id, start, end) == before
+
+
+class TestPricing:
+    """Test versioned pricing and the batch path."""
+    
+    def test_versions(self):
+        """Test that price lists are looked up by version and never replaced."""
+        current = get_pricing()
+        assert get_pricing(current.version) is current
+        assert TokenService(current).calculate_llm_cost(1000, 500, "claude-3-opus") == 7
+        
+        with pytest.raises(ValueError):
+            get_pricing("1999-01")
+        with pytest.raises(ValueError):
+            register_pricing(PricingTable(current.version, 2, 6))
+    
+    def test_batch_matches_scalar(self):
+        """Test that batch costs equal the per-row costs exactly."""
+        np = pytest.importorskip("numpy")
+        pricing = PricingTable("test", 1, 3, {"a": 3.0, "b": 0.5, "c": 0.7}, default_multiplier=1.1)
+        rng = random.Random(7)
+        names = ["a", "b", "c", "unknown"]
+        prompt = [rng.randrange(0, 10**7) for _ in range(5000)] + [0, 999, 1000, 2**40]
+        completion = [rng.randrange(0, 10**6) for _ in range(5000)] + [0, 1, 333, 2**40]
+        codes = [rng.randrange(len(names)) for _ in prompt]
+        models = [names[code] for code in codes]
+        
+        expected = [pricing.llm_cost(p, c, m) for p, c, m in zip(prompt, completion, models)]
+        
+        assert pricing.llm_costs(prompt, completion, models).tolist() == expected
+        assert pricing.llm_costs(
+            np.array(prompt), np.array(completion), np.array(codes), names=names,
+        ).tolist() == expected
+    
+    def test_batch_from_tracker_buffer(self):
+        """Test that a tracker's exported columns re-price in one call."""
+        pytest.importorskip("numpy")
+        tracker = TokenTracker(uuid4())
+        tracker.record_llm_usage(1000, 500, "claude-3-opus")
+        tracker.record_llm_usage(4000, 100, "claude-3-haiku")
+        
+        buffer = tracker.export_buffer()
+        costs = TokenService().calculate_llm_costs(
+            buffer["prompt_tokens"], buffer["completion_tokens"], buffer["name_id"], buffer["names"],
+        )
+        
+        assert costs.tolist() == list(buffer["cost"])
+
+
+class TestStreamingMeter:
+    """Test metering of streamed LLM responses."""
+    
+    def make_meter(self, reserve=10, agent_limit=100, **kwargs):
+        budgets = BudgetEngine(num_shards=4)
+        agent_id = uuid4()
+        budgets.load(agent_id, uuid4(), agent_limit, 0)
+        meter = StreamingMeter(
+            budgets, budgets.reserve(agent_id, reserve), "claude-3-sonnet", **kwargs,
+        )
+        return budgets, agent_id, meter
+    
+    def test_stops_before_overspending(self):
+        """Test that the chunk crossing the reservation signals cancellation."""
+        calls = []
+        budgets, agent_id, meter = self.make_meter(
+            prompt_tokens=1000, on_exceeded=lambda: calls.append(1),
+        )
+        
+        chunks = 0
+        while meter.add(100):
+            chunks += 1
+        
+        assert chunks == 33  # 1000 prompt + 3300 completion tokens cost 10
+        assert meter.exceeded and calls == [1]
+        assert not meter.add(1)
+        assert meter.finish() == 11  # The last chunk was still generated
+        assert budgets.get_usage(agent_id) == {
+            "limit": 100, "used": 11, "reserved": 0, "remaining": 89,
+        }
+    
+    def test_top_up_extends_reservation(self):
+        """Test that the meter reserves more until the agent's budget runs out."""
+        budgets, agent_id, meter = self.make_meter(top_up=20)
+        
+        while meter.set_total(meter.completion_tokens + 500):
+            pass
+        
+        assert len(meter.reservations) == 5  # 10 + 4 * 20 of the 100 budget
+        assert meter.finish() == meter.running_cost
+        assert budgets.get_usage(agent_id)["reserved"] == 0
+        assert budgets.get_usage(agent_id)["used"] == meter.cost
+    
+    def test_completion_limit_is_exact(self):
+        """Test that the precomputed limit agrees with the price calculation."""
+        pricing = get_pricing()
+        rng = random.Random(3)
+        for _ in range(200):
+            reserve, prompt = rng.randrange(1, 5000), rng.randrange(0, 100000)
+            model = rng.choice(["claude-3-opus", "claude-3-haiku", "other"])
+            _, _, meter = self.make_meter(reserve=reserve, agent_limit=10**6, prompt_tokens=prompt)
+            meter.model = model
+            limit = meter._completion_limit()
+            if limit < 0:
+                assert pricing.llm_cost(prompt, 0, model) > reserve
+            else:
+                assert pricing.llm_cost(prompt, limit, model) <= reserve
+                assert pricing.llm_cost(prompt, limit + 1, model) > reserve
+    
+    def test_prompt_over_reservation(self):
+        """Test that a prompt alone larger than the reservation cancels at once."""
+        _, _, meter = self.make_meter(reserve=1, prompt_tokens=5000)
+        
+        assert meter.exceeded
+        assert not meter.add(0)
+
+
+class TestOperationMetrics:
+    """Test latency histograms and the Prometheus export."""
+    
+    def test_histogram_buckets(self):
+        """Test that samples land in the bucket whose upper bound covers them."""
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 1.0, 7.0):
+            histogram.observe(value, tokens=2)
+        
+        assert list(histogram.counts) == [2, 2, 1]
+        assert histogram.count == 5
+        assert histogram.tokens == 10
+    
+    def test_render_prometheus(self):
+        """Test the text exposition of histograms, token counters and collectors."""
+        metrics = OperationMetrics(buckets=(0.1, 1.0))
+        metrics.observe(TokenUsageType.TOOL_EXECUTION, 0.05, "a1", tokens=5)
+        metrics.observe(TokenUsageType.TOOL_EXECUTION, 2.0, "a1", tokens=5)
+        metrics.add_collector("cache", lambda: {"hits": 3, "ratio": 0.5, "nested": {"n": 1}, "ids": []})
+        
+        text = metrics.render()
+        
+        labels = 'operation="tool_execution",agent="a1"'
+        assert f'delta_operation_seconds_bucket{{{labels},le="0.1"}} 1' in text
+        assert f'delta_operation_seconds_bucket{{{labels},le="1.0"}} 1' in text
+        assert f'delta_operation_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+        assert f"delta_operation_seconds_count{{{labels}}} 2" in text
+        assert f"delta_operation_tokens_total{{{labels}}} 10" in text
+        assert "delta_cache_hits 3" in text
+        assert "delta_cache_nested_n 1" in text
+        assert "ids" not in text
+    
+    def test_agent_cardinality_capped(self):
+        """Test that agents past max_agents share the "other" series."""
+        metrics = OperationMetrics(max_agents=2)
+        for agent in ("a", "b", "c", "d"):
+            metrics.observe(TokenUsageType.FILE_OPERATION, 0.01, agent)
+        
+        assert metrics.get(TokenUsageType.FILE_OPERATION, "other").count == 2
+        assert metrics.get(TokenUsageType.FILE_OPERATION, "c") is None
+    
+    def test_tracker_observes_durations(self):
+        """Test that tracked operations with a duration feed the shared histograms."""
+        agent_id = uuid4()
+        tracker = TokenTracker(agent_id)
+        
+        cost = tracker.record_llm_usage(1000, 500, duration=1.5, time_to_first_token=0.2)
+        tracker.record_tool_usage("exec", duration=0.03)
+        tracker.record_message("email")  # No duration, not timed
+        
+        metrics = get_metrics()
+        assert metrics.get(TokenUsageType.LLM_COMPLETION, agent_id).tokens == cost
+        assert metrics.get(TokenUsageType.LLM_PROMPT, agent_id).count == 1
+        assert metrics.get(TokenUsageType.TOOL_EXECUTION, agent_id).count == 1
+        assert metrics.get(TokenUsageType.MESSAGE_SEND, agent_id) is None
+    
+    def test_metrics_endpoint(self, monkeypatch):
+        """Test that /v1/metrics needs its token and serves the text format with component stats."""
+        from fastapi.testclient import TestClient
+        from delta.api.main import app
+        from delta.config import get_settings
+        from delta.core.auth import get_auth_service
+        from delta.core.hashing import get_hashing_pool
+        
+        get_auth_service()
+        get_hashing_pool()
+        client = TestClient(app)
+        assert client.get("/v1/metrics").status_code == 404
+        monkeypatch.setattr(get_settings(), "metrics_token", "scrape")
+        assert client.get("/v1/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+        response = client.get("/v1/metrics", headers={"Authorization": "Bearer scrape"})
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "delta_ws_total_user_connections" in response.text
+        assert "delta_credential_cache_hits" in response.text
+        assert "delta_hashing_rejected" in response.text
+
+
+class TestUsageLog:
+    """Test the append-only usage event segments."""
+    
+    def write_events(self, directory):
+        user_id, first, second = uuid4(), uuid4(), uuid4()
+        log = UsageLog(directory)
+        rows = []
+        for i in range(200):
+            agent_id = first if i % 2 else second
+            day = datetime(2024, 3, 1) if i < 100 or agent_id == first else datetime(2024, 3, 2)
+            rows.append(usage_row(
+                user_id, agent_id,
+                TokenUsageType.LLM_COMPLETION if i % 3 else TokenUsageType.TOOL_EXECUTION,
+                i + 1, model="claude-3-haiku" if i % 3 else None, task_id=f"task-{i % 4}",
+                created_at=day + timedelta(minutes=i),
+            ))
+        for row in rows:
+            log.append(row)
+        log.close()
+        return rows, first, second
+    
+    @pytest.fixture(params=["numpy", "struct"])
+    def scan_path(self, request, monkeypatch):
+        if request.param == "numpy":
+            pytest.importorskip("numpy")
+        else:
+            monkeypatch.setattr(usage_log, "np", None)
+        return request.param
+    
+    def test_aggregate_matches_rows(self, tmp_path, scan_path):
+        """Test that grouped totals equal those computed from the rows."""
+        rows, first, _ = self.write_events(tmp_path)
+        reader = UsageLogReader(tmp_path)
+        
+        by_model = reader.aggregate(group_by="model")
+        by_task = reader.aggregate(agent_id=first, task_id="task-1", group_by="task")
+        
+        haiku = [r["tokens_used"] for r in rows if r["model"] == "claude-3-haiku"]
+        assert by_model["claude-3-haiku"] == {"tokens": sum(haiku), "events": len(haiku)}
+        assert sum(entry["events"] for entry in by_model.values()) == 200
+        task = [r["tokens_used"] for r in rows if r["agent_id"] == first and r["task_id"] == "task-1"]
+        assert by_task == {"task-1": {"tokens": sum(task), "events": len(task)}}
+    
+    def test_index_skips_segments(self, tmp_path, scan_path):
+        """Test that a segment without the agent is never opened."""
+        rows, first, second = self.write_events(tmp_path)
+        reader = UsageLogReader(tmp_path)
+        
+        totals = reader.aggregate(agent_id=first, since=datetime(2024, 3, 1), group_by="agent")
+        
+        assert (reader.segments_read, reader.segments_skipped) == (1, 1)
+        assert totals[first]["events"] == 100
+        assert reader.aggregate(until=datetime(2024, 3, 2), group_by="agent")[second]["events"] == 50
+    
+    def test_torn_tail_and_stale_index(self, tmp_path):
+        """Test that unindexed records are scanned and torn ones dropped on reopen."""
+        self.write_events(tmp_path)
+        log = UsageLog(tmp_path)
+        late = uuid4()
+        log.append(usage_row(uuid4(), late, TokenUsageType.FILE_OPERATION, 7, model="gpt-4o",
+                             task_id="t2", created_at=datetime(2024, 3, 1, 12)))
+        log._segment.file.flush()  # Records on disk, index not updated yet
+        segment = tmp_path / "usage-20240301.seg"
+        with open(segment, "ab") as f:
+            f.write(b"torn")
+        
+        assert UsageLogReader(tmp_path).aggregate(agent_id=late) == {late: {"tokens": 7, "events": 1}}
+        
+        log._segment.file.close()
+        reopened = UsageLog(tmp_path)
+        reopened.append(usage_row(uuid4(), late, TokenUsageType.FILE_OPERATION, 1,
+                                  created_at=datetime(2024, 3, 1, 13)))
+        reopened.close()
+        assert segment.stat().st_size % usage_log.RECORD_SIZE == 0
+        
+        # The crashed record's task and model are indexed again (names were never written)
+        reader = UsageLogReader(tmp_path)
+        model = format(usage_log.name_hash("gpt-4o"), "x")
+        assert reader.aggregate(task_id="t2", group_by="model") == {model: {"tokens": 7, "events": 1}}
+        assert reader.segments_skipped == 1  # Only the other day
+    
+    def test_concurrent_writers(self, tmp_path):
+        """Test that a second writer for the same day appends to its own segment."""
+        first, second = UsageLog(tmp_path), UsageLog(tmp_path)
+        agent_id = uuid4()
+        for log in (first, second, first):
+            log.append(usage_row(uuid4(), agent_id, TokenUsageType.TOOL_EXECUTION, 5,
+                                 created_at=datetime(2024, 3, 1, 12)))
+            log.flush()
+        first.close()
+        second.close()
+        
+        assert sorted(p.name for p in tmp_path.glob("*.seg")) == ["usage-20240301.1.seg", "usage-20240301.seg"]
+        assert UsageLogReader(tmp_path).aggregate(agent_id=agent_id)[agent_id] == {"tokens": 15, "events": 3}
+    
+    async def test_writer_appends_to_log(self, engine, tmp_path):
+        """Test that recorded rows reach the log even before the database."""
+        writer = UsageWriter(engine, flush_interval=60, log=UsageLog(tmp_path))
+        agent_id = uuid4()
+        writer.record(usage_row(uuid4(), agent_id, TokenUsageType.TOOL_EXECUTION, 5))
+        await writer.close()
+        
+        assert UsageLogReader(tmp_path).aggregate(agent_id=agent_id)[agent_id]["tokens"] == 5
 
 
 class TestTokenReset:
@@ -158,3 +936,46 @@ class TestTokenReset:
         
         assert reset_date > datetime.utcnow()
         assert reset_date.day == 1  # First of month
+    
+    async def add_users(self, engine, count, reset_date, used=500):
+        async with engine.begin() as conn:
+            await conn.execute(User.__table__.insert(), [{
+                "id": uuid4(), "email": f"reset-{uuid4()}@example.com", "password_hash": "x",
+                "tokens_used_this_month": used, "token_reset_date": reset_date,
+            } for _ in range(count)])
+    
+    async def test_reset_job_is_chunked_and_idempotent(self, engine):
+        """Test that due users are reset once, in chunks, and caches are told."""
+        now = datetime(2024, 3, 1, 0, 5)
+        await self.add_users(engine, 25, datetime(2024, 3, 1))
+        await self.add_users(engine, 3, datetime(2024, 4, 1))  # Not due yet
+        await self.add_users(engine, 2, None)  # Never scheduled
+        chunks = []
+        job = TokenResetJob(engine, chunk_size=10)
+        job.add_listener(lambda user_ids: chunks.append(len(user_ids)))
+        
+        assert await job.run(now) == 25
+        assert chunks == [10, 10, 5]
+        assert await job.run(now) == 0
+        
+        async with engine.connect() as conn:
+            rows = (await conn.execute(
+                select(User.tokens_used_this_month, User.token_reset_date)
+            )).all()
+        assert sorted(used for used, _ in rows) == [0] * 25 + [500] * 5
+        assert all(reset == datetime(2024, 4, 1) for _, reset in rows)
+    
+    async def test_reset_clears_cached_budgets(self, engine):
+        """Test that a listener can zero in-memory monthly counters."""
+        await self.add_users(engine, 1, datetime(2024, 3, 1))
+        async with engine.connect() as conn:
+            user_id = (await conn.execute(select(User.id))).scalar()
+        budgets = BudgetEngine(num_shards=4)
+        agent_id = uuid4()
+        budgets.load(agent_id, user_id, UNLIMITED, 0, 1000, 500)
+        job = TokenResetJob(engine)
+        job.add_listener(lambda user_ids: [budgets.reset_user(u) for u in user_ids])
+        
+        await job.run(datetime(2024, 3, 2))
+        
+        assert budgets.check(agent_id, 1000) == (True, 0)
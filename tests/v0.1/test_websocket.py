@@ -0,0 +1,590 @@
+"""WebSocket connection manager tests for DELTA v0.1."""
+
+import asyncio
+import gc
+import json
+import tracemalloc
+
+import pytest
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from delta.api.websocket.broker import InMemoryBroker, RedisBroker
+from delta.api.websocket.heartbeat import TimerWheel
+from delta.api.websocket.history import MessageHistory, RingBuffer
+from delta.api.websocket.protocol import MSGPACK_SUBPROTOCOL, Frame
+from delta.api.websocket.terminal import ConnectionManager, Message
+
+
+class FakeWebSocket:
+    """In-memory stand-in for a Starlette WebSocket."""
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.sent: list = []
+        self.accepted = False
+        self.closed_code = None
+
+    async def accept(self, subprotocol=None):
+        self.accepted = True
+
+    async def send_text(self, text):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("connection closed")
+        self.sent.append(json.loads(text))
+    
+    async def send_bytes(self, data):
+        self.sent.append(msgpack.unpackb(data))
+
+    async def close(self, code: int = 1000):
+        self.closed_code = code
+
+
+async def drain():
+    """Let writer tasks flush their queues."""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.fixture
+async def make_manager():
+    """Build connection managers and close them after the test."""
+    managers = []
+
+    def factory(**kwargs) -> ConnectionManager:
+        kwargs.setdefault("num_shards", 4)
+        managers.append(ConnectionManager(**kwargs))
+        return managers[-1]
+
+    yield factory
+    for manager in managers:
+        await manager.close()
+
+
+class TestConnectionManager:
+    """Test connection registration and broadcast."""
+
+    async def test_connect_user(self, make_manager):
+        """Test that a user receives a connection confirmation."""
+        manager = make_manager()
+        ws = FakeWebSocket()
+
+        await manager.connect_user(ws, "agent-1", "user-1")
+        await drain()
+
+        assert ws.accepted
+        assert ws.sent[0]["type"] == "system"
+        assert manager.get_stats()["total_user_connections"] == 1
+
+    async def test_broadcast_reaches_all_watchers(self, make_manager):
+        """Test that agent messages reach every watcher."""
+        manager = make_manager()
+        watchers = [FakeWebSocket() for _ in range(10)]
+        for i, ws in enumerate(watchers):
+            await manager.connect_user(ws, "agent-1", f"user-{i}")
+
+        await manager.send_from_agent("agent-1", "hello")
+        await drain()
+
+        for ws in watchers:
+            assert ws.sent[-1]["content"] == "hello"
+
+    async def test_slow_watcher_does_not_block_others(self, make_manager):
+        """Test that broadcasts do not wait on a slow client."""
+        manager = make_manager()
+        slow = FakeWebSocket(delay=1.0)
+        fast = FakeWebSocket()
+        await manager.connect_user(slow, "agent-1", "slow")
+        await manager.connect_user(fast, "agent-1", "fast")
+
+        await asyncio.wait_for(manager.send_from_agent("agent-1", "hello"), timeout=0.1)
+        await drain()
+
+        assert fast.sent[-1]["content"] == "hello"
+        assert slow.sent == []
+
+    async def test_slow_consumer_drops_oldest(self, make_manager):
+        """Test that a full send queue drops the oldest frame."""
+        manager = make_manager(send_queue_size=2)
+        slow = FakeWebSocket(delay=1.0)
+        await manager.connect_user(slow, "agent-1", "slow")
+        await drain()
+
+        for i in range(5):
+            await manager.send_from_agent("agent-1", f"msg-{i}")
+
+        conn = manager.connections[slow]
+        assert conn.queue.qsize() == 2
+        assert manager.get_stats()["dropped_messages"] == 3
+
+    async def test_slow_consumer_disconnect_policy(self, make_manager):
+        """Test that a full send queue disconnects the client under that policy."""
+        manager = make_manager(send_queue_size=1, slow_consumer_policy="disconnect")
+        slow = FakeWebSocket(delay=1.0)
+        await manager.connect_user(slow, "agent-1", "slow")
+        await drain()
+
+        for i in range(3):
+            await manager.send_from_agent("agent-1", f"msg-{i}")
+        await drain()
+
+        assert slow not in manager.connections
+        assert slow.closed_code == 1008
+        assert manager.get_stats()["slow_consumer_disconnects"] == 1
+
+    async def test_failed_send_unregisters(self, make_manager):
+        """Test that a broken socket is cleaned up by its writer."""
+        manager = make_manager()
+        broken = FakeWebSocket(fail=True)
+        await manager.connect_user(broken, "agent-1", "user-1")
+        await drain()
+
+        assert broken not in manager.connections
+        assert manager.get_watchers("agent-1") == ()
+        assert manager.get_stats()["total_user_connections"] == 0
+
+    async def test_user_message_reaches_agent(self, make_manager):
+        """Test that user messages are delivered to the agent."""
+        manager = make_manager()
+        agent = FakeWebSocket()
+        user = FakeWebSocket()
+        await manager.connect_agent(agent, "agent-1", "key")
+        await manager.connect_user(user, "agent-1", "user-1")
+
+        await manager.send_from_user("agent-1", "user-1", "hi agent")
+        await drain()
+
+        assert agent.sent[-1]["type"] == "user_message"
+        assert agent.sent[-1]["content"] == "hi agent"
+
+    async def test_agents_spread_across_shards(self, make_manager):
+        """Test that registries are partitioned by agent_id."""
+        manager = make_manager(num_shards=8)
+        sockets = []
+        for i in range(64):
+            ws = FakeWebSocket()
+            sockets.append(ws)
+            await manager.connect_user(ws, f"agent-{i}", "user")
+
+        used = sum(1 for shard in manager.shards if shard.user_connections)
+        assert used > 1
+        assert len(manager.get_stats()["agents_with_watchers"]) == 64
+
+        for ws in sockets:
+            manager.disconnect(ws)
+        assert manager.get_stats()["total_user_connections"] == 0
+
+
+class TestFrameEncoding:
+    """Test that broadcast messages are encoded once."""
+
+    async def test_broadcast_encodes_once(self, make_manager, monkeypatch):
+        """Test that one broadcast serializes once regardless of watcher count."""
+        manager = make_manager()
+        watchers = [FakeWebSocket() for _ in range(20)]
+        for i, ws in enumerate(watchers):
+            await manager.connect_user(ws, "agent-1", f"user-{i}")
+        await drain()
+
+        calls = []
+        original = Message.model_dump_json
+        monkeypatch.setattr(
+            Message, "model_dump_json", lambda self, **kw: calls.append(1) or original(self, **kw)
+        )
+        await manager.send_from_agent("agent-1", "hello")
+        await drain()
+
+        assert len(calls) == 1
+        assert all(ws.sent[-1]["content"] == "hello" for ws in watchers)
+
+    async def test_user_message_stored_once(self, make_manager):
+        """Test that a user message appears once in history and reaches the agent."""
+        manager = make_manager()
+        agent = FakeWebSocket()
+        await manager.connect_agent(agent, "agent-1", "key")
+
+        await manager.send_from_user("agent-1", "user-1", "hi")
+        await drain()
+
+        history = manager.history.replay("agent-1")
+        assert [json.loads(f.text)["content"] for f in history].count("hi") == 1
+        assert agent.sent[-1]["content"] == "hi"
+
+    async def test_history_replayed_on_connect(self, make_manager):
+        """Test that a late watcher receives earlier messages."""
+        manager = make_manager()
+        await manager.send_from_agent("agent-1", "earlier")
+
+        ws = FakeWebSocket()
+        await manager.connect_user(ws, "agent-1", "user-1")
+        await drain()
+
+        assert ws.sent[-1]["content"] == "earlier"
+
+
+class TestCoalescing:
+    """Test per-watcher batching of streamed frames."""
+    
+    async def test_window_batches_frames(self, make_manager):
+        """Test that frames within the window arrive as one batch, in order."""
+        manager = make_manager(coalesce_window_ms=20)
+        batched = FakeWebSocket()
+        plain = FakeWebSocket()
+        await manager.connect_user(batched, "agent-1", "user-1")
+        await manager.connect_user(plain, "agent-1", "user-2", coalesce_ms=0)
+        await asyncio.sleep(0.05)
+        
+        for i in range(10):
+            await manager.send_from_agent("agent-1", f"tok-{i}")
+        await asyncio.sleep(0.05)
+        
+        batch = batched.sent[-1]
+        assert batch["type"] == "batch"
+        assert [m["content"] for m in batch["messages"]] == [f"tok-{i}" for i in range(10)]
+        assert [m["content"] for m in plain.sent[1:]] == [f"tok-{i}" for i in range(10)]
+        assert manager.get_stats()["coalesced_batches"] == 1
+    
+    async def test_byte_threshold_flushes_early(self, make_manager):
+        """Test that a batch is sent before the window ends once max_bytes is reached."""
+        manager = make_manager(coalesce_window_ms=1000, coalesce_max_bytes=1)
+        ws = FakeWebSocket()
+        await manager.connect_user(ws, "agent-1", "user-1")
+        
+        await manager.send_from_agent("agent-1", "hello")
+        await drain()
+        
+        assert ws.sent[-1]["content"] == "hello"
+    
+    @pytest.mark.skipif(msgpack is None, reason="msgpack not installed")
+    async def test_msgpack_batch(self, make_manager):
+        """Test that binary connections get a msgpack batch."""
+        manager = make_manager(coalesce_window_ms=20)
+        ws = FakeWebSocket()
+        await manager.connect_user(ws, "agent-1", "user-1", subprotocol=MSGPACK_SUBPROTOCOL)
+        await asyncio.sleep(0.05)
+        
+        await manager.send_from_agent("agent-1", "a")
+        await manager.send_from_agent("agent-1", "b")
+        await asyncio.sleep(0.05)
+        
+        assert ws.sent[-1]["type"] == "batch"
+        assert [m["content"] for m in ws.sent[-1]["messages"]] == ["a", "b"]
+
+
+class TestMessageHistory:
+    """Test ring-buffer history and cursor replay."""
+
+    def test_ring_buffer_wraps(self):
+        """Test that the buffer keeps only the newest frames."""
+        buffer = RingBuffer(capacity=3)
+        frames = [Frame(text=str(i)) for i in range(5)]
+        for frame in frames:
+            buffer.append(frame)
+
+        assert buffer.count == 3
+        assert buffer.last_seq == 5
+        assert buffer.since(0) == frames[2:]
+        assert buffer.since(4) == frames[4:]
+        assert buffer.since(0, limit=1) == frames[4:]
+
+    def test_global_budget_evicts_idle_agents(self):
+        """Test that the least recently used idle agent is evicted first."""
+        active = {"agent-a"}
+        history = MessageHistory(
+            capacity_per_agent=10,
+            max_total_frames=4,
+            is_active=lambda agent_id: agent_id in active,
+        )
+        for agent_id in ("agent-a", "agent-b", "agent-c"):
+            history.append(agent_id, Frame(text="x"))
+            history.append(agent_id, Frame(text="y"))
+
+        assert "agent-a" in history
+        assert "agent-b" not in history
+        assert history.total_frames == 4
+        assert history.get_stats()["evicted_agents"] == 1
+
+    async def test_reconnect_with_cursor(self, make_manager):
+        """Test that a reconnecting user only receives missed messages."""
+        manager = make_manager()
+        first = FakeWebSocket()
+        await manager.connect_user(first, "agent-1", "user-1")
+        await manager.send_from_agent("agent-1", "one")
+        await drain()
+        last_seq = first.sent[-1]["seq"]
+        manager.disconnect(first)
+
+        await manager.send_from_agent("agent-1", "two")
+        await manager.send_from_agent("agent-1", "three")
+
+        second = FakeWebSocket()
+        await manager.connect_user(second, "agent-1", "user-1", since=last_seq)
+        await drain()
+
+        assert [m["content"] for m in second.sent[1:]] == ["two", "three"]
+        assert second.sent[0]["metadata"]["last_seq"] == last_seq + 2
+
+    async def test_sequence_numbers_monotonic(self, make_manager):
+        """Test that frames carry increasing per-agent sequence numbers."""
+        manager = make_manager()
+        ws = FakeWebSocket()
+        await manager.connect_user(ws, "agent-1", "user-1")
+
+        for i in range(5):
+            await manager.send_from_agent("agent-1", f"msg-{i}")
+        await drain()
+
+        seqs = [m["seq"] for m in ws.sent[1:]]
+        assert seqs == sorted(seqs) and len(set(seqs)) == 5
+
+
+class TestHeartbeat:
+    """Test the heartbeat wheel, idle timeouts and reaper."""
+    
+    def test_timer_wheel(self):
+        """Test that items come due after their delay, across revolutions."""
+        wheel = TimerWheel(tick=1.0, slots=4)
+        wheel.schedule("short", 2)
+        wheel.schedule("long", 9)
+        wheel.schedule("cancelled", 1)
+        wheel.cancel("cancelled")
+        
+        due = {tick: wheel.advance() for tick in range(1, 11)}
+        
+        assert due[2] == ["short"]
+        assert due[9] == ["long"]
+        assert sum(len(items) for items in due.values()) == 2
+        assert len(wheel) == 0
+    
+    async def test_quiet_connection_is_pinged_then_closed(self, make_manager):
+        """Test that a client that went silent gets pings and is then disconnected."""
+        manager = make_manager(heartbeat_interval=0.05, idle_timeout=0.15, heartbeat_tick=0.01)
+        ws = FakeWebSocket()
+        await manager.connect_user(ws, "agent-1", "user-1")
+        manager.touch(ws)
+        
+        await wait_for(lambda: any(m.get("type") == "ping" for m in ws.sent))
+        await wait_for(lambda: ws.closed_code is not None)
+        
+        assert ws.closed_code == 1001
+        assert ws not in manager.connections
+        assert manager.get_stats()["idle_disconnects"] == 1
+        assert len(manager.wheel) == 0
+    
+    async def test_touch_keeps_connection_alive(self, make_manager):
+        """Test that a client answering pings stays connected."""
+        manager = make_manager(heartbeat_interval=0.05, idle_timeout=0.1, heartbeat_tick=0.01)
+        ws = FakeWebSocket()
+        await manager.connect_user(ws, "agent-1", "user-1")
+        
+        for _ in range(20):
+            await asyncio.sleep(0.02)
+            manager.touch(ws)
+        
+        assert ws in manager.connections
+        assert ws.closed_code is None
+    
+    async def test_passive_watcher_is_kept(self, make_manager):
+        """Test that a watcher that never sends anything is pinged but not closed."""
+        manager = make_manager(heartbeat_interval=0.05, idle_timeout=0.1, heartbeat_tick=0.01)
+        ws = FakeWebSocket()
+        await manager.connect_user(ws, "agent-1", "user-1")
+        
+        await asyncio.sleep(0.3)
+        
+        assert sum(m.get("type") == "ping" for m in ws.sent) >= 2
+        assert ws in manager.connections and ws.closed_code is None
+    
+    async def test_reaper_frees_abandoned_agents(self, make_manager):
+        """Test that idle agents lose their history but keep sequence numbers increasing."""
+        broker = InMemoryBroker()
+        manager = make_manager(broker=broker, history_ttl=60)
+        await manager.send_from_agent("gone", "bye")
+        ws = FakeWebSocket()
+        await manager.connect_user(ws, "watched", "user-1")
+        await manager.send_from_agent("watched", "hi")
+        
+        manager.reap(now=asyncio.get_running_loop().time() + 120)
+        
+        assert "gone" not in manager.history
+        assert await broker.next_seq("gone") == 2  # Old cursors stay behind new frames
+        assert "watched" in manager.history
+        assert manager.get_stats()["reaped_agents"] == 1
+    
+    async def test_connection_churn_keeps_memory_flat(self, make_manager):
+        """Test that connect/disconnect cycles leave nothing behind."""
+        manager = make_manager()
+        
+        async def churn(n):
+            for i in range(n):
+                ws = FakeWebSocket()
+                await manager.connect_user(ws, f"agent-{i % 100}", f"user-{i}")
+                manager.disconnect(ws)
+                await drain()
+            gc.collect()
+        
+        await churn(1000)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        await churn(10_000)
+        growth = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        
+        assert not manager.connections and len(manager.wheel) == 0
+        assert not manager._subscribed and not manager.broker._handlers
+        assert all(not shard.user_connections for shard in manager.shards)
+        assert growth < 256 * 1024
+
+
+async def wait_for(predicate, timeout: float = 2.0):
+    """Poll until predicate() is true (cross-worker delivery is asynchronous)."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "condition not met in time"
+        await asyncio.sleep(0.01)
+
+
+class TestBrokerRouting:
+    """Test agent/user routing across workers through a broker."""
+
+    async def check_cross_worker_routing(self, worker_a, worker_b):
+        agent = FakeWebSocket()
+        user = FakeWebSocket()
+        await worker_a.connect_agent(agent, "agent-1", "key")
+        await worker_b.connect_user(user, "agent-1", "user-1")
+
+        await worker_a.send_from_agent("agent-1", "from agent")
+        await wait_for(lambda: any(m.get("content") == "from agent" for m in user.sent))
+
+        await worker_b.send_from_user("agent-1", "user-1", "from user")
+        await wait_for(lambda: any(m.get("content") == "from user" for m in agent.sent))
+
+        # Both workers stamp the same seq on the same frame
+        user_seqs = [m["seq"] for m in user.sent if m.get("seq")]
+        assert user_seqs == sorted(user_seqs)
+
+    async def test_in_memory_broker_between_managers(self, make_manager):
+        """Test two managers sharing an in-memory broker act as one."""
+        broker = InMemoryBroker()
+        worker_a = make_manager(broker=broker)
+        worker_b = make_manager(broker=broker)
+
+        await self.check_cross_worker_routing(worker_a, worker_b)
+
+    async def test_redis_broker_between_workers(self, make_manager):
+        """Test routing between two workers over Redis pub/sub."""
+        fakeredis = pytest.importorskip("fakeredis")
+        server = fakeredis.FakeServer()
+        worker_a = make_manager(broker=RedisBroker(client=fakeredis.FakeAsyncRedis(server=server)))
+        worker_b = make_manager(broker=RedisBroker(client=fakeredis.FakeAsyncRedis(server=server)))
+
+        await self.check_cross_worker_routing(worker_a, worker_b)
+
+    async def test_redis_reader_survives_errors(self):
+        """Test that bad frames are skipped and a dropped subscription is restored."""
+        fakeredis = pytest.importorskip("fakeredis")
+        broker = RedisBroker(client=fakeredis.FakeAsyncRedis())
+        received = []
+        await broker.subscribe("delta:ws:a:users", lambda *args: received.append(args[1]))
+        
+        await broker._client.publish("delta:ws:a:users", "garbage")
+        await broker.publish("delta:ws:a:users", 1, Frame(text="{}"), "w")
+        await wait_for(lambda: received == [1])
+        
+        async def broken(**kwargs):
+            raise ConnectionError("connection reset")
+        old = broker._pubsub
+        old.get_message = broken
+        await wait_for(lambda: broker._pubsub is not old)
+        await broker.publish("delta:ws:a:users", 2, Frame(text="{}"), "w")
+        await wait_for(lambda: received == [1, 2])
+        await broker.close()
+
+    async def test_unsubscribes_when_idle(self, make_manager):
+        """Test that a worker leaves an agent's channels when its sockets go."""
+        broker = InMemoryBroker()
+        manager = make_manager(broker=broker)
+        ws = FakeWebSocket()
+        await manager.connect_user(ws, "agent-1", "user-1")
+        assert broker._handlers
+
+        manager.disconnect(ws)
+        await wait_for(lambda: not broker._handlers)
+
+
+needs_msgpack = pytest.mark.skipif(msgpack is None, reason="msgpack not installed")
+
+
+class TestEndpoints:
+    """Test the WebSocket routes served by the API app."""
+    
+    @pytest.fixture
+    def client(self):
+        from fastapi.testclient import TestClient
+        from delta.api.main import app
+        return TestClient(app)
+    
+    def test_agent_to_user_json(self, client):
+        """Test that untyped agent messages reach watchers as JSON."""
+        with client.websocket_connect("/v1/ws/user/ep-json?user_id=u1") as user:
+            assert user.receive_json()["type"] == "system"
+            with client.websocket_connect("/v1/ws/agent/ep-json?api_key=k") as agent:
+                assert agent.receive_json()["type"] == "system"
+                assert user.receive_json()["content"] == "Agent connected"
+                agent.send_json({"content": "hello"})
+                message = user.receive_json()
+        
+        assert message["type"] == "agent_message"
+        assert message["content"] == "hello"
+        assert message["seq"] > 0
+    
+    def test_stats(self, client):
+        """Test that stats count live connections."""
+        with client.websocket_connect("/v1/ws/user/ep-stats?user_id=u1") as user:
+            user.receive_json()
+            stats = client.get("/v1/ws/stats").json()
+        
+        assert "ep-stats" in stats["agents"]
+        assert stats["total_connections"] >= 1
+    
+    @needs_msgpack
+    def test_msgpack_subprotocol(self, client):
+        """Test that clients offering msgpack get binary frames both ways."""
+        with client.websocket_connect(
+            "/v1/ws/user/ep-bin?user_id=u1", subprotocols=[MSGPACK_SUBPROTOCOL]
+        ) as user:
+            assert user.accepted_subprotocol == MSGPACK_SUBPROTOCOL
+            assert msgpack.unpackb(user.receive_bytes())["type"] == "system"
+            
+            with client.websocket_connect("/v1/ws/agent/ep-bin?api_key=k") as agent:
+                agent.receive_json()
+                assert msgpack.unpackb(user.receive_bytes())["content"] == "Agent connected"
+                user.send_bytes(msgpack.packb({"type": "message", "content": "hi"}))
+                assert agent.receive_json()["content"] == "hi"
+                agent.send_json({"type": "message", "content": "tokens"})
+                
+                # The user's own message is echoed first, then the agent's reply
+                assert msgpack.unpackb(user.receive_bytes())["content"] == "hi"
+                assert msgpack.unpackb(user.receive_bytes())["content"] == "tokens"
+    
+    def test_malformed_frame_reports_error(self, client):
+        """Test that an undecodable frame is answered with an error, not a disconnect."""
+        with client.websocket_connect("/v1/ws/user/ep-bad?user_id=u1") as user:
+            user.receive_json()
+            user.send_text("not json")
+            assert user.receive_json()["type"] == "error"
+            user.send_json({"type": "ping"})
+            assert user.receive_json() == {"type": "pong"}
+    
+    @needs_msgpack
+    def test_frame_encodes_each_format_once(self):
+        """Test that the msgpack encoding is cached like the JSON text."""
+        frame = Frame(text=json.dumps({"type": "pong"}))
+        assert frame.binary is frame.binary
+        assert msgpack.unpackb(frame.binary) == {"type": "pong"}